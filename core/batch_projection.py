@@ -0,0 +1,227 @@
+"""Batch Web Mercator projection of coordinate arrays
+
+Map overlays project many points every frame. Instead of calling the scalar
+projection methods for each point, the points are projected once to zoom
+invariant "world" coordinates (relative Web Mercator coordinates, 0-1 on both
+axes) and the per-frame work is just a single affine transform to screen
+coordinates.
+
+NumPy is used if available, otherwise the same is done in pure Python.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import logging
+log = logging.getLogger("core.batch_projection")
+
+# Web Mercator is undefined at the poles
+MAX_LATITUDE = 85.0511287798
+
+# how many world coordinate arrays to keep
+DEFAULT_CACHE_SIZE = 64
+
+
+def numpy_available():
+    return numpy is not None
+
+
+def ll2world(lats, lons):
+    """Project geographic coordinates to world coordinates
+
+    :param lats: sequence of latitudes
+    :param lons: sequence of longitudes
+    :returns: (xs, ys) world coordinates, NumPy arrays if NumPy
+              is available, lists otherwise
+    :rtype: tuple
+    """
+    if numpy is not None:
+        lats = numpy.clip(numpy.asarray(lats, dtype=numpy.float64), -MAX_LATITUDE, MAX_LATITUDE)
+        xs = (numpy.asarray(lons, dtype=numpy.float64) + 180.0) / 360.0
+        s = numpy.sin(numpy.radians(lats))
+        ys = 0.5 - numpy.log((1.0 + s) / (1.0 - s)) / (4.0 * math.pi)
+        return xs, ys
+    else:
+        sin = math.sin
+        log_ = math.log
+        radians = math.radians
+        pi4 = 4.0 * math.pi
+        xs = [(lon + 180.0) / 360.0 for lon in lons]
+        ys = []
+        append = ys.append
+        for lat in lats:
+            if lat > MAX_LATITUDE:
+                lat = MAX_LATITUDE
+            elif lat < -MAX_LATITUDE:
+                lat = -MAX_LATITUDE
+            s = sin(radians(lat))
+            append(0.5 - log_((1.0 + s) / (1.0 - s)) / pi4)
+        return xs, ys
+
+
+def points2world(points):
+    """Project a sequence of (lat, lon, ...) tuples to world coordinates"""
+    return ll2world([point[0] for point in points], [point[1] for point in points])
+
+
+def affine(xs, ys, scale_x, offset_x, scale_y, offset_y):
+    """Apply x * scale + offset to coordinate arrays
+
+    :returns: (xs, ys) transformed coordinates, NumPy arrays for NumPy input,
+              lists otherwise
+    :rtype: tuple
+    """
+    if numpy is not None and isinstance(xs, numpy.ndarray):
+        return xs * scale_x + offset_x, ys * scale_y + offset_y
+    else:
+        return ([x * scale_x + offset_x for x in xs],
+                [y * scale_y + offset_y for y in ys])
+
+
+def world2pxpy(xs, ys, zoom):
+    """Convert world coordinates to projection (tile) units for the given zoom level"""
+    n = 2.0 ** zoom
+    return affine(xs, ys, n, 0.0, n, 0.0)
+
+
+def world2xy(xs, ys, zoom, px1, py1, scale):
+    """Convert world coordinates to screen coordinates
+
+    :param int zoom: zoom level
+    :param float px1: left screen edge in projection units
+    :param float py1: top screen edge in projection units
+    :param float scale: screen pixels per projection unit
+    """
+    n = 2.0 ** zoom
+    return affine(xs, ys, n * scale, -px1 * scale, n * scale, -py1 * scale)
+
+
+def to_list(values):
+    """Convert a coordinate array to a plain list"""
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values.tolist()
+    else:
+        return list(values)
+
+
+class WorldCoordinateCache(object):
+    """Bounded LRU cache of world coordinates of point sequences
+
+    Point sequences (tracklogs, routes, POI lists, ...) are identified
+    by a key provided by the caller. As point sequences might change
+    (a route being recomputed, a tracklog being recorded) the number
+    of points is also stored and the coordinates are projected again
+    if it does not match.
+
+    :param int max_size: maximum number of cached point sequences
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self._max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, points):
+        """Return world coordinates of the given points
+
+        :param key: hashable point sequence identifier
+        :param points: sequence of (lat, lon, ...) tuples
+        :returns: (xs, ys) world coordinates
+        :rtype: tuple
+        """
+        with self._lock:
+            item = self._cache.pop(key, None)
+            if item is not None and item[0] == len(points):
+                self._cache[key] = item
+                self.hits += 1
+                return item[1]
+        self.misses += 1
+        world = points2world(points)
+        with self._lock:
+            self._cache[key] = (len(points), world)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+        return world
+
+    def invalidate(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def benchmark(point_count=100000, frame_count=10):
+    """Batch projection benchmark
+
+    Compares projecting points to screen coordinates one by one
+    with the scalar projection code (as done previously) with batch
+    projection from geographic coordinates and with the affine
+    transform of cached world coordinates.
+    """
+    import random
+    from core.tilenames import ll2xy
+
+    print("# batch projection benchmark start #")
+    print("%d points, %d frames, NumPy: %s" % (point_count, frame_count, numpy_available()))
+    random.seed(0)
+    lats = [random.uniform(48.5, 51.0) for i in range(point_count)]
+    lons = [random.uniform(12.0, 19.0) for i in range(point_count)]
+    points = list(zip(lats, lons))
+    zoom = 13
+    (px1, py1, scale) = (4480.0, 2800.0, 256.0)
+
+    start = time.time()
+    for frame in range(frame_count):
+        result = []
+        for lat, lon in points:
+            px, py = ll2xy(lat, lon, zoom)
+            result.append(((px - px1) * scale, (py - py1) * scale))
+    print("scalar: %1.2f ms per frame" % (1000 * (time.time() - start) / frame_count))
+
+    start = time.time()
+    for frame in range(frame_count):
+        xs, ys = ll2world(lats, lons)
+        world2xy(xs, ys, zoom, px1, py1, scale)
+    print("batch: %1.2f ms per frame" % (1000 * (time.time() - start) / frame_count))
+
+    cache = WorldCoordinateCache()
+    start = time.time()
+    for frame in range(frame_count):
+        xs, ys = cache.get("benchmark", points)
+        world2xy(xs, ys, zoom, px1, py1, scale)
+    print("cached: %1.2f ms per frame" % (1000 * (time.time() - start) / frame_count))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11, without NumPy *
+#
+# # batch projection benchmark start #
+# 100000 points, 10 frames, NumPy: False
+# scalar: 125.98 ms per frame
+# batch: 62.18 ms per frame
+# cached: 17.70 ms per frame
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7, without NumPy *
+#
+# # batch projection benchmark start #
+# 100000 points, 10 frames, NumPy: False
+# scalar: 156.46 ms per frame
+# batch: 57.99 ms per frame
+# cached: 16.85 ms per frame
+# # benchmark finished #
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Crash-safe append-only binary track log
+
+Track logging used to write every point to two redundant CSV files,
+keeping all points in memory and then re-serializing them to GPX once logging
+was stopped. The binary log replaces that with a single append-only file:
+
+* points are stored as fixed size records - latitude, longitude, elevation
+  (NaN if unknown) and a timestamp (seconds since the epoch, UTC)
+* records are appended in blocks, each block starts with a small header
+  holding the record count and a CRC32 checksum of the block records
+* a block is written on every flush, but the expensive fsync call
+  is only done once per sync interval (group commit)
+
+If modRana or the device crashes in the middle of writing a block, the torn
+block fails the checksum test and is ignored on recovery, while all blocks
+written before it are recovered. Only points added since the last flush are
+kept in memory and GPX export streams the points from the file, so memory usage
+does not grow with logging time.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+import logging
+log = logging.getLogger("core.binary_tracklog")
+
+FILE_MAGIC = b"MRBL"
+FORMAT_VERSION = 1
+# magic, format version, reserved
+FILE_HEADER = struct.Struct("<4sHH")
+# block marker, record count, CRC32 of the records
+BLOCK_MARKER = 0xB10C
+BLOCK_HEADER = struct.Struct("<HHI")
+# latitude, longitude, elevation, timestamp
+RECORD = struct.Struct("<dddd")
+MAX_BLOCK_RECORDS = 0xFFFF
+
+NO_ELEVATION = float("nan")
+
+# default minimal interval between two fsync calls in seconds
+DEFAULT_SYNC_INTERVAL = 30
+
+GPX_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class InvalidLogFile(Exception):
+    """Raised when a file is not a binary track log"""
+    pass
+
+
+class BinaryTrackLog(object):
+    """An append-only binary track log being written
+
+    :param str path: path to the log file, an existing file is overwritten
+    :param float sync_interval: minimal interval between fsync calls in seconds
+    """
+
+    def __init__(self, path, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self._path = path
+        self._sync_interval = sync_interval
+        self._pending = []  # records not yet written to the file
+        self._point_count = 0
+        self._lock = threading.RLock()
+        self._last_sync = time.time()
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, 0))
+        self._sync()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def point_count(self):
+        """Number of points in the log, including points not yet written"""
+        return self._point_count
+
+    @property
+    def sync_interval(self):
+        return self._sync_interval
+
+    @sync_interval.setter
+    def sync_interval(self, value):
+        self._sync_interval = value
+
+    def add_point(self, lat, lon, elevation=None, timestamp=None):
+        """Add a point to the log
+
+        The point is only written to the file on next flush().
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :param elevation: elevation in meters or None if unknown
+        :param timestamp: seconds since the epoch (UTC), current time if None
+        """
+        if elevation is None:
+            elevation = NO_ELEVATION
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._pending.append(RECORD.pack(lat, lon, elevation, timestamp))
+            self._point_count += 1
+
+    def flush(self, sync=False):
+        """Write pending points to the log file as a new block
+
+        The file is also fsync-ed if more than sync_interval seconds
+        elapsed since the last fsync or if sync is True.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            for start in range(0, len(pending), MAX_BLOCK_RECORDS):
+                records = b"".join(pending[start:start + MAX_BLOCK_RECORDS])
+                count = len(records) // RECORD.size
+                checksum = zlib.crc32(records) & 0xFFFFFFFF
+                self._file.write(BLOCK_HEADER.pack(BLOCK_MARKER, count, checksum) + records)
+            self._file.flush()
+            if sync or time.time() - self._last_sync >= self._sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.time()
+
+    def close(self):
+        """Write all pending points, sync and close the log file"""
+        with self._lock:
+            if self._file:
+                self.flush(sync=True)
+                self._file.close()
+                self._file = None
+
+    def delete(self):
+        """Close and delete the log file"""
+        self.close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            log.exception("deleting binary track log %s failed", self._path)
+
+
+def read_points(path):
+    """Iterate over points stored in a binary track log
+
+    Reading stops at the first damaged block (such as a block torn by a crash),
+    all points in valid blocks before it are returned.
+
+    :param str path: path to the log file
+    :returns: generator of (lat, lon, elevation, timestamp) tuples,
+              elevation is None if unknown
+    :raises InvalidLogFile: if the file is not a binary track log
+    """
+    with open(path, "rb") as f:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise InvalidLogFile("file too short: %s" % path)
+        magic, version, _ = FILE_HEADER.unpack(header)
+        if magic != FILE_MAGIC or version != FORMAT_VERSION:
+            raise InvalidLogFile("not a binary track log or unsupported version: %s" % path)
+        while True:
+            block_header = f.read(BLOCK_HEADER.size)
+            if not block_header:
+                break  # end of file
+            if len(block_header) < BLOCK_HEADER.size:
+                log.warning("truncated block header in %s, ignoring rest of the log", path)
+                break
+            marker, count, checksum = BLOCK_HEADER.unpack(block_header)
+            records = f.read(count * RECORD.size)
+            if marker != BLOCK_MARKER or len(records) != count * RECORD.size or \
+                    (zlib.crc32(records) & 0xFFFFFFFF) != checksum:
+                log.warning("damaged block in %s, ignoring rest of the log", path)
+                break
+            for offset in range(0, len(records), RECORD.size):
+                lat, lon, elevation, timestamp = RECORD.unpack_from(records, offset)
+                if math.isnan(elevation):
+                    elevation = None
+                yield lat, lon, elevation, timestamp
+
+
+def export_gpx(log_path, gpx_path, name=None):
+    """Export a binary track log to GPX
+
+    Points are streamed from the log file to the GPX file, so the whole
+    track is never held in memory. The GPX file is written to a temporary
+    file first and renamed once complete.
+
+    :param str log_path: path to the binary track log
+    :param str gpx_path: path to the resulting GPX file
+    :param name: optional track name
+    :returns: number of exported points
+    :rtype: int
+    :raises InvalidLogFile: if the file is not a binary track log
+    """
+    temp_path = gpx_path + ".tmp"
+    count = 0
+    try:
+        with open(temp_path, "wt") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<gpx version="1.1" creator="modRana" xmlns="http://www.topografix.com/GPX/1/1">\n')
+            f.write('<trk>\n')
+            if name:
+                name = name.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+                f.write('<name>%s</name>\n' % name)
+            f.write('<trkseg>\n')
+            for lat, lon, elevation, timestamp in read_points(log_path):
+                timeString = time.strftime(GPX_TIMESTAMP_FORMAT, time.gmtime(timestamp))
+                if elevation is None:
+                    f.write('<trkpt lat="%.7f" lon="%.7f"><time>%s</time></trkpt>\n' % (lat, lon, timeString))
+                else:
+                    f.write('<trkpt lat="%.7f" lon="%.7f"><ele>%.2f</ele><time>%s</time></trkpt>\n' %
+                            (lat, lon, elevation, timeString))
+                count += 1
+            f.write('</trkseg>\n')
+            f.write('</trk>\n')
+            f.write('</gpx>\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, gpx_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
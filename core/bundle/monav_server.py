@@ -36,7 +36,7 @@ class TcpConnection(object):
 
     """
 
-    def __init__(self, host='localhost', port=8040):
+    def __init__(self, host='localhost', port=8040, timeout=None):
         """Open a Tcp socket to host.
 
         # http://stackoverflow.com/questions/2038083/how-to-use-python-and-googles-protocol-buffers-to-deserialize-data-sent-over-tcp
@@ -46,6 +46,9 @@ class TcpConnection(object):
         # modRana modification to fix 'Not all bytes of message received.'
         # right after monav-server startup:
         self._socket.setblocking(1)
+        # modRana modification - optional timeout, so that a hung
+        # server can be detected (None means blocking mode)
+        self._socket.settimeout(timeout)
         # TODO: fill in a bug report/pull request on Monav issue tracker
         self._socket.connect((host, port))
 
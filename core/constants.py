@@ -42,6 +42,13 @@ TILE_STORAGE_TYPES = [TILE_STORAGE_FILES, TILE_STORAGE_SQLITE]
 PANGO_ON = '<span color="green">ON</span>'
 PANGO_OFF = '<span color="red">OFF</span>'
 
+# GTK GUI drawing layers, in drawing order
+# - see RanaModule.invalidateLayers()
+DRAW_LAYER_MAP = "map"
+DRAW_LAYER_MAP_OVERLAY = "mapOverlay"
+DRAW_LAYER_SCREEN_OVERLAY = "screenOverlay"
+DRAW_LAYERS = (DRAW_LAYER_MAP, DRAW_LAYER_MAP_OVERLAY, DRAW_LAYER_SCREEN_OVERLAY)
+
 # threads
 
 # search
@@ -55,10 +62,13 @@ THREAD_LOCAL_SEARCH_OSM_SCOUT = "modRanaLocalSearchOSMScoutServer"
 THREAD_ROUTING_ONLINE_GOOGLE = "modRanaRoutingOnlineGoogle"
 THREAD_ROUTING_OFFLINE_MONAV = "modRanaRoutingOfflineMonav"
 THREAD_ROUTING_OFFLINE_OSM_SCOUT_SERVER = "modRanaRoutingOfflineOSMScoutServer"
+THREAD_ROUTING_CACHED = "modRanaRoutingCached"
+THREAD_ROUTING_DISPATCHER = "modRanaRoutingDispatcher"
 # turn-by-turn navigation
 THREAD_TBT_WORKER = "modRanaTurnByTurnWorker"
 # location
 THREAD_GPSD_CONSUMER = "modRanaGPSDConsumer"
+THREAD_LOCATION_REPLAY = "modRanaLocationReplay"
 # tile down-/loading
 THREAD_TILE_DOWNLOAD_MANAGER = "modRanaTileDownloadManager"
 THREAD_TILE_DOWNLOAD_WORKER = "modRanaTileDownloadWorker"
@@ -70,6 +80,12 @@ THREAD_LOCATION_CHECK = "modRanaCurrentPositionCheck"
 THREAD_TESTING_PROVIDER = "modRanaTestingProvider"
 # voice/TTS
 THREAD_VOICE_WORKER = "modRanaVoiceWorker"
+# module loading
+THREAD_DEFERRED_MODULE_LOADING = "modRanaDeferredModuleLoading"
+# POI
+THREAD_POI_IMPORT = "modRanaPOIImport"
+# elevation
+THREAD_ELEVATION_IMPORT = "modRanaElevationImport"
 
 # thread pools
 THREAD_POOL_AUTOMATIC_TILE_DOWNLOAD = "automaticTileDownload"
@@ -175,6 +191,9 @@ ROUTE_PEDESTRIAN = 1
 ROUTE_BIKE = 2
 ROUTE_CAR = 3
 
+# event bus topics
+EVENT_FIX = "fix"  # a core.fix.FixEvent is published for every position update
+
 # navigation
 DEFAULT_NAVIGATION_STEP_ICON = "flag"
 
@@ -0,0 +1,192 @@
+"""Publish/subscribe dispatch of typed events with per subscriber rate limiting
+
+High rate event sources (eq. a 10 Hz GPS or a replayed track log) publish
+every event, but most subscribers don't need to react to all of them.
+Each subscriber can declare the maximum rate it wants to be called at,
+events published in between are coalesced - only the latest one is kept
+and delivered once the subscriber interval elapses.
+
+Pending events are delivered by a timer thread, so that the last event
+of a burst is not lost. The timer thread can hand the delivery over to
+another thread (eq. the main loop) through a dispatch callable. Without
+timers (use_timers=False, eq. for headless replay) a pending event is
+replaced by the next event published after the interval elapses or
+delivered by flush().
+"""
+from __future__ import with_statement  # Python 2.5
+
+import itertools
+import threading
+import time
+
+import logging
+log = logging.getLogger("core.event_bus")
+
+
+class Subscription(object):
+    """A subscriber callback with optional rate limit
+
+    :param str topic: topic subscribed to
+    :param callback: callable taking the event
+    :param max_rate: maximum number of calls per second, None for no limit
+    """
+
+    def __init__(self, topic, callback, max_rate=None):
+        self.topic = topic
+        self.callback = callback
+        if max_rate:
+            self.interval = 1.0 / max_rate
+        else:
+            self.interval = 0.0
+        self.last_delivery = None
+        self.pending = None
+        self.has_pending = False
+        self.timer = None
+        self.delivered = 0
+        self.coalesced = 0
+
+
+class EventBus(object):
+    """Topic based event dispatch
+
+    :param clock: callable returning current time in seconds
+    :param bool use_timers: deliver pending rate limited events from a timer thread
+    :param dispatch: callable taking a function & its arguments, used by the timer
+                     thread to deliver pending events, eq. from the main loop,
+                     None delivers them from the timer thread
+    """
+
+    def __init__(self, clock=time.time, use_timers=True, dispatch=None):
+        self._clock = clock
+        self._use_timers = use_timers
+        self._dispatch = dispatch
+        # topic -> tuple of subscriptions, replaced on change so that
+        # publish() can iterate over it without locking
+        self._topics = {}
+        self._subscriptions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, topic, callback, max_rate=None):
+        """Subscribe to events published to a topic
+
+        :param str topic: topic name
+        :param callback: callable taking the event as its only argument
+        :param max_rate: maximum number of calls per second, None for every event
+        :returns: subscription id, always evaluates as True
+        :rtype: int
+        """
+        subscription = Subscription(topic, callback, max_rate)
+        with self._lock:
+            subscription_id = next(self._ids)
+            self._subscriptions[subscription_id] = subscription
+            self._topics[topic] = self._topics.get(topic, ()) + (subscription,)
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        """Remove a subscription, pending events are dropped
+
+        :returns: True if the subscription existed
+        :rtype: bool
+        """
+        with self._lock:
+            subscription = self._subscriptions.pop(subscription_id, None)
+            if subscription is None:
+                return False
+            self._topics[subscription.topic] = tuple(s for s in self._topics[subscription.topic]
+                                                     if s is not subscription)
+            self._cancel_timer(subscription)
+            subscription.has_pending = False
+            subscription.pending = None
+            return True
+
+    def subscriber_count(self, topic):
+        return len(self._topics.get(topic, ()))
+
+    def publish(self, topic, event):
+        """Deliver an event to subscribers of a topic
+
+        Subscribers with no rate limit are called right away, rate limited
+        subscribers are called right away if their interval elapsed, otherwise
+        the event replaces any event pending for them.
+        """
+        self.published += 1
+        subscriptions = self._topics.get(topic)
+        if not subscriptions:
+            return
+        now = self._clock()
+        for subscription in subscriptions:
+            if not subscription.interval:
+                self._deliver(subscription, event)
+                continue
+            with self._lock:
+                last = subscription.last_delivery
+                if last is not None and now - last < subscription.interval:
+                    if subscription.has_pending:
+                        subscription.coalesced += 1
+                    subscription.pending = event
+                    subscription.has_pending = True
+                    if self._use_timers and subscription.timer is None:
+                        delay = subscription.interval - (now - last)
+                        subscription.timer = threading.Timer(delay, self._timer_cb, [subscription])
+                        subscription.timer.daemon = True
+                        subscription.timer.start()
+                    continue
+                # the pending event is replaced by this one
+                if subscription.has_pending:
+                    subscription.coalesced += 1
+                subscription.pending = None
+                subscription.has_pending = False
+                self._cancel_timer(subscription)
+                subscription.last_delivery = now
+            self._deliver(subscription, event)
+
+    def flush(self, topic=None):
+        """Deliver all pending events, regardless of subscriber rate limits
+
+        :param topic: only flush the given topic, all topics if None
+        """
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions.values()
+                             if s.has_pending and (topic is None or s.topic == topic)]
+        for subscription in subscriptions:
+            self._deliver_pending(subscription)
+
+    def _timer_cb(self, subscription):
+        if self._dispatch is None:
+            self._deliver_pending(subscription)
+        else:
+            self._dispatch(self._deliver_pending, subscription)
+
+    def _deliver_pending(self, subscription):
+        with self._lock:
+            subscription.timer = None
+            if not subscription.has_pending:
+                return
+            event = subscription.pending
+            subscription.pending = None
+            subscription.has_pending = False
+            now = self._clock()
+            subscription.last_delivery = now
+        self._deliver(subscription, event)
+
+    def _deliver(self, subscription, event):
+        subscription.delivered += 1
+        try:
+            subscription.callback(event)
+        except Exception:
+            log.exception("event subscriber for topic %s failed", subscription.topic)
+
+    def _cancel_timer(self, subscription):
+        if subscription.timer is not None:
+            subscription.timer.cancel()
+            subscription.timer = None
+
+    def clear(self):
+        """Remove all subscriptions"""
+        with self._lock:
+            for subscription in self._subscriptions.values():
+                self._cancel_timer(subscription)
+            self._subscriptions = {}
+            self._topics = {}
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 # A fix encapsulating class, based on the AGTL Fix class
+from collections import namedtuple
 from datetime import datetime
 
 
@@ -58,4 +59,60 @@ class Fix():
             self.timestamp = timestamp
 
     def __str__(self):
-        return 'mode:' + self.mode + 'lat,lon:' + self.position + 'elev:' + self.altitude
\ No newline at end of file
+        return 'mode:' + self.mode + 'lat,lon:' + self.position + 'elev:' + self.altitude
+
+
+class FixEvent(namedtuple("FixEvent", ["lat", "lon", "altitude", "bearing", "speed", "fix_class", "time"])):
+    """Immutable position update published by the location module
+
+    Speed is in meters per second, time is the epoch of the update.
+    Fix class: 0 - no fix yet, 2 - 2D fix, 3 - 3D fix
+    """
+    __slots__ = ()
+
+    @property
+    def position(self):
+        """(lat, lon) tuple or None if there is no fix"""
+        if self.lat is None:
+            return None
+        return self.lat, self.lon
+
+    @property
+    def kmh_speed(self):
+        if self.speed is None:
+            return None
+        return self.speed * 3.6
+
+    def options_items(self, source="GPSD"):
+        """Return (key, value) pairs of the position related
+        persistent dictionary keys for this fix
+        """
+        return (('pos', self.position),
+                ('pos_source', source),
+                ('bearing', self.bearing),
+                ('metersPerSecSpeed', self.speed),
+                ('speed', self.kmh_speed),
+                ('elevation', self.altitude),
+                ('fix', self.fix_class),
+                # always set to current epoch once the location is updated
+                ('locationUpdated', self.time))
+
+    @classmethod
+    def from_fix(cls, fix, update_time):
+        """Create a fix event from a (mutable) Fix instance
+
+        :param fix: the fix
+        :type fix: Fix
+        :param float update_time: epoch of the update
+        """
+        if fix.position is None:
+            return cls(None, None, None, None, None, 0, update_time)
+        (lat, lon) = fix.position
+        bearing = fix.bearing
+        if bearing is not None:
+            bearing = float(bearing)
+        if fix.altitude is None:
+            fixClass = 2
+        else:
+            fixClass = 3
+        return cls(lat, lon, fix.altitude, bearing, fix.speed, fixClass, update_time)
@@ -333,120 +333,173 @@ def turnAngle(first, middle, last):
 #  else:
 #    return alpha  + 180
 
-# found on:
-# http://www.quanative.com/2010/01/01/server-side-marker-clustering-for-google-maps-with-python/
-def clusterTrackpoints(trackpointsList, cluster_distance):
-    """
-    Groups points that are less than cluster_distance pixels apart at
-    a given zoom level into a cluster.
-    """
-    clusters = []
-    if trackpointsList:
-        points = [{'latitude': point.latitude, 'longitude': point.longitude} for point in trackpointsList[0]]
-        while len(points) > 0:
-            point1 = points.pop()
-            cluster = []
-            for point2 in points[:]:
-                pixel_distance = distance(point1['latitude'],
-                                          point1['longitude'],
-                                          point2['latitude'],
-                                          point2['longitude'])
-
-                if pixel_distance < cluster_distance:
-                    points.remove(point2)
-                    cluster.append(point2)
-
-            # add the first point to the cluster
-            if len(cluster) > 0:
-                cluster.append(point1)
-                clusters.append(cluster)
-            else:
-                clusters.append([point1])
+# approximate length of one degree of latitude in kilometers
+KM_PER_LAT_DEGREE = 2 * pi * EARTH_RADIUS / 360.0
 
-    return clusters
 
+def _clusterCellSize(cluster_distance, lat):
+    """Return (lat, lon) size of a clustering grid cell in degrees
 
-def old_clusterTrackpoints(trackpointsList, cluster_distance):
+    The longitude size is scaled by latitude so that cells are roughly
+    square on the ground. Near the poles the cell size is capped
+    so that we don't end up with huge or infinite cells.
     """
-    Groups points that are less than cluster_distance pixels apart at
-    a given zoom level into a cluster.
+    latSize = cluster_distance / KM_PER_LAT_DEGREE
+    lonSize = latSize / max(cos(radians(lat)), 0.01)
+    return latSize, lonSize
+
+
+def _boundingCircle(minLat, minLon, maxLat, maxLon):
+    """Return centre and radius of a circle enclosing a lat/lon bounding box"""
+    centreLat = (minLat + maxLat) / 2.0
+    centreLon = (minLon + maxLon) / 2.0
+    # the farthest corner is always on the side closer to the equator,
+    # but checking both is cheap and avoids special-casing hemispheres
+    radius = max(distance(centreLat, centreLon, minLat, minLon),
+                 distance(centreLat, centreLon, maxLat, maxLon))
+    return centreLat, centreLon, radius
+
+
+def clusterTrackIndexes(lats, lons, cluster_distance):
+    """Group track points to clusters using a spatial hash grid.
+
+    The points are assigned to square grid cells about cluster_distance
+    kilometers wide and every contiguous run of points in the same cell
+    becomes one cluster. This runs in O(n), keeps the original track order
+    (both inside the clusters and of the clusters themselves) and computes
+    the circle encompassing each cluster in the same pass.
+
+    :param lats: sequence of point latitudes
+    :param lons: sequence of point longitudes
+    :param float cluster_distance: approximate cluster diameter in kilometers
+    :returns: list of (start index, end index, centreLat, centreLon, radius) tuples,
+              each cluster holds points start to end - 1
+    :rtype: list
     """
-    points = [{'latitude': point.latitude, 'longitude': point.longitude} for point in trackpointsList[0]]
     clusters = []
-    while len(points) > 0:
-        point1 = points.pop()
-        cluster = []
-        for point2 in points[:]:
-            pixel_distance = distance(point1['latitude'],
-                                      point1['longitude'],
-                                      point2['latitude'],
-                                      point2['longitude'])
-
-            if pixel_distance < cluster_distance:
-                points.remove(point2)
-                cluster.append(point2)
-
-        # add the first point to the cluster
-        if len(cluster) > 0:
-            cluster.append(point1)
-            clusters.append(cluster)
+    count = len(lats)
+    if not count:
+        return clusters
+
+    # use a single longitude cell size for the whole track - a track
+    # spanning enough latitude for this to matter will just get somewhat
+    # narrower clusters towards the poles
+    latSize, lonSize = _clusterCellSize(cluster_distance, lats[0])
+
+    currentCell = None
+    start = 0
+    minLat = minLon = maxLat = maxLon = None
+    for i in range(count):
+        lat = lats[i]
+        lon = lons[i]
+        cell = (int(floor(lat / latSize)), int(floor(lon / lonSize)))
+        if cell != currentCell:
+            if i:
+                clusters.append((start, i) + _boundingCircle(minLat, minLon, maxLat, maxLon))
+            currentCell = cell
+            start = i
+            minLat = maxLat = lat
+            minLon = maxLon = lon
         else:
-            clusters.append([point1])
+            if lat < minLat:
+                minLat = lat
+            elif lat > maxLat:
+                maxLat = lat
+            if lon < minLon:
+                minLon = lon
+            elif lon > maxLon:
+                maxLon = lon
+    # don't forget the last cluster
+    clusters.append((start, count) + _boundingCircle(minLat, minLon, maxLat, maxLon))
+    return clusters
+
+
+def clusterTrackpoints(trackpointsList, cluster_distance):
+    """Group trackpoints to clusters using a spatial hash grid.
+
+    See clusterTrackIndexes() for details.
 
+    :param trackpointsList: list of trackpoint lists (only the first one is used)
+    :param float cluster_distance: approximate cluster diameter in kilometers
+    :returns: list of (pointsList, centreLat, centreLon, radius) tuples,
+              where pointsList is a list of {'latitude', 'longitude'} dicts
+    :rtype: list
+    """
+    if not trackpointsList or not trackpointsList[0]:
+        return []
+    lats = [point.latitude for point in trackpointsList[0]]
+    lons = [point.longitude for point in trackpointsList[0]]
+    clusters = []
+    for start, end, centreLat, centreLon, radius in clusterTrackIndexes(lats, lons, cluster_distance):
+        points = [{'latitude': lats[i], 'longitude': lons[i]} for i in range(start, end)]
+        clusters.append((points, centreLat, centreLon, radius))
     return clusters
 
 
-def circleAroundPointCluster(cluster):
-    """Find a circle around a given point cluster and return its centre and radius"""
-
-    """we get the most north, west, south, east points as a heuristics for the preliminary circle"""
-    maxLat = max(cluster, key=lambda x: x['latitude'])
-    minLat = min(cluster, key=lambda x: x['latitude'])
-    maxLon = max(cluster, key=lambda x: x['longitude'])
-    minLon = min(cluster, key=lambda x: x['longitude'])
-    # extremes = [maxLat, minLat, maxLon, minLon]
-    """now we find the north-south and west-east distances using the points above"""
-    latDist = distance(maxLat['latitude'], maxLat['longitude'], minLat['latitude'], minLat['longitude'])
-    lonDist = distance(maxLon['latitude'], maxLon['longitude'], minLon['latitude'], minLon['longitude'])
-    if latDist >= lonDist: #the horizontal distance is the longest
-        centreX = (maxLat['latitude'] + minLat['latitude']) / 2.0
-        centreY = (maxLat['longitude'] + minLat['longitude']) / 2.0
-        pointX = maxLat['latitude']
-        pointY = maxLat['longitude']
-        radius = distance(centreX, centreY, pointX, pointY)
-    else: #the vertical distance is the longest
-        centreX = (maxLon['latitude'] + minLon['latitude']) / 2.0
-        centreY = (maxLon['longitude'] + minLon['longitude']) / 2.0
-        pointX = maxLon['latitude']
-        pointY = maxLon['longitude']
-        radius = distance(centreX, centreY, pointX, pointY)
-    """now we check if all points are inside the circle and adjust it if not"""
-    for point in cluster:
-        currentX = point['latitude']
-        currentY = point['longitude']
-        distanceFromPointToCentre = distance(centreX, centreY, currentX, currentY)
-        if distanceFromPointToCentre > radius:
-            radius = distanceFromPointToCentre
-
-    return centreX, centreY, radius
+def simplifyTrackIndexes(lats, lons, tolerance):
+    """Simplify a track by dropping points too close to the last kept point.
+
+    This is the simple radial distance simplification - a point is kept
+    only if it is at least tolerance kilometers from the previously kept point.
+    The first and last points are always kept. An equirectangular approximation
+    is used for the distance, which is more than precise enough at these scales.
+
+    :param lats: sequence of point latitudes
+    :param lons: sequence of point longitudes
+    :param float tolerance: tolerance in kilometers
+    :returns: indexes of the points that were kept
+    :rtype: list
+    """
+    count = len(lats)
+    if count <= 2:
+        return list(range(count))
+    # compare squared distances in degrees of latitude
+    toleranceSquared = (tolerance / KM_PER_LAT_DEGREE) ** 2
+    lonScale = cos(radians(lats[0]))
+    indexes = [0]
+    lastLat = lats[0]
+    lastLon = lons[0]
+    for i in range(1, count - 1):
+        lat = lats[i]
+        lon = lons[i]
+        dLat = lat - lastLat
+        dLon = (lon - lastLon) * lonScale
+        if dLat * dLat + dLon * dLon >= toleranceSquared:
+            indexes.append(i)
+            lastLat = lat
+            lastLon = lon
+    indexes.append(count - 1)
+    return indexes
+
+
+def trackLength(lats, lons):
+    """Return length of a track given as latitude and longitude sequences in kilometers"""
+    length = 0.0
+    for i in range(1, len(lats)):
+        length += distance(lats[i - 1], lons[i - 1], lats[i], lons[i])
+    return length
 
 
 def perElevList(trackpointsList, numPoints=200):
     """determine elevation in regular interval, numPoints gives the number of intervals"""
-    points = [{'lat': point.latitude, 'lon': point.longitude, 'elev': point.elevation} for point in trackpointsList[0]]
+    points = trackpointsList[0]
+    return perElevListFromArrays([point.latitude for point in points],
+                                 [point.longitude for point in points],
+                                 [point.elevation for point in points],
+                                 numPoints)
+
 
+def perElevListFromArrays(lats, lons, elevations, numPoints=200):
+    """determine elevation in regular interval from point coordinate sequences,
+    unknown elevation is None, numPoints gives the number of intervals"""
     # create a list, where we have (cumulative distance from starting point, elevation)
-    distanceList = [(0, points[0]['elev'], points[0]['lat'], points[0]['lon'])]
-    prevIndex = 0
+    distanceList = [(0, elevations[0], lats[0], lons[0])]
     totalDist = 0
-    for point in points[1:]:
-        prevPoint = points[prevIndex]
-        (pLat, pLon) = (prevPoint['lat'], prevPoint['lon'])
-        (lat, lon, elev) = (point['lat'], point['lon'], point['elev'])
-        dist = distance(pLat, pLon, lat, lon)
-        prevIndex += 1
+    for i in range(1, len(lats)):
+        (lat, lon) = (lats[i], lons[i])
+        dist = distance(lats[i - 1], lons[i - 1], lat, lon)
         totalDist += dist
-        distanceList.append((totalDist, elev, point['lat'], point['lon']))
+        distanceList.append((totalDist, elevations[i], lat, lon))
 
     trackLength = distanceList[-1][0]
     delta = trackLength / numPoints
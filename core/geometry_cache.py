@@ -0,0 +1,181 @@
+"""Zoom level specific cache of projected overlay geometry
+
+Tracklogs and routes are drawn on the map every frame. Instead of projecting
+all their points to the screen every frame, the points are projected once per
+zoom level to absolute (global) pixel coordinates. As the map is just moved
+around on a given zoom level, drawing then only needs to translate
+the cached coordinates by the position of the screen.
+
+The geometry is split to parts (eq. tracklog clusters), each with its own
+bounding box in global pixels, so that parts that are not visible can
+be skipped by a simple rectangle test.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import itertools
+import threading
+from collections import OrderedDict
+
+from core import batch_projection
+
+import logging
+log = logging.getLogger("core.geometry_cache")
+
+TILE_SIZE = 256
+
+# points in a part when splitting a long polyline (eq. a route)
+DEFAULT_PART_SIZE = 64
+
+# how many projected points to keep in the cache over all entries
+DEFAULT_MAX_POINTS = 500000
+
+_versions = itertools.count(1)
+
+
+def new_version():
+    """Return a new geometry version
+
+    Versions are never reused, unlike object ids, so an entry
+    projected from older geometry never matches the new version.
+    """
+    return next(_versions)
+
+
+def split_points(points, part_size=DEFAULT_PART_SIZE):
+    """Split a polyline to parts of at most part_size points
+
+    Consecutive parts share their boundary point, so that
+    the parts drawn together form a continuous line.
+    """
+    parts = []
+    step = max(1, part_size - 1)
+    for start in range(0, max(1, len(points) - 1), step):
+        parts.append(points[start:start + part_size])
+    return parts
+
+
+class ProjectedGeometry(object):
+    """Polyline parts projected to global pixel coordinates for a single zoom level
+
+    :param parts: list of lists of (lat, lon, ...) points
+    :param int zoom: zoom level
+    :param bool connect: if True, each part starts with the last point of the
+                         previous part so that the parts form a continuous line
+    """
+
+    def __init__(self, parts, zoom, connect=False):
+        self.zoom = zoom
+        self.parts = []
+        self.point_count = 0
+        n = TILE_SIZE * 2.0 ** zoom
+        previous = None
+        for points in parts:
+            if not points:
+                continue
+            if connect and previous is not None:
+                points = [previous] + list(points)
+            previous = points[-1]
+            (xs, ys) = batch_projection.points2world(points)
+            (xs, ys) = batch_projection.affine(xs, ys, n, 0.0, n, 0.0)
+            xs = batch_projection.to_list(xs)
+            ys = batch_projection.to_list(ys)
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+            self.parts.append((bbox, xs, ys))
+            self.point_count += len(xs)
+
+    def visible_parts(self, x1, y1, x2, y2):
+        """Return parts whose bounding box intersects the given global pixel rectangle
+
+        :returns: list of (xs, ys) tuples
+        :rtype: list
+        """
+        return [(xs, ys) for (bx1, by1, bx2, by2), xs, ys in self.parts
+                if bx1 <= x2 and bx2 >= x1 and by1 <= y2 and by2 >= y1]
+
+    def draw(self, cr, x1, y1, x2, y2, offset_x, offset_y):
+        """Add parts intersecting the x1, y1, x2, y2 global pixel rectangle
+        to the current path of a cairo context
+
+        :param offset_x: screen left edge in global pixels
+        :param offset_y: screen top edge in global pixels
+        :returns: number of parts added to the path
+        """
+        move_to = cr.move_to
+        line_to = cr.line_to
+        parts = self.visible_parts(x1, y1, x2, y2)
+        for xs, ys in parts:
+            move_to(xs[0] - offset_x, ys[0] - offset_y)
+            for x, y in zip(xs[1:], ys[1:]):
+                line_to(x - offset_x, y - offset_y)
+        return len(parts)
+
+
+class GeometryCache(object):
+    """LRU cache of projected geometry keyed by geometry key & zoom level
+
+    Each entry also has a version, if the version changes (the tracklog has been
+    reloaded or the route has been recomputed), the geometry is projected again.
+    Least recently used entries are removed once the total number of cached
+    points exceeds max_points.
+
+    :param int max_points: maximum number of projected points in the cache
+    """
+
+    def __init__(self, max_points=DEFAULT_MAX_POINTS):
+        self._max_points = max_points
+        self._entries = OrderedDict()
+        self._point_count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def point_count(self):
+        return self._point_count
+
+    def get(self, key, version, zoom, get_parts, connect=False):
+        """Return projected geometry, projecting it if not cached
+
+        :param key: hashable geometry identifier
+        :param version: anything that changes when the geometry changes
+        :param int zoom: zoom level
+        :param get_parts: callable returning the list of point lists to project
+        :param bool connect: connect the parts into a continuous line
+        :rtype: ProjectedGeometry
+        """
+        with self._lock:
+            item = self._entries.pop((key, zoom), None)
+            if item is not None:
+                if item[0] == version:
+                    self._entries[(key, zoom)] = item
+                    self.hits += 1
+                    return item[1]
+                else:
+                    self._point_count -= item[1].point_count
+        self.misses += 1
+        geometry = ProjectedGeometry(get_parts(), zoom, connect=connect)
+        with self._lock:
+            old = self._entries.pop((key, zoom), None)
+            if old is not None:
+                self._point_count -= old[1].point_count
+            self._entries[(key, zoom)] = (version, geometry)
+            self._point_count += geometry.point_count
+            # always keep the newest entry, even if it is larger than the limit
+            while self._point_count > self._max_points and len(self._entries) > 1:
+                (old_key, (old_version, old_geometry)) = self._entries.popitem(last=False)
+                self._point_count -= old_geometry.point_count
+        return geometry
+
+    def invalidate(self, key):
+        """Drop geometry for all zoom levels of the given key"""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == key]:
+                self._point_count -= self._entries.pop(cache_key)[1].point_count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._point_count = 0
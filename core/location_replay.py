@@ -0,0 +1,327 @@
+"""GPX & NMEA position log replay
+
+Position logs are converted to Fix instances that can be fed to the location
+module as if they came from a GPS - for testing navigation on the desktop
+or for benchmarking the position update pipeline without a GUI.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import calendar
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    from xml.etree import cElementTree as ElementTree  # Python 2
+except ImportError:
+    from xml.etree import ElementTree  # Python 3
+
+from core import geo
+from core.fix import Fix, FixEvent
+from core.tracklog_parser import parse_timestamp, TracklogParsingFailed
+
+import logging
+log = logging.getLogger("core.location_replay")
+
+NMEA_EXTENSIONS = (".nmea", ".nma", ".log", ".txt")
+KNOTS_TO_MPS = 0.514444444444444
+
+
+def _local_name(tag):
+    """Drop the XML namespace from an element tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _fix_from_point(lat, lon, elevation, timestamp, previous):
+    """Create a Fix for a log point, speed & bearing are computed from the previous point"""
+    speed = None
+    bearing = None
+    if previous is not None:
+        (prevLat, prevLon, prevTimestamp) = previous
+        bearing = geo.bearing(prevLat, prevLon, lat, lon)
+        if timestamp is not None and prevTimestamp is not None and timestamp > prevTimestamp:
+            speed = geo.distance(prevLat, prevLon, lat, lon) * 1000 / (timestamp - prevTimestamp)
+    if timestamp is None:
+        fixTime = None
+    else:
+        fixTime = datetime.utcfromtimestamp(timestamp)
+    mode = 2
+    if elevation is not None:
+        mode = 3
+    return Fix((lat, lon), elevation, bearing, speed, mode=mode, gps_time=timestamp, timestamp=fixTime)
+
+
+def read_gpx_fixes(path):
+    """Read fixes from trackpoints of a GPX file
+
+    :param str path: path to a GPX file
+    :returns: list of Fix instances
+    :rtype: list
+    """
+    fixes = []
+    previous = None
+    try:
+        for event, element in ElementTree.iterparse(path):
+            if _local_name(element.tag) != "trkpt":
+                continue
+            elevation = None
+            timestamp = None
+            for child in element:
+                childName = _local_name(child.tag)
+                if childName == "ele" and child.text:
+                    elevation = float(child.text)
+                elif childName == "time" and child.text:
+                    timestamp = parse_timestamp(child.text)
+            (lat, lon) = (float(element.get("lat")), float(element.get("lon")))
+            fixes.append(_fix_from_point(lat, lon, elevation, timestamp, previous))
+            previous = (lat, lon, timestamp)
+            element.clear()
+    except Exception as e:
+        log.exception("parsing GPX file failed: %s", path)
+        raise TracklogParsingFailed(str(e))
+    return fixes
+
+
+def _nmea_checksum_ok(sentence):
+    if "*" not in sentence:
+        return True
+    (data, checksum) = sentence[1:].split("*", 1)
+    value = 0
+    for character in data:
+        value ^= ord(character)
+    try:
+        return value == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def _nmea_coordinate(value, hemisphere):
+    """Convert NMEA (d)ddmm.mmmm coordinate to degrees"""
+    if not value:
+        return None
+    degrees = int(float(value) / 100)
+    coordinate = degrees + (float(value) - degrees * 100) / 60.0
+    if hemisphere in ("S", "W"):
+        coordinate = -coordinate
+    return coordinate
+
+
+def _nmea_seconds(timeString):
+    """Seconds since midnight of a NMEA hhmmss(.ss) time"""
+    return int(timeString[0:2]) * 3600 + int(timeString[2:4]) * 60 + float(timeString[4:])
+
+
+def read_nmea_fixes(path):
+    """Read fixes from a NMEA log
+
+    Position, speed & course are read from RMC sentences,
+    altitude & satellite count from GGA sentences of the same time.
+
+    :param str path: path to a NMEA log
+    :returns: list of Fix instances
+    :rtype: list
+    """
+    # NMEA time -> sentence values
+    epochs = OrderedDict()
+    date = None
+    try:
+        with open(path, "rt") as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith("$") or not _nmea_checksum_ok(line):
+                    continue
+                fields = line.split("*", 1)[0].split(",")
+                sentence = fields[0][3:]
+                if sentence == "RMC" and len(fields) >= 10 and fields[1]:
+                    epoch = epochs.setdefault(fields[1], {})
+                    if fields[9]:
+                        date = fields[9]
+                    epoch["date"] = date
+                    if fields[2] == "A":
+                        epoch["lat"] = _nmea_coordinate(fields[3], fields[4])
+                        epoch["lon"] = _nmea_coordinate(fields[5], fields[6])
+                        if fields[7]:
+                            epoch["speed"] = float(fields[7]) * KNOTS_TO_MPS
+                        if fields[8]:
+                            epoch["bearing"] = float(fields[8])
+                elif sentence == "GGA" and len(fields) >= 10 and fields[1]:
+                    epoch = epochs.setdefault(fields[1], {})
+                    if fields[6] and fields[6] != "0":
+                        epoch.setdefault("lat", _nmea_coordinate(fields[2], fields[3]))
+                        epoch.setdefault("lon", _nmea_coordinate(fields[4], fields[5]))
+                        if fields[9]:
+                            epoch["altitude"] = float(fields[9])
+                        if fields[7]:
+                            epoch["sats"] = int(fields[7])
+    except Exception as e:
+        log.exception("parsing NMEA log failed: %s", path)
+        raise TracklogParsingFailed(str(e))
+
+    fixes = []
+    dayOffset = 0
+    lastSeconds = None
+    for timeString, epoch in epochs.items():
+        if epoch.get("lat") is None or epoch.get("lon") is None:
+            continue
+        seconds = _nmea_seconds(timeString)
+        epochDate = epoch.get("date") or date
+        if epochDate:
+            day = calendar.timegm(time.strptime(epochDate, "%d%m%y"))
+        else:
+            # GGA only log, days are counted from the first sentence
+            if lastSeconds is not None and seconds < lastSeconds:
+                dayOffset += 86400
+            day = dayOffset
+        lastSeconds = seconds
+        timestamp = day + seconds
+        altitude = epoch.get("altitude")
+        mode = 2
+        if altitude is not None:
+            mode = 3
+        fixes.append(Fix((epoch["lat"], epoch["lon"]), altitude, epoch.get("bearing"), epoch.get("speed"),
+                         mode=mode, sats_in_use=epoch.get("sats"), gps_time=timestamp,
+                         timestamp=datetime.utcfromtimestamp(timestamp)))
+    return fixes
+
+
+def read_fixes(path):
+    """Read fixes from a GPX file or a NMEA log, the format is determined from file extension
+
+    :param str path: path to a position log
+    :returns: list of Fix instances
+    :rtype: list
+    """
+    if os.path.splitext(path)[1].lower() in NMEA_EXTENSIONS:
+        return read_nmea_fixes(path)
+    else:
+        return read_gpx_fixes(path)
+
+
+def replay(fixes, callback, speed=1.0, stop_event=None):
+    """Feed fixes to a callback with the timing they were recorded with
+
+    :param fixes: list of Fix instances
+    :param callback: callable taking a Fix
+    :param speed: replay speed multiplier, None or 0 replays as fast as possible
+    :param stop_event: threading.Event that stops the replay once set
+    :returns: number of fixes replayed
+    :rtype: int
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    count = 0
+    previousTime = None
+    for fix in fixes:
+        if speed and previousTime is not None and fix.gps_time is not None:
+            delay = (fix.gps_time - previousTime) / float(speed)
+            if delay > 0 and stop_event.wait(delay):
+                break
+        if stop_event.is_set():
+            break
+        if fix.gps_time is not None:
+            previousTime = fix.gps_time
+        callback(fix)
+        count += 1
+    return count
+
+
+def _synthetic_fixes(rate, duration):
+    """Fixes of a car driving east at 15 m/s with rate fixes per second"""
+    fixes = []
+    (lat, lon) = (49.2, 16.6)
+    step = 15.0 / rate / (111320.0 * math.cos(math.radians(lat)))
+    for i in range(int(rate * duration)):
+        timestamp = 1400000000 + i / float(rate)
+        fixes.append(Fix((lat, lon + i * step), 250.0, 90.0, 15.0, mode=3, gps_time=timestamp,
+                         timestamp=datetime.utcfromtimestamp(timestamp)))
+    return fixes
+
+
+def benchmark(path=None, rate=10, duration=600):
+    """Replay a position log headlessly through the position update pipeline
+
+    Compares setting the position keys one by one and notifying the key watchers
+    for every fix with setting the keys at once and delivering fix events to rate
+    limited subscribers. The subscribers stand in for the statistics (1 Hz)
+    and turn by turn navigation (2 Hz) updates. Fix time is used as the event bus
+    clock, so the replay runs as fast as possible.
+
+    :param path: GPX or NMEA log to replay, a synthetic 10 Hz drive is used if None
+    """
+    from core.event_bus import EventBus
+    from core.options_store import OptionsStore
+
+    print("# location replay benchmark start #")
+    if path:
+        fixes = read_fixes(path)
+    else:
+        fixes = _synthetic_fixes(rate, duration)
+    print("%d fixes" % len(fixes))
+    calls = {"stats": 0, "navigation": 0}
+    target = (49.3, 16.8)
+
+    def statsUpdate(speed):
+        calls["stats"] += 1
+
+    def navigationUpdate(pos):
+        calls["navigation"] += 1
+        geo.distance(pos[0], pos[1], target[0], target[1])
+
+    # keys set one by one, watchers called for every fix
+    store = OptionsStore()
+    store.watch("locationUpdated", lambda key, old, new: statsUpdate(store.get("speed", None)))
+    store.watch("locationUpdated", lambda key, old, new: navigationUpdate(store.get("pos", None)))
+    start = time.time()
+    for fix in fixes:
+        event = FixEvent.from_fix(fix, fix.gps_time)
+        for key, value in event.options_items():
+            store.set(key, value)
+    legacy = time.time() - start
+    print("per key set & watchers: %1.2f us per fix, %d stats & %d navigation updates" %
+          (legacy * 1e6 / len(fixes), calls["stats"], calls["navigation"]))
+
+    # keys set at once, rate limited fix event subscribers
+    calls = {"stats": 0, "navigation": 0}
+    clock = [0.0]
+    store = OptionsStore()
+    bus = EventBus(clock=lambda: clock[0], use_timers=False)
+    bus.subscribe("fix", lambda event: statsUpdate(event.kmh_speed), max_rate=1)
+    bus.subscribe("fix", lambda event: navigationUpdate(event.position), max_rate=2)
+
+    def publish(fix):
+        event = FixEvent.from_fix(fix, fix.gps_time)
+        clock[0] = event.time
+        store.set_many(event.options_items())
+        bus.publish("fix", event)
+
+    start = time.time()
+    replay(fixes, publish, speed=None)
+    bus.flush()
+    batched = time.time() - start
+    print("set_many & fix events: %1.2f us per fix, %d stats & %d navigation updates" %
+          (batched * 1e6 / len(fixes), calls["stats"], calls["navigation"]))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # location replay benchmark start #
+# 6000 fixes
+# per key set & watchers: 8.11 us per fix, 6000 stats & 6000 navigation updates
+# set_many & fix events: 8.43 us per fix, 601 stats & 1201 navigation updates
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+#
+# # location replay benchmark start #
+# 6000 fixes
+# per key set & watchers: 21.53 us per fix, 6000 stats & 6000 navigation updates
+# set_many & fix events: 20.75 us per fix, 601 stats & 1201 navigation updates
+# # benchmark finished #
+#
+# The stand-in subscribers are trivial, so the per fix cost is dominated by
+# setting the keys - the gain is the 5-10x lower number of subscriber calls,
+# each of which does real work (statistics, navigation, redraw) in modRana.
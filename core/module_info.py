@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""modRana module loading metadata and on-demand module loading
+
+Not all modRana modules need to be loaded before the GUI shows up -
+many of them are only needed once the user opens a given menu or
+page, or are not used at all in a session. Each module thus declares
+how eagerly it should be loaded:
+
+* EAGER - loaded and initialized before the GUI shows up
+* DEFERRED - loaded in the background once the GUI has been started
+* LAZY - only loaded when first accessed
+
+Modules also declare other modules they depend on, dependencies are
+always loaded and initialized before the modules that depend on them.
+Modules not listed in MODULES are loaded eagerly without dependencies.
+
+The metadata is kept in this module rather than in the modules themselves,
+so that it is available without importing the module.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+
+import logging
+log = logging.getLogger("core.module_info")
+
+EAGER = "eager"
+DEFERRED = "deferred"
+LAZY = "lazy"
+
+
+class ModuleInfo(object):
+    """Loading metadata for a modRana module
+
+    :param str eagerness: when to load the module - EAGER, DEFERRED or LAZY
+    :param dependencies: names of modules the module needs during initialization
+    """
+
+    def __init__(self, eagerness=EAGER, dependencies=()):
+        self.eagerness = eagerness
+        self.dependencies = tuple(dependencies)
+
+
+# the default for modules with no metadata
+DEFAULT_INFO = ModuleInfo()
+
+MODULES = {
+    # core & map display
+    "askMenu": ModuleInfo(EAGER, ["menu"]),
+    "clickHandler": ModuleInfo(EAGER, ["messages"]),
+    "location": ModuleInfo(EAGER, ["cron"]),
+    "mapTiles": ModuleInfo(EAGER, ["mapView", "storeTiles", "mapLayers"]),
+    "menu": ModuleInfo(EAGER, ["icons"]),
+    "options": ModuleInfo(EAGER, ["menu"]),
+    "showOSD": ModuleInfo(EAGER, ["icons"]),
+    # loaded in the background after startup
+    "info": ModuleInfo(DEFERRED),
+    "mapData": ModuleInfo(DEFERRED),
+    "markers": ModuleInfo(DEFERRED),
+    "route": ModuleInfo(DEFERRED, ["turnByTurn"]),
+    "routeProfile": ModuleInfo(DEFERRED),
+    "search": ModuleInfo(DEFERRED),
+    "showPOI": ModuleInfo(DEFERRED, ["storePOI"]),
+    "showTracklogs": ModuleInfo(DEFERRED, ["loadTracklogs"]),
+    "stats": ModuleInfo(DEFERRED),
+    "storePOI": ModuleInfo(DEFERRED),
+    "tracklog": ModuleInfo(DEFERRED),
+    "tracklogManager": ModuleInfo(DEFERRED, ["loadTracklogs"]),
+    "turnByTurn": ModuleInfo(DEFERRED, ["icons"]),
+    "voice": ModuleInfo(DEFERRED),
+    # only loaded on first access
+    "example": ModuleInfo(LAZY),
+    "loadTracklogs": ModuleInfo(LAZY),
+    "onlineServices": ModuleInfo(LAZY),
+    "textEntry": ModuleInfo(LAZY),
+    "tileserver": ModuleInfo(LAZY, ["mapTiles"]),
+}
+
+
+def get_module_info(name):
+    """Return loading metadata for a module
+
+    :param str name: module name (without the mod_ prefix)
+    :rtype: ModuleInfo
+    """
+    return MODULES.get(name, DEFAULT_INFO)
+
+
+def startup_order(names):
+    """Order modules so that dependencies come before modules that depend on them
+
+    Dependencies not present in names are ignored, modules are otherwise
+    kept in alphabetical order to make the startup order reproducible.
+
+    :param names: module names
+    :returns: ordered list of module names
+    :rtype: list
+    """
+    names = set(names)
+    ordered = []
+    done = set()
+    in_progress = set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in in_progress:
+            log.warning("module dependency cycle detected at %s", name)
+            return
+        in_progress.add(name)
+        for dependency in get_module_info(name).dependencies:
+            if dependency in names:
+                visit(dependency)
+        in_progress.discard(name)
+        done.add(name)
+        ordered.append(name)
+
+    for name in sorted(names):
+        visit(name)
+    return ordered
+
+
+def with_dependencies(names, available):
+    """Return the given module names together with all their (transitive) dependencies
+
+    :param names: module names
+    :param available: names of all available modules
+    :rtype: set
+    """
+    result = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in result or name not in available:
+            continue
+        result.add(name)
+        pending.extend(get_module_info(name).dependencies)
+    return result
+
+
+class ModuleDict(dict):
+    """Dictionary of loaded modules that loads available modules on first access
+
+    Only fully initialized modules are stored in the dictionary, so
+    iterating over it never returns a module that is still being loaded.
+
+    Modules that have not been loaded yet get broadcast messages
+    once they are loaded, in the order the messages were sent.
+
+    :param loader: callable taking a module name, it should load and initialize
+                   the module and return the module instance or None if loading failed
+    :param dispatch: callable taking a function & its arguments, it should run the function
+                     on the main loop & return its result, used so that modules are always
+                     initialized on the main loop, None loads modules from the calling thread
+    """
+
+    def __init__(self, loader, dispatch=None):
+        dict.__init__(self)
+        self._loader = loader
+        self._dispatch = dispatch
+        # only guards the bookkeeping, modules are loaded without holding it
+        self._lock = threading.RLock()
+        # module name -> import name for modules that can be loaded on demand
+        self._available = {}
+        # modules currently being loaded -> (partially initialized) instance,
+        # so that modules depending on each other can access each other
+        # during initialization
+        self._loading = {}
+        # modules currently being loaded -> (loaded event, loading thread)
+        self._loading_events = {}
+        # module name -> broadcast messages sent before the module was loaded
+        self._queued_messages = {}
+
+    def set_available(self, available):
+        """Set modules that can be loaded on demand
+
+        :param dict available: module name -> import name
+        """
+        with self._lock:
+            self._available = dict(available)
+
+    def import_name(self, name):
+        return self._available.get(name)
+
+    def is_available(self, name):
+        """Report if a module is loaded or can be loaded on demand"""
+        return dict.__contains__(self, name) or name in self._available
+
+    def not_loaded(self):
+        """Return names of available modules that have not yet been loaded"""
+        with self._lock:
+            return [name for name in self._available if not dict.__contains__(self, name)]
+
+    def set_loading(self, name, instance):
+        """Make a module that is being initialized accessible to its dependencies"""
+        self._loading[name] = instance
+
+    def broadcast(self, message):
+        """Send a message to all modules
+
+        Loaded modules get the message right away, available modules
+        get it once they are loaded.
+        """
+        with self._lock:
+            loaded = list(dict.values(self))
+            for name in self._available:
+                if not dict.__contains__(self, name):
+                    self._queued_messages.setdefault(name, []).append(message)
+        for module in loaded:
+            module.handleMessage(message, None, None)
+
+    def _load(self, name):
+        if self._dispatch is not None and self.is_available(name):
+            return self._dispatch(self._load_now, name)
+        else:
+            return self._load_now(name)
+
+    def _load_now(self, name):
+        current_thread = threading.current_thread()
+        with self._lock:
+            if dict.__contains__(self, name):
+                return dict.__getitem__(self, name)
+            if name in self._loading_events:
+                (event, thread) = self._loading_events[name]
+                if thread is current_thread:
+                    # accessed during its own initialization
+                    return self._loading.get(name)
+            elif name not in self._available:
+                return None
+            else:
+                event = None
+                self._loading_events[name] = (threading.Event(), current_thread)
+        if event is not None:
+            # another thread is loading the module, wait just for this module
+            event.wait()
+            return dict.get(self, name)
+
+        instance = None
+        try:
+            instance = self._loader(name)
+        finally:
+            with self._lock:
+                self._loading.pop(name, None)
+                (event, thread) = self._loading_events.pop(name)
+                queued = self._queued_messages.pop(name, [])
+                if instance is None:
+                    # don't retry modules that failed to load
+                    self._available.pop(name, None)
+                else:
+                    dict.__setitem__(self, name, instance)
+            event.set()
+        if instance is not None:
+            for message in queued:
+                try:
+                    instance.handleMessage(message, None, None)
+                except Exception:
+                    log.exception("module %s failed to handle queued message %s", name, message)
+        return instance
+
+    def get(self, name, default=None):
+        instance = dict.get(self, name)
+        if instance is None:
+            instance = self._load(name)
+            if instance is None:
+                return default
+        return instance
+
+    def __getitem__(self, name):
+        instance = self.get(name)
+        if instance is None:
+            raise KeyError(name)
+        return instance
+
+    # modules might be loaded by another thread while the
+    # result is being iterated, so always return a copy
+
+    def values(self):
+        with self._lock:
+            return list(dict.values(self))
+
+    def items(self):
+        with self._lock:
+            return list(dict.items(self))
+
+    def keys(self):
+        with self._lock:
+            return list(dict.keys(self))
@@ -17,8 +17,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
+# the standard library signal module, not core/signal.py on Python 2
+from __future__ import absolute_import
 import os
-from threading import Thread
+import threading
 import time
 import subprocess
 import signal
@@ -39,6 +41,18 @@ RETRY_COUNT = 3 # if routing fails, try RETRY_COUNT more times
 #
 # Monav routing is also very fast, so doing more tries is not a problem
 
+MONAV_SERVER_PORT = 8040
+# how long to wait for the Monav server to start accepting connections (in seconds)
+SERVER_START_TIMEOUT = 5
+SERVER_START_POLL_INTERVAL = 0.1
+# socket timeouts for health checks & route requests (in seconds)
+HEALTH_CHECK_TIMEOUT = 2
+ROUTING_TIMEOUT = 60
+# don't health check a server that responded less than this many seconds ago
+HEALTH_CHECK_INTERVAL = 60
+# how often to check if a running route search has been cancelled (in seconds)
+CANCEL_POLL_INTERVAL = 0.1
+
 
 import logging
 log = logging.getLogger("mod.routing.monav_support")
@@ -58,10 +72,11 @@ class MonavBase(object):
     def data_path(self, value):
         self._data_path = value
 
-    def get_monav_directions(self, waypoints, route_params):
+    def get_monav_directions(self, waypoints, route_params, cancelled=None):
         """Get route from Monav for a list of waypoints
 
         :param list waypoints: a list of waypoints (Point objects)
+        :param cancelled: optional callable returning True once the route search has been cancelled
         :return: routing result object or None if routing failed
         :rtype: routing result object or None
         TODO: verify this
@@ -77,6 +92,15 @@ class MonavServer(MonavBase):
        useful only on the N900, for which a working Monav routing server binary exists.
        For more up-to-date platforms (supporting Qt 5) the Monav Light routing utility
        should be used instead.
+
+       The server is a long-lived worker process that keeps routing data loaded
+       between requests, so only the first route search (and the first one
+       after the data path changes) has to load the data from disk.
+       The data path is sent with each request, so the server does not need
+       to be restarted when it changes. The server is health checked and
+       restarted automatically if it dies or stops responding. Route
+       requests from multiple threads are serialized, as the server
+       handles one request at a time.
     """
     def __init__(self, monav_data_path, monav_server_executable_path):
         MonavBase.__init__(self, data_path=monav_data_path)
@@ -85,97 +109,160 @@ class MonavServer(MonavBase):
         # make return codes easily accessible
         from signals_pb2 import RoutingResult
         self._return_codes = RoutingResult
+        # guards server start & stop
+        self._server_lock = threading.RLock()
+        # serializes route requests
+        self._request_lock = threading.Lock()
+        # a server we did not start was found running
+        self._external_server = False
+        # when did the server last respond
+        self._last_response = 0
+        self._restart_count = 0
 
         # connect to the shutdown signal so that we can stop
         # the server when modRana shuts down
-        modrana.shutdown_signal.connect(self.stop_server)
-
-    def start_server(self, port=None):
-        log.info('starting Monav server')
-        started = False
+        if modrana:
+            modrana.shutdown_signal.connect(self.stop_server)
 
+    def _connect(self, timeout):
         # only import Monav server & company when actually needed
         # -> the protobuf modules are quite large
         import monav_server
+        return monav_server.TcpConnection(port=MONAV_SERVER_PORT, timeout=timeout)
 
+    def check_health(self):
+        """Check if the server is up and answering requests
+
+        :returns: True if the server is healthy, False otherwise
+        :rtype: bool
+        """
+        import monav_server
         try:
-            # first check if monav server is already running
+            connection = self._connect(HEALTH_CHECK_TIMEOUT)
             try:
-                monav_server.TcpConnection()
-                log.error('server already running')
-            except Exception:
-                import sys
-
-                if not self._monav_server_binary_path:
-                    log.error("can't start monav server - monav server binary missing")
-                    return
-                log.info('using monav server binary in:\n%s', self._monav_server_binary_path)
-
-                def _start_server_process(self):
-                    self._monav_server_process = subprocess.Popen(
-                        "%s" % self._monav_server_binary_path
-                    )
-
-                t = Thread(target=_start_server_process, args=[self], name='asynchronous monav-server start')
-                t.setDaemon(True) # we need that the thread dies with the program
-                t.start()
-                timeout = 5 # in s
-                sleepTime = 0.1 # in s
-                startTimestamp = time.time()
-                elapsed = 0
-                # wait up to timeout seconds for the server to start
-                # and then return
-                while elapsed < timeout:
-                    if self._monav_server_process:
-                        try:
-                            # test if the server is up and accepting connections
-                            monav_server.TcpConnection()
-                            break
-                        except Exception:
-                            pass # not yet fully started
-                    time.sleep(sleepTime)
-                    elapsed = time.time() - startTimestamp
-                started = True
-                # TODO: use other port than 8040 ?, check out tileserver code
+                monav_server.get_version(connection)
+            finally:
+                connection.close()
         except Exception:
-            log.exception('starting Monav server failed')
+            return False
+        self._last_response = time.time()
+        return True
 
-        if started:
-            log.info('Monav server started')
+    def start_server(self, port=None):
+        """Start the server and wait for it to accept requests
+
+        :returns: True if the server is running, False otherwise
+        :rtype: bool
+        """
+        with self._server_lock:
+            if self.server_running:
+                return True
+            log.info('starting Monav server')
+            # first check if monav server is already running
+            if self.check_health():
+                log.warning('Monav server already running, using it')
+                self._external_server = True
+                return True
+            if not self._monav_server_binary_path:
+                log.error("can't start monav server - monav server binary missing")
+                return False
+            log.info('using monav server binary in:\n%s', self._monav_server_binary_path)
+            try:
+                self._monav_server_process = subprocess.Popen([self._monav_server_binary_path])
+            except Exception:
+                log.exception('starting Monav server failed')
+                self._monav_server_process = None
+                return False
+            # wait for the server to start accepting connections
+            start_timestamp = time.time()
+            while time.time() - start_timestamp < SERVER_START_TIMEOUT:
+                if self._monav_server_process.poll() is not None:
+                    log.error('Monav server exited during startup with return code %d',
+                              self._monav_server_process.returncode)
+                    self._monav_server_process = None
+                    return False
+                if self.check_health():
+                    log.info('Monav server started in %1.2f ms', 1000 * (time.time() - start_timestamp))
+                    return True
+                time.sleep(SERVER_START_POLL_INTERVAL)
+            log.error('Monav server did not start in %d s', SERVER_START_TIMEOUT)
+            self.stop_server()
+            return False
 
     def stop_server(self):
-        log.info('stopping Monav server')
-        stopped = False
-        try:
-            if self._monav_server_process:
-                # Python 2.5 doesn't have POpen.terminate(),
-                # so we use this
-                os.kill(self._monav_server_process.pid, signal.SIGKILL)
-                stopped = True
-            else:
-                log.error('no Monav server process found')
-        except Exception:
-            log.exception('stopping Monav server failed')
-        self._monav_server_process = None
-        if stopped:
-            log.info('Monav server stopped')
+        with self._server_lock:
+            log.info('stopping Monav server')
+            self._external_server = False
+            if self._monav_server_process is None:
+                log.debug('no Monav server process found')
+                return
+            try:
+                if self._monav_server_process.poll() is None:
+                    # Python 2.5 doesn't have POpen.terminate(),
+                    # so we use this
+                    os.kill(self._monav_server_process.pid, signal.SIGKILL)
+                    self._monav_server_process.wait()
+                log.info('Monav server stopped')
+            except Exception:
+                log.exception('stopping Monav server failed')
+            self._monav_server_process = None
+
+    def restart_server(self):
+        """Restart the server
+
+        :returns: True if the server is running again, False otherwise
+        :rtype: bool
+        """
+        with self._server_lock:
+            self._restart_count += 1
+            log.warning('restarting Monav server (restart number %d)', self._restart_count)
+            self.stop_server()
+            return self.start_server()
+
+    def ensure_server(self):
+        """Make sure a healthy server is running, (re)start it if needed
+
+        Servers that responded recently are assumed to be healthy,
+        to avoid health check round trips when rerouting.
+
+        :returns: True if the server is running, False otherwise
+        :rtype: bool
+        """
+        with self._server_lock:
+            if not self.server_running:
+                if self._monav_server_process is not None:
+                    log.error('Monav server exited unexpectedly with return code %s',
+                              self._monav_server_process.returncode)
+                    return self.restart_server()
+                return self.start_server()
+            elif time.time() - self._last_response > HEALTH_CHECK_INTERVAL and not self.check_health():
+                log.error('Monav server is not responding')
+                return self.restart_server()
+            return True
 
     @property
     def server_running(self):
-        if self._monav_server_process:
+        if self._external_server:
             return True
-        else:
-            return False
+        return self._monav_server_process is not None and self._monav_server_process.poll() is None
 
-    def get_monav_directions(self, waypoints, route_params):
-        """Search for a route using Monav routing server"""
-        # check if Monav server is running
+    @property
+    def restart_count(self):
+        """Number of automatic server restarts"""
+        return self._restart_count
+
+    def get_monav_directions(self, waypoints, route_params, cancelled=None):
+        """Search for a route using Monav routing server
 
+        A request sent to the server is not interrupted if the search
+        is cancelled, but no more retries are made.
+        """
         if self.data_path is None:
             log.error("error, data_path not set (is None)")
             return None
-        if not self.server_running:
-            self.start_server() # start the server
+        if not self.ensure_server():
+            log.error("monav server: server not running, can't route")
+            return None
 
         # Monav works with (lat, lon) tuples so we
         # need to convert the waypoints to a list of
@@ -187,21 +274,32 @@ class MonavServer(MonavBase):
         import monav_server
 
         log.info('monav server: starting route search')
-        start = time.clock()
+        start = time.time()
         tryNr = 0
         result = None
-        while tryNr < RETRY_COUNT:
-            tryNr += 1
-            try:
-                result = monav_server.get_route(self.data_path, waypoints)
-                break
-            except Exception:
-                log.exception('routing failed')
-
-                if tryNr < RETRY_COUNT:
-                    log.info('retrying')
-        if tryNr < RETRY_COUNT:
-            log.info('monav server: search finished in %1.2f ms and %d tries', 1000 * (time.clock() - start), tryNr)
+        with self._request_lock:
+            while tryNr < RETRY_COUNT:
+                if cancelled is not None and cancelled():
+                    log.info('monav server: route search cancelled')
+                    return None
+                tryNr += 1
+                try:
+                    connection = self._connect(ROUTING_TIMEOUT)
+                    try:
+                        result = monav_server.get_route(self.data_path, waypoints, connection=connection)
+                    finally:
+                        connection.close()
+                    self._last_response = time.time()
+                    break
+                except Exception:
+                    log.exception('routing failed')
+                    # the server might have died or hung during the request
+                    if not self.check_health():
+                        self.restart_server()
+                    if tryNr < RETRY_COUNT:
+                        log.info('retrying')
+        if result is not None:
+            log.info('monav server: search finished in %1.2f ms and %d tries', 1000 * (time.time() - start), tryNr)
             return result
         else:
             log.error('monav server: search failed after %d retries', tryNr)
@@ -284,7 +382,11 @@ class MonavLightResult(object):
         return  self._result_dict["seconds"]
 
 class MonavLight(MonavBase):
-    """This class represents the Monav Light routing utility"""
+    """This class represents the Monav Light routing utility
+
+       Monav Light is a one-shot utility - a new process is started for every
+       route request and it loads the routing data from disk each time.
+    """
 
     def __init__(self, monav_data_path, monav_light_executable_path):
         MonavBase.__init__(self, data_path=monav_data_path)
@@ -306,20 +408,80 @@ class MonavLight(MonavBase):
             "waypoints" : point_list
         })
 
-    def get_monav_directions(self, waypoints, route_params):
-        start = time.clock()
+    def get_monav_directions(self, waypoints, route_params, cancelled=None):
+        """Search for a route using Monav Light
+
+        The Monav Light process is killed if the search is cancelled.
+        """
+        start = time.time()
         input_json = self._get_input_json(waypoints, route_params)
         log.info('monav light: starting route search')
         process = subprocess.Popen([self._monav_light_executable_path, input_json], stdout=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        # read the output in a thread, so that we can check for cancellation
+        output = []
+        reader = threading.Thread(target=lambda: output.append(process.communicate()[0]))
+        reader.daemon = True
+        reader.start()
+        while reader.is_alive():
+            reader.join(CANCEL_POLL_INTERVAL)
+            if reader.is_alive() and cancelled is not None and cancelled():
+                log.info('monav light: route search cancelled')
+                os.kill(process.pid, signal.SIGKILL)
+                reader.join()
+                return None
+        stdout = output[0]
         if process.returncode == 0:
             # Monav Light outputs the route as JSON to stdout
             result_dict = json.loads(stdout.decode("utf-8"))
             result = MonavLightResult(result_dict)
             if result.type == result.SUCCESS:
-                log.info('monav light: route search successful (%1.2f ms)', 1000 * (time.clock() - start))
+                log.info('monav light: route search successful (%1.2f ms)', 1000 * (time.time() - start))
             else:
                 log.error("monav light: routing failed: %s", result.status_message())
             return result
         else:
             log.error("calling monav-light failed with return code %d", process.returncode)
+
+
+def benchmark(data_path, waypoints, monav_server_path=None, monav_light_path=None, request_count=10):
+    """Cold & warm route search latency benchmark
+
+    Monav Light loads the routing data for every request, while the Monav
+    server keeps it loaded, so only its first (cold) request loads the data.
+    No results have been recorded yet, so any difference between the two
+    is unmeasured.
+
+    :param str data_path: path to a Monav routing data folder
+    :param list waypoints: (lat, lon) tuples inside the routing data
+    :param str monav_server_path: path to the monav-server binary
+    :param str monav_light_path: path to the monav-light binary
+    :param int request_count: number of route requests per router
+    """
+    waypoints = [Point(lat, lon) for (lat, lon) in waypoints]
+    routers = []
+    if monav_server_path:
+        routers.append(("monav server", MonavServer(data_path, monav_server_path)))
+    if monav_light_path:
+        routers.append(("monav light", MonavLight(data_path, monav_light_path)))
+
+    print("# Monav route search benchmark start #")
+    for name, router in routers:
+        durations = []
+        for i in range(request_count):
+            start = time.time()
+            if router.get_monav_directions(waypoints, None) is None:
+                print("%s: route search failed" % name)
+                break
+            durations.append(time.time() - start)
+        if durations:
+            print("%s: cold %1.2f ms" % (name, 1000 * durations[0]))
+        if len(durations) > 1:
+            print("%s: warm %1.2f ms (average of %d)"
+                  % (name, 1000 * sum(durations[1:]) / (len(durations) - 1), len(durations) - 1))
+        if isinstance(router, MonavServer):
+            router.stop_server()
+    print("# benchmark finished #")
+
+## RESULTS ##
+# Not run - the bundled monav-server binaries need the Qt 4 & protobuf
+# runtime libraries and no Monav routing data set was available.
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Journaled persistent options storage
+
+The persistent options dictionary used to be marshaled to a single file
+as a whole, only on shutdown. That rewrites all options because of a single
+changed key and loses all changes if modRana or the device crashes.
+
+Options are now stored in two files:
+
+* a snapshot - the whole persistent dictionary marshaled to a single file,
+  in the same format as before, so existing options files are still loaded
+* a journal - an append-only log of keys changed since the snapshot was written
+
+Changed keys are appended to the journal as records, each with a CRC32
+checksum, so that a record torn by a crash is detected and ignored. Once
+the journal grows too big, it is compacted - a new snapshot is written
+to a temporary file, atomically renamed over the old one and the journal
+is emptied. Replaying journal records over a snapshot is idempotent,
+so a crash in the middle of compaction does not lose any data.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+
+import logging
+log = logging.getLogger("core.options_journal")
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAGIC = b"MROJ"
+JOURNAL_VERSION = 1
+# magic, version
+JOURNAL_HEADER = struct.Struct("<4sI")
+# payload length, payload CRC32
+RECORD_HEADER = struct.Struct("<II")
+MARSHAL_VERSION = 2
+
+SET = "s"
+DELETE = "d"
+
+# compact the journal once it is bigger than this (in bytes)
+DEFAULT_COMPACTION_THRESHOLD = 256 * 1024
+
+
+class _Deleted(object):
+    """Marks a removed key in changes passed to OptionsJournal.append()"""
+
+    def __repr__(self):
+        return "DELETED"
+
+DELETED = _Deleted()
+
+
+class OptionsJournal(object):
+    """Journaled storage for the persistent options dictionary
+
+    :param str snapshot_path: path to the options snapshot file
+    :param int compaction_threshold: journal size in bytes triggering compaction
+    """
+
+    def __init__(self, snapshot_path, compaction_threshold=DEFAULT_COMPACTION_THRESHOLD):
+        self._snapshot_path = snapshot_path
+        self._journal_path = snapshot_path + JOURNAL_SUFFIX
+        self._compaction_threshold = compaction_threshold
+        self._journal_size = 0
+        self._lock = threading.RLock()
+
+    @property
+    def snapshot_path(self):
+        return self._snapshot_path
+
+    @property
+    def journal_path(self):
+        return self._journal_path
+
+    @property
+    def needs_compaction(self):
+        """Report if the journal is big enough to be compacted"""
+        return self._journal_size > self._compaction_threshold
+
+    def load(self):
+        """Load the persistent dictionary from the snapshot and the journal
+
+        Journal replay stops at the first damaged record, which is also
+        truncated from the journal, so that new records are appended
+        after the last valid one.
+
+        :returns: the persistent dictionary
+        :rtype: dict
+        :raises: an exception if the snapshot can't be loaded
+        """
+        with self._lock:
+            data = {}
+            if os.path.exists(self._snapshot_path):
+                with open(self._snapshot_path, "rb") as f:
+                    # reading the whole file first is much faster than
+                    # marshal.load(), which reads the file piece by piece
+                    data = marshal.loads(f.read())
+            if os.path.exists(self._journal_path):
+                self._journal_size = self._replay(data)
+            else:
+                self._journal_size = 0
+            return data
+
+    def load_or_reset(self):
+        """Load the persistent dictionary, start from scratch if the snapshot is damaged
+
+        The damaged snapshot & journal are moved aside (renamed with a timestamp
+        suffix), so that they can be inspected or restored manually and new options
+        can be saved as usual.
+
+        :returns: the persistent dictionary & True if it was loaded successfully
+        :rtype: tuple
+        """
+        try:
+            return self.load(), True
+        except Exception:
+            log.exception("loading options failed")
+            self.move_aside()
+            return {}, False
+
+    def move_aside(self):
+        """Rename the snapshot & journal files, so that they are not loaded again"""
+        with self._lock:
+            suffix = ".corrupted-%d" % time.time()
+            for path in (self._snapshot_path, self._journal_path):
+                if os.path.exists(path):
+                    try:
+                        os.rename(path, path + suffix)
+                        log.warning("damaged options file moved to %s", path + suffix)
+                    except OSError:
+                        log.exception("can't move damaged options file %s aside", path)
+            self._journal_size = 0
+
+    def _replay(self, data):
+        """Replay journal records over data
+
+        :returns: size of the valid part of the journal
+        """
+        valid_size = 0
+        record_count = 0
+        with open(self._journal_path, "r+b") as f:
+            header = f.read(JOURNAL_HEADER.size)
+            if len(header) == JOURNAL_HEADER.size and JOURNAL_HEADER.unpack(header) == \
+                    (JOURNAL_MAGIC, JOURNAL_VERSION):
+                valid_size = JOURNAL_HEADER.size
+                while True:
+                    record_header = f.read(RECORD_HEADER.size)
+                    if len(record_header) < RECORD_HEADER.size:
+                        break
+                    length, checksum = RECORD_HEADER.unpack(record_header)
+                    payload = f.read(length)
+                    if len(payload) < length or (zlib.crc32(payload) & 0xFFFFFFFF) != checksum:
+                        break
+                    try:
+                        record = marshal.loads(payload)
+                        if record[0] == SET:
+                            data[record[1]] = record[2]
+                        elif record[0] == DELETE:
+                            data.pop(record[1], None)
+                    except Exception:
+                        log.exception("invalid options journal record")
+                        break
+                    record_count += 1
+                    valid_size += RECORD_HEADER.size + length
+            elif header:
+                log.warning("ignoring options journal with unknown format")
+            f.seek(0, os.SEEK_END)
+            if f.tell() != valid_size:
+                log.warning("options journal damaged, %d bytes ignored", f.tell() - valid_size)
+                f.truncate(valid_size)
+        log.debug("%d options journal records replayed", record_count)
+        return valid_size
+
+    def append(self, changes, sync=True):
+        """Append changed keys to the journal
+
+        The journal is flushed and, if sync is True, fsync-ed before returning.
+
+        :param dict changes: key -> new value, DELETED for removed keys
+        :param bool sync: fsync the journal, so that the records survive a device crash
+        :returns: number of records written
+        :rtype: int
+        """
+        records = []
+        for key, value in changes.items():
+            try:
+                if value is DELETED:
+                    payload = marshal.dumps((DELETE, key), MARSHAL_VERSION)
+                else:
+                    payload = marshal.dumps((SET, key, value), MARSHAL_VERSION)
+            except ValueError:
+                log.error("can't save value of options key %s: %r", key, value)
+                continue
+            records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xFFFFFFFF))
+            records.append(payload)
+        if not records:
+            return 0
+        with self._lock:
+            if self._journal_size == 0:
+                mode = "wb"
+                records.insert(0, JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+            else:
+                mode = "ab"
+            data = b"".join(records)
+            with open(self._journal_path, mode) as f:
+                f.write(data)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+            self._journal_size += len(data)
+        return len(records) // 2
+
+    def compact(self, data):
+        """Write a new snapshot and empty the journal
+
+        :param dict data: the complete persistent dictionary
+        """
+        with self._lock:
+            temp_path = self._snapshot_path + ".tmp"
+            try:
+                with open(temp_path, "wb") as f:
+                    f.write(marshal.dumps(data, MARSHAL_VERSION))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(temp_path, self._snapshot_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            # the snapshot now contains everything from the journal
+            if os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+            self._journal_size = 0
+
+
+def benchmark(key_counts=(1000, 10000, 100000), changed_fraction=0.1):
+    """Options loading benchmark
+
+    Compares loading a whole-dictionary marshal dump followed by setting
+    each key separately (as done previously) with loading a journaled
+    snapshot followed by a bulk load of the persistent dictionary.
+    """
+    import shutil
+    import tempfile
+    from core.options_store import OptionsStore, _LegacyOptions
+
+    def callback(key, oldValue, newValue):
+        pass
+
+    print("# options loading benchmark start #")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for key_count in key_counts:
+            data = dict(("key%d" % i, [i, "value %d" % i, {"nested": i}]) for i in range(key_count))
+            changed_count = int(key_count * changed_fraction)
+            print("%d keys, %d changed keys in the journal" % (key_count, changed_count))
+
+            # legacy - marshal dump & per key set
+            legacy_path = os.path.join(temp_dir, "legacy.bin")
+            with open(legacy_path, "wb") as f:
+                marshal.dump(data, f, MARSHAL_VERSION)
+            legacy = _LegacyOptions()
+            # a handful of watched keys, as after early startup
+            for i in range(10):
+                legacy.watches["key%d" % i] = [("", callback, [])]
+            start = time.time()
+            with open(legacy_path, "rb") as f:
+                loaded = marshal.load(f)
+            for k, v in loaded.items():
+                legacy.set(k, v)
+            print("legacy: %1.2f ms" % (1000 * (time.time() - start)))
+
+            # journal - snapshot + journal replay & bulk load
+            journal = OptionsJournal(os.path.join(temp_dir, "options_%d.bin" % key_count))
+            journal.compact(data)
+            journal.append(dict(("key%d" % i, i) for i in range(changed_count)))
+            store = OptionsStore()
+            for i in range(10):
+                store.watch("key%d" % i, callback)
+            start = time.time()
+            store.load(OptionsJournal(journal.snapshot_path).load())
+            print("journal: %1.2f ms" % (1000 * (time.time() - start)))
+    finally:
+        shutil.rmtree(temp_dir)
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # options loading benchmark start #
+# 1000 keys, 100 changed keys in the journal
+# legacy: 7.27 ms
+# journal: 1.18 ms
+# 10000 keys, 1000 changed keys in the journal
+# legacy: 51.35 ms
+# journal: 8.91 ms
+# 100000 keys, 10000 changed keys in the journal
+# legacy: 943.03 ms
+# journal: 212.43 ms
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+#
+# # options loading benchmark start #
+# 1000 keys, 100 changed keys in the journal
+# legacy: 1.99 ms
+# journal: 0.97 ms
+# 10000 keys, 1000 changed keys in the journal
+# legacy: 21.64 ms
+# journal: 10.77 ms
+# 100000 keys, 10000 changed keys in the journal
+# legacy: 431.65 ms
+# journal: 218.82 ms
+# # benchmark finished #
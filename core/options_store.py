@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""modRana options store
+
+The options store holds the persistent options dictionary, per-mode key
+modifiers and options key watches. Options are read and written on most hot
+paths in modRana - per position fix, per frame and per tile - so the store
+keeps a flattened, mode-resolved view of the keys that have a modifier
+for the current mode. The view is only rebuilt when the mode changes
+or when a key modifier is added or removed, so get() and set() are just
+a couple of dictionary lookups.
+
+Values of keys that have a modifier for a given mode are stored in the
+"<key>#multi" dictionary under the mode name, values of other keys are stored
+directly under the key.
+
+The store also tracks which persistent dictionary keys have been changed,
+so that only changed keys need to be written to storage.
+"""
+import time
+
+import logging
+log = logging.getLogger("core.options_store")
+
+MODE_KEY = "mode"
+DEFAULT_MODE = "car"
+MULTI_KEY_TEMPLATE = "%s#multi"
+# key modifiers are persisted under this key
+KEY_MODIFIERS_KEY = "keyModifiers"
+
+# shared empty dictionary used as default for missing multi mode dictionaries,
+# it is never modified
+_EMPTY = {}
+
+
+class OptionsStore(object):
+    """Persistent options dictionary with per-mode key modifiers and watches
+
+    :param key_default: optional callable returning default value for a key,
+                        used to provide the old value for watches when a key
+                        changes value due to mode or key modifier change
+    :param on_change: optional callable called without arguments when a key
+                      is changed while no write of changed keys is pending,
+                      see take_changed_keys()
+    """
+
+    def __init__(self, key_default=None, on_change=None):
+        self.d = {}  # persistent dictionary of data
+        self._key_modifiers = {}
+        self._watches = {}
+        self._max_watch_id = 0
+        self._key_default = key_default
+        # mode resolved view
+        self._mode = DEFAULT_MODE
+        # key -> multi key for all keys with a modifier for the current mode
+        self._mode_keys = {}
+        # change tracking
+        self._changed = set()
+        self._write_pending = False
+        self._on_change = on_change
+
+    @property
+    def key_modifiers(self):
+        """Per mode key modifiers
+
+        key -> {"modes": {mode: modifier}}
+        """
+        return self._key_modifiers
+
+    @key_modifiers.setter
+    def key_modifiers(self, key_modifiers):
+        self._key_modifiers = key_modifiers
+        self._rebuild()
+        self._mark_changed(KEY_MODIFIERS_KEY)
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def _rebuild(self):
+        """Rebuild the mode resolved view"""
+        mode = self.d.get(MODE_KEY, DEFAULT_MODE)
+        self._mode = mode
+        self._mode_keys = dict((key, MULTI_KEY_TEMPLATE % key)
+                               for key, modifier in self._key_modifiers.items()
+                               if mode in modifier['modes'])
+
+    def _mark_changed(self, key):
+        self._changed.add(key)
+        # the key needs to be added before the flag is checked,
+        # see take_changed_keys()
+        if not self._write_pending:
+            self._write_pending = True
+            if self._on_change:
+                self._on_change()
+
+    def take_changed_keys(self):
+        """Return keys changed since last call and reset change tracking
+
+        Can be called from a different thread than the one setting values.
+
+        :returns: list of changed persistent dictionary keys
+        :rtype: list
+        """
+        # reset the flag first, so that keys changed from now on
+        # either end up in this batch or trigger a new on_change call
+        self._write_pending = False
+        keys = []
+        changed = self._changed
+        while True:
+            try:
+                keys.append(changed.pop())
+            except KeyError:
+                return keys
+
+    def restore_changed_keys(self, keys):
+        """Mark keys returned by take_changed_keys() as changed again
+
+        Used if the changed keys could not be saved, so that
+        they are saved by the next write.
+
+        :param keys: persistent dictionary keys
+        """
+        for key in keys:
+            self._mark_changed(key)
+
+    def load(self, data):
+        """Bulk load persistent dictionary content
+
+        Values are loaded as they are, without notifying watches
+        or marking the keys as changed.
+
+        :param dict data: persistent dictionary content
+        """
+        self.d.update(data)
+        self._rebuild()
+
+    def _get_default(self, key):
+        if self._key_default:
+            return self._key_default(key)
+        else:
+            return None
+
+    ## GETTING & SETTING ##
+
+    def get(self, name, default=None, mode=None):
+        """Get value of an options key
+
+        :param name: options key
+        :param default: returned if the key has no value
+        :param mode: mode to get the value for, current mode if None
+        """
+        if mode is None:
+            multi_key = self._mode_keys.get(name)
+            if multi_key is None:
+                return self.d.get(name, default)
+            else:
+                return self.d.get(multi_key, _EMPTY).get(self._mode, default)
+        else:
+            modifier = self._key_modifiers.get(name)
+            if modifier is not None and mode in modifier['modes']:
+                return self.d.get(MULTI_KEY_TEMPLATE % name, _EMPTY).get(mode, default)
+            else:
+                return self.d.get(name, default)
+
+    def _store(self, name, value, mode):
+        """Store a value without notifying watches"""
+        if mode is None:
+            multi_key = self._mode_keys.get(name)
+            mode = self._mode
+        else:
+            modifier = self._key_modifiers.get(name)
+            if modifier is not None and mode in modifier['modes']:
+                multi_key = MULTI_KEY_TEMPLATE % name
+            else:
+                multi_key = None
+        if multi_key is None:
+            self.d[name] = value
+            self._mark_changed(name)
+        else:
+            multi_dict = self.d.get(multi_key)
+            if multi_dict is None:
+                self.d[multi_key] = {mode: value}
+            else:
+                multi_dict[mode] = value
+            self._mark_changed(multi_key)
+
+    def set(self, name, value, mode=None):
+        """Set value of an options key and notify its watches
+
+        :param name: options key
+        :param value: the new value
+        :param mode: mode to set the value for, current mode if None
+        """
+        if name == MODE_KEY:
+            self.set_many(((name, value),), mode=mode)
+            return
+        if name in self._watches:
+            old_value = self.get(name, value, mode)
+            self._store(name, value, mode)
+            self._notify(name, old_value)
+        else:
+            self._store(name, value, mode)
+
+    def set_many(self, items, mode=None, notify=True):
+        """Set values of multiple options keys at once
+
+        All values are stored before any watch is notified, so watches
+        always see the final state. Each changed key is notified only once,
+        with the value it had before set_many() was called, even if it is
+        present multiple times in items or changes value due to mode change.
+
+        :param items: a dictionary or an iterable of (key, value) pairs
+        :param mode: mode to set the values for, current mode if None
+        :param bool notify: if False, watches are not notified at all
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        old_values = {}
+        changed_keys = []
+        mode_changed = False
+        for name, value in items:
+            if notify and name not in old_values:
+                if name in self._watches:
+                    old_values[name] = self.get(name, value, mode)
+                changed_keys.append(name)
+            if name == MODE_KEY:
+                mode_changed = True
+            self._store(name, value, mode)
+
+        if mode_changed:
+            old_mode = self._mode
+            # old values of keys whose value might change with the mode change
+            # need to be captured before the view is rebuilt
+            if notify:
+                for key, modifier in self._key_modifiers.items():
+                    if key in self._watches and key not in old_values:
+                        old_values[key] = self.get(key, self._get_default(key))
+            self._rebuild()
+            new_mode = self._mode
+            if notify:
+                for key, modifier in self._key_modifiers.items():
+                    if key in old_values and key not in changed_keys:
+                        modes = modifier['modes']
+                        if old_mode in modes or new_mode in modes:
+                            changed_keys.append(key)
+
+        for name in changed_keys:
+            if name in old_values:
+                self._notify(name, old_values[name])
+
+    def has_key(self, key):
+        """Report if a given key exists"""
+        return key in self.d
+
+    def purge_key(self, key):
+        """Remove a key from the persistent dictionary
+
+        This includes possible key modifiers and alternate values.
+
+        :returns: True if the key has been purged, False if it was not present
+        """
+        if key in self.d:
+            old_value = self.get(key, None)
+            del self.d[key]
+            self._mark_changed(key)
+            # purge any key modifiers
+            if key in self._key_modifiers:
+                del self._key_modifiers[key]
+                # also remove the possibly present
+                # alternative states for different modes
+                self.d.pop(MULTI_KEY_TEMPLATE % key, None)
+                self._mark_changed(MULTI_KEY_TEMPLATE % key)
+                self._mark_changed(KEY_MODIFIERS_KEY)
+                self._rebuild()
+            self._notify(key, old_value)
+            return True
+        else:
+            log.error("can't purge a not-present key: %s", key)
+            return False
+
+    ## WATCHES ##
+
+    def watch(self, key, callback, args=None, run_now=False):
+        """Add a callback on an options key
+
+        The callback will get:
+
+        key, oldValue, newValue, *args
+
+        If the callback returns False, the watch is removed.
+
+        NOTE: watch ids are non-empty strings, so that they evaluate as True
+
+        :returns: watch id
+        :rtype: str
+        """
+        if not args:
+            args = []
+        self._max_watch_id += 1
+        watch_id = "%d_%s" % (self._max_watch_id, key)
+        self._watches.setdefault(key, []).append((watch_id, callback, args))
+        # should we now run the callback one ?
+        # -> this is useful for modules that configure
+        # themselves according to an options value at startup
+        if run_now:
+            current_value = self.get(key, None)
+            callback(key, current_value, current_value, *args)
+        return watch_id
+
+    def remove_watch(self, watch_id):
+        """Remove watch specified by the given watch id
+
+        :returns: True if the watch has been removed, False if it was not found
+        :rtype: bool
+        """
+        # the key itself can contain underscores
+        key = watch_id.split('_', 1)[1]
+        callbacks = self._watches.get(key)
+        if callbacks:
+            remaining = [item for item in callbacks if item[0] != watch_id]
+            if len(remaining) != len(callbacks):
+                if remaining:
+                    self._watches[key] = remaining
+                else:
+                    del self._watches[key]
+                return True
+        log.error("can't remove watch - watch not found, watch id: %s", watch_id)
+        return False
+
+    def _notify(self, key, old_value):
+        """Run callbacks registered on an options key
+
+        The callbacks get both the old and the new value.
+        """
+        callbacks = self._watches.get(key)
+        if callbacks:
+            # rather supply the old value than None
+            new_value = self.get(key, old_value)
+            # watches might be removed while being iterated over
+            for watch_id, callback, args in tuple(callbacks):
+                if callback:
+                    if callback(key, old_value, new_value, *args) is False:
+                        # remove watches that return False
+                        self.remove_watch(watch_id)
+                else:
+                    log.error("invalid watcher callback: %s", callback)
+
+    ## KEY MODIFIERS ##
+
+    def add_key_modifier(self, key, modifier=None, mode=None, copy_initial_value=True):
+        """Add a key modifier
+
+        NOTE: currently only used to make value of some keys
+              dependent on the current mode
+        """
+        default_value = self._get_default(key)
+        old_value = self.get(key, default_value)
+        if mode is None:
+            mode = self._mode
+        self._key_modifiers.setdefault(key, {'modes': {}})['modes'][mode] = modifier
+
+        # make sure the multi mode dictionary exists
+        multi_dict = self.d.setdefault(MULTI_KEY_TEMPLATE % key, {})
+        self._rebuild()
+
+        # if the modifier is set for the first time,
+        # do we copy the value from the normal key or not ?
+        if copy_initial_value and mode not in multi_dict:
+            multi_dict[mode] = self.d.get(key, default_value)
+        self._mark_changed(MULTI_KEY_TEMPLATE % key)
+        self._mark_changed(KEY_MODIFIERS_KEY)
+        self._notify(key, old_value)
+
+    def remove_key_modifier(self, key, mode=None):
+        """Remove key modifier
+
+        NOTE: currently this just makes the key independent
+              on the current mode
+
+        :returns: True if the modifier has been removed, False otherwise
+        :rtype: bool
+        """
+        if mode is None:
+            mode = self._mode
+        modifier = self._key_modifiers.get(key)
+        if modifier is None:
+            log.error("key %s has no modifier and thus cannot be removed", key)
+            return False
+        if mode not in modifier['modes']:
+            log.error("can't remove modifier that is not present")
+            log.error("key: %s, mode: %s", key, mode)
+            return False
+        old_value = self.get(key, self._get_default(key))
+        # just remove the key modifier preserving the alternative values
+        del modifier['modes'][mode]
+        if not modifier['modes']:
+            # no modes registered - unregister from modifiers
+            # TODO: handle non-mode modifiers in the future
+            del self._key_modifiers[key]
+        self._rebuild()
+        self._mark_changed(KEY_MODIFIERS_KEY)
+        self._notify(key, old_value)
+        return True
+
+    def has_key_modifier(self, key):
+        """Report if a key has a key modifier"""
+        return key in self._key_modifiers
+
+    def has_key_modifier_in_mode(self, key, mode=None):
+        """Report if a key has a key modifier for the given mode"""
+        if mode is None:
+            mode = self._mode
+        modifier = self._key_modifiers.get(key)
+        return modifier is not None and mode in modifier['modes']
+
+
+class _LegacyOptions(object):
+    """The options handling algorithm formerly used by the ModRana class
+
+    Only used as a baseline by the benchmark below.
+    """
+
+    def __init__(self):
+        self.d = {}
+        self.keyModifiers = {}
+        self.watches = {}
+
+    def get(self, name, default=None, mode=None):
+        if name in self.keyModifiers.keys():
+            if mode is None:
+                mode = self.d.get('mode', 'car')
+            if mode in self.keyModifiers[name]['modes'].keys():
+                multiDict = self.d.get('%s#multi' % name, {})
+                return multiDict.get(mode, default)
+            else:
+                return self.d.get(name, default)
+        else:
+            return self.d.get(name, default)
+
+    def set(self, name, value, mode=None):
+        oldValue = self.get(name, value)
+        if name in self.keyModifiers.keys():
+            if mode is None:
+                mode = self.d.get('mode', 'car')
+            if mode in self.keyModifiers[name]['modes'].keys():
+                try:
+                    self.d['%s#multi' % name][mode] = value
+                except KeyError:
+                    self.d['%s#multi' % name] = {mode: value}
+            else:
+                self.d[name] = value
+        else:
+            self.d[name] = value
+        callbacks = self.watches.get(name, None)
+        if callbacks:
+            for item in callbacks:
+                (watch_id, callback, args) = item
+                newValue = self.get(name, oldValue)
+                callback(name, oldValue, newValue, *args)
+
+
+def benchmark(operations=100000, key_count=200, modifier_count=20, watched_count=10):
+    """Options get/set benchmark comparing the legacy algorithm with the options store
+
+    Simulates a typical modRana options dictionary - a few hundred keys, some of them
+    with per mode modifiers and some of them watched by a couple of callbacks.
+    """
+    print("# options get/set benchmark start #")
+    print("%d keys, %d with modifiers, %d watched, %d operations" %
+          (key_count, modifier_count, watched_count, operations))
+    keys = ["key%d" % i for i in range(key_count)]
+
+    def callback(key, oldValue, newValue):
+        pass
+
+    legacy = _LegacyOptions()
+    store = OptionsStore()
+    for options in (legacy, store):
+        options.set(MODE_KEY, DEFAULT_MODE)
+        for index, key in enumerate(keys):
+            options.set(key, index)
+    for key in keys[:modifier_count]:
+        legacy.keyModifiers[key] = {'modes': {DEFAULT_MODE: None}}
+        legacy.d['%s#multi' % key] = {DEFAULT_MODE: 0}
+        store.add_key_modifier(key)
+    # watch some of the keys with and some without modifiers
+    watched = keys[modifier_count // 2:modifier_count // 2 + watched_count]
+    for key in watched:
+        legacy.watches.setdefault(key, []).append(("", callback, []))
+        store.watch(key, callback)
+    # use each key in turn, so that all kinds of keys are used
+    sequence = [keys[i % key_count] for i in range(operations)]
+
+    for label, options in (("legacy", legacy), ("options store", store)):
+        get = options.get
+        start = time.time()
+        for key in sequence:
+            get(key, None)
+        get_time = time.time() - start
+        set_value = options.set
+        start = time.time()
+        for index, key in enumerate(sequence):
+            set_value(key, index)
+        set_time = time.time() - start
+        print("%s: get %1.3f us/call, set %1.3f us/call" %
+              (label, get_time * 1e6 / operations, set_time * 1e6 / operations))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # options get/set benchmark start #
+# 200 keys, 20 with modifiers, 10 watched, 100000 operations
+# legacy: get 0.290 us/call, set 0.804 us/call
+# options store: get 0.182 us/call, set 0.478 us/call
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+# (keys() builds a new list on every call of the legacy algorithm)
+#
+# # options get/set benchmark start #
+# 200 keys, 20 with modifiers, 10 watched, 100000 operations
+# legacy: get 0.878 us/call, set 2.152 us/call
+# options store: get 0.553 us/call, set 1.087 us/call
+# # benchmark finished #
@@ -36,6 +36,7 @@ POI_FOLDER_NAME = "poi"
 ROUTING_DATA_FOLDER_NAME = "routing_data"
 DEBUG_LOGS_FOLDER_NAME = "debug_logs"
 OVERLAY_GROUPS_FOLDER_NAME = "overlay_groups"
+ELEVATION_DATA_FOLDER_NAME = "elevation_data"
 # file names
 OPTIONS_FILENAME = "options.bin"
 POI_DB_FILENAME = "modrana_poi.db"
@@ -311,6 +312,11 @@ class Paths(object):
         """Return path to the folder where overlay groups are stored as JSON files"""
         return self._assurePathFolder(self.profile_path, OVERLAY_GROUPS_FOLDER_NAME)
 
+    @property
+    def elevation_data_folder_path(self):
+        """Return path to the folder with SRTM HGT elevation data files"""
+        return self._assurePathFolder(self.profile_path, ELEVATION_DATA_FOLDER_NAME)
+
     ## Monav ##
 
     @property
@@ -1,9 +1,13 @@
 """A modRana POI database class"""
 
 import os
+import re
 import sys
+import math
 import sqlite3
+import time
 from core.point import POI
+from core import geo
 from core.backports.six import u
 
 PYTHON3 = sys.version_info[0] > 2
@@ -11,6 +15,33 @@ PYTHON3 = sys.version_info[0] > 2
 import logging
 log = logging.getLogger("core.poi_db")
 
+# bump this and extend _migrate() when the database schema changes
+SCHEMA_VERSION = 2
+
+# spatial index implementations
+RTREE_INDEX = "rtree"
+GRID_INDEX = "grid"
+# full text index implementations
+FTS5_INDEX = "fts5"
+FTS4_INDEX = "fts4"
+
+# size of a grid cell (in degrees) for the grid based spatial index,
+# used if SQLite has been built without the R*Tree module
+GRID_CELL_SIZE = 0.1
+# maximum number of grid rows looked up separately in a query
+MAX_GRID_ROWS = 100
+
+# initial search radius (in degrees of latitude) for nearest POI lookup
+NEAREST_POI_INITIAL_RADIUS = 0.01
+KM_PER_DEGREE = geo.EARTH_RADIUS * math.pi / 180.0
+
+# default maximum number of POI search results
+DEFAULT_SEARCH_LIMIT = 50
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# POI columns in the database & POI object constructor order
+_POI_COLUMNS = "poi.label, poi.desc, poi.lat, poi.lon, poi.cat_id, poi.poi_id"
+
 
 class DatabaseConnectionFailed(Exception):
     """Raised if connection to the underlying database could not be established"""
@@ -26,14 +57,94 @@ class DatabaseNotConnected(Exception):
     """
     pass
 
+def _label_rank(label, words):
+    """Rank a POI search result by how well its label matches the search query words
+
+    :returns: rank, lower is better
+    """
+    label_words = [word.lower() for word in WORD_RE.findall(label or "")]
+    missing = 0
+    for word in words:
+        if not any(label_word.startswith(word) for label_word in label_words):
+            missing += 1
+    return missing, len(label_words)
+
+
+class _TableIndex(object):
+    """An index of the poi table kept in a separate table
+
+    Index tables are kept in sync with the poi table by triggers,
+    so any code changing the poi table updates them automatically.
+
+    :param str kind: index implementation
+    """
+
+    # kind -> (table, key column, column list, values, condition, indexed poi columns),
+    # ROW is replaced by the name of the poi table row
+    DEFINITIONS = {
+        RTREE_INDEX: ("poi_rtree", "poi_id", "", "ROW.poi_id, ROW.lat, ROW.lat, ROW.lon, ROW.lon",
+                      "ROW.lat IS NOT NULL AND ROW.lon IS NOT NULL", "poi_id, lat, lon"),
+        GRID_INDEX: ("poi_grid", "poi_id", "",
+                     "ROW.poi_id, CAST((ROW.lat + 90.0) / %(size)r AS INTEGER), "
+                     "CAST((ROW.lon + 180.0) / %(size)r AS INTEGER)" % {"size": GRID_CELL_SIZE},
+                     "ROW.lat IS NOT NULL AND ROW.lon IS NOT NULL", "poi_id, lat, lon"),
+        FTS5_INDEX: ("poi_fts", "rowid", "(rowid, label, description)", "ROW.poi_id, ROW.label, ROW.desc",
+                     "1", "poi_id, label, desc"),
+        FTS4_INDEX: ("poi_fts", "docid", "(docid, label, description)", "ROW.poi_id, ROW.label, ROW.desc",
+                     "1", "poi_id, label, desc"),
+    }
+
+    def __init__(self, kind):
+        self.kind = kind
+        (self.table, self._key, self._columns, self._values,
+         self._condition, self._indexed_columns) = self.DEFINITIONS[kind]
+
+    def fill(self, db, min_poi_id=None):
+        """Index POI from the poi table
+
+        :param db: database connection
+        :param min_poi_id: only index POI with bigger id, all POI if None
+        """
+        query = "INSERT INTO %s%s SELECT %s FROM poi WHERE %s" % (
+            self.table, self._columns, self._values.replace("ROW", "poi"), self._condition.replace("ROW", "poi"))
+        if min_poi_id is None:
+            db.execute(query)
+        else:
+            db.execute(query + " AND poi.poi_id > ?", (min_poi_id,))
+
+    def create_triggers(self, db):
+        values = {"table": self.table, "key": self._key, "columns": self._columns,
+                  "indexed_columns": self._indexed_columns,
+                  "values": self._values.replace("ROW", "new"),
+                  "condition": self._condition.replace("ROW", "new")}
+        # NOTE: "replace into poi" does not run the delete trigger,
+        #       so the insert trigger needs to replace the old index entry
+        db.execute("CREATE TRIGGER %(table)s_insert AFTER INSERT ON poi WHEN %(condition)s BEGIN "
+                   "INSERT OR REPLACE INTO %(table)s%(columns)s VALUES (%(values)s); END" % values)
+        db.execute("CREATE TRIGGER %(table)s_update AFTER UPDATE OF %(indexed_columns)s ON poi BEGIN "
+                   "DELETE FROM %(table)s WHERE %(key)s = old.poi_id; "
+                   "INSERT INTO %(table)s%(columns)s SELECT %(values)s WHERE %(condition)s; END" % values)
+        db.execute("CREATE TRIGGER %(table)s_delete AFTER DELETE ON poi BEGIN "
+                   "DELETE FROM %(table)s WHERE %(key)s = old.poi_id; END" % values)
+
+    def drop_triggers(self, db):
+        for action in ("insert", "update", "delete"):
+            db.execute("DROP TRIGGER IF EXISTS %s_%s" % (self.table, action))
+
+
 class POIDatabase(object):
-    def __init__(self, db_path):
+    def __init__(self, db_path, spatial_index=None):
         """
         :param str db_path: path to the POI database file
+        :param spatial_index: spatial index implementation to use if the database
+                              does not yet have one (RTREE_INDEX or GRID_INDEX),
+                              R*Tree is used if available if None
         If no POI database exists on the given path a new empty
         database file will be created and initialized.
         """
         self._db = None
+        self._spatial_index = None
+        self._fulltext_index = None
         if os.path.exists(db_path): # connect to existing db
             log.info("POI database path:")
             log.info(db_path)
@@ -51,6 +162,14 @@ class POIDatabase(object):
                 log.exception("POI database creation failed")
                 raise DatabaseConnectionFailed
 
+        try:
+            self._migrate(spatial_index)
+        except Exception:
+            log.exception("POI database migration failed")
+            self._db.close()
+            self._db = None
+            raise DatabaseConnectionFailed
+
     @property
     def connected(self):
         """Report if we are connected to the underlying database"""
@@ -89,6 +208,90 @@ class POIDatabase(object):
         log.debug("new database file has been created")
         return conn
 
+    @property
+    def spatial_index(self):
+        """The spatial index implementation used by the database (RTREE_INDEX or GRID_INDEX)"""
+        return self._spatial_index.kind
+
+    @property
+    def fulltext_index(self):
+        """The full text index implementation used by the database
+
+        FTS5_INDEX, FTS4_INDEX or None if SQLite supports neither.
+        """
+        if self._fulltext_index:
+            return self._fulltext_index.kind
+        else:
+            return None
+
+    def _migrate(self, spatial_index):
+        """Upgrade the database schema to the current version"""
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # version 1 - spatial index & category index
+            log.info("adding spatial index to the POI database")
+            index = self._create_spatial_index(spatial_index)
+            index.fill(self._db)
+            index.create_triggers(self._db)
+            self._db.execute("CREATE INDEX IF NOT EXISTS poi_category ON poi (cat_id)")
+        if version < 2:
+            # version 2 - full text index
+            log.info("adding full text index to the POI database")
+            index = self._create_fulltext_index()
+            if index:
+                index.fill(self._db)
+                index.create_triggers(self._db)
+        if version != SCHEMA_VERSION:
+            self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            self._db.commit()
+        tables = dict(self._db.execute("SELECT name, sql FROM sqlite_master WHERE type='table'"))
+        if "poi_rtree" in tables:
+            self._spatial_index = _TableIndex(RTREE_INDEX)
+        else:
+            self._spatial_index = _TableIndex(GRID_INDEX)
+        if "poi_fts" not in tables:
+            self._fulltext_index = None
+        elif "fts5" in tables["poi_fts"].lower():
+            self._fulltext_index = _TableIndex(FTS5_INDEX)
+        else:
+            self._fulltext_index = _TableIndex(FTS4_INDEX)
+
+    @property
+    def _indexes(self):
+        """All indexes of the poi table"""
+        return [index for index in (self._spatial_index, self._fulltext_index) if index]
+
+    def _create_spatial_index(self, spatial_index):
+        """Create a spatial index table for the poi table
+
+        :returns: the new index
+        """
+        if spatial_index != GRID_INDEX:
+            try:
+                self._db.execute("CREATE VIRTUAL TABLE poi_rtree USING rtree(poi_id, min_lat, max_lat, min_lon, max_lon)")
+                return _TableIndex(RTREE_INDEX)
+            except sqlite3.OperationalError:
+                log.warning("SQLite R*Tree module not available, using grid based POI index")
+        self._db.execute("CREATE TABLE poi_grid (poi_id integer PRIMARY KEY, cell_lat integer, cell_lon integer)")
+        self._db.execute("CREATE INDEX poi_grid_cell ON poi_grid (cell_lat, cell_lon)")
+        return _TableIndex(GRID_INDEX)
+
+    def _create_fulltext_index(self):
+        """Create a full text index table for the poi table
+
+        :returns: the new index or None if full text search is not supported by SQLite
+        """
+        for kind, query in ((FTS5_INDEX, "CREATE VIRTUAL TABLE poi_fts USING fts5(label, description)"),
+                            (FTS4_INDEX, "CREATE VIRTUAL TABLE poi_fts USING fts4(label, description, tokenize=unicode61)"),
+                            (FTS4_INDEX, "CREATE VIRTUAL TABLE poi_fts USING fts4(label, description)")):
+            try:
+                self._db.execute(query)
+                return _TableIndex(kind)
+            except sqlite3.OperationalError:
+                pass
+        log.warning("SQLite full text search not available, POI search will be slow")
+        return None
+
     def disconnect_from_database(self):
         """Close the connection to the underlying SQLite database"""
         log.info("disconnecting from POI db")
@@ -127,7 +330,7 @@ class POIDatabase(object):
         """
         if self.connected:
             values = self._get_poi_db_order(poi)
-            query = "replace into poi values(?,?,?,?,?,?)"
+            query = "insert or replace into poi values(?,?,?,?,?,?)"
             cursor = self._db.cursor()
             cursor.execute(query, values)
             db_id = cursor.lastrowid
@@ -167,15 +370,9 @@ class POIDatabase(object):
         """
         if self.connected:
             # find which POI categories are actually used
-            # TODO: investigate how this scales for many points
-            usedCatIds = self._db.execute('select distinct cat_id from poi').fetchall()
-            usedCategories = []
-            for catId in usedCatIds:
-                nameDescription = self._db.execute('select label,desc,cat_id from category where cat_id=?',
-                                                  catId).fetchone()
-                if nameDescription:
-                    usedCategories.append(nameDescription)
-            return usedCategories #this should be a list of used category ids
+            # (uses the poi category index)
+            return self._db.execute('select label,desc,cat_id from category where cat_id in '
+                                    '(select distinct cat_id from poi)').fetchall()
         else:
             return []
 
@@ -236,4 +433,304 @@ class POIDatabase(object):
             else:
                 return None
         else:
-            return None
\ No newline at end of file
+            return None
+
+    def import_poi(self, points, category_db_index):
+        """Import many POI at once
+
+        All POI are imported in a single transaction & the poi table
+        indexes are updated once all POI are imported, which is much
+        faster than storing the POI one by one.
+
+        :param points: iterable of (name, description, lat, lon) tuples
+        :param int category_db_index: database index of the category for the POI
+        :returns: number of imported POI
+        :rtype: int
+        :raises: DatabaseNotConnected if database is not connected
+        """
+        if not self.connected:
+            raise DatabaseNotConnected
+        rows = ((lat, lon, name, description, category_db_index)
+                for (name, description, lat, lon) in points)
+        # handle the transaction manually, as the sqlite3 module
+        # would otherwise commit before the DDL statements on Python 2
+        isolation_level = self._db.isolation_level
+        self._db.isolation_level = None
+        try:
+            self._db.execute("BEGIN")
+            try:
+                max_poi_id = self._db.execute("SELECT max(poi_id) FROM poi").fetchone()[0] or 0
+                # update the indexes in bulk once all POI have been imported
+                # instead of running the index triggers for each POI
+                indexes = self._indexes
+                for index in indexes:
+                    index.drop_triggers(self._db)
+                cursor = self._db.executemany("INSERT INTO poi (lat, lon, label, desc, cat_id) VALUES (?,?,?,?,?)",
+                                              rows)
+                count = cursor.rowcount
+                for index in indexes:
+                    index.fill(self._db, min_poi_id=max_poi_id)
+                    index.create_triggers(self._db)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        finally:
+            self._db.isolation_level = isolation_level
+        log.info("%d POI imported", count)
+        return count
+
+    def search_poi(self, query, categories=None, limit=DEFAULT_SEARCH_LIMIT):
+        """Search POI by label and description
+
+        Each word from the query needs to match the beginning of a word
+        in the POI label or description. POI with matching labels are
+        returned first.
+
+        :param str query: search query
+        :param categories: only return POI from these category database indexes,
+                           POI from all categories are returned if None
+        :param limit: maximum number of POI to return, no limit if None
+        :returns: list of matching POI, best matches first
+        :rtype: list of POI objects
+        """
+        if not self.connected:
+            return []
+        if not PYTHON3 and isinstance(query, str):
+            query = query.decode("utf-8")
+        words = [word.lower() for word in WORD_RE.findall(query)]
+        if not words:
+            return []
+        args = []
+        fulltext = self.fulltext_index
+        if fulltext == FTS5_INDEX:
+            sql = "SELECT %s FROM poi_fts JOIN poi ON poi.poi_id = poi_fts.rowid WHERE poi_fts MATCH ?" % _POI_COLUMNS
+            # quote the words so that they are not taken for query syntax
+            args.append(" ".join('"%s"*' % word for word in words))
+        elif fulltext == FTS4_INDEX:
+            sql = "SELECT %s FROM poi_fts JOIN poi ON poi.poi_id = poi_fts.docid WHERE poi_fts MATCH ?" % _POI_COLUMNS
+            args.append(" ".join('"%s*"' % word for word in words))
+        else:
+            # no full text index - words are matched anywhere in label & description
+            conditions = []
+            for word in words:
+                conditions.append("(poi.label LIKE ? ESCAPE '\\' OR poi.desc LIKE ? ESCAPE '\\')")
+                pattern = "%%%s%%" % word.replace("_", "\\_")
+                args.extend([pattern, pattern])
+            sql = "SELECT %s FROM poi WHERE %s" % (_POI_COLUMNS, " AND ".join(conditions))
+        if categories is not None:
+            categories = list(categories)
+            sql += " AND poi.cat_id IN (%s)" % ",".join("?" * len(categories))
+            args.extend(categories)
+        if fulltext == FTS5_INDEX:
+            # label matches are more important than description matches
+            sql += " ORDER BY bm25(poi_fts, 10.0, 1.0)"
+            if limit is not None:
+                sql += " LIMIT ?"
+                args.append(limit)
+            return [POI(*row) for row in self._db.execute(sql, args)]
+        else:
+            # no built-in ranking, rank the results by label match
+            results = [POI(*row) for row in self._db.execute(sql, args)]
+            results.sort(key=lambda poi: _label_rank(poi.name, words))
+            if limit is not None:
+                results = results[:limit]
+            return results
+
+    def _query_bbox(self, min_lat, min_lon, max_lat, max_lon, categories, limit):
+        """Query POI rows in a bounding box not crossing the antimeridian"""
+        if self._spatial_index.kind == RTREE_INDEX:
+            query = ("SELECT %s FROM poi_rtree JOIN poi ON poi.poi_id = poi_rtree.poi_id "
+                     "WHERE poi_rtree.max_lat >= ? AND poi_rtree.min_lat <= ? "
+                     "AND poi_rtree.max_lon >= ? AND poi_rtree.min_lon <= ?" % _POI_COLUMNS)
+            args = [min_lat, max_lat, min_lon, max_lon]
+        else:
+            min_row = int((min_lat + 90.0) / GRID_CELL_SIZE)
+            max_row = int((max_lat + 90.0) / GRID_CELL_SIZE)
+            if max_row - min_row < MAX_GRID_ROWS:
+                # listing the rows makes SQLite look up the column
+                # range for each row instead of scanning whole rows
+                rows = list(range(min_row, max_row + 1))
+                lat_condition = "poi_grid.cell_lat IN (%s)" % ",".join("?" * len(rows))
+            else:
+                rows = [min_row, max_row]
+                lat_condition = "poi_grid.cell_lat BETWEEN ? AND ?"
+            query = ("SELECT %s FROM poi_grid JOIN poi ON poi.poi_id = poi_grid.poi_id "
+                     "WHERE %s AND poi_grid.cell_lon BETWEEN ? AND ?" % (_POI_COLUMNS, lat_condition))
+            args = rows + [int((min_lon + 180.0) / GRID_CELL_SIZE), int((max_lon + 180.0) / GRID_CELL_SIZE)]
+        # the index is only approximate (R*Tree stores 32 bit floats,
+        # grid cells are bigger than the bounding box), so also check
+        # the exact coordinates
+        query += " AND poi.lat BETWEEN ? AND ? AND poi.lon BETWEEN ? AND ?"
+        args.extend([min_lat, max_lat, min_lon, max_lon])
+        if categories is not None:
+            categories = list(categories)
+            query += " AND poi.cat_id IN (%s)" % ",".join("?" * len(categories))
+            args.extend(categories)
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        return self._db.execute(query, args).fetchall()
+
+    def get_poi_in_bbox(self, bbox, categories=None, limit=None):
+        """Return POI in a bounding box
+
+        Bounding boxes crossing the antimeridian (min lon > max lon) are supported.
+
+        :param bbox: (min lat, min lon, max lat, max lon) tuple
+        :param categories: only return POI from these category database indexes,
+                           POI from all categories are returned if None
+        :param limit: maximum number of POI to return, no limit if None
+        :returns: list of POI in the bounding box
+        :rtype: list of POI objects
+        """
+        if not self.connected:
+            return []
+        (min_lat, min_lon, max_lat, max_lon) = bbox
+        if min_lon <= max_lon:
+            rows = self._query_bbox(min_lat, min_lon, max_lat, max_lon, categories, limit)
+        else:
+            rows = self._query_bbox(min_lat, min_lon, max_lat, 180.0, categories, limit)
+            if limit is None or len(rows) < limit:
+                if limit is not None:
+                    limit -= len(rows)
+                rows.extend(self._query_bbox(min_lat, -180.0, max_lat, max_lon, categories, limit))
+        return [POI(*row) for row in rows]
+
+    def nearest_poi(self, lat, lon, k=1, categories=None):
+        """Return POI nearest to the given coordinates
+
+        The bounding box around the given coordinates is enlarged until
+        it contains the k nearest POI, so only POI near the coordinates
+        are loaded from the database.
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :param int k: how many POI to return
+        :param categories: only return POI from these category database indexes,
+                           POI from all categories are returned if None
+        :returns: up to k (distance in km, POI) tuples, nearest POI first
+        :rtype: list of tuples
+        """
+        if not self.connected or k < 1:
+            return []
+        radius = NEAREST_POI_INITIAL_RADIUS
+        while True:
+            min_lat = max(lat - radius, -90.0)
+            max_lat = min(lat + radius, 90.0)
+            # make the bounding box contain the circle with the given radius,
+            # which also needs to be wider in degrees of longitude
+            # the further it is from the equator
+            edge_cos = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+            whole_world = min_lat == -90.0 and max_lat == 90.0
+            if edge_cos <= 0.0 or math.sin(math.radians(radius)) >= edge_cos:
+                bbox = (min_lat, -180.0, max_lat, 180.0)
+            else:
+                lon_radius = math.degrees(math.asin(math.sin(math.radians(radius)) / edge_cos))
+                min_lon = lon - lon_radius
+                if min_lon < -180.0:
+                    min_lon += 360.0
+                max_lon = lon + lon_radius
+                if max_lon > 180.0:
+                    max_lon -= 360.0
+                bbox = (min_lat, min_lon, max_lat, max_lon)
+            results = [(geo.distance(lat, lon, poi.lat, poi.lon), poi)
+                       for poi in self.get_poi_in_bbox(bbox, categories=categories)]
+            results.sort(key=lambda result: result[0])
+            # POI outside of the circle might be nearer than
+            # POI in the bounding box corners
+            if whole_world or (len(results) >= k and results[k - 1][0] <= radius * KM_PER_DEGREE):
+                return results[:k]
+            radius *= 4
+
+
+def benchmark(poi_count=1000000, query_count=100):
+    """POI database spatial query benchmark
+
+    Compares loading all POI and filtering them in Python (as done previously)
+    with bounding box & nearest POI queries using the R*Tree and grid
+    spatial indexes on a synthetic POI database.
+    """
+    import random
+    import shutil
+    import tempfile
+
+    print("# POI database benchmark start #")
+    print("%d POI, %d queries" % (poi_count, query_count))
+    random.seed(0)
+    # roughly the Czech Republic
+    area = (48.5, 12.0, 51.0, 19.0)
+    (min_lat, min_lon, max_lat, max_lon) = area
+    rows = [(None, random.uniform(min_lat, max_lat), random.uniform(min_lon, max_lon),
+             u("POI %d") % i, u(""), random.randint(1, 11)) for i in range(poi_count)]
+    # screen sized bounding boxes at zoom level 13
+    boxes = []
+    for i in range(query_count):
+        lat = random.uniform(min_lat, max_lat)
+        lon = random.uniform(min_lon, max_lon)
+        boxes.append((lat - 0.04, lon - 0.07, lat + 0.04, lon + 0.07))
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for spatial_index in (RTREE_INDEX, GRID_INDEX):
+            db_path = os.path.join(temp_dir, "poi_%s.db" % spatial_index)
+            db = POIDatabase(db_path, spatial_index=spatial_index)
+            start = time.time()
+            db._db.executemany("INSERT INTO poi VALUES (?,?,?,?,?,?)", rows)
+            db._db.commit()
+            print("%s: %1.2f s import" % (db.spatial_index, time.time() - start))
+            found = 0
+            start = time.time()
+            for bbox in boxes:
+                found += len(db.get_poi_in_bbox(bbox))
+            print("%s: %1.2f ms per bounding box query (%d POI on average)" %
+                  (db.spatial_index, 1000 * (time.time() - start) / query_count, found // query_count))
+            start = time.time()
+            for bbox in boxes:
+                db.nearest_poi(bbox[0], bbox[1], k=10)
+            print("%s: %1.2f ms per nearest 10 POI query" %
+                  (db.spatial_index, 1000 * (time.time() - start) / query_count))
+            db.disconnect_from_database()
+
+        # legacy - all POI from all categories filtered in Python
+        db = POIDatabase(os.path.join(temp_dir, "poi_%s.db" % RTREE_INDEX))
+        legacy_count = max(1, query_count // 10)
+        start = time.time()
+        for bbox in boxes[:legacy_count]:
+            (s, w, n, e) = bbox
+            found = []
+            for category in db.list_categories():
+                for (label, desc, lat, lon, poi_id) in db.get_all_poi_from_category(category[2]):
+                    if s <= lat <= n and w <= lon <= e:
+                        found.append(poi_id)
+        print("legacy: %1.2f ms per bounding box query" % (1000 * (time.time() - start) / legacy_count))
+        db.disconnect_from_database()
+    finally:
+        shutil.rmtree(temp_dir)
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # POI database benchmark start #
+# 1000000 POI, 100 queries
+# rtree: 36.05 s import
+# rtree: 2.89 ms per bounding box query (639 POI on average)
+# rtree: 0.26 ms per nearest 10 POI query
+# grid: 9.94 s import
+# grid: 6.01 ms per bounding box query (639 POI on average)
+# grid: 1.65 ms per nearest 10 POI query
+# legacy: 1685.95 ms per bounding box query
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+#
+# # POI database benchmark start #
+# 1000000 POI, 100 queries
+# rtree: 34.12 s import
+# rtree: 4.53 ms per bounding box query (623 POI on average)
+# rtree: 0.34 ms per nearest 10 POI query
+# grid: 10.20 s import
+# grid: 7.87 ms per bounding box query (623 POI on average)
+# grid: 1.63 ms per nearest 10 POI query
+# legacy: 1739.25 ms per bounding box query
+# # benchmark finished #
@@ -0,0 +1,521 @@
+"""Viewport indexed point overlay with clustering & label placement
+
+Map overlays (visible POI, search result markers, ...) can contain many
+thousands of points, but only those on the screen need to be drawn & only
+a limited number of them can be drawn in a way the user can still see anything.
+
+* when the points change they are sorted by the Morton (Z-order) code
+  of their world coordinates, so that points in any map tile form
+  a continuous range that can be found by bisection
+* for each visible tile the points are clustered to a 4x4 grid (64x64 pixel
+  cells for 256 pixel tiles), points in a cell are drawn as a single count
+  badge, cell counts & centroids are computed from prefix sums, so clustering
+  a tile takes the same time no matter how many points it contains
+* point labels are placed greedily & labels colliding with already placed
+  labels are culled, the placement is cached until the zoom level, the
+  points or the label sizes (the label key) change, so labels don't flicker
+  when the map is moved
+
+Coordinates returned by the overlay are global pixel coordinates
+(absolute pixel coordinates on the given zoom level), as used by
+the projection getGlobalPixelView() method & the geometry cache.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import bisect
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from core import batch_projection
+from core import render_cache
+
+import logging
+log = logging.getLogger("core.point_overlay")
+
+TILE_SIZE = 256
+
+# world coordinates are quantized to this many bits on each axis,
+# which is pixel precision on zoom level 18
+CODE_BITS = 26
+# tiles are split to (2 ** CLUSTER_LEVELS) ** 2 clustering cells
+CLUSTER_LEVELS = 2
+# don't cluster points on this and higher zoom levels
+MAX_CLUSTER_ZOOM = 18
+# how many zoom levels to keep clustered
+MAX_CACHED_LEVELS = 4
+# once this many tiles have been clustered or labels have been placed
+# on a zoom level (the map has been moved around a lot) the level
+# is started over
+MAX_CACHED_TILES = 1024
+MAX_PLACED_LABELS = 5000
+# collision grid cell size in pixels
+COLLISION_CELL_SIZE = 256
+
+# cluster count badge size & font size
+CLUSTER_BADGE_RADIUS = 16
+CLUSTER_BADGE_FONT_SIZE = 15
+
+# label placement states
+LABEL_UNDECIDED = 0
+LABEL_CULLED = 1
+LABEL_PLACED = 2
+
+# bits of a byte spread to every other bit
+_SPREAD = []
+for _byte in range(256):
+    _spread = 0
+    for _bit in range(8):
+        if _byte & (1 << _bit):
+            _spread |= 1 << (2 * _bit)
+    _SPREAD.append(_spread)
+
+
+def morton_code(x, y):
+    """Interleave bits of two non-negative integers of at most 32 bits
+
+    :returns: Morton (Z-order) code, x bits are on even positions
+    :rtype: int
+    """
+    s = _SPREAD
+    return (s[x & 255] | s[(x >> 8) & 255] << 16 | s[(x >> 16) & 255] << 32 | s[(x >> 24) & 255] << 48 |
+            (s[y & 255] | s[(y >> 8) & 255] << 16 | s[(y >> 16) & 255] << 32 | s[(y >> 24) & 255] << 48) << 1)
+
+
+class Cluster(object):
+    """A point or a group of points drawn as a single badge
+
+    :param float x: global pixel x coordinate
+    :param float y: global pixel y coordinate
+    :param int count: number of points in the cluster
+    :param int index: index of a point in the cluster,
+                      the first point of the cluster in the Morton order
+    :param float lat: cluster centre latitude
+    :param float lon: cluster centre longitude
+    """
+    __slots__ = ("x", "y", "count", "index", "lat", "lon", "label_state", "label")
+
+    def __init__(self, x, y, count, index, lat, lon):
+        self.x = x
+        self.y = y
+        self.count = count
+        self.index = index
+        self.lat = lat
+        self.lon = lon
+        self.label_state = LABEL_UNDECIDED
+        # (x1, y1, x2, y2) label rectangle in global pixels
+        self.label = None
+
+
+class PointIndex(object):
+    """Points sorted by the Morton code of their world coordinates
+
+    :param points: list of (lat, lon, item) tuples
+    """
+
+    def __init__(self, points):
+        lats = [point[0] for point in points]
+        lons = [point[1] for point in points]
+        (xs, ys) = batch_projection.ll2world(lats, lons)
+        xs = batch_projection.to_list(xs)
+        ys = batch_projection.to_list(ys)
+        scale = 2 ** CODE_BITS
+        limit = scale - 1
+        codes = [morton_code(min(max(int(x * scale), 0), limit), min(max(int(y * scale), 0), limit))
+                 for x, y in zip(xs, ys)]
+        # the sort is stable, so points with the same code stay in the original order
+        order = sorted(range(len(points)), key=codes.__getitem__)
+        self.codes = [codes[i] for i in order]
+        self.order = order
+        self.xs = [xs[i] for i in order]
+        self.ys = [ys[i] for i in order]
+        self.lats = [lats[i] for i in order]
+        self.lons = [lons[i] for i in order]
+        # prefix sums for cluster centroids
+        self._sums = []
+        for values in (self.xs, self.ys, self.lats, self.lons):
+            total = 0.0
+            sums = [0.0]
+            for value in values:
+                total += value
+                sums.append(total)
+            self._sums.append(sums)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def tile_range(self, level, tx, ty):
+        """Return (start, end) range of points in a tile
+
+        :param int level: tile zoom level, at most CODE_BITS
+        :param int tx: tile x coordinate
+        :param int ty: tile y coordinate
+        """
+        shift = 2 * (CODE_BITS - level)
+        low = morton_code(tx, ty) << shift
+        high = low + (1 << shift)
+        start = bisect.bisect_left(self.codes, low)
+        return start, bisect.bisect_left(self.codes, high, start)
+
+    def occupied_tiles(self, level):
+        """Return coordinates of tiles with at least one point
+
+        :param int level: tile zoom level, at most CODE_BITS
+        :rtype: list
+        """
+        tiles = []
+        shift = 2 * (CODE_BITS - level)
+        n = 2 ** level
+        codes = self.codes
+        i = 0
+        while i < len(codes):
+            tiles.append((min(int(self.xs[i] * n), n - 1), min(int(self.ys[i] * n), n - 1)))
+            # skip to the first point of the next tile
+            i = bisect.bisect_left(codes, ((codes[i] >> shift) + 1) << shift, i)
+        return tiles
+
+    def centroid(self, start, end):
+        """Return (world x, world y, lat, lon) centroid of a point range"""
+        count = float(end - start)
+        return tuple((sums[end] - sums[start]) / count for sums in self._sums)
+
+
+class LabelPlacer(object):
+    """Greedy label placement with collision culling
+
+    :param cell_size: collision grid cell size in pixels
+    """
+
+    def __init__(self, cell_size=COLLISION_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self.placed = 0
+
+    def _cell_range(self, x1, y1, x2, y2):
+        size = self.cell_size
+        for cx in range(int(math.floor(x1 / size)), int(math.floor(x2 / size)) + 1):
+            for cy in range(int(math.floor(y1 / size)), int(math.floor(y2 / size)) + 1):
+                yield cx, cy
+
+    def collides(self, rect):
+        (x1, y1, x2, y2) = rect
+        cells = self._cells
+        for key in self._cell_range(x1, y1, x2, y2):
+            for (ox1, oy1, ox2, oy2) in cells.get(key, ()):
+                if x1 < ox2 and ox1 < x2 and y1 < oy2 and oy1 < y2:
+                    return True
+        return False
+
+    def place(self, rect):
+        """Place a label if it doesn't collide with any already placed label
+
+        :param rect: (x1, y1, x2, y2) label rectangle
+        :returns: True if the label has been placed, False if it has been culled
+        :rtype: bool
+        """
+        if self.collides(rect):
+            return False
+        for key in self._cell_range(*rect):
+            self._cells.setdefault(key, []).append(rect)
+        self.placed += 1
+        return True
+
+    def clear(self):
+        self._cells = {}
+        self.placed = 0
+
+
+class ClusterLevel(object):
+    """Clusters & label placement for a single zoom level
+
+    Tiles are clustered lazily as they become visible.
+
+    :param index: the points
+    :type index: PointIndex
+    :param int zoom: zoom level, at most CODE_BITS - CLUSTER_LEVELS
+    :param int tile_size: tile size in pixels
+    :param bool cluster: if False each point is a separate cluster
+    """
+
+    def __init__(self, index, zoom, tile_size=TILE_SIZE, cluster=True):
+        self.zoom = zoom
+        self.tile_size = tile_size
+        self.cluster = cluster
+        self._index = index
+        # (tx, ty) -> list of clusters
+        self._tiles = {}
+        self.placer = LabelPlacer()
+        # clusters with a label decision
+        self._decided = []
+        self._label_key = None
+
+    @property
+    def tile_count(self):
+        return len(self._tiles)
+
+    def _cluster_tile(self, tx, ty):
+        index = self._index
+        (start, end) = index.tile_range(self.zoom, tx, ty)
+        clusters = []
+        if start == end:
+            return clusters
+        n = self.tile_size * 2.0 ** self.zoom
+        if not self.cluster:
+            for i in range(start, end):
+                clusters.append(Cluster(index.xs[i] * n, index.ys[i] * n, 1, index.order[i],
+                                        index.lats[i], index.lons[i]))
+            return clusters
+        cells = 2 ** CLUSTER_LEVELS
+        level = self.zoom + CLUSTER_LEVELS
+        for cx in range(tx * cells, (tx + 1) * cells):
+            for cy in range(ty * cells, (ty + 1) * cells):
+                (cell_start, cell_end) = index.tile_range(level, cx, cy)
+                count = cell_end - cell_start
+                if count == 1:
+                    clusters.append(Cluster(index.xs[cell_start] * n, index.ys[cell_start] * n, 1,
+                                            index.order[cell_start],
+                                            index.lats[cell_start], index.lons[cell_start]))
+                elif count:
+                    (x, y, lat, lon) = index.centroid(cell_start, cell_end)
+                    clusters.append(Cluster(x * n, y * n, count, index.order[cell_start], lat, lon))
+        return clusters
+
+    def query(self, x1, y1, x2, y2, label_box=None, label_key=None):
+        """Return clusters in the given global pixel rectangle
+
+        Labels are placed for clusters in the rectangle that have no label
+        decision yet, larger clusters & points added earlier first.
+
+        :param label_box: callable taking a cluster & returning
+                          (dx, dy, w, h) of its label relative to
+                          the cluster position or None if the cluster has
+                          no label, None disables label placement
+        :param label_key: anything that changes when the label sizes change
+                          (eq. captions with distance from current position),
+                          all labels are placed again once it changes
+        :returns: list of clusters, label of a cluster is either None
+                  or a (x1, y1, x2, y2) rectangle
+        :rtype: list
+        """
+        last_tile = 2 ** self.zoom - 1
+        size = float(self.tile_size)
+        tx1 = max(int(math.floor(x1 / size)), 0)
+        ty1 = max(int(math.floor(y1 / size)), 0)
+        tx2 = min(int(math.floor(x2 / size)), last_tile)
+        ty2 = min(int(math.floor(y2 / size)), last_tile)
+        if (tx2 - tx1 + 1) * (ty2 - ty1 + 1) > len(self._index):
+            # the rectangle is larger than the area covered by the points
+            # (eq. a low zoom level), just check the tiles with some points
+            tiles = [(tx, ty) for tx, ty in self._index.occupied_tiles(self.zoom)
+                     if tx1 <= tx <= tx2 and ty1 <= ty <= ty2]
+        else:
+            tiles = [(tx, ty) for tx in range(tx1, tx2 + 1) for ty in range(ty1, ty2 + 1)]
+        if len(self._tiles) + len(tiles) > MAX_CACHED_TILES:
+            self.clear()
+        clusters = []
+        for key in tiles:
+            tile = self._tiles.get(key)
+            if tile is None:
+                tile = self._cluster_tile(*key)
+                self._tiles[key] = tile
+            for cluster in tile:
+                if x1 <= cluster.x <= x2 and y1 <= cluster.y <= y2:
+                    clusters.append(cluster)
+        if label_box is not None:
+            if label_key != self._label_key:
+                self.reset_labels()
+                self._label_key = label_key
+            undecided = [c for c in clusters if c.label_state == LABEL_UNDECIDED]
+            if undecided:
+                if self.placer.placed + len(undecided) > MAX_PLACED_LABELS:
+                    self.reset_labels()
+                    undecided = list(clusters)
+                undecided.sort(key=lambda c: (-c.count, c.index))
+                for cluster in undecided:
+                    self._place_label(cluster, label_box)
+        return clusters
+
+    def _place_label(self, cluster, label_box):
+        box = label_box(cluster)
+        cluster.label_state = LABEL_CULLED
+        cluster.label = None
+        if box is not None:
+            (dx, dy, w, h) = box
+            rect = (cluster.x + dx, cluster.y + dy, cluster.x + dx + w, cluster.y + dy + h)
+            if self.placer.place(rect):
+                cluster.label_state = LABEL_PLACED
+                cluster.label = rect
+        self._decided.append(cluster)
+
+    def reset_labels(self):
+        """Forget all label placement decisions"""
+        for cluster in self._decided:
+            cluster.label_state = LABEL_UNDECIDED
+            cluster.label = None
+        self._decided = []
+        self.placer.clear()
+
+    def clear(self):
+        """Drop clustered tiles & label placement"""
+        self.reset_labels()
+        self._tiles = {}
+
+
+class PointOverlay(object):
+    """Clustered & viewport indexed points of a map overlay
+
+    :param int max_cluster_zoom: don't cluster points on this and higher zoom levels
+    """
+
+    def __init__(self, max_cluster_zoom=MAX_CLUSTER_ZOOM):
+        self._max_cluster_zoom = max_cluster_zoom
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = PointIndex([])
+        self._items = []
+        # (zoom, tile size) -> ClusterLevel
+        self._levels = OrderedDict()
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def version(self):
+        return self._version
+
+    def get_item(self, cluster):
+        """Return the item of a single point cluster or the first item of a larger cluster"""
+        return self._items[cluster.index]
+
+    def set_points(self, version, get_points):
+        """Replace the overlay points if the version changed
+
+        :param version: anything that changes when the points change
+        :param get_points: callable returning a list of (lat, lon, item) tuples,
+                           called only if the version changed
+        :returns: True if the points have been replaced
+        :rtype: bool
+        """
+        with self._lock:
+            if version == self._version:
+                return False
+            points = get_points()
+            self._index = PointIndex(points)
+            self._items = [point[2] for point in points]
+            self._levels.clear()
+            self._version = version
+            return True
+
+    def level(self, zoom, tile_size=TILE_SIZE):
+        """Return clusters for a zoom level
+
+        :rtype: ClusterLevel
+        """
+        key = (zoom, tile_size)
+        with self._lock:
+            level = self._levels.pop(key, None)
+            if level is None:
+                level = ClusterLevel(self._index, zoom, tile_size,
+                                     cluster=zoom < self._max_cluster_zoom)
+                while len(self._levels) >= MAX_CACHED_LEVELS:
+                    self._levels.popitem(last=False)
+            self._levels[key] = level
+            return level
+
+    def query(self, zoom, x1, y1, x2, y2, tile_size=TILE_SIZE, label_box=None, label_key=None):
+        """Return clusters in the given global pixel rectangle on the given zoom level
+
+        See ClusterLevel.query() for details.
+        """
+        level = self.level(zoom, tile_size)
+        with self._lock:
+            return level.query(x1, y1, x2, y2, label_box, label_key)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._index = PointIndex([])
+            self._items = []
+            self._levels.clear()
+
+
+def draw_cluster_badge(cr, x, y, count, rgba):
+    """Draw a cluster as a circle with the number of points in the cluster
+
+    :param cr: cairo context
+    :param x: badge centre in screen coordinates
+    :param y: badge centre in screen coordinates
+    :param int count: number of points in the cluster
+    :param rgba: (r, g, b, a) badge background color
+    """
+    text = str(count)
+    radius = CLUSTER_BADGE_RADIUS
+    cr.set_source_rgba(*rgba)
+    cr.arc(x, y, radius, 0, 2.0 * math.pi)
+    cr.fill_preserve()
+    cr.set_source_rgba(1, 1, 1, 0.95)
+    cr.set_line_width(2)
+    cr.stroke()
+    extents = render_cache.text_cache.text_extents(cr, text, CLUSTER_BADGE_FONT_SIZE)
+    (x_bearing, y_bearing, w, h) = extents[:4]
+    cr.set_font_size(CLUSTER_BADGE_FONT_SIZE)
+    cr.move_to(x - w / 2.0 - x_bearing, y - h / 2.0 - y_bearing)
+    cr.show_text(text)
+
+
+def benchmark(point_count=100000, frame_count=20):
+    """Query a dense overlay while panning the map on multiple zoom levels"""
+    print("# point overlay benchmark start #")
+    random.seed(0)
+    # points around Brno
+    points = [(49.0 + random.random(), 16.0 + random.random(), i) for i in range(point_count)]
+    overlay = PointOverlay()
+    start = time.time()
+    overlay.set_points(1, lambda: points)
+    print("%d points indexed in %1.2f ms" % (point_count, (time.time() - start) * 1000))
+    label_box = lambda cluster: None if cluster.count > 1 else (10, -20, 120, 24)
+    (xs, ys) = batch_projection.ll2world([49.5], [16.5])
+    (centre_x, centre_y) = (batch_projection.to_list(xs)[0], batch_projection.to_list(ys)[0])
+    for zoom in (8, 11, 14, 17, 18):
+        n = TILE_SIZE * 2 ** zoom
+        frame_times = []
+        drawn = 0
+        labels = 0
+        for frame in range(frame_count):
+            # move the screen by 50 pixels each frame
+            x = centre_x * n + frame * 50
+            y = centre_y * n
+            start = time.time()
+            clusters = overlay.query(zoom, x - 950, y - 950, x + 950, y + 950, label_box=label_box)
+            frame_times.append(time.time() - start)
+            drawn += len(clusters)
+            labels += len([c for c in clusters if c.label is not None])
+        print("zl %d: first frame %1.2f ms, %1.2f ms per frame, %d clusters & %d labels per frame" %
+              (zoom, frame_times[0] * 1000, sum(frame_times[1:]) * 1000 / (frame_count - 1),
+               drawn // frame_count, labels // frame_count))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # point overlay benchmark start #
+# 100000 points indexed in 512.32 ms
+# zl 8: first frame 0.79 ms, 0.03 ms per frame, 19 clusters & 0 labels per frame
+# zl 11: first frame 33.11 ms, 0.12 ms per frame, 555 clusters & 0 labels per frame
+# zl 14: first frame 9.07 ms, 0.37 ms per frame, 745 clusters & 194 labels per frame
+# zl 17: first frame 1.40 ms, 1.52 ms per frame, 21 clusters & 18 labels per frame
+# zl 18: first frame 0.34 ms, 0.04 ms per frame, 4 clusters & 4 labels per frame
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+#
+# # point overlay benchmark start #
+# 100000 points indexed in 605.70 ms
+# zl 8: first frame 0.88 ms, 0.06 ms per frame, 19 clusters & 0 labels per frame
+# zl 11: first frame 32.80 ms, 0.26 ms per frame, 555 clusters & 0 labels per frame
+# zl 14: first frame 36.91 ms, 2.52 ms per frame, 745 clusters & 194 labels per frame
+# zl 17: first frame 1.70 ms, 0.09 ms per frame, 21 clusters & 18 labels per frame
+# zl 18: first frame 0.38 ms, 0.05 ms per frame, 4 clusters & 4 labels per frame
+# # benchmark finished #
@@ -11,6 +11,7 @@ class DummyController(object):
         self.status = None
         self.progress = None
         self.callback = None
+        self.cancelled = False
 
 
 class POIProvider(object):
@@ -0,0 +1,409 @@
+"""Shared caches for cairo text & label rendering
+
+Menus, OSD widgets and map overlay captions draw the same strings over and over,
+so text measurements & fitted font sizes are memoised and frequently drawn labels
+are rendered once to a shared atlas surface and then just blitted every frame.
+
+* LRUCache - dictionary with O(1) least recently used item eviction
+* TextCache - cairo text extents & fitted font sizes
+* LabelAtlas - labels rendered to a large surface using simple shelf packing,
+  once the atlas is full it is cleared & filled again
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+import time
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger("core.render_cache")
+
+# how many text measurements to keep
+TEXT_CACHE_SIZE = 2048
+# atlas surface size in pixels
+ATLAS_WIDTH = 1024
+ATLAS_HEIGHT = 1024
+# labels taller than this are always drawn directly
+MAX_LABEL_HEIGHT = 256
+# how many times has a label to be drawn before it is added to the atlas
+LABEL_MIN_USES = 2
+
+
+class LRUCache(object):
+    """Dictionary-like cache with least recently used item eviction
+
+    All operations are O(1).
+
+    :param int max_size: maximum number of items
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, key, default=None):
+        """Return an item and mark it as recently used"""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add or replace an item, evicting the least recently used item
+        if the cache is full
+
+        :returns: (key, value) of the evicted item or None
+        """
+        evicted = None
+        with self._lock:
+            self._items.pop(key, None)
+            if len(self._items) >= self._max_size:
+                evicted = self._items.popitem(last=False)
+            self._items[key] = value
+        return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def source_color(cr):
+    """Return the current source color of a cairo context
+
+    :returns: (r, g, b, a) tuple or None if the source is not a solid color
+    """
+    get_rgba = getattr(cr.get_source(), "get_rgba", None)
+    if get_rgba is None:
+        return None
+    return tuple(get_rgba())
+
+
+class TextCache(object):
+    """Memoised cairo text measurements
+
+    NOTE: measuring a text not yet in the cache changes the font size
+          of the context, but the font size needs to be set for drawing
+          the text anyway
+
+    :param int max_size: how many measurements to keep
+    """
+
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self._cache = LRUCache(max_size)
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def text_extents(self, cr, text, font_size):
+        """Cached equivalent of cr.set_font_size(font_size); cr.text_extents(text)
+
+        :returns: (x_bearing, y_bearing, width, height, x_advance, y_advance) tuple
+        """
+        key = (text, font_size)
+        extents = self._cache.get(key)
+        if extents is None:
+            cr.set_font_size(font_size)
+            extents = tuple(cr.text_extents(text))
+            self._cache.put(key, extents)
+        return extents
+
+    def fit_font_size(self, cr, text, font_size, width_limit=None):
+        """Find font size for the text to fit the width limit
+
+        :param str text: text to fit
+        :param font_size: preferred font size, used if the text fits
+        :param width_limit: maximum text width, None for no limit
+        :returns: (font size, text width, text height) tuple
+        """
+        key = ("fit", text, font_size, width_limit)
+        fitted = self._cache.get(key)
+        if fitted is None:
+            extents = self.text_extents(cr, text, font_size)
+            (width, height) = extents[2:4]
+            if width_limit and width > width_limit:
+                font_size = font_size * width_limit / width
+                extents = self.text_extents(cr, text, font_size)
+                (width, height) = extents[2:4]
+            fitted = (font_size, width, height)
+            self._cache.put(key, fitted)
+        return fitted
+
+    def measure(self, key, compute):
+        """Generic memoised measurement, eq. of a Pango layout
+
+        :param key: hashable description of what is measured
+        :param compute: callable returning the measurement on cache miss
+        """
+        value = self._cache.get(key)
+        if value is None:
+            value = compute()
+            self._cache.put(key, value)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+
+
+class ShelfPacker(object):
+    """Pack rectangles to rows ("shelves") of an area
+
+    :param int width: area width
+    :param int height: area height
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.clear()
+
+    def clear(self):
+        # shelves are [y, height, used width] lists
+        self._shelves = []
+        self._top = 0
+
+    def add(self, w, h):
+        """Find place for a rectangle
+
+        :returns: (x, y) of the rectangle or None if the area is full
+        """
+        if w > self.width or h > self.height:
+            return None
+        for shelf in self._shelves:
+            (y, shelf_height, used) = shelf
+            # don't waste tall shelves on short rectangles
+            if h <= shelf_height <= h * 1.5 and used + w <= self.width:
+                shelf[2] += w
+                return used, y
+        if self._top + h > self.height:
+            return None
+        self._shelves.append([self._top, h, w])
+        self._top += h
+        return 0, self._top - h
+
+
+def _create_image_surface(width, height):
+    import cairo
+    return cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+
+
+def _create_context(surface):
+    import cairo
+    return cairo.Context(surface)
+
+
+class LabelAtlas(object):
+    """Frequently drawn labels rendered to a shared surface
+
+    :param create_surface: callable taking width & height and returning a new image surface
+    :param create_context: callable returning drawing context for a surface
+    :param int width: atlas width
+    :param int height: atlas height
+    :param int min_uses: how many times has a label to be drawn before it is added to the atlas
+    """
+
+    def __init__(self, create_surface=_create_image_surface, create_context=_create_context,
+                 width=ATLAS_WIDTH, height=ATLAS_HEIGHT, min_uses=LABEL_MIN_USES):
+        self._create_surface = create_surface
+        self._create_context = create_context
+        self._packer = ShelfPacker(width, height)
+        self._min_uses = min_uses
+        self._surface = None
+        self._context = None
+        # label key -> (x, y) position in the atlas
+        self._regions = {}
+        # label key -> how many times it has been drawn directly
+        self._uses = LRUCache(TEXT_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self.resets = 0
+
+    def __len__(self):
+        return len(self._regions)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._regions = {}
+        self._packer.clear()
+        self._surface = None
+        self._context = None
+
+    def _add(self, key, w, h, render):
+        position = self._packer.add(w, h)
+        if position is None:
+            if not self._regions:
+                return None
+            # the atlas is full, start over
+            self._reset()
+            self.resets += 1
+            position = self._packer.add(w, h)
+        if self._surface is None:
+            self._surface = self._create_surface(self._packer.width, self._packer.height)
+            self._context = self._create_context(self._surface)
+        (x, y) = position
+        ct = self._context
+        ct.save()
+        ct.rectangle(x, y, w, h)
+        ct.clip()
+        ct.translate(x, y)
+        render(ct)
+        ct.restore()
+        self._regions[key] = position
+        return position
+
+    def draw(self, cr, key, x, y, w, h, render):
+        """Draw a label
+
+        :param cr: context to draw to
+        :param key: hashable label description, must include everything
+                    that influences how the label looks (text, size, color, ...)
+        :param x: label position
+        :param y: label position
+        :param int w: label width
+        :param int h: label height
+        :param render: callable drawing the label to the given context at 0,0,
+                       the drawing is clipped to w,h
+        :returns: True if the label was drawn from the atlas, False if it was drawn directly
+        :rtype: bool
+        """
+        with self._lock:
+            position = self._regions.get(key)
+            if position is None and 0 < h <= MAX_LABEL_HEIGHT:
+                uses = self._uses.get(key, 0) + 1
+                if uses >= self._min_uses:
+                    self._uses.pop(key)
+                    position = self._add(key, w, h, render)
+                else:
+                    self._uses.put(key, uses)
+            if position is not None:
+                (ax, ay) = position
+                # align to whole pixels so that the label is not resampled
+                x = int(round(x))
+                y = int(round(y))
+                cr.save()
+                cr.set_source_surface(self._surface, x - ax, y - ay)
+                cr.rectangle(x, y, w, h)
+                cr.fill()
+                cr.restore()
+                return True
+        cr.save()
+        cr.translate(x, y)
+        render(cr)
+        cr.restore()
+        return False
+
+
+# shared instances
+text_cache = TextCache()
+label_atlas = LabelAtlas()
+
+
+def benchmark(frames=200):
+    """Headless cairo rendering benchmark - a menu screen & a dense POI overlay
+
+    Compares drawing with & without the text cache and label atlas.
+    """
+    print("# render cache benchmark start #")
+    try:
+        import cairo
+    except ImportError:
+        print("pycairo not available, can't run the benchmark")
+        print("# benchmark finished #")
+        return
+    import random
+    random.seed(0)
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 800, 480)
+    cr = cairo.Context(surface)
+    # 3x3 menu buttons with captions fitted to the button width
+    buttons = [("button %d caption" % i, (i % 3) * 266, (i // 3) * 160) for i in range(9)]
+    # 300 POI with captions
+    poi = [("POI number %d" % i, random.randint(0, 780), random.randint(0, 470)) for i in range(300)]
+
+    def draw_label(ct, text, font_size, w, h, y_offset):
+        ct.set_source_rgba(0.1, 0.6, 0.1, 0.45)
+        ct.rectangle(0, 0, w, h)
+        ct.fill()
+        ct.set_source_rgba(1, 1, 1, 0.95)
+        ct.set_font_size(font_size)
+        ct.move_to(2, y_offset)
+        ct.show_text(text)
+
+    def frame_uncached():
+        for text, x, y in buttons:
+            font_size = 40
+            cr.set_font_size(font_size)
+            (w, h) = cr.text_extents(text)[2:4]
+            if w > 250:
+                font_size = font_size * 250 / w
+                cr.set_font_size(font_size)
+                (w, h) = cr.text_extents(text)[2:4]
+            cr.save()
+            cr.translate(x, y)
+            draw_label(cr, text, font_size, int(w) + 4, int(h * 1.4), h)
+            cr.restore()
+        for text, x, y in poi:
+            cr.set_font_size(25)
+            (w, h) = cr.text_extents(text)[2:4]
+            cr.save()
+            cr.translate(x, y)
+            draw_label(cr, text, 25, int(w) + 4, int(h * 1.4), h)
+            cr.restore()
+
+    def frame_cached(cache, atlas):
+        for text, x, y in buttons:
+            (font_size, w, h) = cache.fit_font_size(cr, text, 40, 250)
+            atlas.draw(cr, ("button", text), x, y, int(w) + 4, int(h * 1.4),
+                       lambda ct: draw_label(ct, text, font_size, int(w) + 4, int(h * 1.4), h))
+        for text, x, y in poi:
+            (w, h) = cache.text_extents(cr, text, 25)[2:4]
+            atlas.draw(cr, ("poi", text), x, y, int(w) + 4, int(h * 1.4),
+                       lambda ct: draw_label(ct, text, 25, int(w) + 4, int(h * 1.4), h))
+
+    start = time.time()
+    for i in range(frames):
+        frame_uncached()
+    uncached = time.time() - start
+    cache = TextCache()
+    atlas = LabelAtlas()
+    start = time.time()
+    for i in range(frames):
+        frame_cached(cache, atlas)
+    cached = time.time() - start
+    print("%d frames, %d labels per frame" % (frames, len(buttons) + len(poi)))
+    print("uncached: %1.2f ms per frame" % (1000 * uncached / frames))
+    print("cached: %1.2f ms per frame (%d labels in atlas, %d atlas resets)" %
+          (1000 * cached / frames, len(atlas), atlas.resets))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# Not run - pycairo (and the cairo library it needs) is not available
+# on the machine the render cache was developed on, so no speed-up
+# of the text cache & label atlas has been measured.
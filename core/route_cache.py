@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Route result caching & partial route reuse when rerouting
+
+Route results are cached in memory, keyed by waypoints snapped to a grid
+and the route parameters, so that repeated route requests between nearly
+the same points don't need a route lookup.
+
+When rerouting, most of the current route is usually still valid. So instead
+of asking for a complete new route to the destination, only a short
+connector route leading back to the current route (a rejoin route) is
+requested and spliced into the current route. The rejoin route is only used
+if it is not much longer than the direct distance to the rejoin point,
+otherwise a full route lookup is done.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+import time
+from collections import OrderedDict
+
+from core import geo
+
+import logging
+log = logging.getLogger("core.route_cache")
+
+# waypoints closer than this (in degrees, about 50 meters) share route results
+WAYPOINT_SNAP_PRECISION = 0.0005
+# waypoint headings are snapped to sectors of this many degrees
+WAYPOINT_HEADING_SNAP_PRECISION = 30
+
+ROUTE_CACHE_SIZE = 16
+# cached routes are valid for this many seconds
+ROUTE_CACHE_TTL = 60 * 60
+
+# the rejoin point is this far ahead (in meters along the route)
+# of the route point closest to current position
+REJOIN_DISTANCE = 500
+# do a full reroute if less than this is left from the route after
+# the rejoin point (in meters)
+REJOIN_MIN_REMAINING_DISTANCE = 1000
+# the rejoin route is rejected if it is longer than REJOIN_MAX_DETOUR_RATIO
+# times the direct distance to the rejoin point + REJOIN_DETOUR_SLACK meters
+REJOIN_MAX_DETOUR_RATIO = 2.0
+REJOIN_DETOUR_SLACK = 300
+
+
+def snap_waypoint(point, precision=WAYPOINT_SNAP_PRECISION,
+                  heading_precision=WAYPOINT_HEADING_SNAP_PRECISION):
+    """Snap a waypoint to a grid
+
+    The heading of a Waypoint changes the route result, so it is
+    snapped as well.
+
+    :param point: a Point instance
+    :param float precision: grid cell size in degrees
+    :param float heading_precision: heading sector size in degrees
+    :returns: (lat, lon, heading) grid cell & heading sector indexes,
+              heading sector index is None for points without heading
+    :rtype: tuple
+    """
+    heading = getattr(point, "heading", None)
+    if heading is not None:
+        heading = int(round((heading % 360) / float(heading_precision))) % int(360 / heading_precision)
+    return int(round(point.lat / precision)), int(round(point.lon / precision)), heading
+
+
+def route_key(waypoints, route_params, provider=None):
+    """Return route cache key for a route request
+
+    :param list waypoints: list of Point instances
+    :param route_params: RouteParameters instance or None
+    :param provider: routing provider id
+    :returns: hashable key or None if the request can't be cached
+              (eq. when waypoints are addresses)
+    """
+    if route_params is not None and route_params.addressRoute:
+        return None
+    try:
+        snapped = tuple(snap_waypoint(point) for point in waypoints)
+    except AttributeError:
+        # not Point instances
+        return None
+    if route_params is None:
+        return provider, snapped, None
+    return provider, snapped, (route_params.routeMode, route_params.avoidTollRoads,
+                               route_params.avoidHighways, route_params.language)
+
+
+class RouteCache(object):
+    """Thread safe in memory LRU cache of routes
+
+    Routes (Way instances) are copied when stored & retrieved, as route
+    processing and navigation change the routes in place.
+
+    :param int size: maximum number of cached routes
+    :param float ttl: how long are the routes valid in seconds
+    """
+
+    def __init__(self, size=ROUTE_CACHE_SIZE, ttl=ROUTE_CACHE_TTL):
+        self._size = size
+        self._ttl = ttl
+        self._routes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def get(self, key):
+        """Return a copy of the cached route for the key or None"""
+        if key is None:
+            return None
+        with self._lock:
+            item = self._routes.pop(key, None)
+            if item is None:
+                return None
+            route, timestamp = item
+            if time.time() - timestamp > self._ttl:
+                return None
+            # move to the most recently used end
+            self._routes[key] = item
+        return route.copy()
+
+    def put(self, key, route):
+        """Store a copy of the route"""
+        if key is None or route is None:
+            return
+        with self._lock:
+            self._routes.pop(key, None)
+            self._routes[key] = (route.copy(), time.time())
+            while len(self._routes) > self._size:
+                self._routes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+def find_rejoin_point(route, lat, lon, rejoin_distance=REJOIN_DISTANCE,
+                      min_remaining_distance=REJOIN_MIN_REMAINING_DISTANCE):
+    """Find where to rejoin the route from the given position
+
+    :param route: the current route, a Way instance
+    :param float lat: current latitude
+    :param float lon: current longitude
+    :param float rejoin_distance: distance of the rejoin point ahead of the
+                                  route point closest to the position (in meters)
+    :param float min_remaining_distance: minimum route length after the rejoin point
+    :returns: index of the route point to rejoin the route at,
+              None if the route should not be rejoined
+    :rtype: int or None
+    """
+    if route is None or route.point_count < 2:
+        return None
+    distances = route.get_distances_from_start()
+    target_distance = distances[route.get_closest_point_index(lat, lon)] + rejoin_distance
+    for index, distance in enumerate(distances):
+        if distance >= target_distance:
+            if distances[-1] - distance < min_remaining_distance:
+                return None
+            return index
+    return None
+
+
+def rejoin_acceptable(connector, lat, lon, rejoin_lat, rejoin_lon,
+                      max_detour_ratio=REJOIN_MAX_DETOUR_RATIO, detour_slack=REJOIN_DETOUR_SLACK):
+    """Check if a rejoin route is good enough to be used instead of a full reroute
+
+    :param connector: rejoin route, a Way instance
+    :param float lat: latitude of the rejoin route start
+    :param float lon: longitude of the rejoin route start
+    :param float rejoin_lat: latitude of the rejoin point
+    :param float rejoin_lon: longitude of the rejoin point
+    :returns: True if the rejoin route is acceptable, False otherwise
+    :rtype: bool
+    """
+    if connector is None or connector.point_count < 2:
+        return False
+    length = connector.length
+    if length is None:
+        length = connector.get_distances_from_start()[-1]
+    direct_distance = geo.distance(lat, lon, rejoin_lat, rejoin_lon) * 1000
+    acceptable = length <= direct_distance * max_detour_ratio + detour_slack
+    if not acceptable:
+        log.info("rejoin route rejected: %1.0f m long, %1.0f m direct distance", length, direct_distance)
+    return acceptable
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Concurrent routing with multiple routing providers
+
+The dispatcher is a routing provider that queries several other routing
+providers concurrently, each in its own thread, so that a hung online
+provider does not block routing if an offline provider can answer.
+
+Two policies are supported:
+
+* first acceptable - the first successful route wins
+* best of - once the first successful route arrives, other providers get
+  a short time window to return a better (faster) route
+
+Providers can have an availability check (eq. if a local routing server
+is running), run by the dispatcher thread before the search starts,
+providers that are not available are skipped.
+
+Each provider has a deadline, results arriving after it are ignored.
+Once the dispatcher is done, providers that are still running are
+cancelled through their task controller. Providers check the controller
+cancelled property between their steps (server start, route request,
+result processing) and stop early - a request that has already been
+sent is not interrupted, but its result is dropped.
+
+Latency and success statistics are kept for each provider and decide
+the order in which providers are started and which of equally good
+routes is used.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+import time
+
+try:  # Python 2
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from core import constants
+from core import threads
+from core.providers import RoutingProvider, RoutingResult, DummyController
+
+import logging
+log = logging.getLogger("core.routing_dispatcher")
+
+FIRST_ACCEPTABLE = "firstAcceptable"
+BEST_OF = "bestOf"
+
+# how long to wait for a provider (in seconds)
+DEFAULT_DEADLINE = 30.0
+# how long to wait for better results once the first
+# acceptable result arrives (in seconds, best of policy)
+DEFAULT_BEST_OF_WINDOW = 2.0
+
+# weight of the latest lookup in the average provider latency
+LATENCY_SMOOTHING = 0.3
+
+
+class ProviderStats(object):
+    """Routing provider latency & success statistics"""
+
+    def __init__(self, successes=0, failures=0, timeouts=0, latency=None):
+        self.successes = successes
+        self.failures = failures
+        self.timeouts = timeouts
+        # exponentially weighted moving average of successful lookup duration in seconds
+        self.latency = latency
+
+    def add_success(self, duration):
+        self.successes += 1
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency = LATENCY_SMOOTHING * duration + (1 - LATENCY_SMOOTHING) * self.latency
+
+    def add_failure(self):
+        self.failures += 1
+
+    def add_timeout(self):
+        self.timeouts += 1
+
+    @property
+    def success_rate(self):
+        """Smoothed success rate, providers without statistics get 0.5"""
+        return (self.successes + 1.0) / (self.successes + self.failures + self.timeouts + 2.0)
+
+    @property
+    def score(self):
+        """Expected time to a successful result, lower is better"""
+        if self.latency is None:
+            # not yet successful - try it, unless it keeps failing
+            latency = 1.0
+        else:
+            latency = self.latency
+        return latency / self.success_rate
+
+    def to_dict(self):
+        return {"successes": self.successes, "failures": self.failures,
+                "timeouts": self.timeouts, "latency": self.latency}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(successes=data.get("successes", 0), failures=data.get("failures", 0),
+                   timeouts=data.get("timeouts", 0), latency=data.get("latency"))
+
+
+class _ProviderController(DummyController):
+    """Task controller for a provider run by the dispatcher
+
+    Status messages are forwarded to the dispatcher controller.
+    """
+
+    def __init__(self, provider_id, parent):
+        DummyController.__init__(self)
+        self._provider_id = provider_id
+        self._parent = parent
+        self._thread = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == "status" and value is not None and getattr(self, "_parent", None):
+            self._parent.status = "%s: %s" % (self._provider_id, value)
+
+    def cancel(self):
+        self.cancelled = True
+        if self._thread:
+            self._thread.cancel()
+
+
+def is_acceptable(result):
+    """Report if a routing result contains a usable route"""
+    return result is not None and result.route is not None and result.returnCode == constants.ROUTING_SUCCESS
+
+
+def _route_cost(result):
+    """Cost of a successful routing result, lower is better"""
+    route = result.route
+    if route.duration is not None:
+        return route.duration
+    elif route.length is not None:
+        return route.length
+    else:
+        return 0
+
+
+class RoutingDispatcher(RoutingProvider):
+    """Routing provider querying multiple routing providers concurrently
+
+    :param list providers: (provider id, RoutingProvider instance) tuples
+    :param str policy: FIRST_ACCEPTABLE or BEST_OF
+    :param dict deadlines: provider id -> deadline in seconds
+    :param float default_deadline: deadline for providers not in deadlines
+    :param float best_of_window: how long to wait for better results (BEST_OF policy)
+    :param dict stats: provider id -> ProviderStats.to_dict() output,
+                       statistics from previous runs
+    :param dict availability_checks: provider id -> callable returning True if the
+                                     provider can be used, called before each search
+    """
+
+    def __init__(self, providers, policy=FIRST_ACCEPTABLE, deadlines=None,
+                 default_deadline=DEFAULT_DEADLINE, best_of_window=DEFAULT_BEST_OF_WINDOW, stats=None,
+                 availability_checks=None):
+        RoutingProvider.__init__(self, threadName=constants.THREAD_ROUTING_DISPATCHER)
+        self._providers = dict(providers)
+        # provider order as specified, used to break score ties
+        self._provider_order = [provider_id for (provider_id, provider) in providers]
+        self.policy = policy
+        self._deadlines = deadlines or {}
+        self._default_deadline = default_deadline
+        self._best_of_window = best_of_window
+        self._availability_checks = availability_checks or {}
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        if stats:
+            for provider_id, data in stats.items():
+                self._stats[provider_id] = ProviderStats.from_dict(data)
+
+    def get_stats(self, provider_id):
+        """Return statistics for a provider
+
+        :rtype: ProviderStats instance
+        """
+        with self._stats_lock:
+            return self._stats.setdefault(provider_id, ProviderStats())
+
+    def get_stats_dict(self):
+        """Return statistics for all providers as a dictionary that can be stored in options"""
+        with self._stats_lock:
+            return dict((provider_id, stats.to_dict()) for provider_id, stats in self._stats.items())
+
+    @property
+    def provider_ids(self):
+        """Provider ids ordered by their statistics, most promising first"""
+        return sorted(self._provider_order,
+                      key=lambda provider_id: (self.get_stats(provider_id).score,
+                                               self._provider_order.index(provider_id)))
+
+    def _is_available(self, provider_id):
+        check = self._availability_checks.get(provider_id)
+        if check is None:
+            return True
+        try:
+            available = check()
+        except Exception:
+            log.exception("availability check of routing provider %s failed", provider_id)
+            available = False
+        if not available:
+            log.info("routing provider %s is not available, skipping it", provider_id)
+        return available
+
+    def _run_provider(self, provider_id, waypoints, route_params, controller, results):
+        start = time.time()
+        result = None
+        try:
+            result = self._providers[provider_id].search(waypoints, route_params=route_params,
+                                                         controller=controller)
+        except Exception:
+            log.exception("routing provider %s failed", provider_id)
+        if not controller.cancelled:
+            results.put((provider_id, result, time.time() - start))
+
+    def search(self, waypoints, route_params=None, controller=DummyController()):
+        dispatch_start = time.time()
+        results = queue.Queue()
+        controllers = {}
+        deadlines = {}
+        # availability checks might block (eq. connecting to a local server),
+        # so they are run here in the dispatcher thread
+        for provider_id in [pid for pid in self.provider_ids if self._is_available(pid)]:
+            provider_controller = _ProviderController(provider_id, controller)
+            thread = threads.ModRanaThread(name=self._providers[provider_id].threadName)
+            # bind the loop variables now, not when the thread is started
+            thread.target = lambda provider_id=provider_id, provider_controller=provider_controller: \
+                self._run_provider(provider_id, waypoints, route_params, provider_controller, results)
+            provider_controller._thread = thread
+            controllers[provider_id] = provider_controller
+            deadlines[provider_id] = dispatch_start + self._deadlines.get(provider_id, self._default_deadline)
+            threads.threadMgr.add(thread)
+        log.info("routing with %d providers (%s)", len(controllers), self.policy)
+
+        accepted = []
+        failed = []
+        pending = set(controllers)
+        window_end = None
+        while pending:
+            if getattr(controller, "cancelled", False):
+                log.info("routing cancelled")
+                break
+            now = time.time()
+            for provider_id in list(pending):
+                if now >= deadlines[provider_id]:
+                    log.warning("routing provider %s missed its deadline", provider_id)
+                    pending.discard(provider_id)
+                    controllers[provider_id].cancel()
+                    self.get_stats(provider_id).add_timeout()
+            if not pending or (window_end is not None and now >= window_end):
+                break
+            wait_until = min(deadlines[provider_id] for provider_id in pending)
+            if window_end is not None:
+                wait_until = min(wait_until, window_end)
+            try:
+                # wake up regularly to check for cancellation
+                provider_id, result, duration = results.get(timeout=min(max(wait_until - now, 0), 0.5))
+            except queue.Empty:
+                continue
+            if provider_id not in pending:
+                continue
+            pending.discard(provider_id)
+            if is_acceptable(result):
+                log.info("routing provider %s returned a route in %1.2f s", provider_id, duration)
+                self.get_stats(provider_id).add_success(duration)
+                accepted.append((provider_id, result))
+                if self.policy == BEST_OF:
+                    if window_end is None:
+                        window_end = time.time() + self._best_of_window
+                else:
+                    break
+            else:
+                log.info("routing provider %s failed in %1.2f s", provider_id, duration)
+                self.get_stats(provider_id).add_failure()
+                failed.append((provider_id, result))
+
+        # cancel providers that are still running
+        for provider_id in pending:
+            controllers[provider_id].cancel()
+
+        if accepted:
+            order = self.provider_ids
+            provider_id, result = min(accepted, key=lambda item: (_route_cost(item[1]), order.index(item[0])))
+            log.info("using route from %s", provider_id)
+            return RoutingResult(result.route, route_params, constants.ROUTING_SUCCESS,
+                                 lookupDuration=time.time() - dispatch_start)
+        # return the first failed result with some error information
+        for provider_id, result in failed:
+            if result is not None:
+                return result
+        return RoutingResult(None, route_params)
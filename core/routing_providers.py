@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 # Offline routing providers
+import socket
 import time
 from core import constants
 from core.way import Way
@@ -23,7 +24,26 @@ log = logging.getLogger("mod.routing.providers")
 
 from core.providers import RoutingProvider, DummyController, RouteParameters, RoutingResult
 
-OSM_SCOUT_SERVER_ROUTING_URL = "http://localhost:8553/v2/route?"
+OSM_SCOUT_SERVER_HOST = "localhost"
+OSM_SCOUT_SERVER_PORT = 8553
+OSM_SCOUT_SERVER_ROUTING_URL = "http://%s:%d/v2/route?" % (OSM_SCOUT_SERVER_HOST, OSM_SCOUT_SERVER_PORT)
+# OSM Scout Server route request timeout (in seconds)
+OSM_SCOUT_SERVER_ROUTING_TIMEOUT = 60
+
+
+def osm_scout_server_running(timeout=0.5):
+    """Check if OSM Scout Server accepts connections
+
+    :param float timeout: connection timeout in seconds
+    :returns: True if OSM Scout Server is running, False otherwise
+    :rtype: bool
+    """
+    try:
+        connection = socket.create_connection((OSM_SCOUT_SERVER_HOST, OSM_SCOUT_SERVER_PORT), timeout)
+        connection.close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
 
 class MonavServerRouting(RoutingProvider):
     """Provider that does offline point to point routing
@@ -54,15 +74,18 @@ class MonavServerRouting(RoutingProvider):
             try:
                 if not self._monav.server_running:
                     controller.status = "starting Monav routing server"
-                    self._monav.start_server()
+                self._monav.ensure_server()
+                if controller.cancelled:
+                    return RoutingResult(None, route_params)
                 controller.status = "Monav offline routing in progress"
                 log.info(route_params)
-                result = self._monav.get_monav_directions(waypoints, route_params)
+                result = self._monav.get_monav_directions(waypoints, route_params,
+                                                          cancelled=lambda: controller.cancelled)
                 controller.status = "Monav offline routing done"
             except Exception:
                 log.exception('Monav route lookup failed')
 
-            if result is None: # routing failed for unknown reasons
+            if result is None or controller.cancelled: # routing failed or was cancelled
                 return RoutingResult(None, route_params)
             if result.type == result.SUCCESS:
                 # convert the Monav result to a Way object usable
@@ -118,12 +141,14 @@ class MonavLightRouting(RoutingProvider):
             try:
                 controller.status = "Monav offline routing in progress"
                 log.info(route_params)
-                result = self._monav.get_monav_directions(waypoints, route_params)
+                # the Monav Light process is killed if routing is cancelled
+                result = self._monav.get_monav_directions(waypoints, route_params,
+                                                          cancelled=lambda: controller.cancelled)
                 controller.status = "Monav offline routing done"
             except Exception:
                 log.exception('Monav route lookup failed')
 
-            if result is None: # routing failed for unknown reasons
+            if result is None or controller.cancelled: # routing failed or was cancelled
                 return RoutingResult(None, route_params)
             if result.type == result.SUCCESS:
                 # convert the Monav result to a Way object usable
@@ -167,9 +192,14 @@ class GoogleRouting(RoutingProvider):
         inBetweenPoints = waypoints[1:-1]
         log.info("GoogleRouting: routing from %s to %s", start, destination)
         log.info(route_params)
+        if controller.cancelled:
+            return RoutingResult(None, route_params)
         controller.status = "online routing in progress"
         route, returnCode, errorMessage = _googleDirections(start, destination, inBetweenPoints, route_params)
         controller.status = "online routing done"
+        if controller.cancelled:
+            # the result is not needed anymore, don't process it any further
+            return RoutingResult(None, route_params)
         # return the data from the routing function and add elapsed time in ms
         return RoutingResult(route,
                              route_params,
@@ -321,11 +351,18 @@ class OSMScoutServerRouting(RoutingProvider):
                 'locations': locations
             }
             queryUrl = OSM_SCOUT_SERVER_ROUTING_URL + "json=" + json.dumps(params)
-            reply = urlopen(queryUrl)
-            
+            if controller.cancelled:
+                return RoutingResult(None, route_params)
+            reply = urlopen(queryUrl, timeout=OSM_SCOUT_SERVER_ROUTING_TIMEOUT)
+
             if reply:
-                # json in Python 3 really needs it encoded like this
-                replyData = reply.read().decode("utf-8")
+                try:
+                    # json in Python 3 really needs it encoded like this
+                    replyData = reply.read().decode("utf-8")
+                finally:
+                    reply.close()
+                if controller.cancelled:
+                    return RoutingResult(None, route_params)
                 jsonReply = json.loads(replyData)
                 if "API version" in jsonReply and jsonReply['API version'] == "libosmscout V1":
                     route = Way.from_osm_scout_json(jsonReply)
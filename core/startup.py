@@ -180,6 +180,26 @@ class Startup(object):
             action="store_true"
         )
 
+        # replay a position log instead of using the GPS
+        parser.add_argument(
+            '--replay-location',
+            help='replay a position log instead of using the GPS EXAMPLE: "track.gpx" or "drive.nmea"',
+            metavar="GPX or NMEA file",
+            dest="replay_location",
+            type=str,
+            default=None,
+            action="store"
+        )
+        parser.add_argument(
+            '--replay-speed',
+            help='position log replay speed multiplier, 0 replays as fast as possible EXAMPLE: 2',
+            metavar="speed multiplier",
+            dest="replay_speed",
+            type=float,
+            default=1.0,
+            action="store"
+        )
+
         # subcommands
         #
         # As argparse does not support support optional subcommands
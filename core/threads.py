@@ -167,7 +167,7 @@ class ThreadManager(object):
             thread_instance = self.get(thread_name)
             if thread_instance:
                 # cancel its callback
-                thread_instance.callback = None
+                thread_instance.cancel()
                 log.info("threads: thread %s cancelled" % thread_name)
         except Exception:
             log.exception("notification: exception canceling thread callback for thread %s",
@@ -266,6 +266,7 @@ class ModRanaThread(threading.Thread):
         self._progress = None  # floating point value from 0.1 to 1.0
         self._stateLock = threading.Lock()
         self._callback = None
+        self._cancelled = False
         # it is possible to set the target both in kwargs
         # and by assigning to target before the thread is started
         self.target = (kwargs.get("target", self._nop))  # payload goes here
@@ -326,6 +327,18 @@ class ModRanaThread(threading.Thread):
     def callback(self, value):
         self._callback = value
 
+    @property
+    def cancelled(self):
+        """True if the thread has been cancelled.
+        Long running payloads can check this and stop early."""
+        return self._cancelled
+
+    def cancel(self):
+        """Cancel the thread - its callback will not be called
+        and the cancelled property is set"""
+        self._cancelled = True
+        self.callback = None
+
     def run(self, *args, **kwargs):
         import sys
         log.info("Running Thread: %s (%s)" % (self.name, self.ident))
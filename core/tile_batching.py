@@ -0,0 +1,300 @@
+"""Batched tile availability & download notification protocol
+
+Used by the Qt 5 GUI to reduce the number of messages exchanged between
+QML and Python when map tiles are being loaded.
+
+Tile availability requests
+--------------------------
+Tiles requested by a map instance during a short interval are grouped
+to one request per map layer & zoom level, describing the tile range
+(bounding box of the requested tiles) and which tiles in the range
+are requested:
+
+    [map id, layer id, z, x, y, width, height, indexes]
+
+Indexes are row-major positions of the requested tiles in the range,
+an empty list means all tiles in the range are requested.
+
+The reply for a request is a string with a character for each tile
+in the range: "1" - tile available, "0" - tile not available
+(a download has been requested), "-" - tile not requested.
+
+Download notifications
+----------------------
+Tile download notifications are not sent one by one but coalesced
+into batches that are sent at most once per frame for each map instance.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+import time
+
+import logging
+log = logging.getLogger("core.tile_batching")
+
+TILE_AVAILABLE = "1"
+TILE_MISSING = "0"
+TILE_NOT_REQUESTED = "-"
+
+# how often to send download notification batches (in seconds), eq. once per frame
+NOTIFICATION_INTERVAL = 1 / 60.0
+
+# how many parsed tile ids to keep
+TILE_ID_CACHE_SIZE = 1024
+
+
+def make_tile_id(map_id, layer_id, z, x, y):
+    return "%s/%s/%d/%d/%d" % (map_id, layer_id, z, x, y)
+
+
+def parse_tile_id(tile_id):
+    """Parse a tile id string
+
+    :param str tile_id: map instance name/layer id/z/x/y
+    :returns: (map id, layer id, z, x, y) tuple
+    :rtype: tuple
+    """
+    (map_id, layer_id, z, x, y) = tile_id.split("/")
+    return map_id, layer_id, int(z), int(x), int(y)
+
+
+def make_range_requests(tile_ids):
+    """Group tile ids to tile range requests
+
+    This mirrors what the QML side does & is used in tests & the benchmark.
+
+    :param tile_ids: tile id strings
+    :returns: list of range requests
+    :rtype: list
+    """
+    groups = {}
+    for tile_id in tile_ids:
+        (map_id, layer_id, z, x, y) = parse_tile_id(tile_id)
+        groups.setdefault((map_id, layer_id, z), []).append((x, y))
+    requests = []
+    for (map_id, layer_id, z), tiles in groups.items():
+        min_x = min(x for x, y in tiles)
+        min_y = min(y for x, y in tiles)
+        width = max(x for x, y in tiles) - min_x + 1
+        height = max(y for x, y in tiles) - min_y + 1
+        indexes = sorted(set((y - min_y) * width + (x - min_x) for x, y in tiles))
+        if len(indexes) == width * height:
+            indexes = []
+        requests.append([map_id, layer_id, z, min_x, min_y, width, height, indexes])
+    return requests
+
+
+def answer_range_request(request, check_tile):
+    """Check availability of tiles in a tile range request
+
+    :param list request: tile range request
+    :param check_tile: callable taking z, x, y and tile id and returning
+                       True if the tile is available
+    :returns: tile availability string for the range
+    :rtype: str
+    """
+    (map_id, layer_id, z, min_x, min_y, width, height, indexes) = request
+    if not indexes:
+        indexes = range(width * height)
+    states = [TILE_NOT_REQUESTED] * (width * height)
+    for index in indexes:
+        x = min_x + index % width
+        y = min_y + index // width
+        if check_tile(z, x, y, make_tile_id(map_id, layer_id, z, x, y)):
+            states[index] = TILE_AVAILABLE
+        else:
+            states[index] = TILE_MISSING
+    return "".join(states)
+
+
+def iterate_range_reply(request, reply):
+    """Iterate over tiles in a tile range reply
+
+    :returns: (tile id, available) tuples for the requested tiles
+    """
+    (map_id, layer_id, z, min_x, min_y, width, height, indexes) = request
+    for index, state in enumerate(reply):
+        if state != TILE_NOT_REQUESTED:
+            tile_id = make_tile_id(map_id, layer_id, z, min_x + index % width, min_y + index // width)
+            yield tile_id, state == TILE_AVAILABLE
+
+
+class TileIdCache(object):
+    """Cache of tile ids parsed to lzxy tuples
+
+    :param get_layer: callable returning a layer for a layer id
+    :param int max_size: how many tile ids to keep
+    """
+
+    def __init__(self, get_layer, max_size=TILE_ID_CACHE_SIZE):
+        self._get_layer = get_layer
+        self._max_size = max_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, tile_id):
+        """Return the lzxy tuple for a tile id"""
+        lzxy = self._cache.get(tile_id)
+        if lzxy is None:
+            (map_id, layer_id, z, x, y) = parse_tile_id(tile_id)
+            lzxy = (self._get_layer(layer_id), z, x, y)
+            with self._lock:
+                if len(self._cache) >= self._max_size:
+                    # tile ids change as the map is moved around,
+                    # so just start over once the cache is full
+                    self._cache.clear()
+                self._cache[tile_id] = lzxy
+        return lzxy
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class NotificationBatcher(object):
+    """Coalesce tile download notifications into per map instance batches
+
+    :param send: callable taking a map id & a list of notifications,
+                 called at most once per interval for each map id
+    :param float interval: how often to send notification batches in seconds
+    """
+
+    def __init__(self, send, interval=NOTIFICATION_INTERVAL):
+        self._send = send
+        self._interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self.batches_sent = 0
+        self.notifications_sent = 0
+
+    def add(self, map_id, notification):
+        """Add a notification, it will be sent with the next batch"""
+        with self._lock:
+            self._pending.setdefault(map_id, []).append(notification)
+            if self._timer is None and self._interval is not None:
+                self._timer = threading.Timer(self._interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send all pending notifications"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._timer = None
+        for map_id, notifications in pending.items():
+            self.batches_sent += 1
+            self.notifications_sent += len(notifications)
+            try:
+                self._send(map_id, notifications)
+            except Exception:
+                log.exception("sending tile download notifications failed")
+
+    def cancel(self):
+        """Drop pending notifications"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = {}
+
+
+def benchmark(pan_steps=1000, tiles_x=6, tiles_y=5, layer_count=2):
+    """Headless tile availability protocol benchmark
+
+    Simulates the map being panned by a tile every frame with layer_count map layers
+    and compares the previous protocol (tile id list request, tile id dictionary reply,
+    a message for every downloaded tile) with the batched tile range protocol.
+    Message sizes are measured as JSON, which is roughly what PyOtherSide
+    has to convert between Python & QML. Downloads of tiles that became visible
+    in a pan step are expected to finish during a single frame.
+    """
+    import json
+    import random
+
+    print("# tile protocol benchmark start #")
+    print("%d pan steps, %dx%d tiles, %d layers" % (pan_steps, tiles_x, tiles_y, layer_count))
+    random.seed(0)
+    layers = ["layer%d" % i for i in range(layer_count)]
+    # roughly half of the tiles are available locally
+    def check_tile(z, x, y, tile_id):
+        return (x * 31 + y * 17) % 2 == 0
+
+    # generate the tile ids requested for each pan step (only the newly visible tiles)
+    steps = []
+    x = y = 1000
+    visible = set()
+    for step in range(pan_steps):
+        x += random.choice((-1, 0, 1))
+        y += random.choice((-1, 0, 1))
+        now_visible = set((tx, ty) for tx in range(x, x + tiles_x) for ty in range(y, y + tiles_y))
+        new = now_visible - visible
+        visible = now_visible
+        steps.append([make_tile_id("map", layer, 15, tx, ty) for layer in layers for tx, ty in sorted(new)])
+
+    # previous protocol
+    start = time.time()
+    messages = 0
+    payload = 0
+    for tile_ids in steps:
+        if not tile_ids:
+            continue
+        reply = {}
+        for tile_id in tile_ids:
+            (map_id, layer_id, z, tx, ty) = parse_tile_id(tile_id)
+            reply[tile_id] = check_tile(z, tx, ty, tile_id)
+        messages += 2
+        payload += len(json.dumps(tile_ids)) + len(json.dumps(reply))
+        # a message per downloaded tile
+        for tile_id, tile_available in reply.items():
+            if not tile_available:
+                messages += 1
+                payload += len(json.dumps([tile_id, True, False]))
+    duration = time.time() - start
+    print("previous: %d messages, %d kB, %1.2f ms per step" %
+          (messages, payload // 1024, 1000 * duration / pan_steps))
+
+    # batched protocol
+    sent = []
+    batcher = NotificationBatcher(lambda map_id, batch: sent.append(batch), interval=None)
+    start = time.time()
+    messages = 0
+    payload = 0
+    for tile_ids in steps:
+        if not tile_ids:
+            continue
+        requests = make_range_requests(tile_ids)
+        replies = [answer_range_request(request, check_tile) for request in requests]
+        messages += 2
+        payload += len(json.dumps(requests)) + len(json.dumps(replies))
+        for request, reply in zip(requests, replies):
+            for tile_id, tile_available in iterate_range_reply(request, reply):
+                if not tile_available:
+                    batcher.add("map", [tile_id, True, False])
+        # downloads finishing during a frame are sent together
+        batcher.flush()
+    for batch in sent:
+        messages += 1
+        payload += len(json.dumps(batch))
+    duration = time.time() - start
+    print("batched: %d messages, %d kB, %1.2f ms per step" %
+          (messages, payload // 1024, 1000 * duration / pan_steps))
+    print("# benchmark finished #")
+
+## RESULTS ##
+# * x86_64 Linux, Python 3.11 *
+#
+# # tile protocol benchmark start #
+# 1000 pan steps, 6x5 tiles, 2 layers
+# previous: 8650 messages, 1049 kB, 0.04 ms per step
+# batched: 2643 messages, 418 kB, 0.08 ms per step
+# # benchmark finished #
+#
+# * x86_64 Linux, Python 2.7 *
+#
+# # tile protocol benchmark start #
+# 1000 pan steps, 6x5 tiles, 2 layers
+# previous: 8534 messages, 1047 kB, 0.08 ms per step
+# batched: 2622 messages, 416 kB, 0.11 ms per step
+# # benchmark finished #
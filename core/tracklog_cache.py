@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Per-file binary tracklog cache
+
+Each tracklog has its own cache entry file holding the packed point
+coordinates together with data that is expensive to compute - point clusters,
+simplification levels and track statistics. Entries are keyed by tracklog
+path and remember the size and modification time of the tracklog file,
+so an entry for a modified tracklog is detected as stale and ignored.
+
+Entry file layout (all numbers little endian):
+
+* header (see HEADER) - magic, format version, byte order, tracklog file size,
+  tracklog file mtime, point count & metadata length
+* metadata - UTF-8 encoded JSON (path, segments, clusters, statistics, ...)
+* padding to 8 bytes
+* latitude, longitude & elevation arrays (doubles, point count items each)
+* simplification level index arrays (unsigned 32 bit integers)
+
+The coordinate arrays are memory mapped on load where possible,
+so loading a cached tracklog does not need to read the whole entry.
+"""
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from core import utils
+from core.tracklog_parser import TrackpointArrays
+
+import logging
+log = logging.getLogger("core.tracklog_cache")
+
+MAGIC = b"MRTC"
+# bump this each time the entry layout or metadata semantics change,
+# entries with a different version are ignored and regenerated
+FORMAT_VERSION = 2
+ENTRY_SUFFIX = ".tlc"
+# magic, format version, byte order, file size, file mtime, point count, metadata length
+HEADER = struct.Struct("<4sHHQdII")
+LITTLE_ENDIAN = 0
+BIG_ENDIAN = 1
+BYTE_ORDER = LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+DOUBLE_SIZE = array.array("d").itemsize
+INDEX_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
+INDEX_SIZE = 4
+
+PYTHON3 = sys.version_info[0] > 2
+
+
+def _padding(length):
+    """Number of bytes needed to pad length to 8 bytes"""
+    return (8 - length % 8) % 8
+
+
+def _array_from_buffer(buffer, typecode, offset, count, item_size):
+    """Get an array like view of count items in buffer starting at offset
+
+    On Python 3 a zero copy memoryview is returned, otherwise the items are copied.
+    """
+    if PYTHON3:
+        return memoryview(buffer)[offset:offset + count * item_size].cast(typecode)
+    else:
+        result = array.array(typecode)
+        result.fromstring(buffer[offset:offset + count * item_size])
+        return result
+
+
+def _array_to_bytes(a):
+    if PYTHON3:
+        return a.tobytes()
+    else:
+        return a.tostring()
+
+
+class CacheEntry(object):
+    """A cached tracklog
+
+    :param points: tracklog points
+    :type points: TrackpointArrays
+    :param list clusters: (start index, end index, centre lat, centre lon, radius) tuples
+    :param dict simplification: simplification tolerance in meters -> indexes of kept points
+    :param dict stats: track statistics
+    """
+
+    def __init__(self, points, clusters, simplification=None, stats=None):
+        self.points = points
+        self.clusters = clusters
+        if simplification is None:
+            simplification = {}
+        self.simplification = simplification
+        if stats is None:
+            stats = {}
+        self.stats = stats
+
+
+class TracklogCache(object):
+    """A directory of binary tracklog cache entries
+
+    :param str folder_path: path to the cache folder, created if needed
+    """
+
+    def __init__(self, folder_path):
+        self._folder_path = folder_path
+        utils.create_folder_path(folder_path)
+
+    @property
+    def folder_path(self):
+        return self._folder_path
+
+    def _entry_name(self, path):
+        return hashlib.sha1(path.encode("utf-8")).hexdigest() + ENTRY_SUFFIX
+
+    def _entry_path(self, path):
+        return os.path.join(self._folder_path, self._entry_name(path))
+
+    def get(self, path):
+        """Return a cache entry for the given tracklog
+
+        :param str path: tracklog path
+        :returns: the cache entry or None if there is no valid entry for the tracklog
+        :rtype: CacheEntry or None
+        """
+        entry_path = self._entry_path(path)
+        if not os.path.isfile(entry_path):
+            return None
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None  # the tracklog no longer exists
+        try:
+            with open(entry_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, byte_order, size, mtime, count, metadata_length = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != FORMAT_VERSION or byte_order != BYTE_ORDER:
+                log.debug("ignoring incompatible cache entry for %s", path)
+                return None
+            if size != file_stat.st_size or mtime != file_stat.st_mtime:
+                log.debug("ignoring stale cache entry for %s", path)
+                return None
+            offset = HEADER.size
+            metadata = json.loads(mapped[offset:offset + metadata_length].decode("utf-8"))
+            if metadata["path"] != path:
+                return None  # hash collision, very unlikely
+            offset += metadata_length
+            offset += _padding(offset)
+            levels = metadata["simplification"]
+            expected_length = offset + 3 * count * DOUBLE_SIZE + sum(c for _, c in levels) * INDEX_SIZE
+            if len(mapped) != expected_length:
+                log.warning("ignoring truncated cache entry for %s", path)
+                return None
+
+            points = TrackpointArrays(file_type=metadata["type"])
+            points.lat = _array_from_buffer(mapped, "d", offset, count, DOUBLE_SIZE)
+            offset += count * DOUBLE_SIZE
+            points.lon = _array_from_buffer(mapped, "d", offset, count, DOUBLE_SIZE)
+            offset += count * DOUBLE_SIZE
+            points.elevation = _array_from_buffer(mapped, "d", offset, count, DOUBLE_SIZE)
+            offset += count * DOUBLE_SIZE
+            points.segment_starts = array.array("l", metadata["segment_starts"])
+            points.start_time = metadata["start_time"]
+            points.end_time = metadata["end_time"]
+            simplification = {}
+            for tolerance, level_count in levels:
+                simplification[tolerance] = _array_from_buffer(mapped, INDEX_TYPECODE, offset,
+                                                                level_count, INDEX_SIZE)
+                offset += level_count * INDEX_SIZE
+            clusters = [tuple(cluster) for cluster in metadata["clusters"]]
+            return CacheEntry(points, clusters, simplification, metadata["stats"])
+        except Exception:
+            log.exception("loading cache entry for %s failed", path)
+            return None
+
+    def store(self, path, entry):
+        """Store a cache entry for the given tracklog
+
+        The entry is written to a temporary file first and then renamed
+        over the old entry, so a crash never leaves a partial entry behind.
+
+        :param str path: tracklog path
+        :param entry: the entry to store
+        :type entry: CacheEntry
+        :returns: True if the entry has been stored, False otherwise
+        :rtype: bool
+        """
+        entry_path = self._entry_path(path)
+        temp_path = entry_path + ".tmp"
+        try:
+            file_stat = os.stat(path)
+            points = entry.points
+            levels = sorted(entry.simplification.items())
+            metadata = {
+                "path": path,
+                "type": points.file_type,
+                "segment_starts": list(points.segment_starts),
+                "start_time": points.start_time,
+                "end_time": points.end_time,
+                "clusters": [list(cluster) for cluster in entry.clusters],
+                "simplification": [[tolerance, len(indexes)] for tolerance, indexes in levels],
+                "stats": entry.stats,
+            }
+            metadata = json.dumps(metadata).encode("utf-8")
+            header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, file_stat.st_size,
+                                 file_stat.st_mtime, len(points), len(metadata))
+            with open(temp_path, "wb") as f:
+                f.write(header)
+                f.write(metadata)
+                f.write(b"\0" * _padding(len(header) + len(metadata)))
+                for values in (points.lat, points.lon, points.elevation):
+                    f.write(_array_to_bytes(array.array("d", values)))
+                for _, indexes in levels:
+                    f.write(_array_to_bytes(array.array(INDEX_TYPECODE, indexes)))
+            os.rename(temp_path, entry_path)
+            return True
+        except Exception:
+            log.exception("storing cache entry for %s failed", path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def remove(self, path):
+        """Remove cache entry for the given tracklog (if any)"""
+        entry_path = self._entry_path(path)
+        if os.path.exists(entry_path):
+            try:
+                os.remove(entry_path)
+            except OSError:
+                log.exception("removing cache entry for %s failed", path)
+
+    def clean(self, paths):
+        """Remove cache entries for tracklogs not in paths
+
+        An empty list of paths (eq. tracklogs have not been listed yet)
+        means there is nothing to clean, not that all entries are stale.
+
+        :param paths: paths of all existing tracklogs
+        """
+        if not paths:
+            return
+        valid_names = set(self._entry_name(path) for path in paths)
+        for name in os.listdir(self._folder_path):
+            if name not in valid_names:
+                try:
+                    os.remove(os.path.join(self._folder_path, name))
+                except OSError:
+                    log.exception("removing cache entry %s failed", name)
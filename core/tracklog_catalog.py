@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""A persistent catalogue of available tracklogs
+
+Listing tracklogs by globbing all category folders and calling stat
+on every file gets slow with thousands of tracklogs. The catalogue keeps
+the tracklog list in a SQLite database instead, together with track
+statistics such as point count, bounding box, length and duration.
+
+The catalogue is updated incrementally when tracklogs are added or removed.
+On startup only category folders whose modification time changed since
+the last run are rescanned, which is enough to find tracklogs added, removed
+or renamed behind modRana's back.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import glob
+import os
+import sqlite3
+import threading
+
+import logging
+log = logging.getLogger("core.tracklog_catalog")
+
+# bump this to drop & recreate the catalogue tables on schema change
+SCHEMA_VERSION = 1
+
+TRACKLOG_EXTENSIONS = ("*.gpx", "*.GPX")
+
+
+class TracklogCatalog(object):
+    """SQLite backed tracklog catalogue
+
+    :param str db_path: path to the catalogue database file,
+                        it will be created if it does not exist
+    """
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        # the catalogue is used both from the main thread
+        # and from tracklog loading threads
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                log.info("creating tracklog catalogue tables (schema version %d)", SCHEMA_VERSION)
+                self._db.execute("DROP TABLE IF EXISTS tracklog")
+                self._db.execute("DROP TABLE IF EXISTS category")
+                self._db.execute("CREATE TABLE category (name text PRIMARY KEY, mtime real)")
+                self._db.execute("CREATE TABLE tracklog (path text PRIMARY KEY, category text, filename text, "
+                                 "size integer, mtime real, point_count integer, "
+                                 "min_lat real, min_lon real, max_lat real, max_lon real, "
+                                 "length real, duration real)")
+                self._db.execute("CREATE INDEX tracklog_category ON tracklog (category)")
+                self._db.execute("CREATE INDEX tracklog_bbox ON tracklog (min_lat, max_lat, min_lon, max_lon)")
+                self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _file_info(self, path):
+        """Return (size, mtime) for a file"""
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+
+    def _list_folder(self, folder_path):
+        """List tracklog files in a category folder"""
+        paths = set()
+        for pattern in TRACKLOG_EXTENSIONS:
+            paths.update(glob.glob(os.path.join(folder_path, pattern)))
+        return [path for path in paths if os.path.isfile(path)]
+
+    def _sync_category(self, category, folder_path):
+        """Make the catalogue content for a category match the category folder
+
+        Only new & removed tracklogs are stat-ed.
+        """
+        known = set(row[0] for row in
+                    self._db.execute("SELECT path FROM tracklog WHERE category=?", (category,)))
+        current = set(self._list_folder(folder_path))
+        for path in known - current:
+            self._db.execute("DELETE FROM tracklog WHERE path=?", (path,))
+        for path in current - known:
+            self._insert(path, category)
+        self._db.execute("REPLACE INTO category VALUES (?, ?)", (category, os.path.getmtime(folder_path)))
+
+    def _insert(self, path, category):
+        size, mtime = self._file_info(path)
+        self._db.execute("REPLACE INTO tracklog (path, category, filename, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                         (path, category, os.path.basename(path), size, mtime))
+
+    def reconcile(self, tracklog_folder):
+        """Bring the catalogue in sync with the tracklog folder
+
+        Each sub-folder of the tracklog folder is a category. Categories whose
+        folder modification time did not change since last reconciliation are skipped.
+
+        :param str tracklog_folder: path to the tracklog folder
+        """
+        self._reconcile(tracklog_folder, force=False)
+
+    def rescan(self, tracklog_folder):
+        """Rescan all categories in the tracklog folder
+
+        Unlike reconcile() this also finds tracklogs whose content
+        has been modified in place.
+        """
+        self._reconcile(tracklog_folder, force=True)
+
+    def _reconcile(self, tracklog_folder, force):
+        with self._lock:
+            folders = [name for name in os.listdir(tracklog_folder)
+                       if not name.startswith('.') and os.path.isdir(os.path.join(tracklog_folder, name))]
+            known = dict((row[0], row[1]) for row in self._db.execute("SELECT name, mtime FROM category"))
+            for category in set(known) - set(folders):
+                self._db.execute("DELETE FROM category WHERE name=?", (category,))
+                self._db.execute("DELETE FROM tracklog WHERE category=?", (category,))
+            for category in folders:
+                folder_path = os.path.join(tracklog_folder, category)
+                if force:
+                    # drop tracklogs that have changed, they will be re-added with current info
+                    for row in self._db.execute("SELECT path, size, mtime FROM tracklog WHERE category=?",
+                                                (category,)).fetchall():
+                        try:
+                            if self._file_info(row[0]) != (row[1], row[2]):
+                                self._db.execute("DELETE FROM tracklog WHERE path=?", (row[0],))
+                        except OSError:
+                            pass  # removed, will be handled by _sync_category()
+                    self._sync_category(category, folder_path)
+                elif known.get(category) != os.path.getmtime(folder_path):
+                    log.debug("rescanning changed tracklog category: %s", category)
+                    self._sync_category(category, folder_path)
+            self._db.commit()
+
+    def add(self, path, category):
+        """Add a tracklog to the catalogue (or refresh it if already present)
+
+        :param str path: tracklog path
+        :param str category: tracklog category
+        """
+        with self._lock:
+            self._insert(path, category)
+            # the folder has changed by adding the file, but we already know why,
+            # so make sure it does not trigger a rescan on next startup
+            folder_path = os.path.dirname(path)
+            self._db.execute("UPDATE category SET mtime=? WHERE name=?",
+                             (os.path.getmtime(folder_path), category))
+            self._db.commit()
+
+    def remove(self, path):
+        """Remove a tracklog from the catalogue
+
+        :param str path: tracklog path
+        """
+        with self._lock:
+            row = self._db.execute("SELECT category FROM tracklog WHERE path=?", (path,)).fetchone()
+            self._db.execute("DELETE FROM tracklog WHERE path=?", (path,))
+            folder_path = os.path.dirname(path)
+            if row is not None and os.path.isdir(folder_path):
+                self._db.execute("UPDATE category SET mtime=? WHERE name=?",
+                                 (os.path.getmtime(folder_path), row[0]))
+            self._db.commit()
+
+    def update_stats(self, path, point_count, bbox, length, duration):
+        """Store statistics for a tracklog
+
+        :param str path: tracklog path
+        :param int point_count: number of points
+        :param bbox: (min lat, min lon, max lat, max lon) tuple or None
+        :param length: track length in kilometers or None
+        :param duration: track duration in seconds or None
+        """
+        if bbox is None:
+            bbox = (None, None, None, None)
+        with self._lock:
+            self._db.execute("UPDATE tracklog SET point_count=?, min_lat=?, min_lon=?, max_lat=?, max_lon=?, "
+                             "length=?, duration=? WHERE path=?",
+                             (point_count,) + tuple(bbox) + (length, duration, path))
+            self._db.commit()
+
+    def get(self, path):
+        """Return catalogue record for a tracklog
+
+        :returns: dictionary with tracklog info or None if tracklog is not in the catalogue
+        :rtype: dict or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tracklog WHERE path=?", (path,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(row.keys(), row))
+
+    def list_tracklogs(self, category=None):
+        """List tracklogs in the catalogue
+
+        :param category: only list tracklogs in this category
+        :returns: list of dictionaries describing the tracklogs, ordered by category & filename
+        :rtype: list
+        """
+        with self._lock:
+            if category is None:
+                rows = self._db.execute("SELECT * FROM tracklog ORDER BY category, filename").fetchall()
+            else:
+                rows = self._db.execute("SELECT * FROM tracklog WHERE category=? ORDER BY filename",
+                                        (category,)).fetchall()
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def list_categories(self):
+        """List categories together with their tracklog count
+
+        :returns: list of (category name, tracklog count) tuples
+        :rtype: list
+        """
+        with self._lock:
+            return [tuple(row) for row in self._db.execute(
+                "SELECT category.name, count(tracklog.path) FROM category "
+                "LEFT JOIN tracklog ON tracklog.category = category.name "
+                "GROUP BY category.name ORDER BY category.name")]
+
+    def paths_in_bbox(self, min_lat, min_lon, max_lat, max_lon, paths=None):
+        """Return paths of tracklogs whose bounding box intersects the given bounding box
+
+        Tracklogs with unknown bounding box (not yet loaded) are always included.
+
+        :param paths: only consider these tracklogs (all tracklogs if None)
+        :returns: set of tracklog paths
+        :rtype: set
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM tracklog WHERE min_lat IS NULL OR "
+                                    "(max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)",
+                                    (min_lat, max_lat, min_lon, max_lon)).fetchall()
+        result = set(row[0] for row in rows)
+        if paths is not None:
+            result.intersection_update(paths)
+        return result
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Lightweight streaming tracklog parsers
+
+The upoints based GPX loader builds a full element tree and a heavy Python
+object for every trackpoint, which is both slow and memory hungry for big
+tracklogs. The parsers in this module stream the input file instead and store
+the coordinates in compact arrays, which are also cheap to send between
+processes when tracklogs are loaded in parallel.
+"""
+import array
+import calendar
+import csv
+import math
+import os
+import time
+
+try:
+    from xml.etree import cElementTree as ElementTree  # Python 2
+except ImportError:
+    from xml.etree import ElementTree  # Python 3
+
+import logging
+log = logging.getLogger("core.tracklog_parser")
+
+GPX = "GPX"
+CSV = "CSV"
+
+# missing elevation is stored as NaN in the elevation array
+NO_ELEVATION = float("nan")
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def parse_timestamp(timestamp):
+    """Parse an ISO 8601 UTC timestamp as used in GPX files & CSV logs
+
+    Fractional seconds and time zone designators are ignored.
+
+    :param str timestamp: timestamp string
+    :returns: seconds since the epoch or None if the timestamp can't be parsed
+    :rtype: int or None
+    """
+    try:
+        return calendar.timegm(time.strptime(timestamp.strip()[:19], TIMESTAMP_FORMAT))
+    except (ValueError, AttributeError):
+        return None
+
+
+class TracklogParsingFailed(Exception):
+    """Raised if a tracklog file can't be parsed"""
+    pass
+
+
+class Trackpoint(object):
+    """A minimal trackpoint
+
+    Provides the same latitude, longitude & elevation attributes
+    as the upoints Trackpoint class used previously, but without
+    the per-instance overhead.
+    """
+    __slots__ = ("latitude", "longitude", "elevation")
+
+    def __init__(self, latitude, longitude, elevation=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
+
+class TrackpointArrays(object):
+    """Trackpoint coordinates stored in compact arrays
+
+    Latitude, longitude and elevation are stored in separate
+    double arrays, missing elevation is stored as NaN.
+    Start indexes of individual track segments are stored
+    in the segment_starts array. Timestamps of the first and last
+    point with a timestamp are kept, so that track duration is known.
+    """
+
+    def __init__(self, file_type=GPX):
+        self.file_type = file_type
+        self.lat = array.array("d")
+        self.lon = array.array("d")
+        self.elevation = array.array("d")
+        self.segment_starts = array.array("l")
+        self.start_time = None
+        self.end_time = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def start_segment(self):
+        """Start a new track segment
+
+        Empty segments are ignored.
+        """
+        index = len(self.lat)
+        if not self.segment_starts or self.segment_starts[-1] != index:
+            self.segment_starts.append(index)
+
+    def append(self, lat, lon, elevation=None):
+        if not self.segment_starts:
+            self.segment_starts.append(0)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        if elevation is None:
+            self.elevation.append(NO_ELEVATION)
+        else:
+            self.elevation.append(elevation)
+
+    def add_timestamp(self, timestamp):
+        """Note timestamp of the last added point"""
+        if self.start_time is None:
+            self.start_time = timestamp
+        self.end_time = timestamp
+
+    @property
+    def duration(self):
+        """Track duration in seconds or None if not known"""
+        if self.start_time is None:
+            return None
+        start = parse_timestamp(self.start_time)
+        end = parse_timestamp(self.end_time)
+        if start is None or end is None:
+            return None
+        return end - start
+
+    def bounding_box(self):
+        """Return the (min lat, min lon, max lat, max lon) bounding box or None if there are no points"""
+        if not len(self.lat):
+            return None
+        return min(self.lat), min(self.lon), max(self.lat), max(self.lon)
+
+    def segment_ranges(self):
+        """Return (start, end) index tuples for all non empty segments"""
+        ends = list(self.segment_starts[1:]) + [len(self.lat)]
+        return [(start, end) for start, end in zip(self.segment_starts, ends) if end > start]
+
+    def to_trackpoints_list(self):
+        """Convert the arrays to a list of segments, each being a list of Trackpoint instances
+
+        This is the same structure the upoints Trackpoints class provides.
+        """
+        lat = self.lat
+        lon = self.lon
+        elevation = self.elevation
+        trackpoints_list = []
+        for start, end in self.segment_ranges():
+            segment = []
+            for i in range(start, end):
+                elev = elevation[i]
+                if math.isnan(elev):
+                    elev = None
+                segment.append(Trackpoint(lat[i], lon[i], elev))
+            trackpoints_list.append(segment)
+        return trackpoints_list
+
+
+def _local_name(tag):
+    """Drop the XML namespace from an element tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_gpx(path):
+    """Stream parse trackpoints from a GPX file
+
+    Only trkpt elements are parsed and elements are discarded
+    right after being processed, so memory usage stays proportional
+    to the number of points, not the size of the XML tree.
+
+    :param str path: path to a GPX file
+    :returns: parsed trackpoints
+    :rtype: TrackpointArrays
+    """
+    points = TrackpointArrays(file_type=GPX)
+    try:
+        context = ElementTree.iterparse(path, events=("start", "end"))
+        for event, element in context:
+            name = _local_name(element.tag)
+            if event == "start":
+                if name == "trkseg":
+                    points.start_segment()
+                continue
+            if name == "trkpt":
+                elevation = None
+                timestamp = None
+                for child in element:
+                    child_name = _local_name(child.tag)
+                    if child_name == "ele" and child.text:
+                        elevation = float(child.text)
+                    elif child_name == "time" and child.text:
+                        timestamp = child.text
+                points.append(float(element.get("lat")), float(element.get("lon")), elevation)
+                if timestamp:
+                    points.add_timestamp(timestamp)
+                element.clear()
+            elif name == "trk":
+                element.clear()
+    except Exception as e:
+        log.exception("parsing GPX file failed: %s", path)
+        raise TracklogParsingFailed(str(e))
+    return points
+
+
+def parse_csv(path):
+    """Parse trackpoints from a CSV file
+
+    The format is the same as used by AppendOnlyWay:
+    latitude, longitude, elevation, timestamp
+    (elevation and timestamp are optional)
+
+    :param str path: path to a CSV file
+    :returns: parsed trackpoints
+    :rtype: TrackpointArrays
+    """
+    points = TrackpointArrays(file_type=CSV)
+    try:
+        with open(path, "rt") as f:
+            for row in csv.reader(f):
+                if len(row) < 2:
+                    continue  # skip empty or incomplete lines
+                elevation = None
+                if len(row) >= 3 and row[2] not in ("", "None"):
+                    elevation = float(row[2])
+                points.append(float(row[0]), float(row[1]), elevation)
+                if len(row) >= 4 and row[3]:
+                    points.add_timestamp(row[3])
+    except Exception as e:
+        log.exception("parsing CSV file failed: %s", path)
+        raise TracklogParsingFailed(str(e))
+    return points
+
+
+def parse_tracklog(path):
+    """Parse a tracklog file, the format is determined from file extension
+
+    This function is also used as the work function for parallel
+    tracklog loading, so it needs to stay a module level function.
+
+    :param str path: path to a tracklog file
+    :returns: parsed trackpoints
+    :rtype: TrackpointArrays
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return parse_csv(path)
+    else:
+        return parse_gpx(path)
+
+
+def parse_tracklog_or_none(path):
+    """Parse a tracklog file, return None if it can't be parsed
+
+    Work function for parallel tracklog loading - an exception raised
+    in a pool worker never reaches the apply_async callback (and Python 2
+    has no error callback), so failures are reported as None instead.
+
+    :param str path: path to a tracklog file
+    :returns: parsed trackpoints or None
+    :rtype: TrackpointArrays or None
+    """
+    try:
+        return parse_tracklog(path)
+    except TracklogParsingFailed:
+        return None
+    except Exception:
+        log.exception("loading tracklog failed: %s", path)
+        return None
+
+
+def update_gpx_elevation(path, trackpoints_list):
+    """Write elevation of in memory trackpoints back to a GPX file
+
+    The file is rewritten from its own element tree with only the ele
+    elements of track points updated, so all track segments, timestamps,
+    metadata, waypoints & extensions are preserved. Trackpoints are
+    matched to trkpt elements in document order.
+
+    :param str path: path to the GPX file to update
+    :param trackpoints_list: list of segments, each being a list of objects
+                             with an elevation attribute, as returned by
+                             TrackpointArrays.to_trackpoints_list()
+    :returns: number of updated trackpoints
+    :rtype: int
+    """
+    # keep the namespace prefixes used in the file,
+    # so that the file is not rewritten with generated ones
+    for event, (prefix, uri) in ElementTree.iterparse(path, events=("start-ns",)):
+        ElementTree.register_namespace(prefix, uri)
+    tree = ElementTree.parse(path)
+    root = tree.getroot()
+    namespace = ""
+    if root.tag.startswith("{"):
+        namespace = root.tag[:root.tag.index("}") + 1]
+    points = (point for segment in trackpoints_list for point in segment)
+    updated = 0
+    for trkpt in root.iter(namespace + "trkpt"):
+        point = next(points, None)
+        if point is None:
+            break
+        ele = trkpt.find(namespace + "ele")
+        if point.elevation is None:
+            if ele is not None:
+                trkpt.remove(ele)
+        else:
+            if ele is None:
+                # ele is the first child element of a trkpt in the GPX schema
+                ele = ElementTree.Element(namespace + "ele")
+                trkpt.insert(0, ele)
+            ele.text = "%.2f" % float(point.elevation)
+        updated += 1
+    tree.write(path, encoding="UTF-8", xml_declaration=True)
+    return updated
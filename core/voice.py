@@ -18,11 +18,17 @@
 """Text-to-speech (TTS) engines and voice directions support."""
 
 import atexit
+import collections
+import hashlib
+import itertools
 import os
 import queue
+import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 
 from core import utils
 from core import constants
@@ -34,6 +40,23 @@ import logging
 log = logging.getLogger("core.voice")
 call_log = logging.getLogger("core.voice.call")
 
+# Number of TTS worker threads, each runs one TTS subprocess at a time.
+WORKER_COUNT = max(1, min(4, os.cpu_count() or 1))
+
+# Size limits for the WAV file cache in bytes, the temporary
+# cache is smaller as /tmp is in RAM on Sailfish OS.
+CACHE_SIZE = 50 * 1024 * 1024
+TEMPORARY_CACHE_SIZE = 10 * 1024 * 1024
+
+# Task priorities, lower values are synthesised first.
+# Pre-synthesised announcements use distance ahead in meters.
+PRIORITY_STOP = -2
+PRIORITY_NOW = -1
+
+# Number of upcoming message points pre-synthesised at once,
+# the window is moved ahead as the message points are passed.
+PRESYNTHESIS_WINDOW = 5
+
 class VoiceEngine:
 
     """Base class for text-to-speech (TTS) engines."""
@@ -199,22 +222,166 @@ class VoiceEnginePicoTTS(VoiceEngine):
                           text]) == 0
 
 
-def voice_worker(task_queue, result_queue, engine, tmpdir):
+def normalize_text(text):
+    """Return `text` with redundant whitespace removed."""
+    return " ".join(text.split())
+
+
+def plain_text(text):
+    """Return `text` with SSML & HTML markup removed."""
+    return normalize_text(re.sub(r"<[^>]*>", " ", text))
+
+
+class WavCache:
+
+    """Size bounded content addressed LRU cache of WAV files.
+
+    WAV files are named by a hash of the engine, voice and normalized
+    text, so that the cache can be shared between sessions. File
+    modification time is used to restore the LRU order on startup.
+    """
+
+    def __init__(self, directory, max_size=CACHE_SIZE):
+        """Initialize a :class:`WavCache` instance."""
+        self.directory = directory
+        self.max_size = max_size
+        # Key -> file size, least recently used first.
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return len(self._files)
+
+    def _load(self):
+        """Index WAV files already present in the cache directory."""
+        files = []
+        for name in os.listdir(self.directory):
+            key, extension = os.path.splitext(name)
+            if extension != ".wav":
+                continue
+            try:
+                stat = os.stat(self._path(key))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, key, stat.st_size))
+        for mtime, key, size in sorted(files):
+            self._files[key] = size
+            self._size += size
+        log.debug("%d cached WAV files found", len(self._files))
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def key(engine, text):
+        """Return cache key for `text` said by `engine`."""
+        data = "\n".join((engine.name,
+                          engine.language,
+                          engine.voice_name or "",
+                          normalize_text(text)))
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, "%s.wav" % key)
+
+    @property
+    def size(self):
+        """Return total size of cached files in bytes."""
+        return self._size
+
+    def get(self, key):
+        """Return the WAV filename for `key` or ``None``."""
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+            fname = self._path(key)
+        try:
+            # Keep the LRU order for the next session.
+            os.utime(fname)
+        except OSError:
+            # Removed behind our back.
+            with self._lock:
+                self._size -= self._files.pop(key, 0)
+            return None
+        return fname
+
+    def put(self, key, fname):
+        """Move WAV file `fname` into the cache and return the new filename."""
+        path = self._path(key)
+        size = os.path.getsize(fname)
+        shutil.move(fname, path)
+        with self._lock:
+            self._size -= self._files.pop(key, 0)
+            self._files[key] = size
+            self._size += size
+            self._evict()
+        return path
+
+    def remove(self, key):
+        """Remove WAV file for `key` from the cache."""
+        with self._lock:
+            if key not in self._files:
+                return
+            self._size -= self._files.pop(key)
+            self._remove_file(key)
+
+    def clear(self):
+        """Remove all WAV files from the cache."""
+        with self._lock:
+            for key in self._files:
+                self._remove_file(key)
+            self._files.clear()
+            self._size = 0
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits its size limit."""
+        while self._size > self.max_size and self._files:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            self._remove_file(key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            log.exception("WAV file cleanup failed for %s", key)
+
+
+def voice_worker(task_queue, result_queue, engine, tmpdir, wav_cache):
     """Worker thread to generate WAV files in `task_queue`."""
     log.debug("voice worker starting")
     while True:
-        text = task_queue.get()
+        priority, index, text = task_queue.get()
         if text is None:
             log.debug("voice worker shutting down")
+            task_queue.task_done()
             break
-        handle, fname = tempfile.mkstemp(suffix=".wav", dir=tmpdir)
-        success = engine.make_wav(text, fname)
-        if not success:
-            fname = None
+        key = wav_cache.key(engine, text)
+        # The same text might have been queued again with
+        # a higher priority and already generated.
+        fname = wav_cache.get(key)
+        if fname is None:
+            handle, tmp_fname = tempfile.mkstemp(suffix=".wav", dir=tmpdir)
+            os.close(handle)
+            if engine.make_wav(normalize_text(text), tmp_fname):
+                fname = wav_cache.put(key, tmp_fname)
+            else:
+                os.remove(tmp_fname)
         result_queue.put((text, fname))
         task_queue.task_done()
 
 
+def announcement_variants(point):
+    """Return texts announced for message point `point`."""
+    message = getattr(point, "ssml_message", None) or point.description
+    if message:
+        return [plain_text(message)]
+    return []
+
+
 class VoiceGenerator:
 
     """Threaded generator for voice directions."""
@@ -227,14 +394,27 @@ class VoiceGenerator:
         VoiceEngineEspeak,
     ]
 
-    def __init__(self):
-        """Initialize a :class:`VoiceGenerator` instance."""
+    def __init__(self, cache_dir=None, cache_size=CACHE_SIZE, workers=WORKER_COUNT):
+        """Initialize a :class:`VoiceGenerator` instance.
+
+        WAV files are stored in `cache_dir` and kept between sessions.
+        Without `cache_dir` they are stored in a temporary directory
+        removed on shutdown.
+        """
         self._cache = {}
         self._engine = None
+        self._persistent = cache_dir is not None
+        self._queued = {}
         self._result_queue = None
+        self._task_counter = itertools.count()
         self._task_queue = None
         self._tmpdir = tempfile.mkdtemp(prefix="modrana-")
-        self._worker_thread = None
+        if self._persistent:
+            self._wav_cache = WavCache(cache_dir, cache_size)
+        else:
+            self._wav_cache = WavCache(self._tmpdir, min(cache_size, TEMPORARY_CACHE_SIZE))
+        self._worker_count = workers
+        self._worker_threads = []
         # Normally quit is called from Application,
         # but e.g. when running unit tests we need atexit.
         atexit.register(self.quit)
@@ -245,30 +425,33 @@ class VoiceGenerator:
         return self._engine is not None
 
     def clean(self):
-        """Terminate the worker thread and purge generated files."""
+        """Terminate the worker threads and purge generated files.
+
+        Files in a persistent cache are kept for later sessions.
+        """
         log.debug("performing voice generator cleanup")
         self._clean_worker()
-        for text in list(self._cache):
-            self.clean_text(text)
-
-    def _clean_outdated_cache(self):
-        """Remove oldest generated WAV files from cache."""
-        # Minimizes RAM use on Sailfish OS where /tmp is in RAM.
-        items = list(self._cache.items())
-        items = [x for x in items if x[1] is not None]
-        items.sort(key=lambda x: os.path.getmtime(x[1]))
-        for text, fname in items[:-100]:
-            self.clean_text(text)
+        self._cache.clear()
+        if not self._persistent:
+            self._wav_cache.clear()
 
     def _clean_worker(self):
-        """Terminate the worker thread."""
-        if self._worker_thread is None:
+        """Terminate the worker threads."""
+        if not self._worker_threads:
             return
-        self._task_queue.put(None)
-        self._worker_thread.join()
-        self._worker_thread = None
+        # Stop requests go before any queued texts.
+        for thread in self._worker_threads:
+            self._task_queue.put((PRIORITY_STOP, next(self._task_counter), None))
+        for thread in self._worker_threads:
+            thread.join()
+        self._worker_threads = []
         # Ensure that we have all items.
         self._update_cache()
+        # Texts still in the queue will not be generated.
+        for text in self._queued:
+            if self._cache.get(text, "") is None:
+                del self._cache[text]
+        self._queued.clear()
 
     def _find_engine(self, language, gender="male"):
         """Return TTS engine instance for `language` and `gender`."""
@@ -291,7 +474,19 @@ class VoiceGenerator:
     def get(self, text):
         """Return the WAV filename for `text`."""
         self._update_cache()
-        return self._cache.get(text, None)
+        fname = self._cache.get(text, None)
+        if fname is not None and not os.path.isfile(fname):
+            # Evicted from the WAV file cache.
+            del self._cache[text]
+            return None
+        return fname
+
+    def failed(self, text):
+        """Return ``True`` if generating the WAV file for `text` failed."""
+        self._update_cache()
+        return (text not in self._queued and
+                text in self._cache and
+                self._cache[text] is None)
 
     def get_uri(self, text):
         """Return the WAV file URI for `text`."""
@@ -300,40 +495,108 @@ class VoiceGenerator:
             return None
         return utils.path2uri(fname)
 
-    def make(self, text):
-        """Queue `text` for WAV file generation."""
+    def make(self, text, priority=PRIORITY_NOW):
+        """Queue `text` for WAV file generation.
+
+        Texts with lower `priority` are generated first.
+        """
         if self._engine is None:
             return
         self._update_cache()
-        if text in self._cache:
-            # WAV file already generated, just update
-            # file modification time to prevent removal.
-            if self._cache[text] is not None:
-                os.utime(self._cache[text])
+        # WAV file already generated, possibly in an earlier session,
+        # getting it from cache also prevents its removal.
+        fname = self._wav_cache.get(WavCache.key(self._engine, text))
+        if fname is not None:
+            self._cache[text] = fname
+            return
+        if text in self._queued:
+            if self._queued[text] <= priority:
+                # Don't run the same voice direction twice through the engine.
+                return
+        elif text in self._cache and self._cache[text] is None:
+            # Generating the WAV file failed before.
+            return
+        self._start_workers()
+        self._cache[text] = None
+        self._queued[text] = priority
+        self._task_queue.put((priority, next(self._task_counter), text))
+
+    def presynthesize(self, message_points, distance=0, variants=announcement_variants,
+                      window=PRESYNTHESIS_WINDOW):
+        """Queue announcements for message points ahead for WAV file generation.
+
+        `message_points` are route message points with distance from
+        route start set, `distance` is the current distance from route
+        start in meters. Only the next `window` message points are
+        queued, announcements closer ahead are generated first.
+        `variants` returns the announcement texts for a message point.
+        """
+        if self._engine is None:
+            return
+        count = 0
+        points = 0
+        for point in message_points:
+            if points >= window:
+                break
+            if point.distance_from_start is None:
+                continue
+            ahead = point.distance_from_start - distance
+            if ahead < 0:
+                continue
+            points += 1
+            for text in variants(point):
+                self.make(text, priority=ahead)
+                count += 1
+        log.debug("%d announcements queued for pre-synthesis", count)
+
+    def wait(self, text, timeout):
+        """Wait up to `timeout` seconds for `text` to be generated.
+
+        Return the WAV filename or ``None`` if generation failed
+        or did not finish in time.
+        """
+        fname = self.get(text)
+        if fname is not None or text not in self._queued:
+            return fname
+        deadline = time.monotonic() + timeout
+        while text in self._queued:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                result_text, fname = self._result_queue.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            self._result_queue.task_done()
+            self._cache[result_text] = fname
+            self._queued.pop(result_text, None)
+        return self.get(text)
+
+    def _start_workers(self):
+        """Start the worker threads if not already running."""
+        if self._worker_threads:
             return
-        if self._worker_thread is None:
-            self._result_queue = queue.Queue()
-            self._task_queue = queue.Queue()
-            self._worker_thread = threads.ModRanaThread(
+        self._result_queue = queue.Queue()
+        self._task_queue = queue.PriorityQueue()
+        for i in range(self._worker_count):
+            thread = threads.ModRanaThread(
                 name=constants.THREAD_VOICE_WORKER,
                 target=lambda: voice_worker
                 (task_queue=self._task_queue,
                  result_queue=self._result_queue,
                  engine=self._engine,
-                 tmpdir=self._tmpdir),
+                 tmpdir=self._tmpdir,
+                 wav_cache=self._wav_cache),
                 daemon=True)
-            threads.threadMgr.add(self._worker_thread)
-        # Add an empty element into cache to ensure that we don't
-        # run the same voice direction twice through the engine.
-        self._cache[text] = None
-        self._task_queue.put(text)
-        self._clean_outdated_cache()
+            threads.threadMgr.add(thread)
+            self._worker_threads.append(thread)
 
     def clean_text(self, text):
         """Remove generated WAV file for the text from cache."""
         try:
             if self._cache[text] is not None:
-                os.remove(self._cache[text])
+                key = os.path.splitext(os.path.basename(self._cache[text]))[0]
+                self._wav_cache.remove(key)
         except:
             log.exception("WAV file cleanup failed for %s", text)
 
@@ -343,9 +606,12 @@ class VoiceGenerator:
             log.exception("cache cleanup failed for %s", text)
 
     def quit(self):
-        """Terminate the worker thread and purge generated files."""
+        """Terminate the worker threads and purge temporary files."""
         log.debug("voice generator shutting down")
         self._clean_worker()
+        if not os.path.isdir(self._tmpdir):
+            # already called by the voice module
+            return
         try:
             shutil.rmtree(self._tmpdir)
         except:
@@ -371,3 +637,4 @@ class VoiceGenerator:
             text, fname = self._result_queue.get_nowait()
             self._result_queue.task_done()
             self._cache[text] = fname
+            self._queued.pop(text, None)
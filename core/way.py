@@ -1,6 +1,7 @@
 """a modRana class representing an unified tracklog or route"""
 # -*- coding: utf-8 -*-
 from __future__ import with_statement # for python 2.5
+import copy
 import csv
 import os
 import threading
@@ -317,6 +318,23 @@ class Way(object):
         else:
             return None
 
+    def get_closest_point_index(self, lat, lon):
+        """Get index of the geographically closest regular point.
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :return: index of the closest regular point or None if the way has no points
+        :rtype: int or None
+        """
+        closest_index = None
+        closest_distance = None
+        for index, point in enumerate(self._points):
+            distance = geo.distance(lat, lon, point[0], point[1])
+            if closest_distance is None or distance < closest_distance:
+                closest_index = index
+                closest_distance = distance
+        return closest_index
+
     def get_closest_message_point(self, point):
         """Get the geographically closest message point to a point."""
         if self.message_points:
@@ -338,6 +356,84 @@ class Way(object):
            external sources."""
         self._length = mLength
 
+    def get_distances_from_start(self):
+        """Distance of each regular point from the start of the way.
+
+        :return: distances along the way in meters, one for each regular point
+        :rtype: list of floats
+        """
+        distances = []
+        total = 0.0
+        previous = None
+        for point in self._points:
+            if previous is not None:
+                total += geo.distance(previous[0], previous[1], point[0], point[1]) * 1000
+            distances.append(total)
+            previous = point
+        return distances
+
+    def copy(self):
+        """Return a copy of the way.
+
+        Message points are copied as well, so that changing them
+        (eq. marking them as visited) does not change the original way.
+
+        :return: copy of the way
+        :rtype: Way instance
+        """
+        way = Way(list(self._points))
+        way.add_message_points([copy.copy(point) for point in self._message_points])
+        way._set_length(self._length)
+        way._set_duration(self._duration)
+        return way
+
+    def splice(self, connector, index):
+        """Return a new way following the connector and then this way from the given point.
+
+        Used for rerouting - a short connector route leads back to the way,
+        which is then followed from the point with the given index as before.
+        The connector is expected to end at the point with the given index.
+        The arrival message point at the end of the connector is dropped,
+        as the rejoin point is not the destination. Message points of this
+        way past the point with the given index are kept, with their distances
+        from start updated for the new way.
+
+        :param connector: way leading to the point with the given index
+        :param int index: index of the regular point where the connector joins this way
+        :return: the spliced way
+        :rtype: Way instance
+        """
+        distances = self.get_distances_from_start()
+        join_distance = distances[index]
+        remaining_distance = distances[-1] - join_distance
+        connector_length = connector.length
+        if connector_length is None:
+            connector_length = connector.get_distances_from_start()[-1]
+
+        way = Way(list(connector.points_lle) + list(self._points[index + 1:]))
+        connector_message_points = connector.message_points
+        if connector_message_points:
+            # drop the arrival message point at the end of the connector
+            last_point = connector_message_points[-1]
+            if connector.get_closest_point_index(last_point.lat, last_point.lon) == connector.point_count - 1:
+                connector_message_points = connector_message_points[:-1]
+        message_points = [copy.copy(point) for point in connector_message_points]
+        for point in self._message_points:
+            distance_from_start = getattr(point, "distance_from_start", None)
+            if distance_from_start is None:
+                # use the distance of the closest regular point
+                distance_from_start = distances[self.get_closest_point_index(point.lat, point.lon)]
+            if distance_from_start > join_distance:
+                point = copy.copy(point)
+                if isinstance(point, TurnByTurnPoint):
+                    point.distance_from_start = connector_length + distance_from_start - join_distance
+                message_points.append(point)
+        way.add_message_points(message_points)
+        way._set_length(connector_length + remaining_distance)
+        if connector.duration is not None and self._duration is not None and distances[-1]:
+            way._set_duration(connector.duration + self._duration * remaining_distance / distances[-1])
+        return way
+
 
     # GPX export
 
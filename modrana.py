@@ -26,8 +26,10 @@ import sys
 import time
 
 startTimestamp = time.time()
+PYTHON3 = sys.version_info[0] > 2
 import os
-import marshal
+import threading
+import json
 import imp
 import platform
 
@@ -83,9 +85,14 @@ from core import startup
 from core import utils
 from core import paths
 from core import configs
+from core import constants
 from core import threads
 from core import gs
 from core import singleton
+from core import module_info
+from core.event_bus import EventBus
+from core.options_store import OptionsStore, KEY_MODIFIERS_KEY
+from core.options_journal import OptionsJournal, DELETED
 from core.backports import six
 # record that imports-done timestamp
 importsDoneTimestamp = time.time()
@@ -98,6 +105,18 @@ ALL_MODULE_FOLDERS = [
     DEVICE_MODULES_FOLDER,
     GUI_MODULES_FOLDER
 ]
+# how long to wait after the GUI main loop has been started
+# before loading deferred modules (in ms)
+DEFERRED_MODULE_LOADING_DELAY = 500
+# how long to wait before writing changed options to storage (in seconds)
+OPTIONS_WRITE_DELAY = 5
+# frequently changing options keys that are not worth a fsync
+# of the options journal if nothing else changed
+VOLATILE_OPTIONS_KEYS = frozenset(['pos', 'pos_source', 'bearing', 'metersPerSecSpeed', 'speed',
+                                   'elevation', 'locationUpdated', 'needRedraw'])
+# startup benchmark results (--debug-startup)
+STARTUP_BENCHMARK_FILENAME = "startup_benchmark.json"
+STARTUP_BENCHMARK_RUNS = 20
 
 
 class ModRana(object):
@@ -120,10 +139,19 @@ class ModRana(object):
         self.GUIString = ""
         self.optLoadingOK = None
 
-        self.d = {}  # persistent dictionary of data
-        self.m = {}  # dictionary of loaded modules
-        self.watches = {}  # List of data change watches
-        self.maxWatchId = 0
+        # persistent options, per mode key modifiers & options key watches
+        self.options_store = OptionsStore(key_default=self._get_key_default,
+                                          on_change=self._options_changed_cb)
+        self.d = self.options_store.d  # persistent dictionary of data
+        # journaled options storage, created once options are loaded
+        self.options_journal = None
+        self._options_write_timer = None
+        self._options_write_lock = threading.RLock()
+        # dictionary of loaded modules, modules loaded on demand are initialized on the main loop
+        self.m = module_info.ModuleDict(self._load_module_on_demand,
+                                        dispatch=self._run_on_main_loop_and_wait)
+        # module name -> (import time, firstTime time, eagerness) in ms
+        self.module_timing = {}
 
         self.initInfo = {
             'modrana': self,
@@ -134,15 +162,13 @@ class ModRana(object):
         # signals
         self.notificationTriggered = Signal()
         self.shutdown_signal = Signal()
+        # typed events (eq. position updates) with rate limited subscribers
+        # rate limited subscribers get pending events from the main loop
+        self.events = EventBus(dispatch=self._run_on_main_loop)
 
         self.mapRotationAngle = 0  # in radians
         self.notMovingSpeed = 1  # in m/s
 
-        # per mode options
-        # NOTE: this variable is automatically saved by the
-        # options module
-        self.keyModifiers = {}
-
         # initialize threading
         threads.initThreading()
 
@@ -348,23 +374,42 @@ class ModRana(object):
         self.gui = gui_module
 
     def _load_modules(self):
-        """Load all "normal" (other than device & GUI) modules."""
+        """Load all "normal" (other than device & GUI) modules.
+
+        Only eager modules (and their dependencies) are loaded now,
+        deferred modules are loaded in the background once the GUI
+        has been started and lazy modules are loaded on first access.
+        See core/module_info.py for details.
+        """
 
         log.info("importing modules:")
         start_time = time.clock()
 
-        # make shortcut for the load_module function
-        load_module = self._load_module
-
         # get possible module names
-        module_names = self._get_module_names_from_folder(MAIN_MODULES_FOLDER)
-        # load if possible
-        for module_name in module_names:
+        available = {}
+        for import_name in self._get_module_names_from_folder(MAIN_MODULES_FOLDER):
             # filter out .py
-            module_name = module_name.split('.')[0]
-            load_module(module_name, module_name[4:])
+            import_name = import_name.split('.')[0]
+            available[import_name[4:]] = import_name
+
+        eager = module_info.with_dependencies(
+            [name for name in available if module_info.get_module_info(name).eagerness == module_info.EAGER],
+            available
+        )
+        order = module_info.startup_order(eager)
+        for name in order:
+            import_start = time.time()
+            module = self._load_module(available[name], name)
+            if module is None:
+                # don't try to load modules that failed to load again
+                del available[name]
+            else:
+                self.module_timing[name] = [1000 * (time.time() - import_start), 0, module_info.EAGER]
+        # the rest can be loaded on demand
+        self.m.set_available(available)
 
-        log.info("Loaded all modules in %1.2f ms, initialising" % (1000 * (time.clock() - start_time)))
+        log.info("Loaded %d of %d modules in %1.2f ms, initialising",
+                 len(self.module_timing), len(available), 1000 * (time.clock() - start_time))
         self.addTime("all modules loaded")
 
         # make sure all modules have the device module and other variables before first time
@@ -376,8 +421,12 @@ class ModRana(object):
         self._modules_loaded_pre_first_time()
 
         start_time = time.clock()
-        for m in self.m.values():
-            m.firstTime()
+        for name in order:
+            m = self.m.get(name)
+            if m is not None:
+                first_time_start = time.time()
+                m.firstTime()
+                self.module_timing[name][1] = 1000 * (time.time() - first_time_start)
 
         # run what needs to be done after firstTime is called
         self._modules_loaded_post_first_time()
@@ -387,6 +436,123 @@ class ModRana(object):
         # add last timing checkpoint
         self.addTime("all modules initialized")
 
+    def _load_module_on_demand(self, name):
+        """Load and initialize a module that was not loaded at startup.
+
+        Called by the module dictionary when a not yet loaded module is first accessed.
+        """
+        info = module_info.get_module_info(name)
+        # dependencies need to be initialized first
+        for dependency in info.dependencies:
+            self.m.get(dependency)
+        import_start = time.time()
+        module = self._import_module(self.m.import_name(name), name)
+        if module is None:
+            return None
+        first_time_start = time.time()
+        module.modrana = self
+        module.dmod = self.dmod
+        self.m.set_loading(name, module)
+        try:
+            module.firstTime()
+        except Exception:
+            log.exception("module %s failed to initialize", name)
+        now = time.time()
+        self.module_timing[name] = [1000 * (first_time_start - import_start),
+                                    1000 * (now - first_time_start),
+                                    info.eagerness]
+        log.info("%s module %s loaded on demand in %1.2f ms",
+                 info.eagerness, name, 1000 * (now - import_start))
+        return module
+
+    def _schedule_deferred_module_loading(self):
+        """Load deferred modules in the background once the GUI main loop is running."""
+        cron = self.m.get('cron', None)
+        if cron:
+            cron.addTimeout(self._start_deferred_module_loading, DEFERRED_MODULE_LOADING_DELAY,
+                            self, "load deferred modules")
+        else:
+            self._start_deferred_module_loading()
+
+    def _start_deferred_module_loading(self):
+        threads.threadMgr.add(threads.ModRanaThread(name=constants.THREAD_DEFERRED_MODULE_LOADING,
+                                                    target=self._load_deferred_modules))
+        # one shot timeout
+        return False
+
+    def _load_deferred_modules(self):
+        """Import deferred modules in the background & initialize them on the main loop
+
+        Only the Python modules are imported by the background thread, module instances
+        are created and their firstTime() methods are run from the main loop, one module
+        per idle callback, as firstTime() often sets up GUI or timer related things.
+        """
+        start_time = time.time()
+        names = [name for name in self.m.not_loaded()
+                 if module_info.get_module_info(name).eagerness == module_info.DEFERRED]
+        names = module_info.startup_order(names)
+        for name in names:
+            import_name = self.m.import_name(name)
+            if import_name:
+                try:
+                    self._import_python_module(import_name)
+                except Exception:
+                    # reported once the module is loaded on the main loop
+                    pass
+        log.info("%d deferred modules imported in %1.2f ms", len(names), 1000 * (time.time() - start_time))
+        self._run_on_main_loop(self._initialize_deferred_modules, names, time.time())
+
+    def _initialize_deferred_modules(self, names, start_time):
+        """Initialize the next deferred module on the main loop"""
+        if names:
+            self.m.get(names[0])
+            self._run_on_main_loop(self._initialize_deferred_modules, names[1:], start_time)
+        else:
+            log.info("deferred modules initialized in %1.2f ms", 1000 * (time.time() - start_time))
+            # loaded modules might want to draw something
+            self.set('needRedraw', True)
+        # one shot idle callback
+        return False
+
+    def _run_on_main_loop(self, callback, *args):
+        """Call callback from the main loop once it is idle
+
+        The callback is called right away if there is no main loop.
+        """
+        cron = self.m.get('cron', None)
+        if cron:
+            cron.addIdle(callback, list(args))
+        else:
+            callback(*args)
+
+    def _run_on_main_loop_and_wait(self, callback, *args):
+        """Call callback from the main loop, wait for it to finish & return its result
+
+        The callback is called right away from the main thread or if there is no main loop.
+        """
+        if threads.threadMgr is None or threads.threadMgr.in_main_thread():
+            return callback(*args)
+        cron = self.m.get('cron', None)
+        if cron is None:
+            return callback(*args)
+        result = []
+        done = threading.Event()
+
+        def run():
+            try:
+                result.append(callback(*args))
+            finally:
+                done.set()
+            # one shot idle callback
+            return False
+
+        cron.addIdle(run, [])
+        done.wait()
+        if result:
+            return result[0]
+        else:
+            return None
+
     def _get_module_names_from_folder(self, folder, prefix='mod_'):
         """List a given folder and find all possible module names.
 
@@ -434,33 +600,47 @@ class ModRana(object):
         return self._get_module_names_from_folder(GUI_MODULES_FOLDER)
 
     def _load_module(self, importName, moduleName):
-        """Load a single module by name from path."""
+        """Load a single module by name from path and add it to the module dictionary."""
+        module = self._import_module(importName, moduleName)
+        if module is not None:
+            self.m[moduleName] = module
+        return module
+
+    def _import_module(self, importName, moduleName):
+        """Import a single module by name from path and return its instance."""
         start_m = time.clock()
-        fp = None
         try:
-            if USING_QRC:
-                # we need to use importlib for importing modules from qrc,
-                # the "old" imp modules seems to be unable to do that
-                import importlib
-                a = importlib.import_module(importName)
-            else:
-                fp, pathName, description = imp.find_module(importName, ALL_MODULE_FOLDERS)
-                a = imp.load_module(importName, fp, pathName, description)
-
+            a = self._import_python_module(importName)
             module = a.getModule(self, moduleName, importName)
-            self.m[moduleName] = module
             log.info(" * %s: %s (%1.2f ms)",
                      moduleName,
-                     self.m[moduleName].__doc__,
+                     module.__doc__,
                      (1000 * (time.clock() - start_m))
                      )
             return module
         except Exception:
             log.exception("module: %s/%s failed to load", importName, moduleName)
             return None
+
+    def _import_python_module(self, importName):
+        """Import the Python module of a modRana module, already imported modules are reused"""
+        imp.acquire_lock()
+        fp = None
+        try:
+            if importName in sys.modules:
+                return sys.modules[importName]
+            if USING_QRC:
+                # we need to use importlib for importing modules from qrc,
+                # the "old" imp modules seems to be unable to do that
+                import importlib
+                return importlib.import_module(importName)
+            else:
+                fp, pathName, description = imp.find_module(importName, ALL_MODULE_FOLDERS)
+                return imp.load_module(importName, fp, pathName, description)
         finally:
             if fp:
                 fp.close()
+            imp.release_lock()
 
     def _options_loaded(self):
         """This is run after the persistent options dictionary is loaded from storage."""
@@ -491,8 +671,6 @@ class ModRana(object):
     def _modules_loaded_pre_first_time(self):
         """This is run after all the modules have been loaded, but before their first time is called."""
 
-        # and mode change
-        self.watch('mode', self._mode_changed_cb)
         # cache key modifiers
         self.keyModifiers = self.d.get('keyModifiers', {})
         # check if own Quit button is needed
@@ -531,9 +709,12 @@ class ModRana(object):
         self.reportStartupTime()
 
         # check if loading options failed
-        if self.optLoadingOK:
+        if not self.optLoadingOK:
             self.gui.notify("Loading saved options failed", 7000)
 
+        # load the rest of the modules once the GUI is up
+        self._schedule_deferred_module_loading()
+
         # start the mainloop or equivalent
         self.gui.startMainLoop()
 
@@ -568,6 +749,7 @@ class ModRana(object):
         log.info("Shutting-down modules")
         for m in self.m.values():
             m.shutdown()
+        self.events.clear()
         # trigger the shutdown signal
         self.shutdown_signal()
         self._save_options()
@@ -576,24 +758,30 @@ class ModRana(object):
 
     ## OPTIONS SETTING AND WATCHING ##
 
-    def get(self, name, default=None, mode=None):
-        """Get an item of data."""
+    @property
+    def keyModifiers(self):
+        """Per mode options
 
-        # check if the value depends on current mode
-        if name in self.keyModifiers.keys():
-            # get the current mode
-            if mode is None:
-                mode = self.d.get('mode', 'car')
-            if mode in self.keyModifiers[name]['modes'].keys():
-                # get the dictionary with per mode values
-                multiDict = self.d.get('%s#multi' % name, {})
-                # return the value for current mode
-                return multiDict.get(mode, default)
-            else:
-                return self.d.get(name, default)
+        NOTE: this variable is automatically saved by the
+        options module
+        """
+        return self.options_store.key_modifiers
 
-        else:  # just return the normal value
-            return self.d.get(name, default)
+    @keyModifiers.setter
+    def keyModifiers(self, keyModifiers):
+        self.options_store.key_modifiers = keyModifiers
+
+    def _get_key_default(self, key):
+        """Return default value for an options key from the options module (if available)."""
+        options = self.m.get('options', None)
+        if options:
+            return options.getKeyDefault(key, None)
+        else:
+            return None
+
+    def get(self, name, default=None, mode=None):
+        """Get an item of data."""
+        return self.options_store.get(name, default, mode)
 
     def set(self, name, value, save=False, mode=None):
         """Set an item of data in persistent dictionary.
@@ -601,112 +789,50 @@ class ModRana(object):
         If there is a watch set for this key,
         notify the watcher that its value has changed.
         """
+        self.options_store.set(name, value, mode)
+        # changed options are written to storage shortly after being changed,
+        # but for some data we want to make sure they are stored right away and not
+        # lost for example because of power outage/empty battery, etc.
+        if save:
+            self._write_options()
 
-        oldValue = self.get(name, value)
+    def set_many(self, items, save=False, mode=None):
+        """Set multiple items of data in persistent dictionary at once.
 
-        if name in self.keyModifiers.keys():
-            # get the current mode
-            if mode is None:
-                mode = self.d.get('mode', 'car')
-                # check if there is a modifier for the current mode
-            if mode in self.keyModifiers[name]['modes'].keys():
-                # save it to the name + #multi key under the mode key
-                try:
-                    self.d['%s#multi' % name][mode] = value
-                except KeyError:  # key not yet created
-                    self.d['%s#multi' % name] = {mode: value}
-            else:  # just save to the key as usual
-                self.d[name] = value
-        else:  # just save to the key as usual
-            self.d[name] = value
-
-        self._notify_watcher(name, oldValue)
-        # options are normally saved on shutdown,
-        # but for some data we want to make sure they are stored and not
-        # lost for example because of power outage/empty battery, etc.
+        All values are set before any watcher is notified and each
+        watched key is notified only once.
+
+        :param items: a dictionary or an iterable of (key, value) pairs
+        """
+        self.options_store.set_many(items, mode=mode)
         if save:
-            options = self.m.get('options')
-            if options:
-                options.save()
+            self._write_options()
 
     def optionsKeyExists(self, key):
         """Report if a given key exists."""
-        return key in self.d.keys()
+        return self.options_store.has_key(key)
 
     def purgeKey(self, key):
         """Remove a key from the persistent dictionary.
 
         This includes possible key modifiers and alternate values.
         """
-        if key in self.d:
-            oldValue = self.get(key, None)
-            del self.d[key]
-            # purge any key modifiers
-            if key in self.keyModifiers.keys():
-                del self.keyModifiers[key]
-                # also remove the possibly present
-                # alternative states for different modes"""
-                multiKey = "%s#multi" % key
-                if multiKey in self.d:
-                    del self.d[multiKey]
-            self._notify_watcher(key, oldValue)
-            return True
-        else:
-            log.error("can't purge a not-present key: %s", key)
+        return self.options_store.purge_key(key)
 
     def watch(self, key, callback, args=None, runNow=False):
         """Add a callback on an options key.
 
         The callback will get:
 
-        key, newValue, oldValue, *args
+        key, oldValue, newValue, *args
 
-        NOTE: watch ids should be >0, so that they evaluate as True
+        NOTE: watch ids should evaluate as True
         """
-        if not args: args = []
-        nr_id = self.maxWatchId + 1
-        index = "%d_%s" % (nr_id, key)
-        self.maxWatchId = nr_id  # TODO: recycle ids ? (alla PID)
-        if key not in self.watches:
-            self.watches[key] = []  # create the initial list
-        self.watches[key].append((index, callback, args))
-        # should we now run the callback one ?
-        # -> this is useful for modules that configure
-        # themselves according to an options value at startup
-        if runNow:
-            currentValue = self.get(key, None)
-            callback(key, currentValue, currentValue, *args)
-        return index
+        return self.options_store.watch(key, callback, args=args, run_now=runNow)
 
     def removeWatch(self, id):
         """Remove watch specified by the given watch id."""
-        (nr_id, key) = id.split('_')
-        if key in self.watches:
-            remove = lambda x: x[0] == id
-            self.watches[key][:] = [x for x in self.watches[key] if not remove(x)]
-        log.error("can't remove watch - key does not exist, watchId: %s", id)
-
-    def _notify_watcher(self, key, oldValue):
-        """Run callbacks registered on an options key.
-
-        HOW IT WORKS:
-
-        - the watcher is notified before the key is written to the persistent
-          dictionary, so that it can react before the change is visible
-        - the watcher gets the key and both the new and old values
-        """
-        callbacks = self.watches.get(key, None)
-        if callbacks:
-            for item in callbacks:
-                (id, callback, args) = item
-                # rather supply the old value than None
-                newValue = self.get(key, oldValue)
-                if callback:
-                    if callback(key, oldValue, newValue, *args) == False:
-                        # remove watches that return False
-                        self.removeWatch(id)
-                else:
-                    log.error("invalid watcher callback :", callback)
+        return self.options_store.remove_watch(id)
 
     def addKeyModifier(self, key, modifier=None, mode=None, copyInitialValue=True):
         """Add a key modifier.
@@ -714,35 +840,8 @@ class ModRana(object):
         NOTE: currently only used to make value of some keys
               dependent on the current mode
         """
-        options = self.m.get('options', None)
-        # remember the old value, if not se use default from options
-        # if available
-        if options:
-            default_value = options.getKeyDefault(key, None)
-        else:
-            default_value = None
-        oldValue = self.get(key, default_value)
-        if mode is None:
-            mode = self.d.get('mode', 'car')
-        if key not in self.keyModifiers.keys():  # initialize
-            self.keyModifiers[key] = {'modes': {mode: modifier}}
-        else:
-            self.keyModifiers[key]['modes'][mode] = modifier
-
-        # make sure the multi mode dictionary exists
-        multi_key = '%s#multi' % key
-        multi_dict = self.d.get(multi_key, {})
-        self.d[multi_key] = multi_dict
-
-        # if the modifier is set for the first time,
-        # do we copy the value from the normal key or not ?
-        if copyInitialValue:
-            # check if the key is unset for this mode
-            if mode not in multi_dict:
-                # set for first time, copy value
-                self.set(key, self.d.get(key, default_value), mode=mode)
-                # notify watchers
-        self._notify_watcher(key, oldValue)
+        self.options_store.add_key_modifier(key, modifier=modifier, mode=mode,
+                                            copy_initial_value=copyInitialValue)
 
     def removeKeyModifier(self, key, mode=None):
         """Remove key modifier.
@@ -750,51 +849,15 @@ class ModRana(object):
         NOTE: currently this just makes the key independent
               on the current mode
         """
-        # if no mode is provided, use the current one
-        if mode is None:
-            mode = self.d.get('mode', 'car')
-        if key in self.keyModifiers.keys():
-            # just remove the key modifier preserving the alternative values
-            if mode in self.keyModifiers[key]['modes'].keys():
-                # get the previous value
-                options = self.m.get('options', None)
-                # remember the old value, if not se use default from options
-                # if available
-                if options:
-                    defaultValue = options.getKeyDefault(key, None)
-                else:
-                    defaultValue = None
-                oldValue = self.get(key, defaultValue)
-                del self.keyModifiers[key]['modes'][mode]
-                # was this the last key ?
-                if len(self.keyModifiers[key]['modes']) == 0:
-                    # no modes registered - unregister from modifiers
-                    # TODO: handle non-mode modifiers in the future
-                    del self.keyModifiers[key]
-                    # notify watchers
-                self._notify_watcher(key, oldValue)
-                # done
-                return True
-            else:
-                log.error("can't remove modifier that is not present")
-                log.error("key: %s, mode: %s", key, mode)
-                return False
-        else:
-            log.error("key %s has no modifier and thus cannot be removed", key)
-            return False
+        return self.options_store.remove_key_modifier(key, mode=mode)
 
     def hasKeyModifier(self, key):
         """Report if a key has a key modifier."""
-        return key in self.keyModifiers.keys()
+        return self.options_store.has_key_modifier(key)
 
     def hasKeyModifierInMode(self, key, mode=None):
         """Report if a key has a key modifier."""
-        if mode is None:
-            mode = self.d.get('mode', 'car')
-        if key in self.keyModifiers.keys():
-            return mode in self.keyModifiers[key]['modes'].keys()
-        else:
-            return False
+        return self.options_store.has_key_modifier_in_mode(key, mode)
 
     def notify(self, message, msTimeout=0, icon=""):
         """Try to show a notification message to the user."""
@@ -838,32 +901,6 @@ class ModRana(object):
             log.error('mode %s does not exist and thus has no label' % modeName)
             return None
 
-    def _mode_changed_cb(self, key=None, oldMode=None, newMode=None):
-        """Handle mode change in regards to key modifiers and option key watchers."""
-
-        # get keys that have both a key modifier and a watcher
-        keys = filter(lambda x: x in self.keyModifiers.keys(), self.watches.keys())
-        # filter out only those keys that have a modifier for the new mode
-        # or had a modifier in the previous mode
-        # otherwise their value would not change and thus
-        # triggering a watch is not necessary
-        keys = filter(
-            lambda x: newMode in self.keyModifiers[x]['modes'].keys() or oldMode in self.keyModifiers[x][
-                'modes'].keys(),
-            keys)
-        for key in keys:
-            # try to get some value if the old value is not available
-            options = self.m.get('options', None)
-            # remember the old value, if not se use default from options
-            # if available
-            if options:
-                defaultValue = options.getKeyDefault(key, None)
-            else:
-                defaultValue = None
-            oldValue = self.get(key, defaultValue)
-            # notify watchers
-            self._notify_watcher(key, oldValue)
-
     def _remove_non_persistent_options(self, inputDict):
         """Keys that begin with # are not saved.
 
@@ -878,47 +915,91 @@ class ModRana(object):
             log.exception('options: error while filtering options\nsome nonpersistent keys might have been left in\nNOTE: keys should be strings of length>=1')
             return self.d
 
+    def _options_changed_cb(self):
+        """Called by the options store when options change while no write is pending."""
+        if self.options_journal is not None:
+            self._schedule_options_write()
+
+    def _schedule_options_write(self):
+        """Write changed options once OPTIONS_WRITE_DELAY elapses.
+
+        All options changed in the meantime are written together.
+        """
+        with self._options_write_lock:
+            if self._options_write_timer is None:
+                timer = threading.Timer(OPTIONS_WRITE_DELAY, self._write_options)
+                timer.daemon = True
+                self._options_write_timer = timer
+                timer.start()
+
+    def _write_options(self, compact=False):
+        """Append changed options to the options journal.
+
+        The journal is compacted into a new options snapshot if it grows
+        too big or if compact is True.
+        """
+        with self._options_write_lock:
+            if self._options_write_timer is not None:
+                self._options_write_timer.cancel()
+                self._options_write_timer = None
+            journal = self.options_journal
+            if journal is None:
+                return
+            keys = self.options_store.take_changed_keys()
+            try:
+                changes = {}
+                for key in keys:
+                    # keys that begin with # are not saved
+                    if key[0] == '#':
+                        continue
+                    if key == KEY_MODIFIERS_KEY:
+                        self.d[KEY_MODIFIERS_KEY] = self.keyModifiers
+                    changes[key] = self.d.get(key, DELETED)
+                # only volatile keys changed - no need to wait for the disk
+                sync = compact or not VOLATILE_OPTIONS_KEYS.issuperset(changes)
+                journal.append(changes, sync=sync)
+            except Exception:
+                log.exception("saving options failed")
+                # keep the keys, so that the next write saves them
+                self.options_store.restore_changed_keys(keys)
+            try:
+                if compact or journal.needs_compaction:
+                    log.debug("compacting options journal")
+                    self.d[KEY_MODIFIERS_KEY] = self.keyModifiers
+                    # the options might be changed from another thread
+                    # while being saved, so work on a copy
+                    journal.compact(self._remove_non_persistent_options(dict(self.d)))
+            except Exception:
+                log.exception("saving options failed")
+
     def _save_options(self):
-        """Save the persistent dictionary to file."""
+        """Save all changed options and compact the options journal."""
         log.info("saving options")
-        try:
-            f = open(self.paths.options_file_path, "wb")
-            # remove keys marked as nonpersistent
-            self.d['keyModifiers'] = self.keyModifiers
-            d = self._remove_non_persistent_options(self.d)
-            marshal.dump(d, f, 2)
-            f.close()
-            log.info("options successfully saved")
-        except IOError:
-            log.exception("can't save options")
-        except Exception:
-            log.exception("saving options failed")
+        self._write_options(compact=True)
+        log.info("options saved")
 
     def _load_options(self):
-        """Load the persistent dictionary from file."""
+        """Load the persistent dictionary from storage."""
         log.info("loading options")
+        journal = OptionsJournal(self.paths.options_file_path)
+        # damaged options files are moved aside, so that options
+        # are saved to fresh files even if loading failed
+        newData, success = journal.load_or_reset()
         try:
-            f = open(self.paths.options_file_path, "rb")
-            newData = marshal.load(f)
-            f.close()
             purgeKeys = ["fix"]
             for key in purgeKeys:
                 if key in newData:
                     del newData[key]
-            for k, v in newData.items():
-                self.set(k, v)
-            success = True
-            #print("Options content")
-            #for key, value in newData.iteritems():
-            #    print(key, value)
-
-
+            # bulk load, no watchers need to be notified at this stage
+            self.options_store.load(newData)
         except Exception:
             log.exception("exception while loading saved options")
-            # TODO: a yes/no dialog for clearing (renaming with timestamp :) the corrupted options file (options.bin)
             success = False
+        self.options_journal = journal
 
         self.overrideOptions()
+        # write any options changed before or during loading
+        self._schedule_options_write()
         return success
 
     def overrideOptions(self):
@@ -929,8 +1010,8 @@ class ModRana(object):
 
         TODO: move projection out for peristent dictionary.
         """
-        self.set('centred', True)  # set centering to True at start to get setView to run
-        self.set('editBatchMenuActive', False)
+        self.set_many((('centred', True),  # set centering to True at start to get setView to run
+                       ('editBatchMenuActive', False)))
 
     ## PROFILE PATH ##
 
@@ -988,9 +1069,82 @@ class ModRana(object):
                 log.info("* %s (%1.0f ms), %1.0f/%1.0f ms", message, timeSpent, timeSinceStart, total_time)
                 last_time = t
             log.info("** whole startup: %1.0f ms **" % total_time)
+            if self.args.debug_startup:
+                self._report_module_timing()
+                self._record_startup_benchmark(total_time)
         else:
             log.info("* timing list empty *")
 
+    def _report_module_timing(self):
+        """Report how long it took to import and initialize individual modules."""
+        log.info("** module loading timing (import/firstTime) **")
+        timing = sorted(self.module_timing.items(), key=lambda item: item[1][0] + item[1][1], reverse=True)
+        for name, (import_time, first_time, eagerness) in timing:
+            log.info("* %s (%s): %1.1f/%1.1f ms", name, eagerness, import_time, first_time)
+        not_loaded = sorted(self.m.not_loaded())
+        if not_loaded:
+            log.info("* not loaded yet: %s", ", ".join(not_loaded))
+
+    def _is_cold_start(self):
+        """Report if this was a cold start.
+
+        Startup is considered to be cold if bytecode of any of the loaded modules
+        was missing or had to be regenerated, which also means the module sources
+        were most likely not in the OS file cache.
+        """
+        for module in self.m.values():
+            python_module = sys.modules.get(type(module).__module__)
+            source_path = getattr(python_module, "__file__", None)
+            if not source_path:
+                continue
+            if source_path.endswith((".pyc", ".pyo")):
+                source_path = source_path[:-1]
+            if PYTHON3:
+                import importlib.util
+                bytecode_path = importlib.util.cache_from_source(source_path)
+            else:
+                bytecode_path = source_path + "c"
+            try:
+                if os.path.getmtime(bytecode_path) >= startTimestamp:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _record_startup_benchmark(self, total_time):
+        """Record startup time and report cold/warm startup statistics.
+
+        Startup times of the last STARTUP_BENCHMARK_RUNS runs with --debug-startup
+        are stored in the profile folder, so that startup time can be compared
+        reproducibly by running modRana with --debug-startup a couple of times.
+        """
+        kind = "cold" if self._is_cold_start() else "warm"
+        benchmark_path = os.path.join(self.paths.profile_path, STARTUP_BENCHMARK_FILENAME)
+        runs = []
+        try:
+            if os.path.exists(benchmark_path):
+                with open(benchmark_path, "r") as f:
+                    runs = json.load(f)
+        except Exception:
+            log.exception("loading startup benchmark results failed")
+        runs.append({"kind": kind,
+                     "total": total_time,
+                     "version": paths.VERSION_STRING,
+                     "eager_modules": len(self.module_timing)})
+        runs = runs[-STARTUP_BENCHMARK_RUNS:]
+        try:
+            with open(benchmark_path, "w") as f:
+                json.dump(runs, f)
+        except Exception:
+            log.exception("saving startup benchmark results failed")
+
+        log.info("** startup benchmark: this was a %s start **", kind)
+        for run_kind in ("cold", "warm"):
+            times = sorted(run["total"] for run in runs if run["kind"] == run_kind)
+            if times:
+                log.info("* %s: %d runs, median %1.0f ms, min %1.0f ms, max %1.0f ms",
+                         run_kind, len(times), times[len(times) // 2], times[0], times[-1])
+
 modrana = None
 dmod = None
 gui = None
@@ -28,7 +28,7 @@ class RanaModule(object):
         self.m = self.modrana.m
         self.status = ''
         # and also bind the get set and watch methods to the "kernel" :D
-        self.get = self.modrana.get
+        self.get = self.modrana.options_store.get
         self.set = self.modrana.set
         self.optionsKeyExists = self.modrana.optionsKeyExists
         self.watch = self.modrana.watch
@@ -84,6 +84,17 @@ class RanaModule(object):
         """Draw overlay that's on top of all maps"""
         pass
 
+    def invalidateLayers(self, *layers):
+        """Request a redraw of the given drawing layers (constants.DRAW_LAYER_*)
+
+        Unlike setting needRedraw, which redraws all layers, the GUI can redraw
+        only the layers the module draws to, all layers are redrawn if none are given.
+        """
+        if self.modrana.gui:
+            self.modrana.gui.invalidateLayers(*layers)
+        else:
+            self.set('needRedraw', True)
+
     def handleMessage(self, message, messageType, args):
         """Handles a message from another module, or in response to user action"""
         pass
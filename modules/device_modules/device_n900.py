@@ -28,6 +28,7 @@ import logging
 import dbus.glib
 
 from core import gs, constants
+from core.fix import FixEvent
 import hildon
 import location
 import conic # provide by python-conic on Maemo 5
@@ -568,7 +569,15 @@ class DeviceN900(DeviceModule):
                     self.log.debug("#############################")
                     # always set this key to current epoch once the location is updated
                 # so that modules can watch it and react
-                self.set('locationUpdated', time.time())
+                updateTime = time.time()
+                self.set('locationUpdated', updateTime)
+                pos = self.get('pos', None)
+                if pos:
+                    # deliver the fix to rate limited subscribers
+                    event = FixEvent(pos[0], pos[1], self.get('elevation', None),
+                                     self.get('bearing', None), self.get('metersPerSecSpeed', None),
+                                     fix[0], updateTime)
+                    self.modrana.events.publish(constants.EVENT_FIX, event)
                 #        self.log.debug("updating location")
                 self.set('needRedraw', True)
 
@@ -149,6 +149,21 @@ class GUIModule(RanaModule):
         """
         pass
 
+    def invalidateLayers(self, *layers):
+        """
+        request redraw of the given drawing layers,
+        GUIs without cached drawing layers just redraw everything
+        """
+        self.set('needRedraw', True)
+
+    def setRedrawOnPan(self, layer, redraw):
+        """
+        set if a drawing layer needs to be redrawn when the map is panned,
+        eq. because something is drawn to it relative to the screen edges,
+        only meaningful for GUIs with cached drawing layers
+        """
+        pass
+
     def startMainLoop(self):
         """start the main loop or its equivalent"""
         pass
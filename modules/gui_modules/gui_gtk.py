@@ -32,8 +32,11 @@ pygtk.require('2.0')
 import gobject
 import gtk
 from gtk import gdk
+import cairo
 
+from core import constants
 from modules.gui_modules.base_gui_module import GUIModule
+from modules.gui_modules.layer_compositor import LayerCompositor
 
 CLICK_DRAG_THRESHOLD = 1024
 # Adjust this to the length^2 of a
@@ -269,6 +272,18 @@ class GTKGUI(GUIModule):
     def getShowRedrawTime(self):
         return self.mw.showRedrawTime
 
+    def invalidateLayers(self, *layers):
+        self.mw.invalidateLayers(*layers)
+
+    def setRedrawOnPan(self, layer, redraw):
+        self.mw.compositor.set_redraw_on_pan(layer, redraw)
+
+    def getLayerStats(self):
+        """
+        return per layer frame timing statistics
+        """
+        return self.mw.compositor.stats
+
     def getGTKTopWindow(self):
         return self.mw.topWindow
 
@@ -386,6 +401,8 @@ class MainWidget(gtk.Widget):
         self.topWindow = None
 
         self.redraw = True
+        # a redraw has been requested but the window has not been drawn yet
+        self._redrawPending = False
 
         self.showRedrawTime = False
 
@@ -409,6 +426,9 @@ class MainWidget(gtk.Widget):
         # projection module cache
         self.proj = None
 
+        # cached drawing layers
+        self.compositor = LayerCompositor(self._createLayerSurface, self._createLayerContext)
+
     def firstTime(self):
         """called at the same time as the modules firstTime"""
         self.proj = self.modrana.getModule('projection', None)
@@ -438,22 +458,37 @@ class MainWidget(gtk.Widget):
     def _checkForRedrawCB(self, key, oldValue, newValue):
         """react to redraw requests"""
         if newValue == True:
+            # we don't know what changed, so redraw all layers
+            self.compositor.invalidate()
             self.forceRedraw()
 
+    def invalidateLayers(self, *layers):
+        """redraw only the given layers (all if none given)"""
+        self.compositor.invalidate(*layers)
+        self.forceRedraw()
+
     def forceRedraw(self):
         """Make the window trigger a draw event.
+           Requests made before the window is drawn are merged,
+           so the window is drawn at most once per frame.
            TODO: consider replacing this if porting pyroute to another platform"""
+        # record timestamp
+        self.lastFullRedrawRequest = time.time()
+
+        if self._redrawPending:
+            # the invalidated layers are drawn by the pending redraw
+            return
+
         self.set('needRedraw', False)
         # alter directly, no need to notificate
         # about returning the key to the default state
 
-        # record timestamp
-        self.lastFullRedrawRequest = time.time()
-
         if self.redraw:
             try:
+                self._redrawPending = True
                 self.window.invalidate_rect((0, 0, self.rect.width, self.rect.height), False)
             except Exception:
+                self._redrawPending = False
                 self.log.exception("error in screen invalidating function")
 
     def pressed(self, w, event):
@@ -612,30 +647,24 @@ class MainWidget(gtk.Widget):
 
     def fullDrawMethod(self, cr, event):
         """this is the default drawing method
-        draws all layers and should be used together with full screen redraw"""
+        draws all layers and should be used together with full screen redraw
 
-        # get all modules
-        modules = self.modrana.getModules().values()
+        map, map overlay and screen overlay layers are cached by the compositor
+        and only redrawn when invalidated or when the map view changes"""
 
         menuName = self.modrana.get('menu', None)
         if menuName: # draw the menu
+            # the menu covers all layers, so they will need to be redrawn
+            self.compositor.invalidate()
             menus = self.modrana.getModule('menu', None)
             if menus:
                 menus.mainDrawMenu(cr, menuName)
             else:
                 self.log.error("error, menu module missing")
         else: # draw the map
-            cr.set_source_rgb(0.2, 0.2, 0.2) # map background
-            cr.rectangle(0, 0, self.rect.width, self.rect.height)
-            cr.fill()
-            if self.modrana.get("centred", False) and self.modrana.get("rotateMap", False):
-                proj = self.proj
-                (lat, lon) = (proj.lat, proj.lon)
-                (x1, y1) = proj.ll2xy(lat, lon)
-
-                (x, y) = self.modrana.gui.centerShift
-                cr.translate(x, y)
-                cr.save()
+            proj = self.proj
+            rotating = self.modrana.get("centred", False) and self.modrana.get("rotateMap", False)
+            if rotating:
                 # get the speed and angle
                 speed = self.modrana.get('speed', 0)
                 angle = self.modrana.get('bearing', 0)
@@ -646,36 +675,55 @@ class MainWidget(gtk.Widget):
                 if angle and speed:
                     if speed > self.notMovingSpeed: # do we look like we are moving ?
                         self.modrana.mapRotationAngle = angle
-                cr.translate(x1, y1) # translate to the rotation center
-                cr.rotate(radians(360 - self.modrana.mapRotationAngle)) # do the rotation
-                cr.translate(-x1, -y1) # translate back
-
-                # Draw the base map, the map overlays, and the screen overlays
-                try:
-                    for m in modules:
-                        m.drawMap(cr)
-                    for m in modules:
-                        m.drawMapOverlay(cr)
-                except Exception:
-                    self.log.exception("modRana GTK main loop: an exception occurred")
-                cr.restore()
-                cr.translate(-x, -y)
-                for m in modules:
-                    m.drawScreenOverlay(cr)
-            else: # centering is disabled, just draw the map
-                try:
-                    for m in modules:
-                        m.drawMap(cr)
-                    for m in modules:
-                        m.drawMapOverlay(cr)
-                except Exception:
-                    self.log.exception("modRana GTK main loop: an exception occurred")
-                for m in modules:
-                    m.drawScreenOverlay(cr)
+                viewKey = (proj.zoom, proj.scale, self.modrana.mapRotationAngle, self.modrana.gui.centerShift)
+                # rotated layers can't be just translated
+                origin = None
+            else:
+                viewKey = (proj.zoom, proj.scale)
+                origin = (proj.px1 * proj.scale, proj.py1 * proj.scale)
+            self.compositor.compose(cr, self.rect.width, self.rect.height, viewKey, origin,
+                                    self._drawLayer, log_frames=self.showRedrawTime)
 
         # do the master overlay over everything
         self.drawMasterOverlay(cr)
 
+    def _createLayerSurface(self, w, h):
+        return cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+
+    def _createLayerContext(self, surface):
+        # the GDK context is needed for pixbuf drawing
+        return gtk.gdk.CairoContext(cairo.Context(surface))
+
+    def _drawLayer(self, layer, cr):
+        """draw a single layer to a layer surface"""
+        modules = self.modrana.getModules().values()
+        if layer == constants.DRAW_LAYER_SCREEN_OVERLAY:
+            for m in modules:
+                m.drawScreenOverlay(cr)
+            return
+        if layer == constants.DRAW_LAYER_MAP:
+            cr.set_source_rgb(0.2, 0.2, 0.2) # map background
+            cr.rectangle(0, 0, self.rect.width, self.rect.height)
+            cr.fill()
+        if self.modrana.get("centred", False) and self.modrana.get("rotateMap", False):
+            proj = self.proj
+            (x1, y1) = proj.ll2xy(proj.lat, proj.lon)
+            (x, y) = self.modrana.gui.centerShift
+            cr.translate(x, y)
+            cr.translate(x1, y1) # translate to the rotation center
+            cr.rotate(radians(360 - self.modrana.mapRotationAngle)) # do the rotation
+            cr.translate(-x1, -y1) # translate back
+        # Draw the base map or the map overlays
+        try:
+            if layer == constants.DRAW_LAYER_MAP:
+                for m in modules:
+                    m.drawMap(cr)
+            else:
+                for m in modules:
+                    m.drawMapOverlay(cr)
+        except Exception:
+            self.log.exception("modRana GTK main loop: an exception occurred")
+
     ## FASTER MAP DRAGGING ##
 
     def enableDefaultDrag(self):
@@ -833,6 +881,8 @@ class MainWidget(gtk.Widget):
 
     def do_expose_event(self, event):
         """handle screen redraw"""
+        # redraw requests made from now on need a new frame
+        self._redrawPending = False
         cr = self.window.cairo_create()
         return self._expose_cairo(event, cr)
 
@@ -44,6 +44,8 @@ from core import modrana_log
 from core import utils
 from core import paths
 from core import point
+from core import tile_batching
+from core.fix import FixEvent
 
 import logging
 no_prefix_log = logging.getLogger()
@@ -117,11 +119,15 @@ class QMLGUI(GUIModule):
 
         # NOTE: what about multi-display devices ? :)
 
+        # tile id string -> lzxy tuple cache
+        self._tileIds = tile_batching.TileIdCache(self._getLayerById)
+
         ## add image providers
 
         self._imageProviders = {
             "icon" : IconImageProvider(self),
             "tile" : TileImageProvider(self),
+            "tile_fallback" : TileFallbackImageProvider(self),
         }
 
         # log what version of PyOtherSide we are using
@@ -261,31 +267,27 @@ class QMLGUI(GUIModule):
         lat, lon = float(posDict["latitude"]), float(posDict["longitude"])
         elevation = float(posDict["elevation"])
         metersPerSecSpeed = float(posDict["speedMPS"])  # m/s
+        # check if elevation & speed are valid
+        if math.isnan(elevation):
+            elevation = None
+        if math.isnan(metersPerSecSpeed):
+            metersPerSecSpeed = None
         # report that we have 3D fix
         # (looks like we can't currently reliably discern between 2D
         # and 3D fix on the Jolla, might be good to check what other
         # Sailfish OS running devices report)
-        self.set("fix", 3)
-
-        self.set("pos", (lat, lon))
-
-        # check if elevation is valid
-        if not math.isnan(elevation):
-            self.set("elevation", elevation)
-        else:
-            self.set("elevation", None)
-
-        # check if speed is valid
-        if not math.isnan(metersPerSecSpeed):
-            self.set("speed", metersPerSecSpeed*3.6)
-            self.set("metersPerSecSpeed", metersPerSecSpeed)
-        else:
-            self.set("speed", None)
-            self.set("metersPerSecSpeed", None)
-
+        event = FixEvent(lat, lon, elevation, None, metersPerSecSpeed, 3, time.time())
+        # set all keys at once so that watchers are notified only once
+        self.modrana.set_many((
+            ("fix", event.fix_class),
+            ("pos", event.position),
+            ("elevation", event.altitude),
+            ("speed", event.kmh_speed),
+            ("metersPerSecSpeed", event.speed),
+            ('locationUpdated', event.time)
+        ))
         # update done
-        self.set('locationUpdated', time.time())
-        # TODO: move part of this to the location module ?
+        self.modules.location.publishFix(event)
 
     def _pythonPositionUpdateCB(self, fix):
         self._pythonPositioning = True
@@ -336,6 +338,9 @@ class QMLGUI(GUIModule):
         except Exception:  # catch and report the rest
             self.log.exception("image loading failed, imageId: %s", originalImageId)
 
+    def _getLayerById(self, layerId):
+        return self.modules.mapLayers.getLayerById(layerId)
+
     def _tileId2lzxy(self, tileId):
         """Convert tile id string to the "standard" lzxy tuple
 
@@ -344,27 +349,27 @@ class QMLGUI(GUIModule):
         :returns: lzxy tuple
         :rtype: tuple
         """
-        split = tileId.split("/")
-        # pinchMapId = split[0]
-        layerId = split[1]
-        z = int(split[2])
-        x = int(split[3])
-        y = int(split[4])
-        # TODO: local id:layer cache ?
-        layer = self.modules.mapLayers.getLayerById(layerId)
-        return layer, z, x, y
-
-    def areTilesAvailable(self, tile_ids):
-        """Report if tiles are available & request download for those that are not.
-
-        :param list tile_ids: list of tile ids to check
-        :return: a distionary of tile states, True = available, False = will be downloaded
-        :rtype: dict
+        return self._tileIds.get(tileId)
+
+    def getTileRangesAvailability(self, requests):
+        """Report tile availability for tile range requests & request
+        download for tiles that are not available
+
+        See core.tile_batching for a description of the request & reply format.
+
+        :param list requests: list of tile range requests
+        :return: a tile availability string for each request
+        :rtype: list
         """
-        available_tiles = {}
-        for tile_id in tile_ids:
-            available_tiles[tile_id] = self.isTileAvailable(tile_id)
-        return available_tiles
+        replies = []
+        for request in requests:
+            layer = self._getLayerById(request[1])
+
+            def checkTile(z, x, y, tileId):
+                return self._isLzxyAvailable((layer, z, x, y), tileId)
+
+            replies.append(tile_batching.answer_range_request(request, checkTile))
+        return replies
 
     def isTileAvailable(self, tileId):
         """Check if tile is available and add download request if not.
@@ -376,7 +381,9 @@ class QMLGUI(GUIModule):
         :return: True if the tile is locally available, False if not
         :rtype: bool
         """
-        lzxy = self._tileId2lzxy(tileId)
+        return self._isLzxyAvailable(self._tileId2lzxy(tileId), tileId)
+
+    def _isLzxyAvailable(self, lzxy, tileId):
         if self.modules.mapTiles.tileInStorage(lzxy):
             return True
         else:
@@ -703,6 +710,9 @@ class TileImageProvider(ImageProvider):
 
         self.gui.firstTimeSignal.connect(self._firstTimeCB)
         self._tileNotFoundImage = bytearray([0, 255, 255, 255])
+        # tile download notifications are sent to QML in batches,
+        # at most once per frame for each map instance
+        self._notificationBatcher = tile_batching.NotificationBatcher(self._sendTileNotifications)
 
     def _firstTimeCB(self):
         # connect to the tile downloaded callback so that we can notify
@@ -715,10 +725,13 @@ class TileImageProvider(ImageProvider):
     def _tileDownloadedCB(self, error, lzxy, tag):
         """Notify the QML context that a tile has been downloaded"""
         pinchMapId = tag.split("/")[0]
-        #log.debug("SENDING: %s %s" % ("tileDownloaded:%s" % pinchMapId, tag))
         resoundingSuccess = error == constants.TILE_DOWNLOAD_SUCCESS
         fatalError = error == constants.TILE_DOWNLOAD_ERROR
-        pyotherside.send("tileDownloaded:%s" % pinchMapId, tag, resoundingSuccess, fatalError)
+        self._notificationBatcher.add(pinchMapId, [tag, resoundingSuccess, fatalError])
+
+    def _sendTileNotifications(self, pinchMapId, notifications):
+        #log.debug("SENDING: %s %d" % ("tilesDownloaded:%s" % pinchMapId, len(notifications)))
+        pyotherside.send("tilesDownloaded:%s" % pinchMapId, notifications)
 
     def getImage(self, imageId, requestedSize):
         """
@@ -728,23 +741,11 @@ class TileImageProvider(ImageProvider):
         #log.debug("TILE REQUESTED %s" % imageId)
         #log.debug(requestedSize)
         try:
-            # split the string provided by QML
-            split = imageId.split("/")
-            pinchMapId = split[0]
-            layerId = split[1]
-            z = int(split[2])
-            x = int(split[3])
-            y = int(split[4])
-
-            # TODO: local id:layer cache ?
-            layer = self.gui.modules.mapLayers.getLayerById(layerId)
-
-            # construct the tag
-            #tag = (pinchMapId, layerId, z, x, y)
-            #tag = (pinchMapId, layerId, z, x, y)
+            # parse the string provided by QML
+            lzxy = self.gui._tileId2lzxy(imageId)
 
             # get the tile from the tile module
-            tileData = self.gui.modules.mapTiles.getTile((layer, z, x, y),
+            tileData = self.gui.modules.mapTiles.getTile(lzxy,
                                                          asynchronous=True, tag=imageId,
                                                          download=False)
             imageSize = (256,256)
@@ -768,6 +769,33 @@ class TileImageProvider(ImageProvider):
             log.error(requestedSize)
             log.exception("tile image provider exception")
 
+class TileFallbackImageProvider(ImageProvider):
+    """
+    the TileFallbackImageProvider class provides images made from locally available
+    tiles from neighbouring zoom levels, that are shown while a tile is being downloaded
+    """
+
+    def __init__(self, gui):
+        ImageProvider.__init__(self, gui)
+        # a transparent 1x1 image
+        self._noFallbackImage = bytearray([0, 0, 0, 0])
+
+    def getImage(self, imageId, requestedSize):
+        """
+        the tile info should look like this:
+        pinchMapId/layerID/zl/x/y
+        """
+        try:
+            lzxy = self.gui._tileId2lzxy(imageId)
+            fallbackData = self.gui.modules.mapTiles.getFallbackTileData(lzxy)
+            if fallbackData is None:
+                return self._noFallbackImage, (1,1), pyotherside.format_argb32
+            return bytearray(fallbackData), (256,256), pyotherside.format_data
+        except Exception:
+            log.error("tile fallback image provider: loading fallback tile failed")
+            log.error(imageId)
+            log.exception("tile fallback image provider exception")
+
 class MapTiles(object):
     def __init__(self, gui):
         self.gui = gui
@@ -158,9 +158,11 @@ Rectangle {
         repeat: false
         property bool paused : false
         onTriggered : {
-            var requestBatch = pinchmap.tileRequests.slice()
+            var rangeRequests = pinchmap.makeTileRangeRequests(pinchmap.tileRequests)
             pinchmap.tileRequests = []
-            rWin.python.call("modrana.gui.areTilesAvailable", [requestBatch], tilesAvailabilityCB)
+            rWin.python.call("modrana.gui.getTileRangesAvailability", [rangeRequests], function(replies) {
+                pinchmap.tileRangesAvailabilityCB(rangeRequests, replies)
+            })
             running = false
         }
     }
@@ -247,7 +249,7 @@ Rectangle {
     //   handlers it should not slow down Python -> QML message
     //   handling
     Component.onCompleted: {
-        rWin.python.setHandler("tileDownloaded:" + pinchmap.name, pinchmap.tileDownloadedCB)
+        rWin.python.setHandler("tilesDownloaded:" + pinchmap.name, pinchmap.tilesDownloadedCB)
         // instantiate the nested backing data model for tiles
         updateTilesModel()
     }
@@ -336,21 +338,79 @@ Rectangle {
         }
     }
 
-    function tilesAvailabilityCB(tileAvailabilityDict) {
-        for (var tileId in tileAvailabilityDict) {
-            var tileAvailable = tileAvailabilityDict[tileId]
-            var tile = pinchmap.currentTiles[tileId]
-            if (tile) {
-                tile.available = tileAvailable
+    function makeTileRangeRequests(tileIds) {
+        // Group tile ids to a request for each layer & zoom level
+        // describing the range of the requested tiles & which tiles
+        // in the range are requested, see core/tile_batching.py
+        // for the request format.
+        var groups = {}
+        for (var i=0; i<tileIds.length; i++) {
+            var split = tileIds[i].split("/")
+            var key = split[1] + "/" + split[2]
+            var x = parseInt(split[3])
+            var y = parseInt(split[4])
+            var group = groups[key]
+            if (!group) {
+                group = {layerId : split[1], z : parseInt(split[2]), tiles : [],
+                         minX : x, minY : y, maxX : x, maxY : y}
+                groups[key] = group
+            }
+            group.tiles.push([x, y])
+            group.minX = Math.min(group.minX, x)
+            group.minY = Math.min(group.minY, y)
+            group.maxX = Math.max(group.maxX, x)
+            group.maxY = Math.max(group.maxY, y)
+        }
+        var requests = []
+        for (var groupKey in groups) {
+            var g = groups[groupKey]
+            var width = g.maxX - g.minX + 1
+            var height = g.maxY - g.minY + 1
+            var indexes = []
+            for (var j=0; j<g.tiles.length; j++) {
+                indexes.push((g.tiles[j][1] - g.minY) * width + g.tiles[j][0] - g.minX)
+            }
+            requests.push([pinchmap.name, g.layerId, g.z, g.minX, g.minY, width, height, indexes])
+        }
+        return requests
+    }
+
+    function tileRangesAvailabilityCB(requests, replies) {
+        // replies contain a character for each tile in the requested range:
+        // "1" - available, "0" - not available (download requested), "-" - not requested
+        for (var i=0; i<requests.length; i++) {
+            var request = requests[i]
+            var reply = replies[i]
+            var prefix = request[0] + "/" + request[1] + "/" + request[2] + "/"
+            var width = request[5]
+            for (var index=0; index<reply.length; index++) {
+                var state = reply[index]
+                if (state == "-") {
+                    continue
+                }
+                var tileId = prefix + (request[3] + index % width) + "/" + (request[4] + Math.floor(index / width))
+                var tile = pinchmap.currentTiles[tileId]
+                if (tile) {
+                    var tileAvailable = state == "1"
+                    tile.available = tileAvailable
+                    if (!tileAvailable) {
+                        // show lower or higher detail tiles that are already
+                        // locally available until the tile is downloaded
+                        tile.fallbackSource = pinchmap.fallbackTileUrl(tileId)
+                    }
+                }
             }
         }
     }
 
-    function tileDownloadedCB(tileId, resoundingSuccess, fatalError) {
-        // notify tile delegates waiting for tile data to be available
-        var tile = pinchmap.currentTiles[tileId]
-        if (tile) {
-            tile.tileDownloaded([resoundingSuccess, fatalError])
+    function tilesDownloadedCB(notifications) {
+        // notify tile delegates waiting for tile data to be available,
+        // each notification is a [tileId, resoundingSuccess, fatalError] list
+        for (var i=0; i<notifications.length; i++) {
+            var tile = pinchmap.currentTiles[notifications[i][0]]
+            if (tile) {
+                tile.tileDownloaded([notifications[i][1], notifications[i][2]])
+            }
         }
     }
 
@@ -744,6 +804,10 @@ Rectangle {
         return "image://python/tile/" + tileId
     }
 
+    function fallbackTileUrl(tileId) {
+        return "image://python/tile_fallback/" + tileId
+    }
+
     function isTileAvailable(tileId, callback) {
         // check if the tile is available from local storage
         // TODO: make this Python independent
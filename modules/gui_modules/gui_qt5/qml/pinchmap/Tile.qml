@@ -8,6 +8,7 @@ Item {
     property int tileSize : 256
     property real tileOpacity : 1.0
     property alias source : img.source
+    property alias fallbackSource : fallbackImg.source
     property var tileXY : ""
     property string tileId : mapInstance.name+"/"+tile.mapLayerId+"/"+pinchmap.zoomLevel+"/"+tileXY
     property string oldTileId : ""
@@ -49,6 +50,7 @@ Item {
         tile.downloading = false
         tile.available = false
         tile.source = ""
+        tile.fallbackSource = ""
     }
 
     function tileDownloaded(result) {
@@ -105,6 +107,16 @@ Item {
         mapInstance.isTileAvailable(tile.tileId)
     }
 
+    Image {
+        id: fallbackImg
+        width: tile.tileSize
+        height: tile.tileSize
+        // only shown until the actual tile is loaded
+        visible : img.status != Image.Ready
+        opacity: tile.tileOpacity
+        asynchronous : true
+    }
+
     Image {
         id: img
         width: tile.tileSize
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#----------------------------------------------------------------------------
+# Retained mode drawing layer compositor for the GTK GUI
+#----------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------
+"""Retained mode drawing layer compositor
+
+Each drawing layer (base map, map overlay, screen overlay) is drawn into
+its own cached surface and the surfaces are then painted on screen.
+A layer is only redrawn if it has been invalidated or the view changed.
+
+When the map is just panned by a whole number of pixels, geographic layers
+are not redrawn - the cached surface is translated instead and only the newly
+exposed strips along the screen edges are drawn. Layers with content anchored
+to the screen edges (such as map grid labels) can be marked to be redrawn
+on pan instead.
+
+The compositor does not depend on cairo directly, surfaces and drawing
+contexts are created by the callables provided by the GUI.
+"""
+import time
+
+from core import constants
+
+import logging
+log = logging.getLogger("mod.gui.compositor")
+
+# layers drawn in map coordinates
+GEOGRAPHIC_LAYERS = (constants.DRAW_LAYER_MAP, constants.DRAW_LAYER_MAP_OVERLAY)
+
+# layer update actions
+REUSE = "reuse"
+TRANSLATE = "translate"
+REDRAW = "redraw"
+
+# maximum distance from a whole pixel for a map shift to be considered whole pixel
+SHIFT_TOLERANCE = 0.01
+
+# cairo.OPERATOR_CLEAR, so that cairo does not need to be imported here
+OPERATOR_CLEAR = 0
+
+# log per layer timing statistics summary every this many frames
+STATS_LOG_INTERVAL = 100
+
+
+def get_shift(old_origin, new_origin, width, height):
+    """Return the whole pixel shift between two map view origins
+
+    :param tuple old_origin: (x, y) of the cached view top left corner in global pixels
+    :param tuple new_origin: (x, y) of the new view top left corner in global pixels
+    :param int width: view width
+    :param int height: view height
+    :returns: (dx, dy) shift or None if the views can't be translated into each other
+    :rtype: tuple or None
+    """
+    if old_origin is None or new_origin is None:
+        return None
+    dx = new_origin[0] - old_origin[0]
+    dy = new_origin[1] - old_origin[1]
+    rdx = int(round(dx))
+    rdy = int(round(dy))
+    if abs(dx - rdx) > SHIFT_TOLERANCE or abs(dy - rdy) > SHIFT_TOLERANCE:
+        return None
+    if abs(rdx) >= width or abs(rdy) >= height:
+        # nothing of the cached surface would be visible
+        return None
+    return rdx, rdy
+
+
+def get_exposed_rectangles(dx, dy, width, height):
+    """Return rectangles exposed by shifting the view by dx, dy pixels
+
+    :returns: list of (x, y, w, h) tuples
+    :rtype: list
+    """
+    rectangles = []
+    if dx > 0:
+        rectangles.append((width - dx, 0, dx, height))
+    elif dx < 0:
+        rectangles.append((0, 0, -dx, height))
+    if dy > 0:
+        rectangles.append((0, height - dy, width, dy))
+    elif dy < 0:
+        rectangles.append((0, 0, width, -dy))
+    return rectangles
+
+
+class LayerStats(object):
+    """Drawing time statistics for a single layer"""
+
+    def __init__(self):
+        self.frames = 0
+        self.actions = {REUSE: 0, TRANSLATE: 0, REDRAW: 0}
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+        self.last_action = None
+
+    def add(self, action, duration):
+        self.frames += 1
+        self.actions[action] += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.last_time = duration
+        self.last_action = action
+
+    @property
+    def average_time(self):
+        if self.frames:
+            return self.total_time / self.frames
+        else:
+            return 0.0
+
+
+class CompositorStats(object):
+    """Per layer frame timing statistics"""
+
+    def __init__(self, layers):
+        self.layers = dict((layer, LayerStats()) for layer in layers)
+        self._layer_order = list(layers)
+        self.frames = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+
+    def add_frame(self, duration):
+        self.frames += 1
+        self.total_time += duration
+        self.last_time = duration
+
+    def frame_report(self):
+        """Report how the last frame was drawn"""
+        parts = ["%s: %s %1.2f ms" % (layer, self.layers[layer].last_action, 1000 * self.layers[layer].last_time)
+                 for layer in self._layer_order]
+        return "frame %1.2f ms (%s)" % (1000 * self.last_time, ", ".join(parts))
+
+    def summary(self):
+        """Summarize the statistics collected so far"""
+        lines = ["%d frames, %1.2f ms average" % (self.frames, 1000 * self.total_time / max(self.frames, 1))]
+        for layer in self._layer_order:
+            stats = self.layers[layer]
+            lines.append("%s: %1.2f ms average, %1.2f ms max, %d redrawn, %d translated, %d reused" %
+                         (layer, 1000 * stats.average_time, 1000 * stats.max_time,
+                          stats.actions[REDRAW], stats.actions[TRANSLATE], stats.actions[REUSE]))
+        return "\n".join(lines)
+
+
+class LayerCompositor(object):
+    """Keep a cached surface for each drawing layer & redraw only what's needed
+
+    :param create_surface: callable returning a new transparent surface
+                           for the given width and height
+    :param create_context: callable returning a drawing context for a surface
+    :param layers: layer ids in drawing order
+    """
+
+    def __init__(self, create_surface, create_context, layers=constants.DRAW_LAYERS):
+        self._create_surface = create_surface
+        self._create_context = create_context
+        self._layers = list(layers)
+        self._surfaces = {}
+        # spare surfaces for translating, so that a new surface
+        # doesn't need to be allocated for every frame when dragging the map
+        self._spare_surfaces = {}
+        # (view key, origin) the cached surface was drawn with
+        self._views = {}
+        self._dirty = set(self._layers)
+        # layers redrawn instead of translated when panning
+        self._redraw_on_pan = set()
+        self._size = None
+        self.stats = CompositorStats(self._layers)
+
+    @property
+    def dirty_layers(self):
+        return set(self._dirty)
+
+    def invalidate(self, *layers):
+        """Mark layers as needing a redraw, all layers if none are given"""
+        if layers:
+            self._dirty.update(layers)
+        else:
+            self._dirty.update(self._layers)
+
+    def set_redraw_on_pan(self, layer, redraw):
+        """Set if a geographic layer should be redrawn instead of translated
+        when the map is panned, eq. because it has content anchored to the screen edges
+        """
+        if redraw:
+            self._redraw_on_pan.add(layer)
+        else:
+            self._redraw_on_pan.discard(layer)
+
+    def _get_surface(self, layer):
+        surface = self._spare_surfaces.pop(layer, None)
+        if surface is None:
+            surface = self._create_surface(*self._size)
+        return surface
+
+    def _clear(self, cr):
+        # the spare surfaces are reused, so clear any old content
+        cr.save()
+        cr.set_operator(OPERATOR_CLEAR)
+        cr.paint()
+        cr.restore()
+
+    def compose(self, cr, width, height, view_key, origin, draw_layer, log_frames=False):
+        """Draw all layers to the given context
+
+        :param cr: drawing context of the screen
+        :param int width: screen width
+        :param int height: screen height
+        :param view_key: anything besides the origin geographic layers depend on
+                         (zoom level, map rotation, etc.), geographic layers are
+                         redrawn if it changes
+        :param tuple origin: (x, y) top left screen corner in global pixel coordinates
+                             or None if the view can't be translated
+        :param draw_layer: callable drawing the given layer to the given context
+        :param bool log_frames: log how long drawing of the frame and its layers took
+        """
+        frame_start = time.time()
+        if self._size != (width, height):
+            self._size = (width, height)
+            self._surfaces.clear()
+            self._spare_surfaces.clear()
+            self._views.clear()
+        for layer in self._layers:
+            start = time.time()
+            if layer in GEOGRAPHIC_LAYERS:
+                action = self._update_layer(layer, view_key, origin, draw_layer)
+            else:
+                # screen overlay does not depend on the map view
+                action = self._update_layer(layer, None, None, draw_layer)
+            self.stats.layers[layer].add(action, time.time() - start)
+            cr.set_source_surface(self._surfaces[layer], 0, 0)
+            cr.paint()
+        self._dirty.clear()
+        self.stats.add_frame(time.time() - frame_start)
+        if log_frames:
+            log.debug(self.stats.frame_report())
+            if self.stats.frames % STATS_LOG_INTERVAL == 0:
+                log.debug(self.stats.summary())
+
+    def _update_layer(self, layer, view_key, origin, draw_layer):
+        surface = self._surfaces.get(layer)
+        cached = self._views.get(layer)
+        if surface is not None and layer not in self._dirty and cached is not None and cached[0] == view_key:
+            if cached[1] == origin:
+                return REUSE
+            shift = get_shift(cached[1], origin, *self._size)
+            if shift is not None and layer not in self._redraw_on_pan:
+                self._translate(layer, shift, draw_layer)
+                self._views[layer] = (view_key, origin)
+                return TRANSLATE
+        if surface is None:
+            surface = self._get_surface(layer)
+            self._surfaces[layer] = surface
+        cr = self._create_context(surface)
+        self._clear(cr)
+        draw_layer(layer, cr)
+        self._views[layer] = (view_key, origin)
+        return REDRAW
+
+    def _translate(self, layer, shift, draw_layer):
+        """Reuse the cached layer surface shifted by the given whole pixel amount"""
+        dx, dy = shift
+        old_surface = self._surfaces[layer]
+        surface = self._get_surface(layer)
+        cr = self._create_context(surface)
+        self._clear(cr)
+        cr.set_source_surface(old_surface, -dx, -dy)
+        cr.paint()
+        # draw the newly exposed area
+        cr.save()
+        for x, y, w, h in get_exposed_rectangles(dx, dy, *self._size):
+            cr.rectangle(x, y, w, h)
+        cr.clip()
+        draw_layer(layer, cr)
+        cr.restore()
+        self._surfaces[layer] = surface
+        self._spare_surfaces[layer] = old_surface
@@ -71,8 +71,9 @@ class Cron(RanaModule):
         RanaModule.__init__(self, *args, **kwargs)
 
     def addIdle(self, callback, args):
-        """add a callback that is called once the main loop becomes idle"""
-        pass
+        """add a callback that is called once the main loop becomes idle
+        - there is no main loop, so the callback is called right away"""
+        callback(*args)
 
     def addTimeout(self, callback, timeout, caller, description, args=None):
         """the callback will be called timeout + time needed to execute the callback
@@ -264,6 +265,16 @@ class CronQt5(Cron):
             self.nextId += 1
             return timeoutId
 
+    def addIdle(self, callback, args):
+        """add a callback that is called once the main loop becomes idle
+        - a one shot zero length QML timer is used"""
+        self.addTimeout(self._idleCB, 0, self, "idle callback", [callback, args])
+
+    def _idleCB(self, callback, args):
+        callback(*args)
+        # one shot
+        return False
+
     def addTimeout(self, callback, timeout, caller, description, args=None):
         """the callback will be called timeout + time needed to execute the callback
         and other events
@@ -34,6 +34,7 @@ if gs.GUIString == "GTK":
     import cairo
     from core.color import Color
 from core import constants
+from core.render_cache import LRUCache
 
 
 def getModule(*args, **kwargs):
@@ -48,9 +49,8 @@ class Icons(RanaModule):
 
         self.defaultTheme = constants.DEFAULT_THEME_ID
         self.cantLoad = []
-        self.imageOrderList = [] # for cache trimming
         self.maxImages = 200 # default 200
-        self.images = {}
+        self.images = LRUCache(self.maxImages)
 
         self.currentTheme = self.defaultTheme
         self.themeList = []
@@ -345,16 +345,16 @@ class Icons(RanaModule):
 
     def flushIconCache(self):
         """flush the icon cache"""
-        self.images = {}
+        self.images.clear()
         self.cantLoad = []
-        self.imageOrderList = []
 
     def draw(self, cr, name, x, y, w, h):
         # is the icon already cached ?
         cacheName = "%fx%f#%s" % (w, h, name)
 
-        if cacheName in self.images.keys():
-            self.drawIcon(cr, self.images[cacheName], x, y, w, h)
+        cachedIcon = self.images.get(cacheName)
+        if cachedIcon is not None:
+            self.drawIcon(cr, cachedIcon, x, y, w, h)
         else:
             # run through possible "layers", which are separated by >
             compositedIcon = None
@@ -515,16 +515,9 @@ class Icons(RanaModule):
 
     def storeInCache(self, name, image, w, h):
         """store an item in cache and return the cache representation"""
-        # check if the cache is full
-        if len(self.images) >= self.maxImages:
-            # get the oldest image + remove it from the queue
-            oldestImageName = self.imageOrderList.pop(0) # TODO: this might be slow
-            #      self.log.debug("trimming cache, %s, %d" % (oldestImageName, len(self.images)))
-            # remove it from the cache
-            del self.images[oldestImageName]
         cacheRepresentation = {'image': image, 'w': w, 'h': h, 'name': name}
-        self.images[name] = cacheRepresentation
-        self.imageOrderList.append(name)
+        # the least recently used icon is evicted if the cache is full
+        self.images.put(name, cacheRepresentation)
         return cacheRepresentation
 
     def handleMessage(self, message, messageType, args):
@@ -19,15 +19,17 @@
 # ---------------------------------------------------------------------------
 from modules.base_module import RanaModule
 from core import geo
+from core import geometry_cache
 from core import utils
+from core import threads
+from core import tracklog_parser
+from core import tracklog_cache
+from core import tracklog_catalog
+import array
+import bisect
 import math
 import os
-import glob
-
-try:
-    import cPickle as pickle  # Python 2
-except ImportError:
-    import pickle  # Python 3
+import threading
 import shutil
 from time import clock
 from time import gmtime, strftime
@@ -45,14 +47,28 @@ class LoadTracklogs(RanaModule):
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
         self.tracklogs = {}  # dictionary of all loaded tracklogs, path is the key
-        self.cache = {}
+        self._cache = None
+        self._catalog = None
         self._tracklog_list = []
         self._tracklog_path_list = []
         self._category_list = []
+        # parallel tracklog loading
+        self._pool = None
+        self._pending_paths = set()
+        self._pending_lock = threading.RLock()
+        self._batch_start = None
+        self._batch_count = 0
+        self._batch_failed = 0
 
     def firstTime(self):
         self._create_basic_folder_structure()
 
+    def shutdown(self):
+        if self._pool:
+            self._pool.terminate()
+        if self._catalog:
+            self._catalog.close()
+
     def handleMessage(self, message, messageType, args):
         if message == 'loadActive':
             # load the active tracklog
@@ -60,26 +76,14 @@ class LoadTracklogs(RanaModule):
             if path is not None and self._tracklog_list:
                 self.log.info("* loading tracklog:\n%s", path)
 
-                # Zeroth, is the tracklog already loaded ?
+                # is the tracklog already loaded ?
                 if path not in self.tracklogs.keys():
-                    # First, is the cache loaded ?
-                    if self.cache == {}:
-                        self._load_cache()
-                    else:
-                        self.log.warning("not loading tracklog cache (already loaded)")
-                        # Second, try to load the tracklog (if its not loaded)
-
+                    # try to load the tracklog (if its not loaded)
                     try:
                         self.load_tracklog(path)
                         self.log.info("tracklog successfully loaded")
                     except Exception:
                         self.log.exception("loading tracklog from path: %s failed", path)
-
-                    # Third, assure consistency of the cache
-                    self.log.info("** Assuring tracklog cache consistency")
-                    self.save()
-                    self._clean_cache()
-                    self.log.info("** Tracklog cache consistency assured")
                 #    elif message == 'renameActiveTracklog':
                 #      activeTracklog = self.get_active_tracklog()
                 #      if activeTracklog:
@@ -130,33 +134,28 @@ class LoadTracklogs(RanaModule):
 
     # tracklog cache
 
-    def _load_cache(self):
-        """Unpickle the cache from file."""
-        self.log.info("** Loading tracklog cache")
-        start = clock()
-        try:
-            f = open(self.get_tracklog_cache_path(), 'rb')
-            self.cache = pickle.load(f)
-            f.close()
-        except Exception:
-            self.log.exception("loading cache from file failed")
-            self.cache = {}
-        self.log.info("** Loading tracklog cache took %1.2f ms", 1000 * (clock() - start))
+    @property
+    def cache(self):
+        """The tracklog cache, created on first use."""
+        if self._cache is None:
+            cache_folder = self.modrana.paths.cache_folder_path
+            self._cache = tracklog_cache.TracklogCache(os.path.join(cache_folder, "tracklogs"))
+            # remove the old single file pickle cache if present
+            old_cache_path = os.path.join(cache_folder, 'tracklog_cache.txt')
+            if os.path.exists(old_cache_path):
+                try:
+                    os.remove(old_cache_path)
+                except OSError:
+                    self.log.exception("can't remove old tracklog cache file")
+        return self._cache
 
     def _clean_cache(self):
-        """Remove files that are not present from the cache."""
-        paths = self._tracklog_path_list
-        garbage = filter(lambda x: x not in paths, self.cache)
-        for g in garbage:
-            del self.cache[g]
+        """Remove cache entries for tracklogs that are no longer present."""
+        self.cache.clean(self._tracklog_path_list)
 
     def delete_tracklog_from_cache(self, tracklogFile):
         """Self explanatory."""
-        if tracklogFile in self.cache:
-            del self.cache[tracklogFile]
-
-    def get_tracklog_cache_path(self):
-        return os.path.join(self.modrana.paths.cache_folder_path, 'tracklog_cache.txt')
+        self.cache.remove(tracklogFile)
 
     # active tracklog
 
@@ -165,7 +164,6 @@ class LoadTracklogs(RanaModule):
         # is the tracklog loaded ?
         if path not in self.tracklogs.keys():
             self.load_tracklog(path)
-            self.save()
             # was the tracklog loaded successfully ?
         if path not in self.tracklogs.keys():
             return None
@@ -191,6 +189,14 @@ class LoadTracklogs(RanaModule):
             else:  # something went wrong, return None
                 return None
 
+    def get_loaded_tracklog(self, path):
+        """Return the tracklog for path if it is already loaded, None otherwise.
+
+        Unlike get_tracklog_for_path() this never loads the tracklog,
+        so it is safe to use from drawing code.
+        """
+        return self.tracklogs.get(path)
+
     def get_tracklog_points_for_path(self, path):
         # used by Qt 5 UI - let's ignore the clusters for now
         #                   and just return full list of points
@@ -223,53 +229,81 @@ class LoadTracklogs(RanaModule):
 
         return self._tracklog_path_list.index(path)
 
-    def list_available_tracklogs(self):
+    @property
+    def catalog(self):
+        """The tracklog catalogue, created on first use."""
+        if self._catalog is None:
+            dbPath = os.path.join(self.modrana.paths.cache_folder_path, 'tracklog_catalog.sqlite')
+            self._catalog = tracklog_catalog.TracklogCatalog(dbPath)
+        return self._catalog
+
+    def _catalog_record_to_item(self, record):
+        """Convert a catalogue record to the tracklog list item format."""
+        path = record['path']
+        return {'path': path,
+                'filename': record['filename'],
+                'lastModified': strftime("%d.%m.%Y %H:%M:%S", gmtime(record['mtime'])),
+                'size': utils.bytes_to_pretty_unit_string(record['size']),
+                'type': os.path.splitext(path)[1][1:],
+                'cat': record['category']}
+
+    def list_available_tracklogs(self, rescan=False):
+        """Refresh the list of available tracklogs from the tracklog catalogue.
+
+        Only category folders that changed since last time are rescanned,
+        unless rescan is True.
+        """
         self.log.info("** making a list of available tracklogs")
 
         tf = self.modrana.paths.tracklog_folder_path
         # does the tracklog folder exist ?
         if tf is None or not os.path.exists(tf):
             return  # no tracklog folder, nothing to list
-            # get the available directories,
-        # each directory represents a category
-        currentFolders = os.listdir(tf)
-        # leave just folders (that are not hidden)
-        currentFolders = list(filter(lambda x: os.path.isdir(os.path.join(tf, x)) and not x.startswith('.'), currentFolders))
-        # add files from all available folders
-        availableFiles = []
-        pathList = []
-        for folder in currentFolders:
-            # TODO: support other tracklogs
-            folderFiles = glob.glob(os.path.join(tf, folder, '*.gpx'))
-            folderFiles.extend(glob.glob(os.path.join(tf, folder, '*.GPX')))
-            # remove possible folders
-            folderFiles = filter(lambda x: os.path.isfile(x), folderFiles)
-            for file in folderFiles:
-                path = file
-                filename = os.path.split(file)[1]
-                lastModifiedEpochSecs = os.path.getmtime(path)
-                lastModified = strftime("%d.%m.%Y %H:%M:%S", gmtime(lastModifiedEpochSecs))
-                size = utils.bytes_to_pretty_unit_string(os.path.getsize(path))
-                extension = os.path.splitext(path)[1]
-                cat = folder
-                item = {'path': path,
-                        'filename': filename,
-                        'lastModified': lastModified,
-                        'size': size,
-                        'type': extension[1:],
-                        'cat': cat}
-                availableFiles.append(item)
-            pathList.extend(folderFiles)
-
-        self._category_list = currentFolders
+        if rescan:
+            self.catalog.rescan(tf)
+        else:
+            self.catalog.reconcile(tf)
+        availableFiles = [self._catalog_record_to_item(record) for record in self.catalog.list_tracklogs()]
+
+        self._category_list = [name for name, count in self.catalog.list_categories()]
 
         self.log.info("*  using this tracklog folder:")
         self.log.info("* %s" % self.modrana.paths.tracklog_folder_path)
         self.log.info("*  there are %d tracklogs available" % len(availableFiles))
         self.log.info("**")
-        self._tracklog_path_list = pathList
+        self._tracklog_path_list = [item['path'] for item in availableFiles]
         self._tracklog_list = availableFiles
 
+    def add_tracklog_path(self, path):
+        """Add a new tracklog file to the list of available tracklogs.
+
+        The tracklog category is the name of the folder containing the file.
+        """
+        if not os.path.isfile(path):
+            self.log.error("can't add tracklog - no tracklog file: %s", path)
+            return
+        category = os.path.basename(os.path.dirname(path))
+        self.catalog.add(path, category)
+        item = self._catalog_record_to_item(self.catalog.get(path))
+        if path in self._tracklog_path_list:
+            index = self._tracklog_path_list.index(path)
+            self._tracklog_list[index] = item
+        else:
+            self._tracklog_path_list.append(path)
+            self._tracklog_list.append(item)
+            if category not in self._category_list:
+                self._category_list.append(category)
+
+    def remove_tracklog_path(self, path):
+        """Remove a tracklog from the list of available tracklogs and from the cache."""
+        self.catalog.remove(path)
+        self.delete_tracklog_from_cache(path)
+        self.tracklogs.pop(path, None)
+        if path in self._tracklog_path_list:
+            index = self._tracklog_path_list.index(path)
+            del self._tracklog_path_list[index]
+            del self._tracklog_list[index]
+
     def get_category_list(self):
         """Return the list of available categories."""
         if not self._category_list:
@@ -278,18 +312,20 @@ class LoadTracklogs(RanaModule):
 
     def get_category_dict_list(self):
         # get dictionary describing tracklog categories
-        category_dict_list = []
-
-        tracklog_folder = self.modrana.paths.tracklog_folder_path
-        for category in self.get_category_list():
-            tracklog_count = 0
-            for item in os.listdir(os.path.join(tracklog_folder, category)):
-                item_path = os.path.join(tracklog_folder, category, item)
-                if os.path.isfile(item_path) and os.path.splitext(item_path)[1].lower() == ".gpx":
-                    tracklog_count += 1
-            category_dict_list.append({"name": category,
-                                       "tracklog_count": tracklog_count})
-        return category_dict_list
+        if not self._category_list:
+            self.list_available_tracklogs()
+        return [{"name": name, "tracklog_count": count} for name, count in self.catalog.list_categories()]
+
+    def get_visible_path_candidates(self, paths, bbox):
+        """Filter paths to tracklogs that might intersect the given bounding box.
+
+        :param paths: tracklog paths
+        :param bbox: (min lat, min lon, max lat, max lon) tuple
+        :returns: set of tracklog paths
+        """
+        if not self._tracklog_list:
+            self.list_available_tracklogs()
+        return self.catalog.paths_in_bbox(*bbox, paths=paths)
 
     def get_tracklogs_list_for_category(self, category_name):
         # get list of dictionaries describing tracklogs in a category
@@ -329,72 +365,125 @@ class LoadTracklogs(RanaModule):
     #    self.tracklogList[index]['cat'] = cathegory
 
 
-    #  def load(self):
-    #    start = clock()
-    #
-    #    try:
-    #      f = open(self.cachePath, 'r')
-    #      cache = cPickle.load(f)
-    #
-    #      self.cache = cache
-    #    except:
-    #      print("loadTracklogs: loading cache from file failed")
-    #      self.cache = {}
-    #
-    #    print("Loading from cache took %1.2f ms" % (1000 * (clock() - start)))
-    #
-    #    files = []
-    #    if os.path.exists(self.tracklogFolder):
-    #      files = os.listdir(self.tracklogFolder)
-    #      files = filter(lambda x: x != '.svn', files)
-    #
-    #
-    #      print(self.tracklogFolder)
-    #      print(os.path.exists(self.tracklogFolder))
-    #      for file in files:
-    #        try:
-    #          self.load_tracklog(self.tracklogFolder + file)
-    #        except:
-    #          "loading tracklog failed: %s" % file
-    #
-    #    self._clean_cache(files)
-    #    self.save()
-    #    print("Loading tracklogs took %1.2f ms" % (1000 * (clock() - start)))
+    # load tracklogs
 
-    def save(self):
-        try:
-            f = open(self.get_tracklog_cache_path(), 'w')
-            pickle.dump(self.cache, f)
-            f.close()
-        except Exception:
-            self.log.exception("can't store tracklog data to cache, tracklogs will be loaded from files next time")
+    def _get_pool(self):
+        """Return the tracklog loading process pool
 
-    # load tracklogs
+        The pool is created lazily on first use. If processes can't be used
+        on the current platform, None is returned and tracklogs are parsed
+        in a background thread instead.
+        """
+        if self._pool is None:
+            try:
+                import multiprocessing
+                processes = max(1, min(multiprocessing.cpu_count(), 4))
+                self._pool = multiprocessing.Pool(processes=processes)
+                self.log.info("tracklog loading pool started with %d processes", processes)
+            except Exception:
+                self.log.exception("can't start tracklog loading process pool, using a thread")
+                self._pool = False
+        return self._pool or None
 
     def loadPathList(self, pathList):
-        self.log.info("** Loading tracklogs list")
-        start = clock()
-        count = len(pathList)
-        index = 1
-        self.sendMessage('notification:loading %d tracklogs#1' % count)
+        """Asynchronously load tracklogs for the given paths
+
+        The tracklogs are parsed in parallel by a process pool
+        and added to the loaded tracklogs once ready, the screen is
+        redrawn each time a tracklog is loaded. Paths that are already
+        being loaded are skipped, so this can be safely called repeatedly,
+        eq. from the drawing code.
+        """
+        with self._pending_lock:
+            pathList = [path for path in pathList
+                        if path not in self._pending_paths and path not in self.tracklogs]
+            if not pathList:
+                return
+            self._pending_paths.update(pathList)
+            if self._batch_count == 0:
+                self._batch_start = clock()
+            self._batch_count += len(pathList)
+
+        # even loading from the cache (mmap read & catalogue update)
+        # is done by the loader thread, so that the caller (eq. drawing code)
+        # is never blocked
+        threads.threadMgr.add(threads.ModRanaThread(name="tracklogLoader",
+                                                    target=lambda: self._load_tracklogs(pathList)))
+
+    def _load_tracklogs(self, pathList):
+        """Load tracklogs with a valid cache entry & hand the rest to the parsing pool
+
+        Run by the tracklog loader thread.
+        """
+        toParse = []
         for path in pathList:
-            self.load_tracklog(path, False)
-            self.sendMessage('notification:%d of %d loaded#1' % (index, count))
-            index += 1
+            entry = self.cache.get(path)
+            if entry is None:
+                toParse.append(path)
+            else:
+                self._tracklog_parsed(path, entry.points, entry)
+        if not toParse:
+            return
+
+        self.log.info("** Loading %d tracklogs", len(toParse))
+        self.sendMessage('notification:loading %d tracklogs#1' % len(toParse))
+        pool = self._get_pool()
+        if pool:
+            for path in toParse:
+                pool.apply_async(tracklog_parser.parse_tracklog_or_none, (path,),
+                                 callback=lambda points, path=path: self._tracklog_parsed(path, points))
+        else:
+            for path in toParse:
+                self._tracklog_parsed(path, tracklog_parser.parse_tracklog_or_none(path))
 
-        elapsed = (1000 * (clock() - start))
-        self.log.info("** Loading tracklogs took %1.2f ms", elapsed)
-        self.save()
-        self._clean_cache()
-        self.sendMessage('notification:%d tracks loaded in %1.2f ms#1' % (count, elapsed))
+    def _tracklog_parsed(self, path, points, cacheEntry=None):
+        """Handle a tracklog parsed in the background
 
-    def load_tracklog(self, path, notify=True):
-        """Load a GPX file to datastructure."""
-        # is the cache loaded
-        if self.cache == {}:
-            # load the cache
-            self._load_cache()
+        :param points: parsed trackpoints, None if parsing failed
+        """
+        failed = points is None
+        try:
+            if failed:
+                self.log.error("loading tracklog failed: %s", path)
+            else:
+                self._add_tracklog(path, points, cacheEntry)
+        except Exception:
+            failed = True
+            self.log.exception("post-processing of tracklog %s failed", path)
+        finally:
+            with self._pending_lock:
+                self._pending_paths.discard(path)
+                if failed:
+                    self._batch_failed += 1
+                batch_done = not self._pending_paths
+                if batch_done:
+                    count = self._batch_count - self._batch_failed
+                    failedCount = self._batch_failed
+                    elapsed = 1000 * (clock() - self._batch_start)
+                    self._batch_count = 0
+                    self._batch_failed = 0
+            self.set('needRedraw', True)
+        if batch_done:
+            self.log.info("** Loading %d tracklogs took %1.2f ms", count, elapsed)
+            self._clean_cache()
+            if failedCount:
+                self.log.error("** %d tracklogs could not be loaded", failedCount)
+                self.sendMessage('notification:%d tracks loaded in %1.2f ms, %d failed#2' %
+                                 (count, elapsed, failedCount))
+            else:
+                self.sendMessage('notification:%d tracks loaded in %1.2f ms#1' % (count, elapsed))
 
+    def _add_tracklog(self, path, points, cacheEntry=None):
+        """Create a tracklog from parsed trackpoints and add it to loaded tracklogs"""
+        track = GPXTracklog(points, path, points.file_type, self.cache, cacheEntry)
+        self.tracklogs[path] = track
+        # update tracklog statistics in the catalogue
+        self.catalog.update_stats(path, len(points), points.bounding_box(),
+                                  track.getLength(), points.duration)
+        return track
+
+    def load_tracklog(self, path, notify=True):
+        """Load a tracklog file to datastructure."""
         # just to be sure, refresh the tracklog list if needed
         if self._tracklog_list == []:
             self.list_available_tracklogs()
@@ -402,41 +491,30 @@ class LoadTracklogs(RanaModule):
         start = clock()
         self.filename = path
 
-        file = None
-
-        try:
-            file = open(path, 'rt')
-        except Exception:
-            self.log.exception("loading tracklog failed: %s", path)
+        if not os.path.isfile(path):
+            self.log.error("loading tracklog failed - no tracklog file: %s", path)
+            return None
 
         if notify:
             self.sendMessage('notification:loading %s#1' % path)
 
-        if file:  # TODO: add handling of other than GPX files
-            # import the GPX module only when really needed
-            from upoints import gpx
-
-            track = gpx.Trackpoints()  # create new Trackpoints object
-            # lets assume we have only GPX 1.1 files TODO: 1.1 and 1.0
+        cacheEntry = self.cache.get(path)
+        if cacheEntry is None:
             try:
-                track.import_locations(file)  # load a gpx file into it
-            except Exception:
-                self.log.exception("loading tracklog failed")
+                points = tracklog_parser.parse_tracklog(path)
+            except tracklog_parser.TracklogParsingFailed:
+                self.log.error("loading tracklog failed: %s", path)
                 if notify:
                     self.sendMessage('notification:loading tracklog failed#2')
-                return
-            file.close()
-
-            type = "GPX"  # TODO: more formats support
-
-            track = GPXTracklog(track, path, type, self.cache, self.save)
-            self.tracklogs[path] = track
-            self.log.info("Loading tracklog \n%s\ntook %1.2f ms", path, (1000 * (clock() - start)))
-            if notify:
-                self.sendMessage('notification:loaded in %1.2f ms' % (1000 * (clock() - start)))
-            return track
+                return None
         else:
-            self.log.info("No tracklog file")
+            points = cacheEntry.points
+
+        track = self._add_tracklog(path, points, cacheEntry)
+        self.log.info("Loading tracklog \n%s\ntook %1.2f ms", path, (1000 * (clock() - start)))
+        if notify:
+            self.sendMessage('notification:loaded in %1.2f ms' % (1000 * (clock() - start)))
+        return track
 
     # store tracklogs
 
@@ -488,11 +566,10 @@ class LoadTracklogs(RanaModule):
                 self.sendMessage('notification:Error: saving tracklog failed#3')
                 return None
 
-        # refresh the available tracklog list,
+        # add the new tracklog to the available tracklog list,
         # so the new tracklog shows up
         if refresh:
-            self.list_available_tracklogs()
-            # TODO: incremental addition of new tracklogs without relisting
+            self.add_tracklog_path(os.path.join(path, filename))
         self.log.info("tracklog: %s", filename)
         self.log.info("tracklog saved successfully")
         return os.path.join(path, filename)
@@ -505,41 +582,29 @@ class LoadTracklogs(RanaModule):
         dy = y2 - y1
         return math.sqrt(dx ** 2 + dy ** 2)
 
-    # found on:
-    # http://www.quanative.com/2010/01/01/server-side-marker-clustering-for-google-maps-with-python/
     def cluster_trackpoints(self, trackpointsList, cluster_distance):
+        """Group trackpoints to clusters about cluster_distance kilometers in diameter.
+
+        See geo.clusterTrackpoints() for details.
         """
-        Groups points that are less than cluster_distance pixels apart at
-        a given zoom level into a cluster.
-        """
-        points = [{'latitude': point.latitude, 'longitude': point.longitude} for point in trackpointsList[0]]
-        self.set('clPoints', points)
-        clusters = []
-        while len(points) > 0:
-            point1 = points.pop()
-            cluster = []
-            for point2 in points[:]:
-
-                pixel_distance = geo.distance(point1['latitude'],
-                                              point1['longitude'],
-                                              point2['latitude'],
-                                              point2['longitude'])
-
-                if pixel_distance < cluster_distance:
-                    points.remove(point2)
-                    cluster.append(point2)
-
-            # add the first point to the cluster
-            if len(cluster) > 0:
-                cluster.append(point1)
-                clusters.append(cluster)
-            else:
-                clusters.append([point1])
+        return clusters_from_point_lists(geo.clusterTrackpoints(trackpointsList, cluster_distance))
+
+
+def clusters_from_point_lists(clusters):
+    """Convert geo.clusterTrackpoints() results to clusters of point index ranges
 
-        return clusters
+    Clusters are contiguous runs of points in track order.
+    """
+    result = []
+    start = 0
+    for pointsList, centreX, centreY, radius in clusters:
+        end = start + len(pointsList)
+        result.append(ClusterOfPoints(start, end, centreX, centreY, radius))
+        start = end
+    return result
 
 
-class Tracklog():
+class Tracklog(object):
     """A basic class representing a tracklog."""
 
     def __init__(self, trackpointsList, filename, type):
@@ -583,16 +648,20 @@ class Tracklog():
 class GPXTracklog(Tracklog):
     """A class representing a GPX tracklog."""
 
-    def __init__(self, trackpointsList, filename, type, cache, save):
-        Tracklog.__init__(self, trackpointsList, filename, type)
+    # cluster points to clusters about 5 kilometers in diameter
+    CLUSTER_DISTANCE = 5
+    # simplification tolerances in meters
+    SIMPLIFICATION_LEVELS = (10, 50, 250)
+
+    def __init__(self, points, filename, type, cache, cacheEntry=None):
+        self.points = points  # compact point coordinate arrays
+        # the trackpoint list is created from the point arrays on first use
+        Tracklog.__init__(self, None, filename, type)
         Tracklog.type = 'GPX'
         self.routeInfo = None  # a dictionary for storing route information
         # TODO: set this automatically
 
-        filename = self.filename
-
         self.cache = cache
-        self.save = save
 
         self.clusters = []
 
@@ -600,67 +669,176 @@ class GPXTracklog(Tracklog):
 
         self.perElevList = None
 
+        self.simplification = {}  # simplification tolerance in meters -> kept point indexes
+
+        # changes every time the tracklog changes, so that cached projected
+        # geometry of the tracklog can be refreshed
+        self.version = geometry_cache.new_version()
+
+        self.length = None  # track length in kilometers
+
         # do we have any points to process ?
-        if self.trackpointsList == []:
+        if not len(self.points):
             # no points, we are done :)
             return
 
-        if filename in cache:
+        if cacheEntry is not None:
             gpx_log.info("** loading tracklog from cache")
-            self.clusters = cache[filename].clusters
-            self.routeInfo = cache[filename].routeInfo
-            if self.routeInfo is not None:
-                self.elevation = True
-            self.perElevList = cache[filename].perElevList
-
+            self._restoreFromCacheEntry(cacheEntry)
         else:
             gpx_log.info("* creating clusters,routeInfo and perElevList: %s", filename)
-            clusterDistance = 5  # cluster points to clusters about 5 kilometers in diameter
-            self.clusters = []
+            self._process()
+            self._storeToCache()
 
-            try:
-                rawClusters = geo.clusterTrackpoints(trackpointsList, clusterDistance)  # we cluster the points
-                for cluster in rawClusters:  # now we find for each cluster a circle encompassing all points
-                    (centreX, centreY, radius) = geo.circleAroundPointCluster(cluster)
-                    self.clusters.append(ClusterOfPoints(cluster, centreX, centreY, radius))
+    def _firstSegment(self):
+        """Return latitude, longitude & elevation arrays of the first track segment
 
-                self.checkElevation()
+        Only the first segment is used for clusters, simplification & statistics.
+        """
+        start, end = self.points.segment_ranges()[0]
+        return (self.points.lat[start:end], self.points.lon[start:end],
+                self.points.elevation[start:end])
 
-                if self.elevation is True:
-                    self.getPerElev()
-                else:
-                    self.perElevList = None
-            except Exception:
-                gpx_log.exception("tracklog post-processing failed")
+    def _process(self):
+        """Compute clusters, simplification levels & statistics for the tracklog
+
+        Everything is computed from the point arrays, no per point objects are created.
+        """
+        self.version = geometry_cache.new_version()
+        self.clusters = []
+        try:
+            lats, lons = self._firstSegment()[:2]
+            # cluster the points & find a circle encompassing each cluster
+            self.clusters = [ClusterOfPoints(*cluster) for cluster in
+                             geo.clusterTrackIndexes(lats, lons, self.CLUSTER_DISTANCE)]
+            self.simplification = {}
+            for tolerance in self.SIMPLIFICATION_LEVELS:
+                self.simplification[tolerance] = geo.simplifyTrackIndexes(lats, lons, tolerance / 1000.0)
+            self.length = geo.trackLength(lats, lons)
+
+            self.checkElevation()
+
+            if self.elevation is True:
+                self.getPerElev()
+            else:
+                self.perElevList = None
+        except Exception:
+            gpx_log.exception("tracklog post-processing failed")
+
+    def _storeToCache(self):
+        """Store the tracklog with all computed data to the tracklog cache"""
+        clusters = [(cluster.start, cluster.end, cluster.centreX, cluster.centreY, cluster.radius)
+                    for cluster in self.clusters]
+        stats = {'routeInfo': self.routeInfo,
+                 'perElevList': self.perElevList,
+                 'length': self.length}
+        entry = tracklog_cache.CacheEntry(self.points, clusters, self.simplification, stats)
+        self.cache.store(self.filename, entry)
+
+    def _restoreFromCacheEntry(self, entry):
+        """Restore clusters, simplification levels & statistics from a cache entry"""
+        self.version = geometry_cache.new_version()
+        self.clusters = [ClusterOfPoints(*cluster) for cluster in entry.clusters]
+        self.simplification = entry.simplification
+        self.routeInfo = entry.stats.get('routeInfo')
+        if self.routeInfo is not None:
+            self.elevation = True
+        else:
+            self.elevation = False
+        self.perElevList = entry.stats.get('perElevList')
+        self.length = entry.stats.get('length')
+
+    @property
+    def trackpointsList(self):
+        """List of segments, each being a list of trackpoints
+
+        Created from the point arrays on first use, as only some tools
+        (elevation lookup, colored drawing, ...) need per point objects.
+        """
+        if self._trackpointsList is None:
+            self._trackpointsList = self.points.to_trackpoints_list()
+        return self._trackpointsList
 
-            ci = CacheItem(self.clusters, self.routeInfo, self.perElevList)
-            cache[filename] = ci
+    @trackpointsList.setter
+    def trackpointsList(self, trackpointsList):
+        self._trackpointsList = trackpointsList
+
+    def getSimplificationTolerance(self, maxError):
+        """Return the largest simplification tolerance not exceeding maxError meters
+
+        :returns: tolerance in meters or None if no simplification level is precise enough
+        """
+        tolerances = [t for t in self.simplification if t <= maxError]
+        if tolerances:
+            return max(tolerances)
+        else:
+            return None
+
+    def getClusterParts(self, maxError=None):
+        """Return cluster points as lists of (lat, lon) tuples
+
+        :param maxError: maximum simplification error in meters, a precomputed
+                         simplification level is used if one fits, None for all points
+        """
+        lat = self.points.lat
+        lon = self.points.lon
+        tolerance = None
+        if maxError is not None:
+            tolerance = self.getSimplificationTolerance(maxError)
+        if tolerance is None:
+            return [[(lat[i], lon[i]) for i in range(cluster.start, cluster.end)]
+                    for cluster in self.clusters]
+        indexes = self.simplification[tolerance]
+        parts = []
+        for cluster in self.clusters:
+            first = bisect.bisect_left(indexes, cluster.start)
+            last = bisect.bisect_left(indexes, cluster.end)
+            kept = [indexes[j] for j in range(first, last)]
+            # always keep the cluster end points, so that the clusters stay connected
+            if not kept or kept[0] != cluster.start:
+                kept.insert(0, cluster.start)
+            if kept[-1] != cluster.end - 1:
+                kept.append(cluster.end - 1)
+            parts.append([(lat[i], lon[i]) for i in kept])
+        return parts
+
+    def getLength(self):
+        """return length of the tracklog in kilometers if known, None else"""
+        return self.length
 
     def modified(self):
         """the tracklog has been modified, recount all the statistics and clusters"""
         # TODO: implement this ? :D
+        self.version = geometry_cache.new_version()
+        # elevation is modified on the trackpoint objects, so copy it
+        # back to the point arrays the statistics are computed from
+        if self._trackpointsList is not None:
+            elevation = array.array("d")
+            for segment in self._trackpointsList:
+                for point in segment:
+                    if point.elevation is None:
+                        elevation.append(tracklog_parser.NO_ELEVATION)
+                    else:
+                        elevation.append(point.elevation)
+            self.points.elevation = elevation
         self.checkElevation()  # update the elevation statistics
         if self.elevation is True:
             self.getPerElev()  # update the periodic elevation data
 
     def checkElevation(self):
-        pointsWithElevation = list(filter(lambda x: x.elevation is not None, self.trackpointsList[0]))
-        if pointsWithElevation:  # do we have some points with known elevation ?
+        # missing elevation is stored as NaN in the point arrays
+        knownElevation = [elevation for elevation in self._firstSegment()[2]
+                          if not math.isnan(elevation)]
+        if knownElevation:  # do we have some points with known elevation ?
             self.elevation = True
             self.routeInfo = {}
-            # there we have the points, that contain the highest, lowest, first and last point
-            firstPoint = pointsWithElevation[0]
-            lastPoint = pointsWithElevation[len(pointsWithElevation) - 1]
-            # now we use some lambdas, to find the lowest and highest point
-            maxElevationPoint = (max(pointsWithElevation, key=lambda x: x.elevation))
-            minElevationPoint = (min(pointsWithElevation, key=lambda x: x.elevation))
             # just the highest/lowest elevations in numerical form
-            maxElevation = float(maxElevationPoint.elevation)
-            minElevation = float(minElevationPoint.elevation)
+            maxElevation = max(knownElevation)
+            minElevation = min(knownElevation)
             difference = maxElevation - minElevation
             middle = minElevation + (difference / 2)
-            firstElevation = float(firstPoint.elevation)
-            lastElevation = float(lastPoint.elevation)
+            firstElevation = knownElevation[0]
+            lastElevation = knownElevation[-1]
             # because there are many possible statistics about a given route with elevation,
             # we will store them in a dictionary, so new ones can be quickly added as needed
             #      self.routeInfo['firstPoint'] = firstPoint
@@ -677,35 +855,31 @@ class GPXTracklog(Tracklog):
 
     def replaceFile(self):
         """
-        we output the tree structure of the gpx xml back to the file
-        this can also mean, that some info that we didn't load to the tree will be lost
-        also attributes that were changed after the initial load will be written in the current (changed) state
+        we write the current trackpoint elevation back to the GPX file,
+        the rest of the file (all segments, timestamps, metadata) is kept as it is
         """
-        f = open(self.filename, "w")  # open the old file
-        xmlTree = self.trackpointsList.export_gpx_file()  # get the element tree
-        xmlTree.write(f)  # overwrite the old file with the new structure
+        # update the old file with the current points
+        tracklog_parser.update_gpx_elevation(self.filename, self.trackpointsList)
         gpx_log.info("%s has been replaced by the current in memory version", self.filename)
-        del self.cache[self.filename]  # the file has been modified, so it must be cached again
-        self.save()  # save the cache to disk
+        # the file has been modified, so it must be cached again
+        self.points = tracklog_parser.parse_tracklog(self.filename)
+        self.trackpointsList = None
+        self._process()
+        self._storeToCache()
 
     def getPerElev(self):
-        self.perElevList = geo.perElevList(self.trackpointsList)
-
-
-class CacheItem():
-    """class representing a cache item"""
-
-    def __init__(self, clusters, routeInfo=None, perElevList=None):
-        self.clusters = clusters
-        self.routeInfo = routeInfo
-        self.perElevList = perElevList
+        lats, lons, elevations = self._firstSegment()
+        elevations = [None if math.isnan(elevation) else elevation for elevation in elevations]
+        self.perElevList = geo.perElevListFromArrays(lats, lons, elevations)
 
 
-class ClusterOfPoints():
+class ClusterOfPoints(object):
     """A basic class representing a cluster of nearby points."""
 
-    def __init__(self, pointsList, centreX, centreY, radius):
-        self.pointsList = pointsList  # points in the cluster
+    def __init__(self, start, end, centreX, centreY, radius):
+        # the cluster holds points start to end - 1 of the tracklog
+        self.start = start
+        self.end = end
         """coordinates of the circle encompassing all points"""
         self.centreX = centreX
         self.centreY = centreY
@@ -20,6 +20,8 @@ from __future__ import with_statement # for python 2.5
 from modules.base_module import RanaModule
 from time import *
 from core import gs
+from core import constants
+from core.fix import FixEvent
 from core.signal import Signal
 
 
@@ -44,9 +46,19 @@ class Location(RanaModule):
         self.startSignal = Signal()
         self.stopSignal = Signal()
         self.positionUpdate = Signal()
+        self._replaying = False
 
+        replayPath = getattr(self.modrana.args, "replay_location", None)
+        if replayPath:
+            # replay a position log instead of using the device position source
+            self.log.info("replaying position log: %s", replayPath)
+            from . import replay
+
+            replaySpeed = getattr(self.modrana.args, "replay_speed", 1.0)
+            self.provider = replay.Replay(self, replayPath, speed=replaySpeed)
+            self._replaying = True
         # check if the device handles location by itself
-        if not self.modrana.dmod.handles_location:
+        elif not self.modrana.dmod.handles_location:
             method = self.modrana.dmod.location_type
             if method == "qt_mobility":
                 self.log.info("using Qt Mobility")
@@ -83,7 +95,7 @@ class Location(RanaModule):
 
         # only try to update position info if
         # location is enabled
-        if self._enabled and self.provider:
+        if self._enabled and self.provider and not self._replaying:
             self.provider._updateGPSD()
 
             fix = self.provider.getFix()
@@ -105,7 +117,9 @@ class Location(RanaModule):
             # make sure the screen is updated at least once per second
             sFromLastRequest = time() - self.modrana.gui.getLastFullRedrawRequest()
             if sFromLastRequest > 0.85:
-                self.set('needRedraw', True)
+                # the map itself only changes if it is centred on position,
+                # which is handled by the GUI
+                self.invalidateLayers(constants.DRAW_LAYER_MAP_OVERLAY, constants.DRAW_LAYER_SCREEN_OVERLAY)
 
     def _debugCB(self, key, oldValue, newValue):
         if self.provider:
@@ -131,50 +145,37 @@ class Location(RanaModule):
         """
         update position info with new Fix data
         """
-        if fix.position is None:
+        event = FixEvent.from_fix(fix, time())
+        if event.position is None:
             # set fix class to 0 - nothing yet
             self.set('fix', 0)
             # wait for valid data
             return
-        (lat, lon) = fix.position
-        fixClass = 2 # 2D data
-
-        # position
-        self.set('pos', (lat, lon))
-        self.set('pos_source', 'GPSD')
-        # bearing
-        self.set('bearing', float(fix.bearing))
-        # speed
-        #    if speed != None:
-        #      # normal gpsd reports speed in knots per second
-        #      gpsdSpeed = self.get('gpsdSpeedUnit', 'knotsPerSecond')
-        #      if gpsdSpeed == 'knotsPerSecond':
-        #        # convert to meters per second
-        #        speed = float(speed) * 0.514444444444444 # knots/sec to m/sec
-        if fix.speed is not None:
-            self.set('metersPerSecSpeed', fix.speed)
-            self.set('speed', fix.speed * 3.6)
-        else:
-            self.set('metersPerSecSpeed', None)
-            self.set('speed', None)
-            # elevation
-        if fix.altitude is not None:
-            self.set('elevation', fix.altitude)
-            fixClass = 3
-        else:
-            self.set('elevation', None)
 
-        # set fix class
-        # NOTE:
+        # all keys are set at once, so that each watcher
+        # is notified only once & sees the whole fix
+        # NOTE: fix class
         # 0 - no sats
         # 1 - no fix
         # 2 - 2D
         # 3 - 3D
-        self.set("fix", fixClass)
-        # always set this key to current epoch once the location is updated
-        # so that modules can watch it and react on position updates
+        self.modrana.set_many(event.options_items())
         self.positionUpdate(fix)
-        self.set('locationUpdated', time())
+        self.publishFix(event)
+
+    def publishFix(self, event):
+        """Deliver a position update to the fix event subscribers
+
+        Modules should subscribe to constants.EVENT_FIX on the modRana
+        event bus with a maximum rate they need instead of watching
+        the position keys, eq.:
+
+        self.modrana.events.subscribe(constants.EVENT_FIX, self._fixCB, max_rate=1)
+
+        :param event: the position update
+        :type event: core.fix.FixEvent
+        """
+        self.modrana.events.publish(constants.EVENT_FIX, event)
 
     def getFix(self):
         return self.provider.getFix()
@@ -184,7 +185,10 @@ class Location(RanaModule):
         # send the location start signal
         self.startSignal()
         if not self._enabled:
-            if self.modrana.dmod.handles_location:
+            if self._replaying:
+                self.log.info("starting position log replay")
+                self.provider.start(startMainLoop=startMainLoop)
+            elif self.modrana.dmod.handles_location:
                 locationType = self.modrana.dmod.location_type
                 if locationType != "QML":
                     # location startup is handled by the
@@ -206,7 +210,9 @@ class Location(RanaModule):
         # send the location stop signal
         self.stopSignal()
         self.log.info("location: disabling location")
-        if self.modrana.dmod.handles_location:
+        if self._replaying:
+            self.provider.stop()
+        elif self.modrana.dmod.handles_location:
             self.modrana.dmod.stop_location()
         # check if location provider is available,
         # if it is available, stop location
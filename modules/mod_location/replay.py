@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Supplies position info from a GPX or NMEA position log
+#---------------------------------------------------------------------------
+# Copyright 2012, Martin Kolman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------
+from __future__ import with_statement # for python 2.5
+import threading
+
+from .base_position_source import PositionSource
+from core import location_replay
+from core import threads
+from core import constants
+
+import logging
+log = logging.getLogger("mod.location.replay")
+
+
+class Replay(PositionSource):
+    """Replays a recorded position log as if it came from a GPS
+
+    :param location: the location module
+    :param str path: path to a GPX file or a NMEA log
+    :param speed: replay speed multiplier, 0 replays as fast as possible
+    """
+
+    def __init__(self, location, path, speed=1.0):
+        PositionSource.__init__(self, location)
+        self.path = path
+        self.speed = speed
+        self._stopEvent = threading.Event()
+        self._running = False
+        # fixes replayed but not yet handed over to the main loop
+        self._pendingFixes = []
+        self._pendingLock = threading.Lock()
+
+    def start(self, startMainLoop=False):
+        """start replaying the position log"""
+        if self._running:
+            log.warning("position log replay already running")
+            return
+        self._stopEvent.clear()
+        self._running = True
+        t = threads.ModRanaThread(name=constants.THREAD_LOCATION_REPLAY,
+                                  target=self._replay)
+        threads.threadMgr.add(t)
+
+    def stop(self):
+        """stop replaying the position log"""
+        self._stopEvent.set()
+
+    def isRunning(self):
+        return self._running
+
+    def _replay(self):
+        try:
+            fixes = location_replay.read_fixes(self.path)
+            log.info("replaying %d fixes from %s", len(fixes), self.path)
+            count = location_replay.replay(fixes, self._fixCB, self.speed, self._stopEvent)
+            log.info("position log replay finished after %d fixes", count)
+        except location_replay.TracklogParsingFailed:
+            log.error("position log can't be replayed: %s", self.path)
+        except Exception:
+            log.exception("position log replay failed")
+        finally:
+            self._running = False
+
+    def _fixCB(self, fix):
+        # called from the replay thread - the position update runs
+        # stats, turn by turn & redraws, so hand it over to the main loop
+        self.fix = fix
+        with self._pendingLock:
+            scheduled = bool(self._pendingFixes)
+            self._pendingFixes.append(fix)
+        if not scheduled:
+            self.location.modrana._run_on_main_loop(self._updatePositionCB)
+
+    def _updatePositionCB(self):
+        # a fast replay can outrun the main loop, so update the position
+        # with all the fixes replayed since the last idle callback
+        with self._pendingLock:
+            fixes = self._pendingFixes
+            self._pendingFixes = []
+        for fix in fixes:
+            self.location.updatePosition(fix)
+        # one shot idle callback
+        return False
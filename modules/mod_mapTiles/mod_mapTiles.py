@@ -45,6 +45,7 @@ from core.signal import Signal
 from core import threads
 
 from .tile_downloader import Downloader
+from . import tile_fallback
 
 StringIO = six.moves.cStringIO
 
@@ -62,6 +63,10 @@ NORMAL_TILE = "normal"
 LOADING_TILE = "loadingTile"
 COMPOSITE_TILE = "composite"
 SPECIAL_TILE = "special"
+# tile types that contain actual map data
+USABLE_TILE_TYPES = (NORMAL_TILE, COMPOSITE_TILE)
+# tiles stored in place of tiles that failed to download
+DOWNLOAD_ERROR_TILE_TYPES = ("error", "semiPermanentError")
 
 # only import GKT libs if GTK GUI is used
 from core import gs
@@ -145,8 +150,30 @@ class MapTiles(RanaModule):
 
         self._filterTile = self._nop
 
+        # ancestor/descendant tiles drawn in place of tiles that are not yet loaded
+        if self.cacheImageSurfaces:
+            self._fallbackResolver = tile_fallback.FallbackResolver(self._getUsableImage,
+                                                                    self._renderAncestorSurface,
+                                                                    self._renderChildrenSurface)
+        elif tile_fallback.data_rendering_available():
+            self._fallbackResolver = tile_fallback.FallbackResolver(self._getUsableTileData,
+                                                                    tile_fallback.render_ancestor_data,
+                                                                    tile_fallback.render_children_data)
+        else:
+            self.log.info("PIL not available, fallback tiles disabled")
+            self._fallbackResolver = None
+
         self._tileDownloaded = Signal()
 
+        # input tile lzxy -> names of overlay composite tiles waiting for it to be downloaded
+        self._compositeInputs = {}
+        if self.cacheImageSurfaces:
+            self._tileDownloaded.connect(self._compositeInputDownloadedCB)
+        elif self._fallbackResolver is not None:
+            # the GTK GUI invalidates fallback tiles once the downloaded
+            # tile is loaded to the in memory cache
+            self._tileDownloaded.connect(self._invalidateFallbackCB)
+
         self._dlRequestQueue = six.moves.queue.Queue()
         self._downloader = None
 
@@ -246,6 +273,8 @@ class MapTiles(RanaModule):
             # check if the data is actually an image, and not an error page
             if utils.is_the_string_an_image(tileData):
                 self._storeTiles.store_tile_data(lzxy, tileData)
+                if self._fallbackResolver is not None:
+                    self._fallbackResolver.invalidate(lzxy)
                 #        self.log.debug("STORED")
                 return tileData
             else:
@@ -376,6 +405,10 @@ class MapTiles(RanaModule):
                         sprint = self._realDebugLog
                     else:
                         sprint = self._fakeDebugLog
+                    if isinstance(lzxy[0], tuple):
+                        # overlay composite tile
+                        self._loadCompositeTile(lzxy, sprint)
+                        continue
                     sprint("looking for tile %s", lzxy)
                     tileData = self._storeTiles.get_tile_data(lzxy)
                     if not tileData:  # TODO: is this actually needed ?
@@ -564,41 +597,21 @@ class MapTiles(RanaModule):
                                     name = (layerInfo, z, x, y)
                                     tileImage = self.images[0].get(name)
                                     if tileImage:
-                                        # tile found in memory cache, draw it
-                                        drawImage(cr, tileImage[0], x1, y1, scale)
+                                        if tileImage[1]['type'] in USABLE_TILE_TYPES:
+                                            # tile found in memory cache, draw it
+                                            drawImage(cr, tileImage[0], x1, y1, scale)
+                                        elif tileImage[1]['type'] == LOADING_TILE:
+                                            # the tile is still being loaded or downloaded
+                                            self._drawMissingTile(cr, name, tileImage[0], x1, y1, scale)
+                                        else:
+                                            # keep download errors visible
+                                            drawImage(cr, tileImage[0], x1, y1, scale)
                                     else:
                                         # tile not found in memory cache - submit tile loading request
                                         # and draw loading tile
                                         if overlay:
-                                            # check if the separate tiles are already cached
-                                            # and send loading request/-s if not
-                                            # if both tiles are in the cache, combine them, cache and display the result
-                                            # and remove the separate tiles from cache
-                                            layerBack = layerInfo[0][0]
-                                            layerOver = layerInfo[1][0]
-                                            nameBack = (layer1, z, x, y)
-                                            nameOver = (layer2, z, x, y)
-                                            backImage = self.images[0].get(nameBack)
-                                            overImage = self.images[0].get(nameOver)
-                                            if backImage and overImage: # both images available
-                                                # we check the the metadata to filter out the "Downloading... special tiles
-                                                if backImage[1]['type'] == "normal" and overImage[1]['type'] == "normal":
-                                                    # if both tiles are available, combine them remove the old tiles and cache the new one
-                                                    drawImage(cr, self._combine2Tiles(name, backImage[0], nameBack, overImage[0], nameOver, alphaOver), x1, y1, scale)
-                                                else: # on or more tiles not usable
-                                                    # so at least draw a combined image
-                                                    self._drawCompositeImage(cr, backImage[0], overImage[0], x1, y1, scale, alpha1=alphaOver)
-                                            else:
-                                                if backImage:
-                                                    requests.append(((layerBack, z, x, y), None))
-                                                    self.storeInMemory(loadingTileImageSurface, nameBack, imageType=LOADING_TILE)
-                                                elif overImage:
-                                                    requests.append(((layerOver, z, x, y), None))
-                                                    self.storeInMemory(loadingTileImageSurface, nameOver, imageType=LOADING_TILE)
-                                                else:
-                                                    requests.append(((layerBack, z, x, y), None))
-                                                    requests.append(((layerOver, z, x, y), None))
-                                                drawImage(cr, loadingTileImageSurface, x1, y1, scale)
+                                            # the composite tile is built by the tile loading manager thread
+                                            self._requestCompositeTile(cr, name, loadingTileImageSurface, x1, y1, scale, requests)
                                         else:
                                             # tile not found in memory cache, add a loading request
                                             requests.append(((layerInfo, z, x, y), None))
@@ -606,7 +619,7 @@ class MapTiles(RanaModule):
                                             # request over and over again (the tile request queue is using a stack,
                                             # so this would really not make sense)
                                             self.storeInMemory(loadingTileImageSurface, name, imageType=LOADING_TILE)
-                                            drawImage(cr, loadingTileImageSurface, x1, y1, scale)
+                                            self._drawMissingTile(cr, name, loadingTileImageSurface, x1, y1, scale)
 
                         gui = self.modrana.gui
                         if gui and gui.getIDString() == "GTK":
@@ -647,40 +660,20 @@ class MapTiles(RanaModule):
                                 name = (layerInfo, z, x, y)
                                 tileImage = self.images[0].get(name)
                                 if tileImage:
-                                    # tile found in memory cache, draw it
-                                    drawImage(cr, tileImage[0], x1, y1, scale)
+                                    if tileImage[1]['type'] in USABLE_TILE_TYPES:
+                                        # tile found in memory cache, draw it
+                                        drawImage(cr, tileImage[0], x1, y1, scale)
+                                    elif tileImage[1]['type'] == LOADING_TILE:
+                                        # the tile is still being loaded or downloaded
+                                        self._drawMissingTile(cr, name, tileImage[0], x1, y1, scale)
+                                    else:
+                                        # keep download errors visible
+                                        drawImage(cr, tileImage[0], x1, y1, scale)
                                 else:
                                     # tile not found im memory cache, do something else
                                     if overlay:
-                                        # check if the separate tiles are already cached
-                                        # and send loading request/-s if not
-                                        # if both tiles are in the cache, combine them, cache and display the result
-                                        # and remove the separate tiles from cache
-                                        layerBack = layerInfo[0][0]
-                                        layerOver = layerInfo[1][0]
-                                        nameBack = (layer1, z, x, y)
-                                        nameOver = (layer2, z, x, y)
-                                        backImage = self.images[0].get(nameBack)
-                                        overImage = self.images[0].get(nameOver)
-                                        if backImage and overImage: # both images available
-                                            # we check the the metadata to filter out the "Downloading..." special tiles
-                                            if backImage[1]['type'] == "normal" and overImage[1]['type'] == "normal":
-                                                # if both tiles are available, combine them remove the old tiles and cache the new one
-                                                drawImage(cr, self._combine2Tiles(name, backImage[0], nameBack, overImage[0], nameOver, alphaOver), x1, y1, scale)
-                                            else: # on or more tiles not usable
-                                                # so at least draw a combined image
-                                                self._drawCompositeImage(cr, backImage[0], overImage[0], x1, y1, scale, alpha1=alphaOver)
-                                        else:
-                                            if backImage:
-                                                requests.append(((layerBack, z, x, y), None))
-                                                self.storeInMemory(loadingTileImageSurface, nameBack, imageType=LOADING_TILE)
-                                            elif overImage:
-                                                requests.append(((layerOver, z, x, y), None))
-                                                self.storeInMemory(loadingTileImageSurface, nameOver, imageType=LOADING_TILE)
-                                            else:
-                                                requests.append(((layerBack, z, x, y), None))
-                                                requests.append(((layerOver, z, x, y), None))
-                                            drawImage(cr, loadingTileImageSurface, x1, y1, scale)
+                                        # the composite tile is built by the tile loading manager thread
+                                        self._requestCompositeTile(cr, name, loadingTileImageSurface, x1, y1, scale, requests)
                                     else:
                                         # tile not found in memory cache, add a loading request
                                         requests.append(((layerInfo, z, x, y), None))
@@ -688,7 +681,7 @@ class MapTiles(RanaModule):
                                         # request over and over again (the tile request queue is using a stack,
                                         # so this would really not make sense)
                                         self.storeInMemory(loadingTileImageSurface, name, imageType=LOADING_TILE)
-                                        drawImage(cr, loadingTileImageSurface, x1, y1, scale)
+                                        self._drawMissingTile(cr, name, loadingTileImageSurface, x1, y1, scale)
             if requests:
                 self._dlRequestQueue.put(requests)
 
@@ -704,24 +697,215 @@ class MapTiles(RanaModule):
         cr.paint()
         cr.restore() # Return the cairo projection to what it was
 
-    def _combine2Tiles(self, name, backImage, nameBack, overImage, nameOver, alphaOver):
-        # transparently combine two tiles
-        # WARNING: this modifies the backImage ImageSurface !
+    def _drawMissingTile(self, cr, name, placeholder, x, y, scale):
+        """Draw a fallback tile made from already loaded tiles
+        from neighbouring zoom levels or the placeholder tile
+        if no such tiles are available
 
-        # combine the two images
-        ct = cairo.Context(backImage)
-        ct2 = gtk.gdk.CairoContext(ct)
-        ct2.set_source_surface(overImage, 0, 0)
-        ct2.paint_with_alpha(alphaOver)
-
-        #drop the two individual images
-        # remove the separate images from cache
-        self.removeImageFromMemory(nameBack)
-        self.removeImageFromMemory(nameOver)
-        # cache the combined image
-        self.storeInMemory(backImage, name, imageType=COMPOSITE_TILE)
-        # return the composite image
-        return backImage
+        NOTE: the in memory tile cache is expected to be already locked
+        """
+        if isinstance(name[0], tuple) and self._drawCompositeInputs(cr, name, x, y, scale):
+            return
+        fallback = None
+        if self._fallbackResolver is not None and self.get('drawFallbackTiles', True):
+            fallback = self._fallbackResolver.get(name)
+        if fallback is not None:
+            self._drawImage(cr, fallback, x, y, scale)
+        else:
+            self._drawImage(cr, placeholder, x, y, scale)
+
+    def _getUsableImage(self, lzxy):
+        """Return tile image surface from the in memory cache
+        if it contains actual map data
+
+        :param tuple lzxy: tile description tuple
+        :returns: cairo image surface or None
+        """
+        cacheItem = self.images[0].get(lzxy)
+        if cacheItem and cacheItem[1]['type'] in USABLE_TILE_TYPES:
+            return cacheItem[0]
+        else:
+            return None
+
+    def _getUsableTileData(self, lzxy):
+        """Return locally available tile data without triggering a download"""
+        return self.getTile(lzxy, download=False)
+
+    def _renderAncestorSurface(self, surface, cropX, cropY, cropSize):
+        """Crop the given part of an ancestor tile and scale it to a tile sized surface"""
+        tileSurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.tileSide, self.tileSide)
+        ct = cairo.Context(tileSurface)
+        ct.scale(1.0 / cropSize, 1.0 / cropSize)
+        ct.set_source_surface(surface, -cropX * surface.get_width(), -cropY * surface.get_height())
+        ct.paint()
+        return tileSurface
+
+    def _renderChildrenSurface(self, children):
+        """Scale child tiles down to a tile sized surface"""
+        tileSurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.tileSide, self.tileSide)
+        ct = cairo.Context(tileSurface)
+        for surface, positionX, positionY in children:
+            ct.save()
+            ct.translate(positionX * self.tileSide, positionY * self.tileSide)
+            ct.scale(0.5 * self.tileSide / surface.get_width(), 0.5 * self.tileSide / surface.get_height())
+            ct.set_source_surface(surface, 0, 0)
+            ct.paint()
+            ct.restore()
+        return tileSurface
+
+    def getFallbackTileData(self, lzxy):
+        """Return a PNG fallback tile made from locally available tiles
+        from neighbouring zoom levels
+
+        :param tuple lzxy: tile description tuple
+        :returns: PNG image data or None if no fallback tile is available
+        """
+        if self.cacheImageSurfaces or self._fallbackResolver is None:
+            return None
+        if not self.get('drawFallbackTiles', True):
+            return None
+        return self._fallbackResolver.get(lzxy)
+
+    def _requestCompositeTile(self, cr, name, placeholder, x, y, scale, requests):
+        """Request an overlay composite tile to be built & draw
+        a temporary tile in its place
+
+        NOTE: the in memory tile cache is expected to be already locked
+
+        :param tuple name: composite tile name - ((back layer, alpha), (overlay layer, alpha)), z, x, y
+        """
+        requests.append((name, None))
+        # cache a loading tile so that the composite is requested only once
+        self.storeInMemory(placeholder, name, imageType=LOADING_TILE)
+        self._drawMissingTile(cr, name, placeholder, x, y, scale)
+
+    def _drawCompositeInputs(self, cr, name, x, y, scale):
+        """Draw the input tiles of a composite tile that is not yet built
+        if they are in memory (eq. from before overlay was enabled),
+        the base layer tile is drawn alone if the overlay tile is not available
+
+        NOTE: the in memory tile cache is expected to be already locked
+
+        :returns: True if the input tiles were drawn, False otherwise
+        :rtype: bool
+        """
+        (((layerBack, alphaBack), (layerOver, alphaOver)), z, tileX, tileY) = name
+        backImage = self._getUsableImage((layerBack, z, tileX, tileY))
+        overImage = self._getUsableImage((layerOver, z, tileX, tileY))
+        if backImage is None:
+            return False
+        self._drawCompositeImage(cr, backImage, overImage, x, y, scale, alpha1=alphaOver, alpha2=alphaBack)
+        return True
+
+    def _loadCompositeTile(self, name, sprint):
+        """Build an overlay composite tile from its input tiles & cache it
+
+        The input tiles are taken from the in memory cache or from local storage
+        and are not cached separately. Missing input tiles are downloaded and
+        the composite is built once the downloads finish. If the overlay tile
+        can't be downloaded or downloading is disabled, the composite is built
+        from the base layer tile alone.
+
+        NOTE: this is run by the tile loading manager thread, not the UI thread
+
+        :param tuple name: composite tile name
+        """
+        (layerInfo, z, x, y) = name
+        surfaces = []
+        missing = []
+        baseMissing = False
+        for index, (layer, alpha) in enumerate(layerInfo):
+            lzxy = (layer, z, x, y)
+            with self.imagesLock:
+                cacheItem = self.images[0].get(lzxy)
+            if cacheItem:
+                imageType = cacheItem[1]['type']
+                if imageType in USABLE_TILE_TYPES:
+                    surfaces.append((cacheItem[0], alpha))
+                    continue
+                elif imageType in DOWNLOAD_ERROR_TILE_TYPES:
+                    if index == 0:
+                        # show the base layer download error in place of the composite
+                        self.storeInMemory(cacheItem[0], name, imageType, cacheItem[1].get('expireTimestamp'))
+                        return
+                    else:
+                        sprint("overlay tile %s not available - building composite without it", lzxy)
+                        continue
+            tileData = self._storeTiles.get_tile_data(lzxy)
+            if tileData:
+                surfaces.append((self._data2cairoImageSurface(tileData), alpha))
+            else:
+                missing.append(lzxy)
+                if index == 0:
+                    baseMissing = True
+
+        if missing and self.get('network', 'full') != 'full':
+            if baseMissing:
+                sprint("auto tile dl disabled - can't build composite %s", name)
+                return
+            sprint("auto tile dl disabled - building composite %s without overlay", name)
+        elif missing:
+            downloads = []
+            with self.imagesLock:
+                for lzxy in missing:
+                    waiting = self._compositeInputs.get(lzxy)
+                    if waiting is None:
+                        waiting = self._compositeInputs[lzxy] = set()
+                        downloads.append(lzxy)
+                    waiting.add(name)
+            for lzxy in downloads:
+                sprint("downloading composite input tile %s", lzxy)
+                droppedRequest = self._downloader.downloadTile(lzxy)
+                if droppedRequest:
+                    self.tileDownloaded(constants.TILE_DOWNLOAD_QUEUE_FULL, droppedRequest[0], droppedRequest[1])
+            return
+
+        sprint("building composite tile %s", name)
+        self.storeInMemory(self._compositeSurfaces(surfaces), name, imageType=COMPOSITE_TILE)
+        # the composite replaces the input tiles, so they don't need
+        # to take space in the in memory cache anymore
+        with self.imagesLock:
+            for layer, alpha in layerInfo:
+                self.images[0].pop((layer, z, x, y), None)
+
+    def _compositeSurfaces(self, surfaces):
+        """Blend (surface, alpha) pairs to a new tile sized surface"""
+        tileSurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.tileSide, self.tileSide)
+        ct = cairo.Context(tileSurface)
+        for surface, alpha in surfaces:
+            ct.set_source_surface(surface, 0, 0)
+            ct.paint_with_alpha(alpha)
+        return tileSurface
+
+    def _compositeInputDownloadedCB(self, error, lzxy, tag):
+        """Build composites waiting for a downloaded input tile"""
+        with self.imagesLock:
+            names = self._compositeInputs.pop(lzxy, None)
+            if not names:
+                return
+            if error != constants.TILE_DOWNLOAD_SUCCESS:
+                cacheItem = self.images[0].get(lzxy)
+                downloadFailed = cacheItem and cacheItem[1]['type'] in DOWNLOAD_ERROR_TILE_TYPES
+                failedOverlays = []
+                for name in names:
+                    if not downloadFailed:
+                        # drop the composite loading tile so that the composite
+                        # is requested again if it is still visible
+                        self.images[0].pop(name, None)
+                    elif name[0][0][0] == lzxy[0]:
+                        # show the base layer download error in place of the composite
+                        self.images[0][name] = cacheItem
+                    else:
+                        # build the composite from the base layer tile alone
+                        failedOverlays.append(name)
+                names = failedOverlays
+        if names:
+            self._dlRequestQueue.put([(name, None) for name in names])
+
+    def _invalidateFallbackCB(self, error, lzxy, tag):
+        """Drop fallback tiles the downloaded tile replaces or could improve"""
+        if error == constants.TILE_DOWNLOAD_SUCCESS:
+            self._fallbackResolver.invalidate(lzxy)
 
     def removeImageFromMemory(self, name, dictIndex=0):
         """Remove a tile from the in memory tile cache"""
@@ -746,8 +930,9 @@ class MapTiles(RanaModule):
         # Display the image
         cr.set_source_surface(backImage, 0, 0) # draw the background
         cr.paint_with_alpha(alpha2)
-        cr.set_source_surface(overImage, 0, 0) # draw the overlay
-        cr.paint_with_alpha(alpha1)
+        if overImage is not None:
+            cr.set_source_surface(overImage, 0, 0) # draw the overlay
+            cr.paint_with_alpha(alpha1)
 
         # Return to the cairo projection to what it was before
         cr.restore()
@@ -837,6 +1022,8 @@ class MapTiles(RanaModule):
             metadata['expireTimestamp'] = expireTimestamp
         with self.imagesLock: #make sure no one fiddles with the cache while we are working with it
             self.images[dictIndex][name] = (surface, metadata) # store the image in memory
+            if imageType in USABLE_TILE_TYPES and self._fallbackResolver is not None:
+                self._fallbackResolver.invalidate(name)
 
             # check cache size,
             # if there are too many images, delete them
@@ -853,9 +1040,9 @@ class MapTiles(RanaModule):
             overlay = self.get('overlay', False)
             if overlay: # only redraw when a composited tile is loaded with overlay on
                 if imageType == COMPOSITE_TILE:
-                    self.set('needRedraw', True)
+                    self.invalidateLayers(constants.DRAW_LAYER_MAP)
             else: # redraw regardless of type with overlay off
-                self.set('needRedraw', True)
+                self.invalidateLayers(constants.DRAW_LAYER_MAP)
 
     def _trimCache(self):
         """To avoid a memory leak, the maximum size of the image cache is fixed
@@ -886,6 +1073,8 @@ class MapTiles(RanaModule):
         with self.imagesLock:
             self.log.info('fully clearing the in memory tile cache (%d tiles)', len(self.images[0]))
             self.images[0] = {}
+        if self._fallbackResolver is not None:
+            self._fallbackResolver.clear()
 
     def _removeTilesFromCache(self, imageTypes):
         """Remove tiles of the given types from the in memory tile cache.
@@ -1052,6 +1241,13 @@ class MapTiles(RanaModule):
     #    self.log.debug("tile negative in %1.2f ms" % (1000 * (time.clock() - start1)))
 
     def _mapStateChangedCB(self, key, oldValue, newValue):
+        if key in ("overlay", "layer", "layer2"):
+            # composites waiting for downloads might no longer be needed
+            with self.imagesLock:
+                self._compositeInputs.clear()
+        if key in ("overlay", "layer", "layer2") and self._fallbackResolver is not None:
+            # fallback tiles of the previous layer are not needed anymore
+            self._fallbackResolver.clear()
         if key == "overlay":
             if newValue:
                 # for some reason we need to drop the cache or else overlay won't
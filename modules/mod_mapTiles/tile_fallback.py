@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Fallback images for map tiles that are not yet loaded
+
+When a tile is not yet available, an already available tile from a lower
+zoom level (an ancestor) is cropped and scaled up to its place or the tiles
+from the next zoom level (its children) are scaled down to its place,
+so that the map is not blank while tiles are being loaded or downloaded.
+
+Finding the fallback tiles is independent of the image format, the actual
+rendering is done by callables provided by the GUI specific code. Rendering
+from & to encoded tile data is provided here for GUIs that don't have any
+image handling of their own (the Qt 5 GUI) - it is only available if PIL
+is installed.
+
+Rendered fallback tiles are kept in a bounded LRU cache.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import logging
+log = logging.getLogger("mod.mapTiles.fallback")
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# how many zoom levels up to look for an ancestor tile
+MAX_ANCESTOR_LEVELS = 4
+# how many rendered fallback tiles to keep
+FALLBACK_CACHE_SIZE = 32
+
+TILE_SIZE = 256
+
+
+def get_ancestors(z, x, y, max_levels=MAX_ANCESTOR_LEVELS):
+    """Return ancestor tiles of a tile, nearest first
+
+    The part of the ancestor tile covered by the tile is described as
+    a square in tile fractions - top left corner coordinates and side.
+
+    :returns: list of (z, x, y, crop x, crop y, crop size) tuples
+    :rtype: list
+    """
+    ancestors = []
+    for dz in range(1, max_levels + 1):
+        if z - dz < 0:
+            break
+        ax = x >> dz
+        ay = y >> dz
+        size = 1.0 / (1 << dz)
+        ancestors.append((z - dz, ax, ay, (x - (ax << dz)) * size, (y - (ay << dz)) * size, size))
+    return ancestors
+
+
+def get_children(z, x, y):
+    """Return the four child tiles of a tile
+
+    Child tile position in the tile is in tile fractions,
+    each child covers a quarter of the tile.
+
+    :returns: list of (z, x, y, position x, position y) tuples
+    :rtype: list
+    """
+    return [(z + 1, 2 * x + i, 2 * y + j, i * 0.5, j * 0.5) for j in (0, 1) for i in (0, 1)]
+
+
+class FallbackResolver(object):
+    """Find available tiles that can stand in for a missing tile and render them
+
+    :param lookup: callable returning the image for a lzxy tuple if available
+                   locally, None otherwise
+    :param render_ancestor: callable rendering a fallback tile from an ancestor
+                            image & crop x, crop y and crop size (see get_ancestors())
+    :param render_children: callable rendering a fallback tile from a list of
+                            (child image, position x, position y) tuples (see get_children())
+    :param int max_levels: how many zoom levels up to look for ancestor tiles
+    :param int cache_size: how many rendered fallback tiles to keep
+    """
+
+    def __init__(self, lookup, render_ancestor, render_children,
+                 max_levels=MAX_ANCESTOR_LEVELS, cache_size=FALLBACK_CACHE_SIZE):
+        self._lookup = lookup
+        self._render_ancestor = render_ancestor
+        self._render_children = render_children
+        self._max_levels = max_levels
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, lzxy):
+        """Return a fallback image for the given tile
+
+        The tile children are used if all of them are available,
+        followed by the nearest available ancestor and any available children.
+
+        :param tuple lzxy: tile description tuple
+        :returns: rendered fallback image or None if no usable tiles are available
+        """
+        with self._lock:
+            image = self._cache.pop(lzxy, None)
+            if image is not None:
+                self._cache[lzxy] = image
+                return image
+        layer, z, x, y = lzxy
+        children = []
+        for cz, cx, cy, px, py in get_children(z, x, y):
+            child = self._lookup((layer, cz, cx, cy))
+            if child is not None:
+                children.append((child, px, py))
+        if len(children) == 4:
+            return self._store(lzxy, self._render_children(children))
+        for az, ax, ay, crop_x, crop_y, crop_size in get_ancestors(z, x, y, self._max_levels):
+            ancestor = self._lookup((layer, az, ax, ay))
+            if ancestor is not None:
+                return self._store(lzxy, self._render_ancestor(ancestor, crop_x, crop_y, crop_size))
+        if children:
+            # don't cache incomplete fallback tiles, the other
+            # children might become available in the meantime
+            return self._render_children(children)
+        return None
+
+    def _store(self, lzxy, image):
+        if image is None:
+            return None
+        with self._lock:
+            self._cache[lzxy] = image
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return image
+
+    def invalidate(self, lzxy):
+        """Drop fallback images a newly available tile replaces or could improve
+
+        These are the fallback image for the tile itself, for its parent
+        (made from its children) and for its descendants (made from an ancestor).
+
+        :param tuple lzxy: tile description tuple of the newly available tile
+        """
+        layer, z, x, y = lzxy
+        with self._lock:
+            for key in list(self._cache):
+                k_layer, k_z, k_x, k_y = key
+                if k_layer != layer:
+                    continue
+                dz = k_z - z
+                if dz == -1:
+                    if (x >> 1, y >> 1) == (k_x, k_y):
+                        del self._cache[key]
+                elif 0 <= dz <= self._max_levels:
+                    if (k_x >> dz, k_y >> dz) == (x, y):
+                        del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def data_rendering_available():
+    """Report if fallback tiles can be rendered from & to encoded tile data"""
+    return Image is not None
+
+
+def _encode(image):
+    output = BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+def render_ancestor_data(data, crop_x, crop_y, crop_size):
+    """Render a fallback tile from encoded ancestor tile data
+
+    :returns: PNG encoded fallback tile
+    """
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    box = (int(crop_x * width), int(crop_y * height),
+           int((crop_x + crop_size) * width), int((crop_y + crop_size) * height))
+    return _encode(image.convert("RGBA").crop(box).resize((TILE_SIZE, TILE_SIZE), Image.BILINEAR))
+
+
+def render_children_data(children):
+    """Render a fallback tile from encoded child tile data
+
+    :returns: PNG encoded fallback tile
+    """
+    tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE))
+    half = TILE_SIZE // 2
+    for data, position_x, position_y in children:
+        child = Image.open(BytesIO(data)).convert("RGBA").resize((half, half), Image.BILINEAR)
+        tile.paste(child, (int(position_x * TILE_SIZE), int(position_y * TILE_SIZE)))
+    return _encode(tile)
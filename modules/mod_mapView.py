@@ -19,6 +19,7 @@
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
 from core import color
+from core import constants
 from core import geo
 
 def getModule(*args, **kwargs):
@@ -171,6 +172,7 @@ class MapView(RanaModule):
 
     def _drawGridEnabledCB(self, key, oldKey, newKey):
         self.drawGrid = newKey
+        self._updateGridRedrawOnPan()
 
     def _drawGridColorCB(self, key, oldKey, newKey):
         if newKey is not None:
@@ -183,6 +185,14 @@ class MapView(RanaModule):
     def _drawGridLabelsCB(self, key, oldKey, newKey):
         if newKey is not None:
             self.drawGridLabels = newKey
+            self._updateGridRedrawOnPan()
+
+    def _updateGridRedrawOnPan(self):
+        """grid labels are drawn along the screen edges, so the map overlay
+        can't be just translated when the map is panned while they are shown"""
+        if self.modrana.gui:
+            labelsShown = bool(self.drawGrid and self.drawGridLabels)
+            self.modrana.gui.setRedrawOnPan(constants.DRAW_LAYER_MAP_OVERLAY, labelsShown)
 
     def _drawGrid(self, cr):
         proj = self.m.get('projection', None)
@@ -20,6 +20,8 @@
 from modules.base_module import RanaModule
 import math
 from core import geo
+from core import point_overlay
+from core import render_cache
 from core.color import Color
 
 import logging
@@ -36,6 +38,7 @@ class Markers(RanaModule):
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
         self.groups = {} # marker groups
+        self._overlay = point_overlay.PointOverlay()
 
     def addGroup(self, name, points, menu=False):
         """Add a marker group
@@ -108,44 +111,89 @@ class Markers(RanaModule):
             self.clearAll()
 
     def drawMapOverlay(self, cr):
-        if self.groups:
-            pos = self.get('pos', None)
-            units = self.m.get('units', None)
-            proj = self.m.get('projection', None)
-            crPosUnitsProj = (cr, pos, units, proj)
-            for key in self.groups.keys(): # draw all groups
-                group = self.groups[key]
-                menu = group.getMenuEnabled()
+        proj = self.m.get('projection', None)
+        if self.groups and proj:
+            # points of all groups are clustered & indexed once they change
+            # and only the clusters in the visible area are drawn
+            keys = sorted(self.groups.keys())
+            version = tuple((key, id(self.groups[key]), len(self.groups[key].getPoints())) for key in keys)
+            self._overlay.set_points(version, lambda: self._getOverlayPoints(keys))
+            zoom = proj.zoom
+            (x1, y1, x2, y2, originX, originY) = proj.getGlobalPixelView()
+            # captions include distance from current position
+            labelKey = (self.get('pos', None), self.get('unitType', None))
+            clusters = self._overlay.query(zoom, x1, y1, x2, y2, proj.scale,
+                                           lambda cluster: self._captionBox(cr, cluster), labelKey)
+            click = self.m.get('clickHandler', None)
+            for cluster in clusters:
+                (key, index) = self._overlay.get_item(cluster)
+                group = self.groups.get(key)
+                if group is None:
+                    continue
                 colors = group.getColors()
-
-                index = 0
-                for point, highlight in group.getPoints(): # draw all points in group
-                    if menu:
-                        # key contains the point group name, it should be the same
-                        # as the corresponding listable menu name
-                        action = "set:menu:menu#listDetail#%s#%d" % (key, index)
-                    else:
-                        action = ""
-                    if highlight:
-                        self._drawPoint(crPosUnitsProj, point, colors, action=action, highlight=True)
-                    else:
-                        self._drawPoint(crPosUnitsProj, point, colors, action=action)
-                    index += 1
-
-    def _drawPoint(self, crPosUnitsProj, point, colors, distance=True, action="", highlight=False):
-        (cr, pos, units, proj) = crPosUnitsProj
-        (lat, lon) = point.getLL() #TODO use getLLE for 3D distance
-        (lat1, lon1) = pos # current position coordinates
-        kiloMetricDistance = geo.distance(lat, lon, lat1, lon1)
-        unitString = units.km2CurrentUnitString(kiloMetricDistance, 0, True)
+                x = cluster.x - originX
+                y = cluster.y - originY
+                if cluster.count > 1:
+                    # use the background color of the first point in the cluster
+                    point_overlay.draw_cluster_badge(cr, x, y, cluster.count, colors[0].getCairoColor())
+                    if click:
+                        # zoom in on the cluster so that it splits
+                        r = point_overlay.CLUSTER_BADGE_RADIUS
+                        click.registerXYWH(x - r, y - r, 2 * r, 2 * r,
+                                           'mapView:recentre %f %f %d' %
+                                           (cluster.lat, cluster.lon, zoom + point_overlay.CLUSTER_LEVELS))
+                    continue
+                (point, highlight) = group.getPoints()[index]
+                if group.getMenuEnabled():
+                    # key contains the point group name, it should be the same
+                    # as the corresponding listable menu name
+                    action = "set:menu:menu#listDetail#%s#%d" % (key, index)
+                else:
+                    action = ""
+                self._drawPoint(cr, x, y, colors, highlight=highlight)
+                # captions colliding with other captions are not drawn
+                if cluster.label is not None:
+                    (lx1, ly1, lx2, ly2) = cluster.label
+                    self._drawCaption(cr, x, y, (lx1 - originX, ly1 - originY, lx2 - lx1, ly2 - ly1),
+                                      self._getCaption(point), colors, action)
+
+    def _getOverlayPoints(self, keys):
+        points = []
+        for key in keys:
+            for index, (point, highlight) in enumerate(self.groups[key].getPoints()):
+                (lat, lon) = point.getLL()
+                points.append((lat, lon, (key, index)))
+        return points
+
+    def _getCaption(self, point, distance=True):
+        """Return point caption - name & optionally distance from current position"""
+        pos = self.get('pos', None)
+        units = self.m.get('units', None)
         if distance and pos and units:
+            (lat, lon) = point.getLL() #TODO use getLLE for 3D distance
+            (lat1, lon1) = pos # current position coordinates
+            kiloMetricDistance = geo.distance(lat, lon, lat1, lon1)
+            unitString = units.km2CurrentUnitString(kiloMetricDistance, 0, True)
             distanceString = " (%s)" % unitString
         else:
             distanceString = ""
+        return "%s%s" % (point.name, distanceString)
 
-        text = "%s%s" % (point.name, distanceString)
+    def _captionBox(self, cr, cluster):
+        """Return caption (dx, dy, w, h) relative to the point for label placement"""
+        if cluster.count > 1:
+            return None
+        (key, index) = self._overlay.get_item(cluster)
+        group = self.groups.get(key)
+        if group is None:
+            return None
+        (point, highlight) = group.getPoints()[index]
+        extents = render_cache.text_cache.text_extents(cr, self._getCaption(point), 25) # get the text extents
+        (w, h) = (extents[2], extents[3])
+        border = 2
+        return 12 - border, border + 6 - h * 1.2, w + 4 * border, h * 1.4
 
-        (x, y) = proj.ll2xy(lat, lon)
+    def _drawPoint(self, cr, x, y, colors, highlight=False):
         # get colors
         (bgColor, textColor) = colors
 
@@ -167,15 +215,13 @@ class Markers(RanaModule):
         cr.arc(x, y, 2, 0, 2.0 * math.pi)
         cr.stroke()
 
+    def _drawCaption(self, cr, x, y, rect, text, colors, action=""):
         # draw a caption with transparent background
-        cr.set_font_size(25)
-        extents = cr.text_extents(text) # get the text extents
-        (w, h) = (extents[2], extents[3])
-        border = 2
+        (bgColor, textColor) = colors
+        (rx, ry, rw, rh) = rect
         cr.set_line_width(2)
 
         cr.set_source_rgba(*bgColor.getCairoColor()) # trasparent blue
-        (rx, ry, rw, rh) = (x - border + 12, y + border + h * 0.2 + 6, w + 4 * border, -(h * 1.4))
         cr.rectangle(rx, ry, rw, rh) # create the transparent background rectangle
         cr.fill()
 
@@ -183,11 +229,12 @@ class Markers(RanaModule):
         click = self.m.get('clickHandler', None)
         if click:
             # make the POI caption clickable
-            click.registerXYWH(rx, ry - (-rh), rw, -rh, action)
+            click.registerXYWH(rx, ry, rw, rh, action)
         cr.fill()
 
         # draw the actual text
         cr.set_source_rgba(*textColor.getCairoColor()) # slightly transparent white
+        cr.set_font_size(25)
         cr.move_to(x + 15, y + 7)
         cr.show_text(text) # show the transparent result caption
         cr.stroke()
@@ -22,6 +22,7 @@ import time
 import math
 from core import geo, constants
 from core import utils
+from core import render_cache
 
 # only import GKT libs if GTK GUI is used
 from core import gs
@@ -303,6 +304,21 @@ class Menus(RanaModule):
             w *= (1 - 2 * border)
             h *= (1 - 2 * border)
 
+        # the same captions are drawn every frame, so they are drawn
+        # from the label atlas once rendered
+        color = rgbaColor
+        if color is None:
+            color = render_cache.source_color(cr)
+        (labelW, labelH) = (int(math.ceil(w)), int(math.ceil(h)))
+        if color is None or labelW <= 0 or labelH <= 0:
+            self._drawTextDirect(cr, text, x, y, w, h, rgbaColor)
+        else:
+            key = ("menuText", text, labelW, labelH, color)
+            render_cache.label_atlas.draw(cr, key, x, y, labelW, labelH,
+                                          lambda ct: self._drawTextDirect(ct, text, 0, 0, w, h, color))
+
+    def _drawTextDirect(self, cr, text, x, y, w, h, rgbaColor=None):
+        """Draw text centered to the given area using Pango"""
         # get a pangocairo context
         pg = pangocairo.CairoContext(cr)
         layout = pg.create_layout()
@@ -998,6 +1014,7 @@ class Menus(RanaModule):
         self.clearMenu('searchWhat')
         self.addItem('searchWhat', 'online#address', 'generic', 'search:searchAddress')
         self.addItem('searchWhat', 'online#wikipedia', 'generic', 'search:searchWikipedia')
+        self.addItem('searchWhat', 'stored#POI', 'generic', 'search:searchPOI')
         self.addItem('searchWhat', 'online#presets', 'generic', 'set:menu:searchWhere')
         self.addItem('searchWhat', 'results#clear all', 'generic', 'search:clearSearch|set:menu:None')
 
@@ -1433,8 +1450,8 @@ class Menus(RanaModule):
         )
 
     def boxedText(self, cr, x, y, text, size=12, align=1, border=2, fg=(0, 0, 0, 1), bg=(1, 1, 1, 1)):
+        extents = render_cache.text_cache.text_extents(cr, text, 12)
         cr.set_font_size(12)
-        extents = cr.text_extents(text)
         (w, h) = (extents[2], extents[3])
 
         x1 = x
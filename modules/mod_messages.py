@@ -49,8 +49,8 @@ class MessageModule(RanaModule):
                 self.set(text, not self.get(text, 0))
 
             elif module == "*": # send to all modules
-                for m in self.m.items():
-                    m.handleMessage(text)
+                # modules not yet loaded get the message once loaded
+                self.m.broadcast(text)
 
             elif module == 'ms': # short for message + single simple string
                 # Example:
@@ -18,10 +18,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
 from core import constants
+from core import elevation
 from core import point
 from core import threads
 from modules.base_module import RanaModule
 import traceback
+import os
 import sys
 import re
 import threading
@@ -31,10 +33,13 @@ from . import geonames
 from . import local_search
 from . import online_providers
 from . import offline_providers
+from . import result_cache
 
 import logging
 log = logging.getLogger("mod.onlineServices")
 
+RESULT_CACHE_FILENAME = "search_result_cache.sqlite"
+
 def getModule(*args, **kwargs):
     return OnlineServices(*args, **kwargs)
 
@@ -50,6 +55,18 @@ class OnlineServices(RanaModule):
         self._connectingCondition = threading.Condition()
         # TODO: move to location ?
         self._initGPSCondition = threading.Condition()
+        self._resultCache = None
+        self._resultCacheFailed = False
+        # result cache key -> callbacks waiting for an in-progress search
+        self._inFlight = {}
+        self._inFlightLock = threading.Lock()
+        self._elevationProvider = None
+
+    def shutdown(self):
+        if self._resultCache:
+            self._resultCache.close()
+        if self._elevationProvider:
+            self._elevationProvider.close()
 
 
     #  # testing
@@ -63,6 +80,12 @@ class OnlineServices(RanaModule):
             # * make sure there are no results returned after the button is pressed
             # * remove the cancel button and the "working" overlay
             self.stop()
+        elif messageType == 'ml' and message == "importElevationData":
+            # import SRTM HGT files, zip archives with HGT files
+            # or folders containing them
+            # format: path;path;...
+            if args:
+                self.importElevationData(args)
 
     def _disableOverlay(self):
         """disable the "working" overlay + disable the timestamp"""
@@ -85,8 +108,8 @@ class OnlineServices(RanaModule):
             provider = online_providers.GeocodingNominatim()
         #provider = online_providers.TestingProvider()
 
-        provider.searchAsync(callback, term=address)
-        return provider.threadName
+        key = result_cache.make_key(provider.__class__.__name__, query=address)
+        return self._searchAsync(provider, key, callback, term=address)
 
     def reverseGeocoding(self, searchPoint, callback):
         """Synchronous reverse geocoding"""
@@ -95,8 +118,11 @@ class OnlineServices(RanaModule):
     def reverseGeocodeAsync(self, searchPoint, callback):
         """Asynchronous reverse geocoding"""
         provider = online_providers.ReverseGeocodingNominatim()
-        provider.searchAsync(callback, term=searchPoint)
-        return provider.threadName
+        # nearby points share the cached result
+        key = result_cache.make_key(provider.__class__.__name__,
+                                    location=(searchPoint.lat, searchPoint.lon),
+                                    cell_size=result_cache.REVERSE_GEOCODING_CELL_SIZE)
+        return self._searchAsync(provider, key, callback, term=searchPoint)
 
     def localSearch(self, term, around=None, maxResults=8):
         """Synchronous generic local search query
@@ -123,9 +149,15 @@ class OnlineServices(RanaModule):
         else:
             provider = online_providers.GoogleLocalSearch()
 
-        provider.searchAsync(callback, term=term, around=around, maxResults=maxResults,
-                             sensor=sensor, radius=radius)
-        return provider.threadName
+        if around is None:
+            # current position is used & not known yet, so the search can't be cached
+            key = None
+        else:
+            key = result_cache.make_key(provider.__class__.__name__, query=term,
+                                        location=(around.lat, around.lon),
+                                        params=(radius, maxResults))
+        return self._searchAsync(provider, key, callback, term=term, around=around,
+                                 maxResults=maxResults, sensor=sensor, radius=radius)
 
     # ** OSM static map URL **
 
@@ -157,8 +189,38 @@ class OnlineServices(RanaModule):
     # ** Geonames **
 
     def elevFromGeonamesBatchAsync(self, latLonList, outputHandler, key, tracklog=None):
-        flags = {'net': True}
-        self._addWorkerThread(Worker._elevFromGeonamesBatch, [latLonList, tracklog], outputHandler, key, flags)
+        latLonList = list(latLonList)
+        if self.elevationProvider.covers(latLonList):
+            # local elevation data covers all the points,
+            # no need to query Geonames
+            self._addWorkerThread(Worker._elevFromLocalData, [latLonList, tracklog], outputHandler, key)
+        else:
+            flags = {'net': True}
+            self._addWorkerThread(Worker._elevFromGeonamesBatch, [latLonList, tracklog], outputHandler, key, flags)
+
+    # ** Local elevation data **
+
+    @property
+    def elevationProvider(self):
+        """Offline elevation lookup from SRTM HGT files in the elevation data folder"""
+        if self._elevationProvider is None:
+            self._elevationProvider = elevation.ElevationProvider(self.modrana.paths.elevation_data_folder_path)
+        return self._elevationProvider
+
+    def importElevationData(self, paths):
+        """Import SRTM HGT files to the elevation data folder in the background
+
+        :param list paths: paths to HGT files, zip archives or folders
+        """
+        provider = self.elevationProvider
+
+        def importData():
+            imported = elevation.import_hgt_files(paths, provider.folder)
+            provider.refresh()
+            self.sendMessage('ml:notification:m:%d elevation tiles imported;5' % len(imported))
+
+        self.sendMessage('ml:notification:m:elevation data import starting;5')
+        threads.threadMgr.add(threads.ModRanaThread(name=constants.THREAD_ELEVATION_IMPORT, target=importData))
 
 
     # ** Google Maps **
@@ -202,9 +264,110 @@ class OnlineServices(RanaModule):
         :rtype: list
         """
         provider = online_providers.WikipediaSearchNominatim()
-        provider.searchAsync(callback, term=query)
+        key = result_cache.make_key(provider.__class__.__name__, query=query)
+        return self._searchAsync(provider, key, callback, term=query)
+
+    # ** Result caching **
+
+    @property
+    def resultCache(self):
+        """The persistent search result cache, created on first use,
+        None if result caching is disabled or the cache can't be opened"""
+        if not self.get("searchResultCacheEnabled", True):
+            return None
+        if self._resultCache is None and not self._resultCacheFailed:
+            dbPath = os.path.join(self.modrana.paths.cache_folder_path, RESULT_CACHE_FILENAME)
+            try:
+                self._resultCache = result_cache.ResultCache(dbPath)
+            except Exception:
+                log.exception("can't open search result cache: %s", dbPath)
+                self._resultCacheFailed = True
+        return self._resultCache
+
+    def _searchAsync(self, provider, key, callback, **kwargs):
+        """Asynchronous search with result caching
+
+        * valid cached results are returned without querying the provider
+        * identical queries issued while a search is in progress wait
+          for its results instead of starting another search
+        * in offline mode only cached results (even expired ones) are returned
+
+        The callback is always called from a thread named after the provider,
+        just like if the provider was queried directly.
+
+        :param provider: POIProvider instance
+        :param key: result cache key, None if the search should not be cached
+        :param callback: result handler
+        :returns: name of the search thread
+        :rtype: str
+        """
+        cache = self.resultCache
+        if cache is None or key is None:
+            provider.searchAsync(callback, **kwargs)
+            return provider.threadName
+
+        offline = self.get("searchOfflineMode", False)
+        results = cache.get(key, ignore_ttl=offline)
+        if results is not None or offline:
+            if results is None:
+                log.info("offline mode: no cached results for %s", key)
+                results = []
+            else:
+                log.debug("cached results for %s", key)
+            thread = threads.ModRanaThread(name=provider.threadName)
+            thread.target = lambda: results
+            thread.callback = callback
+            threads.threadMgr.add(thread)
+            return provider.threadName
+
+        with self._inFlightLock:
+            callbacks = self._inFlight.get(key)
+            if callbacks is not None:
+                log.debug("waiting for in progress search for %s", key)
+                callbacks.append(callback)
+                return provider.threadName
+            self._inFlight[key] = [callback]
+
+        thread = threads.ModRanaThread(name=provider.threadName)
+        thread.target = lambda: self._cachedSearch(provider, key, thread, kwargs)
+        thread.callback = self._deliverResults
+        threads.threadMgr.add(thread)
         return provider.threadName
 
+    def _cachedSearch(self, provider, key, controller, kwargs):
+        """Query the provider and cache the results
+
+        :returns: (callbacks waiting for the results, results) tuple
+        """
+        results = None
+        try:
+            results = provider.search(controller=controller, **kwargs)
+            cache = self._resultCache
+            if results:
+                if cache:
+                    cache.put(key, provider.__class__.__name__, results)
+            elif cache:
+                # the search failed or found nothing (possibly due to
+                # connectivity issues), replay expired results if we have any
+                expiredResults = cache.get(key, ignore_ttl=True)
+                if expiredResults:
+                    log.info("no results from provider, using expired cached results for %s", key)
+                    results = expiredResults
+        finally:
+            with self._inFlightLock:
+                callbacks = self._inFlight.pop(key, [])
+        return callbacks, results
+
+    def _deliverResults(self, reply):
+        """Pass search results to all callbacks that waited for them"""
+        callbacks, results = reply
+        for callback in callbacks:
+            if results is None:
+                callback(results)
+            else:
+                # each callback gets its own list it can sort, etc.
+                callback(list(results))
+
     # ** Background processing **
 
     def _addWorkerThread(self, *args):
@@ -329,6 +492,16 @@ class Worker(threading.Thread):
             log.exception('exception during elevation lookup')
             return None, tracklog
 
+    def _elevFromLocalData(self, latLonList, tracklog):
+        try:
+            self._setWorkStatusText("local elevation lookup starting...")
+            results = self.online.elevationProvider.lookup_batch(latLonList)
+            self._setWorkStatusText("local elevation lookup done   ")
+            return results, tracklog
+        except Exception:
+            log.exception('exception during local elevation lookup')
+            return None, tracklog
+
     def _geonamesCallback(self, progress):
         percentDone = 100 - int(100 * progress)
         self._setWorkStatusText("online elevation lookup %d %% done" % percentDone)
\ No newline at end of file
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""A persistent cache for geocoding & search results
+
+Results are stored in a SQLite database, keyed by provider, normalised
+query and a coarse location cell. Each provider has its own time to live
+- addresses don't change much, while local search results carry opening
+hours & ratings. Expired results are not used for normal lookups,
+but they are kept for a while so that they can be replayed when modRana
+is offline or the provider fails.
+
+Location cells are obtained by quantising coordinates to a grid, so that
+for example reverse geocoding of points a few meters apart (as happens
+along a drive) is answered by a single provider lookup.
+"""
+from __future__ import with_statement  # Python 2.5
+
+import math
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from core.point import Point
+from modules.mod_onlineServices.online_providers import LocalSearchPoint
+from modules.mod_onlineServices.geonames import GeonamesWikipediaPoint
+
+PYTHON3 = sys.version_info[0] > 2
+
+import logging
+log = logging.getLogger("mod.onlineServices.result_cache")
+
+# bump this to drop & recreate the cache table on schema change
+SCHEMA_VERSION = 1
+
+DAY = 24 * 60 * 60
+
+# how long are results from a given provider valid (in seconds)
+PROVIDER_TTLS = {
+    "GeocodingNominatim": 30 * DAY,
+    "GeocodingOSMScoutServer": 30 * DAY,
+    "ReverseGeocodingNominatim": 30 * DAY,
+    "GoogleLocalSearch": DAY,
+    "OSMScoutServerLocalSearch": 7 * DAY,
+    "WikipediaSearchNominatim": 7 * DAY,
+}
+DEFAULT_TTL = DAY
+
+# expired results are kept for offline replay until they are this old
+MAX_AGE = 90 * DAY
+
+# location cell sizes in degrees
+# - about 50 meters, nearby reverse geocoding lookups share the result
+REVERSE_GEOCODING_CELL_SIZE = 0.0005
+# - about 1 km, local search results are valid for nearby locations
+LOCAL_SEARCH_CELL_SIZE = 0.01
+
+# serialized point types
+POINT = "point"
+LOCAL_SEARCH_POINT = "local"
+WIKIPEDIA_POINT = "wikipedia"
+
+KEY_SEPARATOR = "|"
+
+
+def normalize_query(query):
+    """Normalize a textual query so that trivially different queries share a key
+
+    Case and redundant whitespace are ignored.
+
+    :param query: the query
+    :returns: normalized query
+    :rtype: unicode
+    """
+    if not PYTHON3 and isinstance(query, str):
+        query = query.decode("utf-8")
+    return u" ".join(query.lower().split())
+
+
+def location_cell(lat, lon, cell_size):
+    """Quantize coordinates to a location cell
+
+    :param float lat: latitude
+    :param float lon: longitude
+    :param float cell_size: cell size in degrees
+    :returns: location cell id
+    :rtype: str
+    """
+    return "%d:%d" % (math.floor(lat / cell_size), math.floor(lon / cell_size))
+
+
+def make_key(provider, query=None, location=None, cell_size=LOCAL_SEARCH_CELL_SIZE, params=()):
+    """Make a result cache key
+
+    :param str provider: provider name
+    :param query: textual query, if any
+    :param location: (lat, lon) tuple, if any
+    :param float cell_size: location cell size in degrees
+    :param params: any other parameters that influence the results
+    :returns: result cache key
+    :rtype: unicode
+    """
+    parts = [provider]
+    if query is None:
+        parts.append(u"")
+    else:
+        parts.append(normalize_query(query))
+    if location is None:
+        parts.append(u"")
+    else:
+        parts.append(location_cell(location[0], location[1], cell_size))
+    parts.extend(str(param) for param in params)
+    return KEY_SEPARATOR.join(parts)
+
+
+def point_to_dict(point):
+    """Convert a result point to a JSON serializable dictionary"""
+    if isinstance(point, GeonamesWikipediaPoint):
+        return {"type": WIKIPEDIA_POINT, "result": point.result}
+    elif isinstance(point, LocalSearchPoint):
+        return {"type": LOCAL_SEARCH_POINT, "lat": point.lat, "lon": point.lon, "name": point._name,
+                "phoneNumbers": point._phoneNumbers, "urls": point._urls,
+                "addressLines": point._addressLines, "emails": point._emails,
+                "openingHours": point._openingHours, "priceLevel": point._priceLevel,
+                "rating": point._rating}
+    else:
+        return {"type": POINT, "lat": point.lat, "lon": point.lon, "elevation": point.elevation,
+                "name": point._name, "summary": point._summary, "message": point._message}
+
+
+def dict_to_point(data):
+    """Convert a dictionary created by point_to_dict() back to a point"""
+    point_type = data.pop("type")
+    if point_type == WIKIPEDIA_POINT:
+        return GeonamesWikipediaPoint(data["result"])
+    elif point_type == LOCAL_SEARCH_POINT:
+        return LocalSearchPoint(**data)
+    else:
+        return Point(**data)
+
+
+class ResultCache(object):
+    """SQLite backed geocoding & search result cache
+
+    :param str db_path: path to the cache database file,
+                        it will be created if it does not exist
+    :param dict ttls: provider name -> time to live in seconds,
+                      overrides the default provider TTLs
+    """
+
+    def __init__(self, db_path, ttls=None):
+        self._db_path = db_path
+        self._ttls = dict(PROVIDER_TTLS)
+        if ttls:
+            self._ttls.update(ttls)
+        # the cache is used both from the main thread
+        # and from search threads
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._init_schema()
+        self.purge()
+
+    def _init_schema(self):
+        with self._lock:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                log.info("creating result cache table (schema version %d)", SCHEMA_VERSION)
+                self._db.execute("DROP TABLE IF EXISTS result")
+                self._db.execute("CREATE TABLE result (key text PRIMARY KEY, provider text, "
+                                 "created real, results text)")
+                self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def ttl(self, provider):
+        """Return time to live for results from the given provider (in seconds)"""
+        return self._ttls.get(provider, DEFAULT_TTL)
+
+    def get(self, key, ignore_ttl=False):
+        """Get cached results
+
+        :param key: result cache key, see make_key()
+        :param bool ignore_ttl: also return expired results
+        :returns: list of points or None if there are no (valid) results for the key
+        """
+        with self._lock:
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT provider, created, results FROM result WHERE key=?",
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        provider, created, results = row
+        if not ignore_ttl and time.time() - created > self.ttl(provider):
+            return None
+        try:
+            return [dict_to_point(data) for data in json.loads(results)]
+        except Exception:
+            log.exception("can't load cached results for %s", key)
+            return None
+
+    def put(self, key, provider, results):
+        """Store results in the cache
+
+        :param key: result cache key, see make_key()
+        :param str provider: name of the provider the results are from
+        :param list results: list of points
+        """
+        try:
+            data = json.dumps([point_to_dict(point) for point in results])
+        except Exception:
+            log.exception("can't cache results for %s", key)
+            return
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("REPLACE INTO result VALUES (?, ?, ?, ?)", (key, provider, time.time(), data))
+            self._db.commit()
+
+    def purge(self, max_age=MAX_AGE):
+        """Remove results older than max_age seconds
+
+        :returns: number of removed results
+        :rtype: int
+        """
+        with self._lock:
+            if self._db is None:
+                return 0
+            count = self._db.execute("DELETE FROM result WHERE created < ?",
+                                     (time.time() - max_age,)).rowcount
+            self._db.commit()
+        if count:
+            log.debug("%d old results removed from result cache", count)
+        return count
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("DELETE FROM result")
+            self._db.commit()
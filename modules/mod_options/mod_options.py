@@ -487,6 +487,7 @@ class Options(RanaModule):
                 (4, "4X")],
                group,
                1)
+        addBoolOpt("Show lower detail tiles while loading", "drawFallbackTiles", group, True)
 
         # ** centering
         group = addGroup("Centering", "centering", catMap, "generic")
@@ -767,6 +768,13 @@ class Options(RanaModule):
                group,
                constants.DEFAULT_ROUTING_PROVIDER)
 
+        addOpt("Query more providers", "routingDispatchPolicy",
+               [("single", "selected provider only"),
+                ("firstAcceptable", "first route found"),
+                ("bestOf", "fastest of routes found")],
+               group,
+               "single")
+
         addBoolOpt("Avoid major highways", "routingAvoidHighways", group, False)
 
         addBoolOpt("Avoid toll roads", "routingAvoidToll", group, False)
@@ -889,6 +897,7 @@ class Options(RanaModule):
                  "30")
         # for some reason, the items menu doesn't work correctly for
         # non-string values (eq. 10 won't work correctly but "10" would
+        addBoolOpt("Reuse current route when rerouting", "rerouteByRejoining", group, True)
 
         # * the POI category
         catPOI = addCat("POI", "poi", "poi")
@@ -961,6 +970,11 @@ class Options(RanaModule):
                group,
                "True")
 
+        # ** search result cache
+        group = addGroup("Search result cache", "search_cache", catPOI, "generic")
+        addBoolOpt("Cache search results", "searchResultCacheEnabled", group, True)
+        addBoolOpt("Offline search (cached results only)", "searchOfflineMode", group, False)
+
         # * the Location category *
         catLocation = addCat("Location", "location", "gps_satellite")
 
@@ -1130,6 +1144,14 @@ class Options(RanaModule):
         group = addGroup("Tracklogs", "tracklogs", catDebug, "generic")
         addBoolOpt("Debug circles", "debugCircles", group, False)
         addBoolOpt("Debug squares", "debugSquares", group, False)
+        addOpt("Sync recorded tracklog every", "tracklogSyncInterval",
+               [(5, "5 s"),
+                (10, "10 s"),
+                (30, "30 s (default)"),
+                (60, "1 min"),
+                (120, "2 min")],
+               group,
+               30)
         # ** navigation
         group = self.addGroup("Navigation", "navigation", catDebug, "generic")
         addBoolOpt("Print Turn-By-Turn triggers", "debugTbT", group, False)
@@ -20,6 +20,7 @@
 from modules.base_module import RanaModule
 from core.tilenames import *
 from core import geo
+from core import batch_projection
 from core.constants import DEFAULT_COORDINATES
 from math import *
 import math
@@ -56,6 +57,9 @@ class Projection(RanaModule):
         # Scale is the number of display pixels per projected unit
         self.scale = tileSizePixels()
 
+        # relative projection units of point sequences drawn every frame
+        self._pxpyRelCache = batch_projection.WorldCoordinateCache()
+
     #    self.initView()
 
 
@@ -340,6 +344,68 @@ class Projection(RanaModule):
         y = self.h * (py - self.py1) / self.pdy
         return x, y
 
+    # batch conversions
+    # - these take coordinate arrays (any sequence) and return coordinate arrays
+    #   (NumPy arrays if NumPy is available, lists otherwise)
+    # - relative projection units are zoom invariant, so if they are computed once
+    #   (or taken from getPxpyRel()) only a single affine transform is needed per frame
+
+    def ll2xyBatch(self, lats, lons):
+        """Convert arrays of geographic units to display units"""
+        (pxs, pys) = batch_projection.ll2world(lats, lons)
+        return self.pxpyRel2xyBatch(pxs, pys)
+
+    def ll2pxpyBatch(self, lats, lons):
+        """Convert arrays of geographic units to projection units"""
+        (pxs, pys) = batch_projection.ll2world(lats, lons)
+        return batch_projection.world2pxpy(pxs, pys, self.zoom)
+
+    def ll2pxpyRelBatch(self, lats, lons):
+        """Convert arrays of geographic units to relative projection units"""
+        return batch_projection.ll2world(lats, lons)
+
+    def pxpyRel2xyBatch(self, pxs, pys):
+        """Convert arrays of relative projection units to display units"""
+        n = 2 ** self.zoom
+        return batch_projection.affine(pxs, pys,
+                                       self.w * n / self.pdx, -self.w * self.px1 / self.pdx,
+                                       self.h * n / self.pdy, -self.h * self.py1 / self.pdy)
+
+    def getPxpyRel(self, key, points):
+        """Return relative projection units for a sequence of (lat, lon, ...) points,
+        cached under the given key so that they are not recomputed every frame
+
+        :param key: hashable identifier of the point sequence
+        :param points: sequence of (lat, lon, ...) tuples
+        :returns: (pxs, pys) tuple of coordinate arrays
+        """
+        return self._pxpyRelCache.get(key, points)
+
+    def dropPxpyRel(self, key):
+        """Drop cached relative projection units for the given key"""
+        self._pxpyRelCache.invalidate(key)
+
+    def getGlobalPixelView(self):
+        """Return the area that might be visible on the screen in global pixel
+        coordinates (absolute pixel coordinates on the current zoom level)
+        together with the global pixel coordinates of the display origin
+
+        The area is a square around the screen centre with a side of two
+        screen diagonals, so that it covers the screen even when the map
+        is rotated or shifted.
+
+        :returns: (x1, y1, x2, y2, originX, originY) tuple
+        :rtype: tuple
+        """
+        originX = self.px1 * self.scale
+        originY = self.py1 * self.scale
+        centreX = originX + self.w / 2.0
+        centreY = originY + self.h / 2.0
+        diagonal = math.hypot(self.w, self.h)
+        return (centreX - diagonal, centreY - diagonal,
+                centreX + diagonal, centreY + diagonal,
+                originX, originY)
+
     def xy2ll(self, x, y):
         """Convert display units to geographic units"""
         px = self.px1 + x / self.scale
@@ -33,6 +33,10 @@ from core.signal import Signal
 from core.way import Way
 from core.backports.six import u
 from core import routing_providers
+from core import route_cache
+from core import routing_dispatcher
+from core import geometry_cache
+from core import threads
 from core import gs
 
 
@@ -54,6 +58,8 @@ class Route(RanaModule):
 
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
+        # route polyline projected to global pixel coordinates for each zoom level
+        self._route_geometry = geometry_cache.GeometryCache()
         self._go_to_initial_state()
         # how long the last routing lookup took in seconds
         self._route_lookup_duration = 0
@@ -76,6 +82,8 @@ class Route(RanaModule):
         # offline routing provider
         self._offline_routing_provider = None
 
+        self._route_cache = route_cache.RouteCache()
+
         # signals
         self.routing_done = Signal()
 
@@ -94,7 +102,10 @@ class Route(RanaModule):
     def _go_to_initial_state(self):
         """restorer initial routing state
         -> used in init and when rerouting"""
-        self._pxpy_route = [] # route in screen coordinates
+        self._pxpy_route = ([], []) # route in relative projection units (x and y arrays)
+        self._route_points = [] # route (lat, lon, elevation) points
+        self._route_version = geometry_cache.new_version()
+        self._route_geometry.clear()
         self._directions = [] # directions object
         self.set('midText', [])
         self._duration_string = None # in seconds
@@ -118,6 +129,8 @@ class Route(RanaModule):
         self._expect_end = False
 
         self._route_detail_geocoding_triggered = False
+        # unprocessed copy of the current route, used for rerouting
+        self._raw_route = None
 
     @property
     def route_lookup_duration(self):
@@ -429,7 +442,11 @@ class Route(RanaModule):
             self.set('needRedraw', True) # show the new menu
 
     def reroute(self):
-        """Reroute from current position to destination."""
+        """Reroute from current position to destination.
+
+        If possible, only a short route leading back to the current route
+        is requested and the rest of the current route is reused.
+        """
 
         # is there a destination and valid position ?
         self.log.info("rerouting from current position to last destination")
@@ -437,10 +454,49 @@ class Route(RanaModule):
         bearing = self.get('bearing', None)
         if self._destination and pos:
             start = Waypoint(lat=pos[0], lon=pos[1], heading=bearing)
-            self.waypoints_route([start, self._destination])
+            if not self._rejoin_route(start):
+                self.waypoints_route([start, self._destination])
             self._start = None
             self.set('needRedraw', True)
 
+    def _rejoin_route(self, start):
+        """Request a route from start back to the current route
+
+        :param start: start of the rejoin route
+        :type start: Waypoint instance
+        :returns: True if rejoin route has been requested, False if full rerouting is needed
+        :rtype: bool
+        """
+        route = self._raw_route
+        if route is None or not self.get('rerouteByRejoining', True):
+            return False
+        index = route_cache.find_rejoin_point(route, start.lat, start.lon)
+        if index is None:
+            return False
+        rejoin_point = route.get_point_by_index(index)
+        self.log.info("requesting route back to current route (point %d of %d)", index, route.point_count)
+        self.routeAsync(lambda result: self._handle_rejoin_result_cb(result, route, index, start),
+                        [start, Waypoint(rejoin_point.lat, rejoin_point.lon)])
+        return True
+
+    def _handle_rejoin_result_cb(self, result, route, index, start):
+        """Splice the rejoin route into the current route or do a full reroute
+        if the rejoin route can't be used"""
+        rejoin_point = route.get_point_by_index(index)
+        if result.route and result.returnCode == constants.ROUTING_SUCCESS and \
+                route_cache.rejoin_acceptable(result.route, start.lat, start.lon,
+                                              rejoin_point.lat, rejoin_point.lon):
+            self.log.info("rerouting: rejoining current route")
+            result = routing_providers.RoutingResult(route.splice(result.route, index),
+                                                     result.routeParameters,
+                                                     constants.ROUTING_SUCCESS,
+                                                     lookupDuration=result.lookupDuration)
+            self._handle_routing_result_cb(result)
+        elif self._destination:
+            self.log.info("rerouting: can't rejoin current route, requesting full route")
+            self.waypoints_route([start, self._destination])
+            self._start = None
+
     def routeAsync(self, callback, waypoints, route_params=None):
         """Asynchronous routing
 
@@ -461,6 +517,45 @@ class Route(RanaModule):
 
         provider_id = self.get('routingProvider', constants.DEFAULT_ROUTING_PROVIDER)
         self.log.debug("routing provider ID: %s", provider_id)
+        policy = self.get('routingDispatchPolicy', "single")
+        if policy != "single":
+            # several providers are queried, so the results don't depend
+            # only on the configured provider
+            key = route_cache.route_key(waypoints, route_params, policy)
+        else:
+            key = route_cache.route_key(waypoints, route_params, provider_id)
+        cached_route = self._route_cache.get(key)
+        if cached_route is not None:
+            self.log.info("using cached route")
+            result = routing_providers.RoutingResult(cached_route, route_params, constants.ROUTING_SUCCESS)
+            thread = threads.ModRanaThread(name=constants.THREAD_ROUTING_CACHED)
+            thread.target = lambda: result
+            thread.callback = callback
+            threads.threadMgr.add(thread)
+            return
+        elif key is not None:
+            callback = self._caching_callback(key, callback)
+
+        if policy != "single":
+            provider = self._get_routing_dispatcher(provider_id, policy)
+            callback = self._stats_saving_callback(provider, callback)
+        else:
+            provider = self._get_routing_provider(provider_id)
+        if provider:
+            provider.searchAsync(
+                callback,
+                waypoints,
+                route_params=route_params
+            )
+        else:
+            self.log.error("unknown routing provider ID: %s", provider_id)
+
+    def _get_routing_provider(self, provider_id):
+        """Return routing provider instance for the given provider id
+
+        :param str provider_id: routing provider id
+        :returns: RoutingProvider instance or None for unknown provider id
+        """
         if provider_id in (constants.ROUTING_PROVIDER_MONAV_SERVER, constants.ROUTING_PROVIDER_MONAV_LIGHT):
             # is Monav initialized ? (lazy initialization)
             if self._offline_routing_provider is None:
@@ -480,30 +575,61 @@ class Route(RanaModule):
             # update the path to the Monav data folder
             # in the Monav wrapper in case in changed since last search
             self._offline_routing_provider.data_path = self._get_monav_data_path()
-
-            # do the offline routing
-            self._offline_routing_provider.searchAsync(
-            callback,
-            waypoints,
-            route_params=route_params
-        )
+            return self._offline_routing_provider
         elif provider_id == constants.ROUTING_PROVIDER_GOOGLE:
-            provider = routing_providers.GoogleRouting()
-            provider.searchAsync(
-                callback,
-                waypoints,
-                route_params=route_params
-            )
+            return routing_providers.GoogleRouting()
         elif provider_id == constants.ROUTING_PROVIDER_OSM_SCOUT:
-            provider = routing_providers.OSMScoutServerRouting()
-            provider.searchAsync(
-                callback,
-                waypoints,
-                route_params=route_params
-            )
+            return routing_providers.OSMScoutServerRouting()
         else:
-            self.log.error("unknown routing provider ID: %s", provider_id)
+            return None
+
+    def _get_routing_dispatcher(self, provider_id, policy):
+        """Return a dispatcher querying all usable routing providers concurrently
+
+        The configured routing provider is used first, other providers
+        are only used if they can work (routing data, API key or a running
+        OSM Scout Server available).
 
+        :param str provider_id: the configured routing provider id
+        :param str policy: routing dispatch policy
+        """
+        provider_ids = [provider_id]
+        checks = {}
+        if provider_id not in (constants.ROUTING_PROVIDER_MONAV_SERVER, constants.ROUTING_PROVIDER_MONAV_LIGHT) \
+                and self._get_monav_data_path():
+            provider_ids.append(constants.ROUTING_PROVIDER_MONAV_SERVER)
+        if constants.ROUTING_PROVIDER_OSM_SCOUT in self.modrana.dmod.offline_routing_providers:
+            provider_ids.append(constants.ROUTING_PROVIDER_OSM_SCOUT)
+            if provider_id != constants.ROUTING_PROVIDER_OSM_SCOUT:
+                # the connection check is done by the dispatcher thread,
+                # not here on the main thread
+                checks[constants.ROUTING_PROVIDER_OSM_SCOUT] = routing_providers.osm_scout_server_running
+        if constants.GOOGLE_API_KEY is not None:
+            provider_ids.append(constants.ROUTING_PROVIDER_GOOGLE)
+        providers = []
+        for pid in provider_ids:
+            provider = self._get_routing_provider(pid)
+            if provider and pid not in [p[0] for p in providers]:
+                providers.append((pid, provider))
+        return routing_dispatcher.RoutingDispatcher(providers, policy=policy,
+                                                    stats=self.get('routingProviderStats', {}),
+                                                    availability_checks=checks)
+
+    def _stats_saving_callback(self, dispatcher, callback):
+        """Wrap a routing result handler so that routing provider statistics
+        are saved once the dispatcher is done"""
+        def _save_stats_cb(result):
+            self.set('routingProviderStats', dispatcher.get_stats_dict())
+            callback(result)
+        return _save_stats_cb
+
+    def _caching_callback(self, key, callback):
+        """Wrap a routing result handler so that successful results are cached"""
+        def _cache_result_cb(result):
+            if result.route and result.returnCode == constants.ROUTING_SUCCESS:
+                self._route_cache.put(key, result.route)
+            callback(result)
+        return _cache_result_cb
 
     def _get_default_route_parameters(self):
         mode = self.get("mode", "car")
@@ -593,6 +719,10 @@ class Route(RanaModule):
     def _handle_routing_result_cb(self, result):
         # remove any previous route description
         self._text = None
+        # keep an unprocessed copy of the route for rerouting,
+        # route processing changes the route in place
+        if result.route and result.returnCode == constants.ROUTING_SUCCESS:
+            self._raw_route = result.route.copy()
         # trigger the routing done signal
         self.routing_done(result)
 
@@ -622,7 +752,10 @@ class Route(RanaModule):
                 # save a copy of the route in projection units for faster drawing
                 proj = self.m.get('projection', None)
                 if proj:
-                    self._pxpy_route = [proj.ll2pxpyRel(x[0], x[1]) for x in result.route.points_lle]
+                    points = result.route.points_lle
+                    self._route_points = points
+                    self._route_version = geometry_cache.new_version()
+                    self._pxpy_route = proj.ll2pxpyRelBatch([x[0] for x in points], [x[1] for x in points])
                 self.process_and_save_directions(result.route)
                 self._osd_menu_state = OSD_CURRENT_ROUTE
                 self.start_navigation()
@@ -708,6 +841,11 @@ class Route(RanaModule):
         # save
         self._directions = route
 
+        # synthesize turn announcements in advance
+        voice = self.m.get('voice', None)
+        if voice:
+            voice.presynthesizeRoute(route)
+
     def get_directions(self):
         return self._directions
 
@@ -849,14 +987,14 @@ class Route(RanaModule):
             steps = self._directions.message_points_lle
 
             # now we convert geographic coordinates to screen coordinates, so we dont need to do it twice
-            steps = map(lambda x: (proj.ll2xy(x[0], x[1])), steps)
+            steps = list(zip(*proj.ll2xyBatch([x[0] for x in steps], [x[1] for x in steps])))
+            (routeXs, routeYs) = self._pxpy_route
 
             if self._start:
                 start = proj.ll2xy(self._start.lat, self._start.lon)
                 # line from starting point to start of the route
                 (x, y) = start
-                (px1, py1) = self._pxpy_route[0]
-                (x1, y1) = proj.pxpyRel2xy(px1, py1)
+                (x1, y1) = proj.pxpyRel2xy(routeXs[0], routeYs[0])
                 cr.set_source_rgba(0, 0, 0.5, 0.45)
                 cr.set_line_width(10)
                 cr.move_to(x, y)
@@ -867,8 +1005,7 @@ class Route(RanaModule):
                 destination = proj.ll2xy(self._destination.lat, self._destination.lon)
                 # line from the destination point to end of the route
                 (x, y) = destination
-                (px1, py1) = self._pxpy_route[-1]
-                (x1, y1) = proj.pxpyRel2xy(px1, py1)
+                (x1, y1) = proj.pxpyRel2xy(routeXs[-1], routeYs[-1])
                 cr.set_source_rgba(0, 0, 0.5, 0.45)
                 cr.set_line_width(10)
                 cr.move_to(x, y)
@@ -894,15 +1031,6 @@ class Route(RanaModule):
 
             # draw the points from the polyline as a polyline :)
 
-            (px, py) = self._pxpy_route[0]
-            (x, y) = proj.pxpyRel2xy(px, py)
-            cr.move_to(x, y)
-
-            # well, this SHOULD be faster and this is a performance critical section after all...
-            #    map(lambda x: cr.line_to(x[0],x[1]), route[1:]) # lambda drawing :)
-            # according to numerous sources, list comprehensions should be faster than for loops and map+lambda
-            # if its faster in this case too has not been determined
-
             # routing result drawing algorithm
             # adapted from TangoGPS source (tracks.c)
             # works surprisingly good
@@ -912,42 +1040,23 @@ class Route(RanaModule):
             # (they have a different structure than logging traces,
             # eq. long segments delimited by only two points, etc)
             # basically, routing results have only the really needed points -> less points than traces
-            if self._handmade or len(self._pxpy_route) < 20:
+            if self._handmade or len(routeXs) < 20:
                 # handmade routes usually have very few points and we don't want to skip any
                 # also handle very short routes that might have the same issue
                 modulo = 1
             elif 16 > z > 10:
-                modulo = 2 ** (14 - z)
+                modulo = max(1, 2 ** (14 - z))
             elif z <= 10:
                 modulo = 16
             else:
                 modulo = 1
 
-                #    maxDraw = 300
-                #    drawCount = 0
-            counter = 0
-
-            for point in self._pxpy_route[1:]: #draw the track
-                counter += 1
-                if counter % modulo == 0:
-                #      if 1:
-                #        drawCount+=1
-                #        if drawCount>maxDraw:
-                #          break
-                    (px, py) = point
-                    (x, y) = proj.pxpyRel2xy(px, py)
-                    cr.line_to(x, y)
-
-                    # make a line to the last point (the modulo method sometimes skips the end of the track)
-                    #    [cr.line_to(x[0],x[1])for x in route[1:]] # list comprehension drawing :D
-
-                    #    self.log.debug(drawCount)
-                    #    self.log.debug(modulo)
-
-            # make sure the last point is connected
-            (px, py) = self._pxpy_route[-1]
-            (x, y) = proj.pxpyRel2xy(px, py)
-            cr.line_to(x, y)
+            # the route is projected once per zoom level & only parts
+            # of the route that can be visible are drawn
+            points = self._route_points
+            geometry = self._route_geometry.get("route", self._route_version, z,
+                                                lambda: self._get_route_parts(points, modulo))
+            geometry.draw(cr, *proj.getGlobalPixelView())
 
             cr.stroke()
 
@@ -965,6 +1074,17 @@ class Route(RanaModule):
 
             #    self.log.debug("Redraw took %1.9f ms" % (1000 * (clock() - start1)))
 
+    def _get_route_parts(self, points, modulo):
+        """Split every modulo-th route point to parts for drawing
+
+        The last point is always included, so that the drawn route
+        is not cut short.
+        """
+        selected = points[::modulo]
+        if points and (len(points) - 1) % modulo:
+            selected.append(points[-1])
+        return geometry_cache.split_points(selected)
+
     def get_current_directions(self):
         """return the current route"""
         return self._directions
@@ -20,6 +20,8 @@
 from core.point import Point
 from modules.base_module import RanaModule
 from core import geo
+from core import render_cache
+from core import batch_projection
 import math
 import re
 
@@ -29,6 +31,13 @@ except ImportError:
     from core.backports.odict import odict  # Python <2.7
 
 
+# maximum number of stored POI search results
+POI_SEARCH_RESULT_LIMIT = 50
+
+# key of search result coordinates in the projection cache
+RESULTS_PXPY_KEY = "search:results"
+
+
 def getModule(*args, **kwargs):
     return Search(*args, **kwargs)
 
@@ -46,7 +55,7 @@ class Search(RanaModule):
         self.menuWatchId = None
         self.filters = {}
         # names of marker groups used for search results
-        self._relatedMarkerGroups = ["addressResults", "wikipediaResults"]
+        self._relatedMarkerGroups = ["addressResults", "wikipediaResults", "poiResults"]
 
     def firstTime(self):
         self.menuWatchId = self.modrana.watch('menu', self._checkMenuEnteredCB)
@@ -170,6 +179,7 @@ class Search(RanaModule):
         elif message == 'clearSearch':
             self.localSearchResults = None
             self.list = None
+            self._dropResultCoordinates()
             # also remove all search related marker groups
             markers = self.m.get("markers")
             if markers:
@@ -254,6 +264,9 @@ class Search(RanaModule):
                         online.geocodeAsync(query, self._address2llCB)
                     else:
                         self.log.error("online services module missing")
+                elif sType == "poi":
+                    self.log.info("stored POI search")
+                    self._handlePOISearchResults(self.searchPOI(args[1]))
                 elif sType == "wikipedia":
                     self.log.info("Wikipedia search")
                     query = args[1]
@@ -336,6 +349,13 @@ class Search(RanaModule):
                 entry.entryBox(self, 'address', description='Enter an address or location description',
                                persistentKey="lastAddressSearchInput")
 
+        elif message == "searchPOI":
+            # start text input for a stored POI search
+            entry = self.m.get('textEntry', None)
+            if entry:
+                entry.entryBox(self, 'poi', description='Stored POI search query',
+                               persistentKey="lastPOISearchInput")
+
         elif message == "searchWikipedia":
             # start text input for an address
             entry = self.m.get('textEntry', None)
@@ -393,15 +413,8 @@ class Search(RanaModule):
 
     def showText(self, cr, text, x, y, widthLimit=None, fontsize=40):
         if text:
+            (fontsize, textWidth, textHeight) = render_cache.text_cache.fit_font_size(cr, text, fontsize, widthLimit)
             cr.set_font_size(fontsize)
-            stats = cr.text_extents(text)
-            (textWidth, textHeight) = stats[2:4]
-
-            if widthLimit and textWidth > widthLimit:
-                cr.set_font_size(fontsize * widthLimit / textWidth)
-                stats = cr.text_extents(text)
-                (textWidth, textHeight) = stats[2:4]
-
             cr.move_to(x, y + textHeight)
             cr.show_text(text)
 
@@ -578,6 +591,12 @@ class Search(RanaModule):
         if menus:
             menus.clearMenu('searchCustomQuery', 'set:menu:search')
 
+    def _dropResultCoordinates(self):
+        """Drop projected coordinates of previous search results"""
+        proj = self.m.get('projection', None)
+        if proj:
+            proj.dropPxpyRel(RESULTS_PXPY_KEY)
+
     def drawMapOverlay(self, cr):
         """Draw overlay that's part of the map"""
         # draw the GLS results on the map
@@ -589,19 +608,22 @@ class Search(RanaModule):
         menus = self.m.get("menu", None)
 
         highlightNr = int(self.get('searchResultsItemNr', -1))
+        highlighted = None
 
         # highlight the currently selected result on the map
 
         if not self.list:
             # there is nothing to draw
             return
-        for itemTuple in self.list:
+        # results are projected once & only converted to screen coordinates every frame
+        (pxs, pys) = proj.getPxpyRel(RESULTS_PXPY_KEY, [item[1].getLL() for item in self.list])
+        (xs, ys) = proj.pxpyRel2xyBatch(pxs, pys)
+        for itemTuple, x, y in zip(self.list, batch_projection.to_list(xs), batch_projection.to_list(ys)):
             (distance, point, index) = itemTuple
             if index == highlightNr:  # the highlighted result is draw in the end
                 # skip it this time
+                highlighted = (point, x, y)
                 continue
-            (lat, lon) = point.getLL()
-            (x, y) = proj.ll2xy(lat, lon)
             cr.set_source_rgb(0.0, 0.0, 0.0)
             cr.set_line_width(10)
             cr.arc(x, y, 3, 0, 2.0 * math.pi)
@@ -618,8 +640,7 @@ class Search(RanaModule):
             # Pango does not like & so we need to replace it with &amp
             text = re.sub('&', '&amp;', point.name) # result caption
 
-            cr.set_font_size(20)
-            extents = cr.text_extents(text) # get the text extents
+            extents = render_cache.text_cache.text_extents(cr, text, 20) # get the text extents
             (w, h) = (extents[2] * 1.5, extents[3] * 1.5)
             border = 2
             cr.set_line_width(2)
@@ -637,11 +658,8 @@ class Search(RanaModule):
             menus.drawText(cr, text, rx, ry - (-rh), rw, -rh, 0.05)
             cr.stroke()
 
-        if highlightNr != -1: # is there some search result to highlight ?
-            itemTuple = filter(lambda x: x[2] == int(highlightNr), self.list).pop()
-            point = itemTuple[1]
-            lat, lon = point.getLL()
-            (x, y) = proj.ll2xy(lat, lon)
+        if highlighted is not None: # is there some search result to highlight ?
+            (point, x, y) = highlighted
 
             # draw the highlighting circle
             cr.set_line_width(8)
@@ -663,8 +681,7 @@ class Search(RanaModule):
             # draw a caption with transparent background
             # Pango does not like & so we need to replace it with &amp
             text = re.sub('&', '&amp;', point.name) # result caption
-            cr.set_font_size(20)
-            extents = cr.text_extents(text) # get the text extents
+            extents = render_cache.text_cache.text_extents(cr, text, 20) # get the text extents
             (w, h) = (extents[2] * 1.5, extents[3] * 1.5)
             border = 2
             cr.set_line_width(2)
@@ -737,6 +754,9 @@ class Search(RanaModule):
             else:
                 self.log.error("online services module missing")
 
+        elif key == "poi":
+            self._handlePOISearchResults(self.searchPOI(result))
+
         elif key == "wikipedia":
             online = self.m.get('onlineServices')
             textInput = result
@@ -773,30 +793,55 @@ class Search(RanaModule):
         # only show the results list if there are some results
         if results:
             self.localSearchResults = results
+            self._dropResultCoordinates()
             self.set('menu', 'search#searchResults')
 
     def _handleWikipediaResultsCB(self, results):
         """Handle results from the asynchronous Wikipedia search"""
         if results:
             self.log.info("wikipedia search done - something found")
-            name = 'wikipediaResults'
-            markers = self.m.get('markers', None)
-            if markers:
-                g = markers.addGroup(name, results, menu=True)
-                menu = g.getMenuInstance()
-                if len(results) == 1: # if only one result is found, center on it righ away
-                    point = results[0]
-                    self._jumpToPoint(point)
-                else:
-                    self.sendMessage('set:menu:menu#list#%s' % name)
-                menu.setOnceBackAction('set:menu:searchWhat')
-            else: # just jump to the first result
-                point = results[0]
-                self._jumpToPoint(point)
+            self._showResultGroup('wikipediaResults', results)
         else:
             self.log.info("wikipedia search done - nothing found")
             self.sendMessage('ml:notification:m:No results found for this query.;5')
 
+    def searchPOI(self, query):
+        """Search stored POI by label and description
+
+        :param str query: search query
+        :returns: matching POI, best matches first
+        :rtype: list of POI objects
+        """
+        store = self.m.get('storePOI', None)
+        if store is None:
+            self.log.error("storePOI module not present")
+            return []
+        return store.db.search_poi(query, limit=POI_SEARCH_RESULT_LIMIT)
+
+    def _handlePOISearchResults(self, results):
+        if results:
+            self.log.info("stored POI search done - %d results", len(results))
+            self._showResultGroup('poiResults', results)
+        else:
+            self.log.info("stored POI search done - nothing found")
+            self.sendMessage('ml:notification:m:No stored POI found for this query.;5')
+
+    def _showResultGroup(self, name, results):
+        """Show search results as a marker group with a menu"""
+        markers = self.m.get('markers', None)
+        if markers:
+            g = markers.addGroup(name, results, menu=True)
+            menu = g.getMenuInstance()
+            if len(results) == 1: # if only one result is found, center on it righ away
+                point = results[0]
+                self._jumpToPoint(point)
+            else:
+                self.sendMessage('set:menu:menu#list#%s' % name)
+            menu.setOnceBackAction('set:menu:searchWhat')
+        else: # just jump to the first result
+            point = results[0]
+            self._jumpToPoint(point)
+
     def _jumpToPoint(self, point):
         mw = self.m.get('mapView', None)
         if mw:
@@ -19,6 +19,7 @@
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
 from core import geo
+from core import render_cache
 # only import GKT libs if GTK GUI is used
 from core import gs
 
@@ -196,7 +197,7 @@ class ShowOSD(RanaModule):
             (w, h) = (0, 0)
             yOffset = []
             for line in lines:
-                extents = cr.text_extents(line)
+                extents = render_cache.text_cache.text_extents(cr, line, fontSize)
                 (w, h) = (max(w, extents[2]), h + extents[3] + border)
                 yOffset.append(y + h)
 
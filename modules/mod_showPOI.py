@@ -20,6 +20,8 @@
 from __future__ import with_statement # for python 2.5
 from modules.base_module import RanaModule
 from core import geo
+from core import point_overlay
+from core import render_cache
 from core.point import POI
 from core.singleton import modrana
 import math
@@ -37,6 +39,8 @@ class ShowPOI(RanaModule):
         RanaModule.__init__(self, *args, **kwargs)
         self.activePOI = None
         self.visiblePOI = []
+        self._visiblePOIVersion = 0
+        self._overlay = point_overlay.PointOverlay()
         self.listMenusDirty = True
         self.drawActivePOI = False
         self.expectPoint = False
@@ -65,25 +69,38 @@ class ShowPOI(RanaModule):
             proj = self.m.get('projection', None)
             menus = self.m.get('menu', None)
             if proj and self.visiblePOI:
-                for POI in self.visiblePOI:
+                # many POI can be visible (eg. all stored POI), so the visible
+                # POI are clustered & indexed once they change and only
+                # the clusters in the visible area are drawn
+                self._overlay.set_points(self._visiblePOIVersion,
+                                         lambda: [(POI.lat, POI.lon, POI) for POI in self.visiblePOI])
+                zoom = proj.zoom
+                hidePOICaptionZl = int(self.get("hideMarkerCaptionsBelowZl", 13))
+                if zoom > hidePOICaptionZl:
+                    labelBox = lambda cluster: self._captionBox(cr, cluster)
+                else:
+                    labelBox = None
+                (x1, y1, x2, y2, originX, originY) = proj.getGlobalPixelView()
+                # captions include distance from current position
+                labelKey = (self.get('pos', None), self.get('unitType', None))
+                clusters = self._overlay.query(zoom, x1, y1, x2, y2, proj.scale, labelBox, labelKey)
+                click = self.m.get('clickHandler', None)
+                for cluster in clusters:
+                    x = cluster.x - originX
+                    y = cluster.y - originY
+                    if cluster.count > 1:
+                        point_overlay.draw_cluster_badge(cr, x, y, cluster.count, (0.1, 0.6, 0.1, 0.85))
+                        if click:
+                            # zoom in on the cluster so that it splits
+                            r = point_overlay.CLUSTER_BADGE_RADIUS
+                            click.registerXYWH(x - r, y - r, 2 * r, 2 * r,
+                                               'mapView:recentre %f %f %d' %
+                                               (cluster.lat, cluster.lon, zoom + point_overlay.CLUSTER_LEVELS))
+                        continue
+
+                    POI = self._overlay.get_item(cluster)
                     poiID = POI.db_index
-                    lat = POI.lat
-                    lon = POI.lon
-                    name = POI.name
-                    hidePOICaptionZl = int(self.get("hideMarkerCaptionsBelowZl", 13))
-                    if int(self.get('z', 15)) > hidePOICaptionZl:
-                        distanceString = ""
-                        pos = self.get('pos', None)
-                        units = self.m.get('units', None)
-                        if pos and units:
-                            (lat1, lon1) = pos # current position coordinates
-                            kiloMetricDistance = geo.distance(lat, lon, lat1, lon1)
-                            unitString = units.km2CurrentUnitString(kiloMetricDistance, 0, True)
-                            distanceString = " (%s)" % unitString
-
-                        text = "" + name + distanceString
-
-                    (x, y) = proj.ll2xy(lat, lon) #   draw the highlighting circle
+                    # draw the highlighting circle
                     cr.set_line_width(8)
                     cr.set_source_rgba(0.1, 0.6, 0.1, 0.55) # highlight circle color
                     cr.arc(x, y, 15, 0, 2.0 * math.pi)
@@ -100,35 +117,58 @@ class ShowPOI(RanaModule):
                     cr.arc(x, y, 2, 0, 2.0 * math.pi)
                     cr.stroke()
 
-                    # draw a caption with transparent background
-                    if int(self.get('z', 15)) > hidePOICaptionZl:
-                        cr.set_font_size(25)
-                        extents = cr.text_extents(text) # get the text extents
-                        (w, h) = (extents[2], extents[3])
-                        border = 2
+                    # draw a caption with transparent background,
+                    # captions colliding with other captions are not drawn
+                    if cluster.label is not None:
+                        text = self._getPOICaption(POI)
+                        (lx1, ly1, lx2, ly2) = cluster.label
+                        (rx, ry, rw, rh) = (lx1 - originX, ly1 - originY, lx2 - lx1, ly2 - ly1)
                         cr.set_line_width(2)
                         cr.set_source_rgba(0.1, 0.6, 0.1, 0.45) # transparent blue
-                        (rx, ry, rw, rh) = (x - border + 12, y + border + h * 0.2 + 6, w + 4 * border, -(h * 1.4))
                         cr.rectangle(rx, ry, rw, rh) # create the transparent background rectangle
                         cr.fill()
 
                         # register clickable area
-                        click = self.m.get('clickHandler', None)
                         if click:
                             # make the POI caption clickable
                             if poiID is not None: # new POI have id == None
-                                click.registerXYWH(rx, ry - (-rh), rw, -rh,
+                                click.registerXYWH(rx, ry, rw, rh,
                                                    "ms:showPOI:setActivePOI:%d|set:menu:showPOI#POIDetail" % poiID)
                             else: # the last added POI is still set, no need to set the id
-                                click.registerXYWH(rx, ry - (-rh), rw, -rh, "set:menu:showPOI#POIDetail")
+                                click.registerXYWH(rx, ry, rw, rh, "set:menu:showPOI#POIDetail")
                         cr.fill()
 
                         # draw the actual text
-                        #        cr.set_source_rgba(1, 1, 0, 0.95) # slightly transparent white
                         cr.set_source_rgba(1, 1, 1, 0.95) # slightly transparent white
-                        menus.drawText(cr, text, rx, ry - (-rh), rw, -rh, 0.05)
+                        menus.drawText(cr, text, rx, ry, rw, rh, 0.05)
                         cr.stroke()
 
+    def _getPOICaption(self, POI):
+        """Return POI caption - name & distance from current position"""
+        distanceString = ""
+        pos = self.get('pos', None)
+        units = self.m.get('units', None)
+        if pos and units:
+            (lat1, lon1) = pos # current position coordinates
+            kiloMetricDistance = geo.distance(POI.lat, POI.lon, lat1, lon1)
+            unitString = units.km2CurrentUnitString(kiloMetricDistance, 0, True)
+            distanceString = " (%s)" % unitString
+        return "" + POI.name + distanceString
+
+    def _captionBox(self, cr, cluster):
+        """Return caption (dx, dy, w, h) relative to the POI for label placement"""
+        if cluster.count > 1:
+            return None
+        text = self._getPOICaption(self._overlay.get_item(cluster))
+        extents = render_cache.text_cache.text_extents(cr, text, 25) # get the text extents
+        (w, h) = (extents[2], extents[3])
+        border = 2
+        return 12 - border, border + 6 - h * 1.2, w + 4 * border, h * 1.4
+
+    def _visiblePOIChanged(self):
+        """The visible POI or their properties changed, so they need to be indexed again"""
+        self._visiblePOIVersion += 1
+
     def handleMessage(self, message, messageType, args):
         # messages that need the store and/or menus go here
         store = self.m.get('storePOI', None)
@@ -347,20 +387,20 @@ class ShowPOI(RanaModule):
         # check if the POI is already present
         if POI and POI not in self.visiblePOI:
             self.visiblePOI.append(POI)
+            self._visiblePOIChanged()
 
     def makeAllStoredPOIVisible(self):
         """make all stored POI visible"""
         store = self.m.get('storePOI', None)
-        cats = store.db.list_categories()
-        count = 0
-        _makePOIVisible = self._makePOIVisible
-        for cat in cats:
-            (label, desc, cat_id) = cat
-            catPOI = store.db.get_all_poi_from_category(cat_id)
-            count += len(catPOI)
-            for item in catPOI:
-                (label, _desc, lat, lon, poi_id) = item
-                _makePOIVisible(store.db.get_poi(poi_id))
+        # load all POI at once instead of one by one
+        allPOI = store.db.get_poi_in_bbox((-90.0, -180.0, 90.0, 180.0))
+        count = len(allPOI)
+        # checking the visible POI list for each POI would be too slow
+        visibleIDs = set(POI.db_index for POI in self.visiblePOI)
+        for POI in allPOI:
+            if POI.db_index not in visibleIDs:
+                self.visiblePOI.append(POI)
+        self._visiblePOIChanged()
         self.saveVisibleIDs()
         self.drawPOI()
         return count
@@ -370,12 +410,14 @@ class ShowPOI(RanaModule):
         count = len(self.visiblePOI)
         self.dontDrawPOI()
         self.visiblePOI = []
+        self._visiblePOIChanged()
         self.saveVisibleIDs()
         return count
 
     def removePOIFromVisible(self, POI):
         if POI in self.visiblePOI:
             self.visiblePOI.remove(POI)
+            self._visiblePOIChanged()
             self.saveVisibleIDs()
 
     def saveVisibleIDs(self):
@@ -408,6 +450,8 @@ class ShowPOI(RanaModule):
     def handleTextEntryResult(self, key, result):
         # TODO: add input checking
         entry = self.m.get('textEntry', None)
+        # the active POI might be visible on the map
+        self._visiblePOIChanged()
         if key == 'name':
             self.activePOI.name = result
             self.activePOI.commit()
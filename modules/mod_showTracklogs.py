@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
+from core import geometry_cache
 from core import geo
 import math
 #from time import clock
@@ -28,6 +29,10 @@ if gs.GUIString == "GTK":
     import gtk
 
 
+# maximum tracklog simplification error in global pixels
+SIMPLIFICATION_MAX_ERROR_PX = 2
+
+
 def getModule(*args, **kwargs):
     return ShowTracklogs(*args, **kwargs)
 
@@ -51,6 +56,8 @@ class ShowTracklogs(RanaModule):
             'yellow'
         ]
         self.colorIndex = 0
+        # tracklog points projected to global pixel coordinates for each zoom level
+        self._geometryCache = geometry_cache.GeometryCache()
 
     def setupChooseDistColorMenu(self, parent, additionalActions=""):
         """setup a menu for choosing from the distinct colors
@@ -131,16 +138,23 @@ class ShowTracklogs(RanaModule):
         loadTl = self.m.get('loadTracklogs', None) # get the tracklog module
         loadedTracklogsPathList = loadTl.get_loaded_tracklog_path_list()
 
+        # only tracklogs that intersect the current viewport
+        # (or that have not been loaded yet) need to be drawn
+        onscreen = loadTl.get_visible_path_candidates(list(visibleTracklogs.keys()),
+                                                      (proj.S, proj.W, proj.N, proj.E))
         # find what tracklogs are not loaded and load them
-        notLoaded = filter(lambda x: x not in loadedTracklogsPathList, visibleTracklogs)
+        notLoaded = [x for x in onscreen if x not in loadedTracklogsPathList]
         if notLoaded:
             # remove possible nonexistent tracks from the not loaded tracks
             notLoaded = self.removeNonexistentTracks(notLoaded)
-            # load the existing not loaded tracks
+            # start loading the existing not loaded tracks in the background,
+            # the screen will be redrawn once they are loaded
             loadTl.loadPathList(notLoaded)
 
-        for path in visibleTracklogs.keys():
-            GPXTracklog = loadTl.get_tracklog_for_path(path)
+        for path in onscreen:
+            GPXTracklog = loadTl.get_loaded_tracklog(path)
+            if GPXTracklog is None:
+                continue  # not yet loaded
             colorName = visibleTracklogs[path]['colorName']
 
             if self.get('showTracklog', None) == 'simple':
@@ -164,7 +178,7 @@ class ShowTracklogs(RanaModule):
             availablePaths = loadTl.get_tracklog_path_list()
 
             # look which files exist and which don't
-            nonexistent = filter(lambda x: x not in availablePaths, tracks)
+            nonexistent = [x for x in tracks if x not in availablePaths]
             # remove nonexistent tracks:
 
             # from the persistent list
@@ -175,7 +189,7 @@ class ShowTracklogs(RanaModule):
             self.set('visibleTracklogsDict', visibleTracklogs)
 
             # from the input list
-            tracks = filter(lambda x: x not in nonexistent, tracks)
+            tracks = [x for x in tracks if x not in nonexistent]
 
             # return the existing tracks
             return tracks
@@ -246,55 +260,20 @@ class ShowTracklogs(RanaModule):
             self.log.info("skipping drawing of one track (tracklog or projection == None)")
             return
 
-        (screenCentreX, screenCentreY, screenRadius) = proj.screenRadius()
+        # the tracklog is projected once per zoom level and a new version
+        # is projected only if the tracklog changes (eq. the tracklog is reloaded)
+        geometry = self._geometryCache.get(GPXTracklog.filename,
+                                           GPXTracklog.version,
+                                           proj.zoom,
+                                           lambda: GPXTracklog.getClusterParts(
+                                               self._getMaxSimplificationError(GPXTracklog, proj.zoom)),
+                                           connect=True)
         #    cr.set_source_rgb(0,0, 0.5)
         cr.set_source_color(gtk.gdk.color_parse(colorName))
         cr.set_line_width(self.lineWidth)
-        numberOfClusters = len(GPXTracklog.clusters) # how many clusters do we have in this tracklog ?
-        for cluster in GPXTracklog.clusters: # we draw all clusters in tracklog
-
-            # do we see this cluster ?
-            clusterCentreX = cluster.centreX
-            clusterCentreY = cluster.centreY
-            clusterRadius = cluster.radius
-            screenToClusterDistance = geo.distance(screenCentreX, screenCentreY, clusterCentreX, clusterCentreY)
-            if (screenToClusterDistance - (screenRadius + clusterRadius)) >= 0:
-                continue # we don't see this cluster se we skip it
-            clusterNr = GPXTracklog.clusters.index(cluster)
-            #self.log.debug("Cluster nr %d" % clusterNr)
-            # now we need to draw lines to connect neighboring clusters
-            prevClusterNr = clusterNr - 1
-            nextClusterNr = clusterNr + 1
-            if prevClusterNr >= 0: # the 0th cluster has no previous cluster
-                prevCluster = GPXTracklog.clusters[prevClusterNr]
-                thisClusterLen = len(cluster.pointsList)
-                prevClusterFirstPoint = prevCluster.pointsList[0]
-                thisClusterLastPoint = cluster.pointsList[thisClusterLen - 1]
-                (x1, y1) = proj.ll2xy(thisClusterLastPoint['latitude'], thisClusterLastPoint['longitude'])
-                (x2, y2) = proj.ll2xy(prevClusterFirstPoint['latitude'], prevClusterFirstPoint['longitude'])
-                self.drawLineSegment(cr, x1, y1, x2, y2) # now we connect the two clusters
-                #self.point(cr, x1, y1)
-                #self.point(cr, x2, y2)
-
-            if nextClusterNr <= (numberOfClusters - 1): # the last cluster has no next cluster
-                nextCluster = GPXTracklog.clusters[nextClusterNr]
-                nextClusterLen = len(nextCluster.pointsList)
-                nextClusterLastPoint = nextCluster.pointsList[nextClusterLen - 1]
-                thisClusterFirstPoint = cluster.pointsList[0]
-                (x1, y1) = proj.ll2xy(thisClusterFirstPoint['latitude'], thisClusterFirstPoint['longitude'])
-                (x2, y2) = proj.ll2xy(nextClusterLastPoint['latitude'], nextClusterLastPoint['longitude'])
-                self.drawLineSegment(cr, x1, y1, x2, y2) # now we connect the two clusters
-                #self.point(cr, x1, y1)
-                #self.point(cr, x2, y2)
-
-                # get a list of onscreen coordinates
-            #      points = map(lambda x: proj.ll2xy(x['latitude'], x['longitude']), cluster.pointsList)
-            points = [proj.ll2xy(x['latitude'], x['longitude']) for x in cluster.pointsList]
-            # draw these coordinates
-            (x, y) = points[0]
-            cr.move_to(x, y) # go the the first point
-            [cr.line_to(x[0], x[1]) for x in points[1:]] # extend the line over the other points in the cluster
-
+        # only clusters that can be visible are added to the path
+        # & they are all drawn at once
+        geometry.draw(cr, *proj.getGlobalPixelView())
         cr.stroke()
         cr.fill()
 
@@ -302,6 +281,13 @@ class ShowTracklogs(RanaModule):
     #    self.log.debug("Nr of trackpoints drawn: %d" % pointsDrawn)
     #    self.log.debug("Redraw took %1.2f ms" % (1000 * (clock() - start)))
 
+    def _getMaxSimplificationError(self, GPXTracklog, zoom):
+        """Return the largest simplification error in meters that is not visible on the given zoom level"""
+        lat = GPXTracklog.points.lat[0]
+        metersPerPixel = (2 * math.pi * geo.EARTH_RADIUS * 1000 * math.cos(math.radians(lat)) /
+                          (geometry_cache.TILE_SIZE * 2 ** zoom))
+        return SIMPLIFICATION_MAX_ERROR_PX * metersPerPixel
+
 
     def drawColoredTracklog(self, cr, GPXTracklog):
         """show color depending on height"""
@@ -19,6 +19,7 @@
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
 from core import geo
+from core import constants
 from time import *
 
 
@@ -36,8 +37,9 @@ class Stats(RanaModule):
         self.maxSpeed = 0
         self.avg1 = 0
         self.avg2 = 0
-        # update stats once new position info is available
-        self.modrana.watch('locationUpdated', self.updateStatsCB)
+        # update stats once new position info is available,
+        # at most once per second
+        self.modrana.events.subscribe(constants.EVENT_FIX, self.updateStatsCB, max_rate=1)
 
 
     def updateStatsCB(self, *args):
@@ -22,6 +22,9 @@ import os
 import csv
 from core.point import POI
 from core.poi_db import POIDatabase
+from core import poi_import
+from core import constants
+from core import threads
 
 def getModule(*args, **kwargs):
     return StorePOI(*args, **kwargs)
@@ -142,6 +145,12 @@ class StorePOI(RanaModule):
             self.set('menu', None)
             self._dump_to_CSV()
 
+        elif messageType == 'ml' and message == "importFile":
+            # import POI from a GPX, CSV or OSM XML file
+            # format: path;category db index
+            if len(args) >= 2:
+                self.importPOIFile(args[0], int(args[1]))
+
     def handleTextEntryResult(self, key, result):
         if key == 'onlineResultName':
             # like this, the user can edit the name of the
@@ -185,6 +194,30 @@ class StorePOI(RanaModule):
                 self.log.exception("CSV dump failed")
                 self.sendMessage('ml:notification:m:POI export failed;5')
 
+    def importPOIFile(self, path, category_db_index):
+        """Import POI from a GPX, CSV or OSM XML file in the background
+
+        :param str path: path to the file
+        :param int category_db_index: database index of the category for the imported POI
+        """
+        db_path = self.modrana.paths.poi_database_path
+
+        def import_poi():
+            # SQLite connections can't be shared between threads,
+            # so use a separate connection for the import
+            db = POIDatabase(db_path=db_path)
+            try:
+                count = poi_import.import_file(db, path, category_db_index)
+                self.sendMessage('ml:notification:m:%d POI imported;5' % count)
+                self.sendMessage('showPOI:listMenusDirty')
+            except poi_import.POIImportFailed:
+                self.sendMessage('ml:notification:m:POI import failed;5')
+            finally:
+                db.disconnect_from_database()
+
+        self.sendMessage('ml:notification:m:POI import starting;5')
+        threads.threadMgr.add(threads.ModRanaThread(name=constants.THREAD_POI_IMPORT, target=import_poi))
+
     def shutdown(self):
         """Disconnect from the database on shutdown"""
         self._db.disconnect_from_database()
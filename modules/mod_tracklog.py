@@ -24,13 +24,17 @@ import time
 import os
 from collections import deque
 from core import geo
-from core.way import Way, AppendOnlyWay
+from core.way import Way
+from core import binary_tracklog
 from core import gs
 from core.signal import Signal
 
 if gs.GUIString == "GTK":
     import gtk
 
+# suffix of the temporary binary log file used during logging
+TEMPORARY_LOG_SUFFIX = ".temporary_log"
+
 DONT_ADD_TO_TRACE_THRESHOLD = 1
 # if a point is less distant from the last
 # point added to the trace than DONT_ADD_TO_TRACE_THRESHOLD
@@ -60,12 +64,10 @@ class Tracklog(RanaModule):
         self.logName = None #name of the current log
         self.logFilename = None #name of the current log
         self.logPath = None #path to the current log
-        self.currentLogGPX = None
         self.currentTempLog = []
-        # primary and secondary AOWay objects for
-        # persistent log storage during logging
-        self.log1 = None
-        self.log2 = None
+        # crash-safe binary log used as persistent
+        # log storage during logging
+        self.binaryLog = None
         # timer ids
         self.updateLogTimerId = None
         self.saveLogTimerId = None
@@ -175,35 +177,15 @@ class Tracklog(RanaModule):
         filename = None
 
         if logType == 'gpx':
-            # importing the GPX module can be time consuming so import it
-            # when it is really needed
             self.log.info("GPX selected as format for the final output")
-
-            from upoints import gpx
-
-            self.currentLogGPX = gpx.Trackpoints()
-            # set tracklog metadata
-            self.currentLogGPX.name = name
-            self.currentLogGPX.time = time.gmtime()
-
-            #      self.currentLogGPX.author = "modRana - a flexible GPS navigation system"
-            #      self.currentLogGPX.link = "http://nlp.fi.muni.cz/trac/gps_navigace"
-
             filename = "%s.gpx" % name
             self.logFilename = filename
             self.logPath = os.path.join(logFolder, filename)
 
-            # initialize temporary CSV log files
-            path1 = os.path.join(logFolder, "%s.temporary_csv_1" % name)
-            path2 = os.path.join(logFolder, "%s.temporary_csv_2" % name)
-
-            log1 = AppendOnlyWay()
-            log1.start_writing_csv(path1)
-            self.log1 = log1
-
-            log2 = AppendOnlyWay()
-            log2.start_writing_csv(path2)
-            self.log2 = log2
+            # initialize the temporary binary log file
+            tempPath = os.path.join(logFolder, "%s%s" % (name, TEMPORARY_LOG_SUFFIX))
+            syncInterval = int(self.get('tracklogSyncInterval', binary_tracklog.DEFAULT_SYNC_INTERVAL))
+            self.binaryLog = binary_tracklog.BinaryTrackLog(tempPath, sync_interval=syncInterval)
 
             # start update and save timers
             self._startTimers()
@@ -222,25 +204,28 @@ class Tracklog(RanaModule):
         # stop timers
         self._stopTimers()
 
-        # save current log increment to storage (in CSV)
-        self._saveLogIncrement()
+        # write the rest of the log to storage
+        self.binaryLog.close()
 
         # try to export the log to GPX
         self.notify("saving tracklog", 3000)
-        # first from the primary log
-        if not self.log1.save_to_GPX(self.logPath):
-            self.log2.save_to_GPX(self.logPath) # try the secondary log
-            # TODO: check if the GPX file is loadable and retry ?
+        exported = False
+        try:
+            binary_tracklog.export_gpx(self.binaryLog.path, self.logPath, name=self.logName)
+            exported = True
+        except Exception:
+            self.log.exception("exporting tracklog to GPX failed, "
+                               "keeping the temporary log for later recovery")
 
         # cleanup
-        # -> this deletes the temporary log files
-        # and discards the temporary AOWay objects
-        self._cleanup()
+        # -> this deletes the temporary log file (if the export succeeded)
+        # and discards the binary log object
+        self._cleanup(deleteTempLogs=exported)
         self.loggingEnabled = False
         # now we make the tracklog manager aware, that there is a new log
         loadTl = self.m.get('loadTracklogs', None)
         if loadTl:
-            loadTl.list_available_tracklogs() #TODO: incremental addition
+            loadTl.add_tracklog_path(self.logPath)
 
 
     def pauseLogging(self):
@@ -271,11 +256,9 @@ class Tracklog(RanaModule):
         """add current position at the end of the log"""
         pos = self.get('pos', None)
         if pos and not self.loggingPaused:
-            timestamp = geo.timestampUTC()
             lat, lon = pos
             elevation = self.get('elevation', None)
-            self.log1.add_point_llet(lat, lon, elevation, timestamp)
-            self.log2.add_point_llet(lat, lon, elevation, timestamp)
+            self.binaryLog.add_point(lat, lon, elevation, time.time())
 
             # update statistics for the current log
             if self.loggingEnabled and not self.loggingPaused:
@@ -324,8 +307,8 @@ class Tracklog(RanaModule):
         """
         pointCount = 0
         units = self.m.get('units', None)
-        if self.log1:
-            pointCount = self.log1.point_count
+        if self.binaryLog:
+            pointCount = self.binaryLog.point_count
 
         speed = self.get('speed', 0)
         if speed is not None:
@@ -365,16 +348,15 @@ class Tracklog(RanaModule):
             self.log.info('temp log files saved for %s, %1.1f min elapsed', self.logName, minutesElapsed)
 
     def _saveLogIncrement(self):
-        """save current log increment to storage"""
-        try:
-            self.log1.flush()
-        except Exception:
-            self.log.exception('saving primary temporary tracklog failed')
+        """save current log increment to storage
 
+        The increment is written as a new checksummed block,
+        fsync is done at most once per tracklogSyncInterval.
+        """
         try:
-            self.log2.flush()
+            self.binaryLog.flush()
         except Exception:
-            self.log.exception('saving secondary temporary tracklog failed')
+            self.log.exception('saving temporary tracklog failed')
 
     def generateLogName(self, name):
         """generate a unique name for a log"""
@@ -409,6 +391,7 @@ class Tracklog(RanaModule):
             # in the persistent dictionary
             self.modrana.watch('tracklogLogInterval', self._updateIntervalChangedCB)
             self.modrana.watch('tracklogSaveInterval', self._saveIntervalChangedCB)
+            self.modrana.watch('tracklogSyncInterval', self._syncIntervalChangedCB)
 
     def _updateIntervalChangedCB(self, key, oldInterval, newInterval):
         if self.updateLogTimerId:
@@ -430,6 +413,11 @@ class Tracklog(RanaModule):
             else:
                 self.log.error("the modRana cron module is not available")
 
+    def _syncIntervalChangedCB(self, key, oldInterval, newInterval):
+        if self.binaryLog:
+            self.binaryLog.sync_interval = int(newInterval)
+            self.log.info('tracklog sync interval changed to %s s', newInterval)
+
     def _stopTimers(self):
         """stop the update and save timers"""
         cron = self.m.get('cron', None)
@@ -447,10 +435,8 @@ class Tracklog(RanaModule):
 
         # delete the temporary log files
         if deleteTempLogs:
-            self.log1.delete_file()
-            self.log2.delete_file()
-        self.log1 = None
-        self.log2 = None
+            self.binaryLog.delete()
+        self.binaryLog = None
 
         # statistics
         self.loggingStartTimestamp = None
@@ -706,6 +692,34 @@ class Tracklog(RanaModule):
 
         # check out the log folder for temporary files
 
+        # binary logs
+        binaryLogs = glob.glob("%s/*%s" % (logFolder, TEMPORARY_LOG_SUFFIX))
+        if binaryLogs:
+            self.log.info('exporting %d unsaved binary tracklog files to GPX', len(binaryLogs))
+            self.notify("exporting temporary tracklogs to GPX", 5000)
+            self.set('needRedraw', True)
+            for logPath in binaryLogs:
+                basePath = logPath[:-len(TEMPORARY_LOG_SUFFIX)]
+                exportPath = "%s.gpx" % basePath
+                # does the GPX file already exist ?
+                # (eq. caused by a crash during saving the GPX file)
+                if os.path.exists(exportPath):  # save to backup path
+                    exportPath = "%s_1.gpx" % basePath
+                try:
+                    pointCount = binary_tracklog.export_gpx(logPath, exportPath,
+                                                            name=os.path.basename(basePath))
+                    self.log.info('%d points recovered from %s', pointCount, logPath)
+                    os.remove(logPath)
+                except Exception:
+                    self.log.exception('exporting unsaved binary log file %s failed', logPath)
+                    failedPath = "%s.broken_log" % basePath
+                    try:
+                        shutil.move(logPath, failedPath)
+                        self.log.info('renamed to %s', failedPath)
+                    except Exception:
+                        self.log.exception('renaming %s to %s failed', logPath, failedPath)
+
+        # legacy CSV logs from older modRana versions
         # first scan for primary logs
         primaryLogs = glob.glob("%s/*.temporary_csv_1" % logFolder)
         secondaryLogs = glob.glob("%s/*.temporary_csv_2" % logFolder)
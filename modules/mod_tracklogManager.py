@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
+from core import render_cache
 import os
 
 
@@ -121,15 +122,10 @@ class TracklogManager(RanaModule):
     def deleteTracklog(self, path):
         # delete a tracklog
         self.log.info("deleting tracklog:%s", path)
-        # from cache
-        self.LTModule.delete_tracklog_from_cache(path)
-        # from loaded tracklogs
-        del self.LTModule.tracklogs[path]
         # delete the tracklog file
         os.remove(path)
-
-        # relist all tracklogs
-        self.LTModule.list_available_tracklogs()
+        # remove it from cache, loaded tracklogs & the tracklog list
+        self.LTModule.remove_tracklog_path(path)
 
     def setupCategoriesMenu(self):
         # setup the categories menu
@@ -333,15 +329,8 @@ class TracklogManager(RanaModule):
 
     def showText(self, cr, text, x, y, widthLimit=None, fontsize=40):
         if text:
+            (fontsize, textWidth, textHeight) = render_cache.text_cache.fit_font_size(cr, text, fontsize, widthLimit)
             cr.set_font_size(fontsize)
-            stats = cr.text_extents(text)
-            (textWidth, textHeight) = stats[2:4]
-
-            if widthLimit and textWidth > widthLimit:
-                cr.set_font_size(fontsize * widthLimit / textWidth)
-                stats = cr.text_extents(text)
-                (textWidth, textHeight) = stats[2:4]
-
             cr.move_to(x, y + textHeight)
             cr.show_text(text)
 
@@ -43,6 +43,10 @@ REROUTING_TRIGGER_COUNT = 3
 MAX_CONSECUTIVE_AUTOMATIC_REROUTES = 3
 AUTOMATIC_REROUTE_COUNTER_EXPIRATION_TIME = 600  # in seconds
 
+# maximum navigation update rate, fixes from faster position
+# sources are coalesced to the latest one
+NAVIGATION_UPDATE_RATE = 2  # per second
+
 # only import GKT libs if GTK GUI is used
 if gs.GUIString == "GTK":
     import pango
@@ -74,6 +78,7 @@ class TurnByTurn(RanaModule):
         self.destination_reached = Signal()
         self.rerouting_triggered = Signal()
         self.current_step_changed = Signal()
+        self.current_step_changed.connect(self._presynthesize_ahead)
 
     def _go_to_initial_state(self):
         """restore initial state"""
@@ -87,7 +92,7 @@ class TurnByTurn(RanaModule):
         self._current_step = None
         self._navigation_box_hidden = False
         self._m_route_length = 0
-        self._location_watch_id = None
+        self._fix_subscription_id = None
         self._on_route = False
         # rerouting is enabled once the route is reached for the first time
         self._route_reached = False
@@ -348,6 +353,12 @@ class TurnByTurn(RanaModule):
         """
         return self.get('reroutingThreshold', REROUTING_DEFAULT_THRESHOLD)
 
+    def _presynthesize_ahead(self, step):
+        """Move voice pre-synthesis to the turns following the current step."""
+        voice = self.m.get('voice', None)
+        if voice and self._route and step is not None and step.distance_from_start is not None:
+            voice.presynthesizeRoute(self._route, distance=step.distance_from_start)
+
     def _say_turn(self, message, distanceInMeters, force_language_code=False):
         """Say a text-to-speech message about a turn.
 
@@ -358,14 +369,8 @@ class TurnByTurn(RanaModule):
         units = self.m.get('units', None)
 
         if voice and units:
-            (dist_string, short, long) = units.humanRound(distanceInMeters)
-
-            if dist_string == "0":
-                dist_string = ""
-            else:
-                dist_string = '<p xml:lang="en">in <emphasis level="strong">' + dist_string + ' ' + long + '</emphasis></p><br>'
-                # TODO: language specific distance strings
-            text = dist_string + message
+            # the same text is used when pre-synthesizing announcements
+            text = voice.turnAnnouncement(message, distanceInMeters)
 
             #      """ the message can contain unicode, this might cause an exception when printing it
             #      in some systems (SHR-u on Neo, for example)"""
@@ -573,29 +578,26 @@ class TurnByTurn(RanaModule):
                     self.log.debug("not enough data to decide, using closest turn")
                     self.current_step = cs
         self._do_navigation_update()  # run a first time navigation update
-        self._location_watch_id = self.watch('locationUpdated', self.location_update_cb)
+        self._fix_subscription_id = self.modrana.events.subscribe(constants.EVENT_FIX, self.location_update_cb,
+                                                                  max_rate=NAVIGATION_UPDATE_RATE)
         self.log.info("started and ready")
         # trigger the navigation-started signal
         self.navigation_started()
 
     def stop_tbt(self):
         """Stop Turn-by-Turn navigation."""
-        # remove location watch
-        if self._location_watch_id:
-            self.removeWatch(self._location_watch_id)
+        # stop receiving position updates
+        if self._fix_subscription_id:
+            self.modrana.events.unsubscribe(self._fix_subscription_id)
         # cleanup
         self._go_to_initial_state()
         self._stop_tbt_worker()
         self.log.info("stopped")
         self.navigation_stopped()
 
-    def location_update_cb(self, key, newValue, oldValue):
+    def location_update_cb(self, fix_event):
         """Position changed, do a tbt navigation update."""
-        # TODO: use a Signal for this ?
-        if key == "locationUpdated":  # just to be sure
-            self._do_navigation_update()
-        else:
-            self.log.error("invalid key: %r", key)
+        self._do_navigation_update()
 
     def _do_navigation_update(self):
         """Do a navigation update."""
@@ -19,10 +19,29 @@ from __future__ import with_statement # for python 2.5
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
+from core import utils
+import os
 import subprocess
 import re
 import threading
 
+try:
+    from core import voice
+except ImportError:
+    # the voice generator needs Python 3
+    voice = None
+
+# turn announcements are pre-synthesized with these distances in addition
+# to the announcement without distance said once a turn is reached,
+# distances in announcements are snapped to the nearest one
+ANNOUNCEMENT_METERS = [50, 100, 150, 200, 250, 300, 400, 500, 700, 1000, 1500, 2000, 3000, 5000]
+# the same for imperial units
+ANNOUNCEMENT_FEET = [100, 200, 300, 500]
+ANNOUNCEMENT_MILES = [0.2, 0.3, 0.5, 0.7, 1, 1.5, 2, 3]
+
+# how long to wait for an announcement not yet synthesized (in seconds)
+SYNTHESIS_TIMEOUT = 2.0
+
 
 def getModule(*args, **kwargs):
     return Voice(*args, **kwargs)
@@ -41,6 +60,11 @@ class Voice(RanaModule):
             'espeak': 'espeak -v %language% -s 120 -a %volume% -m %qmessage%'
         }
         self.defaultProvider = "espeak"
+        # pre-synthesizes announcements to a persistent WAV file cache,
+        # created once the voice output is first used
+        self._generator = None
+        self._generatorLanguage = None
+        self._generatorLock = threading.Lock()
 
     def firstTime(self):
         es = self.get("voiceString", None)
@@ -71,6 +95,89 @@ class Voice(RanaModule):
             else:
                 self.notify("Sound output disabled, can't test", 2000)
 
+    def turnAnnouncement(self, message, distanceInMeters):
+        """Return the text announcing a turn described by the message
+        at the given distance"""
+        units = self.m.get('units', None)
+        if units is None or not distanceInMeters:
+            return message
+        distanceInMeters = self._snapDistance(units, distanceInMeters)
+        (distString, short, long) = units.humanRound(distanceInMeters)
+        if distString == "0":
+            return message
+        # TODO: language specific distance strings
+        distString = '<p xml:lang="en">in <emphasis level="strong">' + distString + ' ' + long + '</emphasis></p><br>'
+        return distString + message
+
+    def _announcementDistances(self, units):
+        """Return distances (in meters) turns are announced with for the current unit type"""
+        if self.get('unitType', 'km') == 'mile':
+            return ([feet * units.footInMeters for feet in ANNOUNCEMENT_FEET] +
+                    [miles * units.mileInMeters for miles in ANNOUNCEMENT_MILES])
+        else:
+            return ANNOUNCEMENT_METERS
+
+    def _snapDistance(self, units, distanceInMeters):
+        """Snap the distance to the nearest pre-synthesized one,
+        distances far out of the pre-synthesized range are kept"""
+        distances = self._announcementDistances(units)
+        if distances[0] / 2.0 <= distanceInMeters <= distances[-1] * 1.5:
+            return min(distances, key=lambda distance: abs(distance - distanceInMeters))
+        else:
+            return distanceInMeters
+
+    def _announcementVariants(self, point):
+        """Return all texts that can be said for a turn"""
+        message = getattr(point, "ssml_message", None) or point.description
+        units = self.m.get('units', None)
+        if not message or units is None:
+            return []
+        texts = []
+        for distance in [0] + self._announcementDistances(units):
+            text = voice.plain_text(self.turnAnnouncement(message, distance))
+            if text not in texts:
+                texts.append(text)
+        return texts
+
+    def presynthesizeRoute(self, route, distance=0):
+        """Queue announcements for the next few turns on the route ahead for WAV file
+        generation, so that they don't need to be synthesized once the turns are reached,
+        call this again once turns are passed to move to the following turns
+
+        :param route: the route
+        :type route: Way instance
+        :param float distance: current distance from route start in meters
+        """
+        if not self._isEnabled():
+            return
+        languageCode = self.get('directionsLanguage', 'en en').split(" ")[0]
+        with self._generatorLock:
+            generator = self._getGenerator(languageCode)
+            if generator is not None:
+                generator.presynthesize(route.message_points, distance, variants=self._announcementVariants)
+
+    def _getGenerator(self, languageCode):
+        """Return the voice generator for the given language
+        or None if voice output should use espeak directly
+
+        NOTE: call this with the generator lock held
+        """
+        if voice is None or self.get('voiceParameters', None) == "manual":
+            return None
+        if self._generator is None:
+            cacheDir = os.path.join(self.modrana.paths.cache_folder_path, "voice")
+            self._generator = voice.VoiceGenerator(cache_dir=cacheDir)
+        if languageCode != self._generatorLanguage:
+            # finding an engine probes for the TTS commands, so only do that
+            # once the language changes - all announcements in the language
+            # are then said by the same engine
+            self._generator.set_voice(languageCode)
+            self._generatorLanguage = languageCode
+        if self._generator.active:
+            return self._generator
+        else:
+            return None
+
     def espeakSay(self, plaintextMessage, distanceMeters, forceLanguageCode=False):
         """say routing messages through espeak"""
         if self._isEnabled():
@@ -120,11 +227,50 @@ class Voice(RanaModule):
                             # TODO: can this actually happen then using the Python logging module
                     return False
                 else:
-                    self._speak(language, text)
-                    return True
+                    return self._speak(language, text)
 
     def _speak(self, languageCode, message):
-        """say a message wth espeak"""
+        """say a message, using a pre-synthesized WAV file if available,
+        return False if the message could not be said"""
+        with self._generatorLock:
+            generator = self._getGenerator(languageCode)
+            if generator is not None:
+                text = voice.plain_text(message)
+                fname = generator.get(text)
+                if fname is None:
+                    # synthesize it with the same engine as the pre-synthesized
+                    # announcements, so that the voice does not change
+                    generator.make(text)
+                    fname = generator.wait(text, SYNTHESIS_TIMEOUT)
+                    if fname is None and not generator.failed(text):
+                        self.log.warning("voice message not synthesized in time: %s", text)
+                        return False
+                if fname is not None:
+                    process = self._playWav(fname)
+                    if process is not None:
+                        self.espaekProcess = process
+                        return True
+        return self._speakEspeak(languageCode, message)
+
+    def _playWav(self, fname):
+        """play a WAV file, return the player process or None if no player is available"""
+        volume = self._getEspeakVolumeValue() / 100.0
+        if utils.requirement_found("gst-launch-1.0"):
+            args = ["gst-launch-1.0", "-q", "playbin", "uri=%s" % utils.path2uri(fname), "volume=%1.2f" % volume]
+        elif utils.requirement_found("paplay"):
+            args = ["paplay", "--volume=%d" % int(65536 * volume), fname]
+        elif utils.requirement_found("aplay"):
+            args = ["aplay", "-q", fname]
+        else:
+            return None
+        try:
+            return subprocess.Popen(args)
+        except Exception:
+            self.log.exception("playing WAV file failed")
+            return None
+
+    def _speakEspeak(self, languageCode, message):
+        """say a message wth espeak, return False if espeak could not be started"""
         mode = self.get('voiceParameters', None)
         volume = "%d" % self._getEspeakVolumeValue()
         if mode == "manual": # user editable voice string
@@ -153,6 +299,7 @@ class Voice(RanaModule):
             languageParam = '-v%s' % languageCode
             args = ['espeak', languageParam, '-s 120', '-a', '%s' % volume, '-m', '"%s"' % message]
             self.espaekProcess = self._start_espeak_subprocess(args)
+        return self.espaekProcess is not None
 
     def _getEspeakVolumeValue(self):
         """get espeak volume value
@@ -197,3 +344,8 @@ class Voice(RanaModule):
             return True
         else:
             return False
+
+    def shutdown(self):
+        with self._generatorLock:
+            if self._generator is not None:
+                self._generator.quit()
@@ -0,0 +1,48 @@
+import unittest
+
+from core import batch_projection
+from core.tilenames import ll2xy
+
+POINTS = [(49.2, 16.6), (-33.9, 151.2), (0.0, 0.0), (64.1, -21.9), (89.9, 179.9)]
+
+
+class BatchProjectionTests(unittest.TestCase):
+
+    def world_coordinates_test(self):
+        """Check that batch projection matches the scalar projection"""
+        lats = [point[0] for point in POINTS[:-1]]
+        lons = [point[1] for point in POINTS[:-1]]
+        (xs, ys) = batch_projection.ll2world(lats, lons)
+        (pxs, pys) = batch_projection.world2pxpy(xs, ys, 15)
+        for (lat, lon), px, py in zip(POINTS, pxs, pys):
+            (expected_px, expected_py) = ll2xy(lat, lon, 15)
+            self.assertAlmostEqual(px, expected_px, places=6)
+            self.assertAlmostEqual(py, expected_py, places=6)
+        # latitudes beyond the Web Mercator limit are clamped
+        (xs, ys) = batch_projection.points2world(POINTS[-1:])
+        self.assertAlmostEqual(ys[0], 0.0, places=6)
+
+    def screen_coordinates_test(self):
+        """Check conversion of world coordinates to screen coordinates"""
+        (xs, ys) = batch_projection.world2xy([0.5, 0.75], [0.25, 0.5], 2, 1.5, 0.5, 256)
+        self.assertEqual(batch_projection.to_list(xs), [128.0, 384.0])
+        self.assertEqual(batch_projection.to_list(ys), [128.0, 384.0])
+        (xs, ys) = batch_projection.ll2world([], [])
+        self.assertEqual(batch_projection.to_list(xs), [])
+
+    def cache_test(self):
+        """Check that world coordinates are cached & recomputed when the points change"""
+        cache = batch_projection.WorldCoordinateCache(max_size=2)
+        points = list(POINTS)
+        first = cache.get("track", points)
+        self.assertIs(cache.get("track", points), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        points.append((50.0, 14.4))
+        self.assertEqual(len(cache.get("track", points)[0]), 6)
+        self.assertEqual(cache.misses, 2)
+        cache.get("route", points)
+        cache.get("poi", points)
+        self.assertEqual(len(cache), 2)
+        cache.invalidate("poi")
+        cache.clear()
+        self.assertEqual(len(cache), 0)
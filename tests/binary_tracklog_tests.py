@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core import binary_tracklog
+from core import tracklog_parser
+
+
+class BinaryTracklogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.temp_dir, "track.temporary_log")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_log(self):
+        track_log = binary_tracklog.BinaryTrackLog(self.log_path)
+        track_log.add_point(49.2, 16.6, 250.0, 1000000000)
+        track_log.add_point(49.3, 16.7, None, 1000000001)
+        track_log.flush()
+        track_log.add_point(49.4, 16.8, 260.0, 1000000002)
+        self.assertEqual(track_log.point_count, 3)
+        track_log.close()
+
+    def write_and_read_test(self):
+        """Check that points written to the log can be read back"""
+        self._write_log()
+        points = list(binary_tracklog.read_points(self.log_path))
+        self.assertEqual(points, [(49.2, 16.6, 250.0, 1000000000),
+                                  (49.3, 16.7, None, 1000000001),
+                                  (49.4, 16.8, 260.0, 1000000002)])
+
+    def torn_block_test(self):
+        """Check that a block damaged by a crash is ignored while earlier blocks are recovered"""
+        self._write_log()
+        # cut the last block in half, as if the write was interrupted
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, "r+b") as f:
+            f.truncate(size - binary_tracklog.RECORD.size // 2)
+        points = list(binary_tracklog.read_points(self.log_path))
+        self.assertEqual([p[0] for p in points], [49.2, 49.3])
+
+    def corrupted_block_test(self):
+        """Check that a block with a bad checksum is ignored"""
+        self._write_log()
+        with open(self.log_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\xff")
+        points = list(binary_tracklog.read_points(self.log_path))
+        self.assertEqual(len(points), 2)
+
+    def invalid_file_test(self):
+        """Check that a file that is not a binary log is rejected"""
+        with open(self.log_path, "wb") as f:
+            f.write(b"49.2,16.6,250.0\n")
+        with self.assertRaises(binary_tracklog.InvalidLogFile):
+            list(binary_tracklog.read_points(self.log_path))
+
+    def export_gpx_test(self):
+        """Check that an exported GPX file can be parsed"""
+        self._write_log()
+        gpx_path = os.path.join(self.temp_dir, "track.gpx")
+        self.assertEqual(binary_tracklog.export_gpx(self.log_path, gpx_path, name="a <b> & c"), 3)
+        points = tracklog_parser.parse_gpx(gpx_path)
+        self.assertEqual(list(points.lat), [49.2, 49.3, 49.4])
+        self.assertEqual(points.start_time, "2001-09-09T01:46:40Z")
+        self.assertEqual(points.duration, 2)
+        self.assertFalse(os.path.exists(gpx_path + ".tmp"))
@@ -0,0 +1,128 @@
+import threading
+import unittest
+
+from core import constants
+from core.backports import six
+from modules.mod_mapTiles.mod_mapTiles import MapTiles, COMPOSITE_TILE, LOADING_TILE
+
+BASE = ("base", 15, 1, 2)
+OVERLAY = ("overlay", 15, 1, 2)
+COMPOSITE = ((("base", 1.0), ("overlay", 0.5)), 15, 1, 2)
+
+
+class FakeTileStorage(object):
+    """Tile storage with tile data in a dictionary"""
+
+    def __init__(self):
+        self.tiles = {}
+
+    def get_tile_data(self, lzxy):
+        return self.tiles.get(lzxy)
+
+
+class FakeDownloader(object):
+    """Downloader that records the requested tiles"""
+
+    def __init__(self):
+        self.requests = []
+
+    def downloadTile(self, lzxy, tag=None):
+        self.requests.append(lzxy)
+        return None
+
+
+class FakeContext(object):
+    """Drawing context that records the calls made to it"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class CompositeTileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.options = {}
+        self.tiles = MapTiles.__new__(MapTiles)
+        self.tiles.images = [{}, {}]
+        self.tiles.imagesLock = threading.RLock()
+        self.tiles.maxImagesInMemory = 100
+        self.tiles._fallbackResolver = None
+        self.tiles._compositeInputs = {}
+        self.tiles._dlRequestQueue = six.moves.queue.Queue()
+        self.tiles._storeTiles = FakeTileStorage()
+        self.tiles._downloader = FakeDownloader()
+        self.tiles.get = lambda key, default=None: self.options.get(key, default)
+        self.tiles._tileLoadedNotify = lambda imageType: None
+        # the composites just record the input surfaces
+        self.tiles._compositeSurfaces = lambda surfaces: ("composite", surfaces)
+        self.tiles._data2cairoImageSurface = lambda data: "surface(%s)" % data
+
+    def _load(self):
+        self.tiles._loadCompositeTile(COMPOSITE, self.tiles._fakeDebugLog)
+        return self.tiles.images[0].get(COMPOSITE)
+
+    def composite_test(self):
+        """Check that composites are built from memory & storage and replace their inputs"""
+        self.tiles.storeInMemory("base image", BASE)
+        self.tiles._storeTiles.tiles[OVERLAY] = "overlay data"
+        surface, metadata = self._load()
+        self.assertEqual(surface, ("composite", [("base image", 1.0), ("surface(overlay data)", 0.5)]))
+        self.assertEqual(metadata['type'], COMPOSITE_TILE)
+        self.assertNotIn(BASE, self.tiles.images[0])
+
+    def download_test(self):
+        """Check that missing inputs are downloaded & the composite is built afterwards"""
+        self.tiles._storeTiles.tiles[BASE] = "base data"
+        self.assertIsNone(self._load())
+        self.assertEqual(self.tiles._downloader.requests, [OVERLAY])
+        self.tiles._storeTiles.tiles[OVERLAY] = "overlay data"
+        self.tiles._compositeInputDownloadedCB(constants.TILE_DOWNLOAD_SUCCESS, OVERLAY, None)
+        self.assertEqual(self.tiles._dlRequestQueue.get_nowait(), [(COMPOSITE, None)])
+        surface, metadata = self._load()
+        self.assertEqual(surface, ("composite", [("surface(base data)", 1.0), ("surface(overlay data)", 0.5)]))
+
+    def offline_test(self):
+        """Check that composites are built without the overlay when downloading is disabled"""
+        self.options['network'] = 'offline'
+        self.assertIsNone(self._load())
+        self.tiles._storeTiles.tiles[BASE] = "base data"
+        surface, metadata = self._load()
+        self.assertEqual(surface, ("composite", [("surface(base data)", 1.0)]))
+        self.assertEqual(self.tiles._downloader.requests, [])
+
+    def overlay_download_error_test(self):
+        """Check that a failed overlay download still results in a composite of the base layer"""
+        self.tiles._storeTiles.tiles[BASE] = "base data"
+        self._load()
+        self.tiles.storeInMemory("error image", OVERLAY, imageType="error")
+        self.tiles._compositeInputDownloadedCB(constants.TILE_DOWNLOAD_ERROR, OVERLAY, None)
+        self.assertEqual(self.tiles._dlRequestQueue.get_nowait(), [(COMPOSITE, None)])
+        surface, metadata = self._load()
+        self.assertEqual(surface, ("composite", [("surface(base data)", 1.0)]))
+
+    def base_download_error_test(self):
+        """Check that a failed base layer download is shown in place of the composite"""
+        self.tiles._storeTiles.tiles[OVERLAY] = "overlay data"
+        self.tiles.storeInMemory("loading image", COMPOSITE, imageType=LOADING_TILE)
+        self._load()
+        self.tiles.storeInMemory("error image", BASE, imageType="error")
+        self.tiles._compositeInputDownloadedCB(constants.TILE_DOWNLOAD_ERROR, BASE, None)
+        self.assertTrue(self.tiles._dlRequestQueue.empty())
+        surface, metadata = self.tiles.images[0][COMPOSITE]
+        self.assertEqual((surface, metadata['type']), ("error image", "error"))
+
+    def draw_inputs_test(self):
+        """Check that the base layer is drawn alone while the overlay is not available"""
+        cr = FakeContext()
+        self.assertFalse(self.tiles._drawCompositeInputs(cr, COMPOSITE, 0, 0, 1))
+        self.tiles.storeInMemory("base image", BASE)
+        self.assertTrue(self.tiles._drawCompositeInputs(cr, COMPOSITE, 0, 0, 1))
+        self.assertEqual([call[1] for call in cr.calls if call[0] == "set_source_surface"], ["base image"])
+        self.tiles.storeInMemory("overlay image", OVERLAY)
+        cr = FakeContext()
+        self.assertTrue(self.tiles._drawCompositeInputs(cr, COMPOSITE, 0, 0, 1))
+        self.assertEqual([call[1] for call in cr.calls if call[0] == "set_source_surface"],
+                         ["base image", "overlay image"])
@@ -0,0 +1,113 @@
+import unittest
+
+from core import constants
+from modules.gui_modules import layer_compositor
+from modules.gui_modules.layer_compositor import LayerCompositor, REUSE, TRANSLATE, REDRAW
+
+MAP = constants.DRAW_LAYER_MAP
+MAP_OVERLAY = constants.DRAW_LAYER_MAP_OVERLAY
+SCREEN_OVERLAY = constants.DRAW_LAYER_SCREEN_OVERLAY
+
+
+class FakeContext(object):
+    """Drawing context that records the calls made to it"""
+
+    def __init__(self, surface=None):
+        self.surface = surface
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class CompositorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.drawn = []
+        self.surfaces = []
+        self.compositor = LayerCompositor(self._create_surface, FakeContext)
+
+    def _create_surface(self, w, h):
+        self.surfaces.append((w, h))
+        return "surface%d" % len(self.surfaces)
+
+    def _draw_layer(self, layer, cr):
+        self.drawn.append((layer, cr.calls[:]))
+
+    def _compose(self, origin=(0, 0), view_key=15):
+        self.drawn = []
+        cr = FakeContext()
+        self.compositor.compose(cr, 800, 480, view_key, origin, self._draw_layer)
+        return cr
+
+    def _actions(self):
+        return dict((layer, stats.last_action) for layer, stats in self.compositor.stats.layers.items())
+
+    def dirty_tracking_test(self):
+        """Check that only invalidated layers are redrawn"""
+        cr = self._compose()
+        self.assertEqual([layer for layer, calls in self.drawn], list(constants.DRAW_LAYERS))
+        # all layers are painted on screen in order
+        self.assertEqual([call[1] for call in cr.calls if call[0] == "set_source_surface"],
+                         ["surface1", "surface2", "surface3"])
+        self._compose()
+        self.assertEqual(self.drawn, [])
+        self.compositor.invalidate(SCREEN_OVERLAY)
+        self._compose()
+        self.assertEqual([layer for layer, calls in self.drawn], [SCREEN_OVERLAY])
+        self.assertEqual(self._actions(), {MAP: REUSE, MAP_OVERLAY: REUSE, SCREEN_OVERLAY: REDRAW})
+        # no new surfaces were needed
+        self.assertEqual(len(self.surfaces), 3)
+
+    def view_change_test(self):
+        """Check that geographic layers are translated when panning & redrawn on zoom"""
+        self._compose()
+        self._compose(origin=(10, -5))
+        self.assertEqual(self._actions(), {MAP: TRANSLATE, MAP_OVERLAY: TRANSLATE, SCREEN_OVERLAY: REUSE})
+        layer, calls = self.drawn[0]
+        # the old surface is painted shifted and only the exposed strips are drawn
+        self.assertIn(("set_source_surface", "surface1", -10, 5), calls)
+        self.assertIn(("rectangle", 790, 0, 10, 480), calls)
+        self.assertIn(("rectangle", 0, 0, 800, 5), calls)
+        self.assertEqual(calls[-1], ("clip",))
+        # sub-pixel pan
+        self._compose(origin=(10.5, -5))
+        self.assertEqual(self._actions()[MAP], REDRAW)
+        # zoom change
+        self._compose(origin=(10.5, -5), view_key=16)
+        self.assertEqual(self._actions()[MAP], REDRAW)
+        # no origin, eq. rotated map
+        self._compose(origin=None, view_key=16)
+        self._compose(origin=None, view_key=16)
+        self.assertEqual(self._actions()[MAP], REUSE)
+
+    def shift_test(self):
+        """Check whole pixel shift detection"""
+        self.assertEqual(layer_compositor.get_shift((0.5, 0.5), (3.5, -1.5), 800, 480), (3, -2))
+        self.assertIsNone(layer_compositor.get_shift((0, 0), (0.3, 0), 800, 480))
+        self.assertIsNone(layer_compositor.get_shift((0, 0), (800, 0), 800, 480))
+        self.assertIsNone(layer_compositor.get_shift(None, (0, 0), 800, 480))
+        self.assertEqual(layer_compositor.get_exposed_rectangles(-3, 0, 800, 480), [(0, 0, 3, 480)])
+
+    def stats_test(self):
+        """Check per layer timing statistics"""
+        self._compose()
+        self._compose(origin=(1, 1))
+        self._compose(origin=(1, 1))
+        stats = self.compositor.stats
+        self.assertEqual(stats.frames, 3)
+        self.assertEqual(stats.layers[MAP].actions, {REDRAW: 1, TRANSLATE: 1, REUSE: 1})
+        self.assertIn("1 redrawn, 1 translated, 1 reused", stats.summary())
+        self.assertIn("%s: reuse" % MAP, stats.frame_report())
+
+    def redraw_on_pan_test(self):
+        """Check that layers anchored to the screen edges are redrawn on pan"""
+        self.compositor.set_redraw_on_pan(MAP_OVERLAY, True)
+        self._compose()
+        self._compose(origin=(10, -5))
+        self.assertEqual(self._actions(), {MAP: TRANSLATE, MAP_OVERLAY: REDRAW, SCREEN_OVERLAY: REUSE})
+        self._compose(origin=(10, -5))
+        self.assertEqual(self._actions()[MAP_OVERLAY], REUSE)
+        self.compositor.set_redraw_on_pan(MAP_OVERLAY, False)
+        self._compose(origin=(20, -5))
+        self.assertEqual(self._actions()[MAP_OVERLAY], TRANSLATE)
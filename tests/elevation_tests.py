@@ -0,0 +1,93 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from core import elevation
+
+SAMPLES = elevation.HGT_SAMPLES_3_ARCSEC
+
+
+def make_hgt(path, value=lambda row, col: row + col):
+    """Write a 3" HGT file with the given sample values"""
+    with open(path, "wb") as f:
+        for row in range(SAMPLES):
+            f.write(struct.pack(">%dh" % SAMPLES, *[value(row, col) for col in range(SAMPLES)]))
+
+
+class ElevationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.temp_dir, "elevation_data")
+        os.mkdir(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def tile_name_test(self):
+        """Check tile naming for all hemispheres"""
+        self.assertEqual(elevation.tile_name(49.5, 16.5), "N49E016")
+        self.assertEqual(elevation.tile_name(-0.5, -0.5), "S01W001")
+        self.assertEqual(elevation.parse_tile_name("/tmp/s01w001.HGT"), ("S01W001", -1, -1))
+        self.assertIsNone(elevation.parse_tile_name("N49E016.zip"))
+
+    def interpolation_test(self):
+        """Check bilinear interpolation & the tile orientation"""
+        make_hgt(os.path.join(self.data_dir, "N49E016.hgt"))
+        provider = elevation.ElevationProvider(self.data_dir)
+        step = 1.0 / (SAMPLES - 1)
+        # north-west corner is the first sample
+        self.assertAlmostEqual(provider.elevation(50.0 - 1e-9, 16.0), 0.0, places=4)
+        self.assertAlmostEqual(provider.elevation(49.0, 17.0 - 1e-9), 2 * (SAMPLES - 1), places=4)
+        # half way between samples in both directions
+        self.assertAlmostEqual(provider.elevation(50.0 - 10.5 * step, 16.0 + 20.5 * step), 31.0)
+        # outside of the available data
+        self.assertIsNone(provider.elevation(10.0, 10.0))
+        provider.close()
+
+    def void_test(self):
+        """Check that void samples are not interpolated"""
+        void = elevation.HGT_VOID
+        make_hgt(os.path.join(self.data_dir, "N49E016.hgt"),
+                 value=lambda row, col: void if row <= 1 and col <= 1 else 100)
+        provider = elevation.ElevationProvider(self.data_dir)
+        step = 1.0 / (SAMPLES - 1)
+        self.assertAlmostEqual(provider.elevation(50.0 - 1.5 * step, 16.0 + 1.5 * step), 100.0)
+        self.assertIsNone(provider.elevation(50.0 - 0.5 * step, 16.0 + 0.5 * step))
+        provider.close()
+
+    def batch_test(self):
+        """Check batch lookup over multiple tiles & the open tile limit"""
+        make_hgt(os.path.join(self.data_dir, "N49E016.hgt"), value=lambda row, col: 200)
+        make_hgt(os.path.join(self.data_dir, "N50E016.hgt"), value=lambda row, col: 300)
+        provider = elevation.ElevationProvider(self.data_dir, max_open_tiles=1)
+        points = [(49.5, 16.5), (50.5, 16.5), (49.2, 16.2), (48.5, 16.5)]
+        self.assertTrue(provider.covers(points[:3]))
+        self.assertFalse(provider.covers(points))
+        self.assertEqual(provider.lookup_batch(points),
+                         [(49.5, 16.5, 200.0), (50.5, 16.5, 300.0), (49.2, 16.2, 200.0), (48.5, 16.5, None)])
+        self.assertEqual(provider.open_tile_count, 1)
+        provider.close()
+        self.assertEqual(provider.open_tile_count, 0)
+
+    def import_test(self):
+        """Check importing HGT files & zip archives"""
+        source_dir = os.path.join(self.temp_dir, "source")
+        os.mkdir(source_dir)
+        make_hgt(os.path.join(source_dir, "N49E016.hgt"))
+        make_hgt(os.path.join(self.temp_dir, "N50E014.hgt"))
+        with zipfile.ZipFile(os.path.join(source_dir, "N50E014.hgt.zip"), "w") as archive:
+            archive.write(os.path.join(self.temp_dir, "N50E014.hgt"), "N50E014.hgt")
+        # truncated file
+        with open(os.path.join(source_dir, "N10E010.hgt"), "wb") as f:
+            f.write(b"\0" * 100)
+        provider = elevation.ElevationProvider(self.data_dir)
+        self.assertFalse(provider.covers([(49.5, 16.5)]))
+        imported = elevation.import_hgt_files([source_dir], self.data_dir)
+        self.assertEqual(sorted(imported), ["N49E016", "N50E014"])
+        provider.refresh()
+        self.assertEqual(sorted(provider.available_tiles), ["N49E016", "N50E014"])
+        self.assertTrue(provider.covers([(49.5, 16.5), (50.1, 14.4)]))
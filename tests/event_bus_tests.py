@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from core import location_replay
+from core.event_bus import EventBus
+from core.fix import Fix, FixEvent
+
+GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><trkseg>
+<trkpt lat="49.2" lon="16.6"><ele>250</ele><time>2014-05-13T16:53:20Z</time></trkpt>
+<trkpt lat="49.2" lon="16.601"><ele>251</ele><time>2014-05-13T16:53:25Z</time></trkpt>
+</trkseg></trk>
+</gpx>
+"""
+
+# NMEA sentences without checksums
+NMEA = [
+    "GPRMC,165320,A,4912.000,N,01636.000,E,010.0,090.0,130514,,",
+    "GPGGA,165320,4912.000,N,01636.000,E,1,08,0.9,250.0,M,,,,",
+    "GPRMC,165321,A,4912.000,N,01636.010,E,010.0,090.0,130514,,",
+    "GPRMC,165322,A,4912.000,N,01636.020,E,010.0,090.0,130514,,",
+]
+
+
+def nmea_sentence(data):
+    """Add checksum to a NMEA sentence"""
+    checksum = 0
+    for character in data:
+        checksum ^= ord(character)
+    return "$%s*%02X" % (data, checksum)
+
+
+class EventBusTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = [0.0]
+        self.bus = EventBus(clock=lambda: self.clock[0], use_timers=False)
+
+    def publish_at(self, now, event):
+        self.clock[0] = now
+        self.bus.publish("fix", event)
+
+    def rate_limit_test(self):
+        """Check that rate limited subscribers get coalesced latest events"""
+        every = []
+        limited = []
+        self.bus.subscribe("fix", every.append)
+        self.bus.subscribe("fix", limited.append, max_rate=2)
+        for i in range(10):
+            self.publish_at(i * 0.1, i)
+        self.assertEqual(every, list(range(10)))
+        # delivered on the leading edge of every 0.5 second interval
+        self.assertEqual(limited, [0, 5])
+        # the last event is not lost
+        self.bus.flush()
+        self.assertEqual(limited, [0, 5, 9])
+        self.bus.flush()
+        self.assertEqual(limited, [0, 5, 9])
+
+    def unsubscribe_test(self):
+        """Check that unsubscribed callbacks are not called & pending events are dropped"""
+        events = []
+        subscription = self.bus.subscribe("fix", events.append, max_rate=1)
+        self.assertEqual(self.bus.subscriber_count("fix"), 1)
+        self.publish_at(0, "a")
+        self.publish_at(0.5, "b")
+        self.assertTrue(self.bus.unsubscribe(subscription))
+        self.assertFalse(self.bus.unsubscribe(subscription))
+        self.bus.flush()
+        self.publish_at(2, "c")
+        self.assertEqual(events, ["a"])
+        self.assertEqual(self.bus.subscriber_count("fix"), 0)
+
+    def failing_subscriber_test(self):
+        """Check that a failing subscriber does not break delivery to others"""
+        events = []
+        self.bus.subscribe("fix", lambda event: 1 / 0)
+        self.bus.subscribe("fix", events.append)
+        self.publish_at(0, "a")
+        self.assertEqual(events, ["a"])
+
+    def dispatch_test(self):
+        """Check that timers deliver pending events through the dispatch callable"""
+        dispatched = []
+        delivered = threading.Event()
+
+        def dispatch(callback, *args):
+            dispatched.append((callback, args))
+            delivered.set()
+
+        bus = EventBus(dispatch=dispatch)
+        events = []
+        bus.subscribe("fix", events.append, max_rate=20)
+        bus.publish("fix", "a")
+        bus.publish("fix", "b")
+        self.assertTrue(delivered.wait(2))
+        # the timer thread does not call the subscriber itself
+        self.assertEqual(events, ["a"])
+        self.assertEqual(len(dispatched), 1)
+        (callback, args) = dispatched[0]
+        callback(*args)
+        self.assertEqual(events, ["a", "b"])
+        bus.clear()
+
+    def fix_event_test(self):
+        """Check conversion of a Fix to a fix event & option items"""
+        event = FixEvent.from_fix(Fix((49.2, 16.6), 250, 90, 10.0, mode=3), 100)
+        self.assertEqual(event.position, (49.2, 16.6))
+        self.assertEqual(event.fix_class, 3)
+        self.assertAlmostEqual(event.kmh_speed, 36.0)
+        items = dict(event.options_items())
+        self.assertEqual(items["pos"], (49.2, 16.6))
+        self.assertEqual(items["elevation"], 250)
+        self.assertEqual(items["locationUpdated"], 100)
+        event = FixEvent.from_fix(Fix(), 100)
+        self.assertIsNone(event.position)
+        self.assertEqual(event.fix_class, 0)
+        self.assertIsNone(event.kmh_speed)
+
+
+class LocationReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def gpx_test(self):
+        """Check reading fixes from a GPX file"""
+        fixes = location_replay.read_fixes(self.write("track.gpx", GPX))
+        self.assertEqual(len(fixes), 2)
+        self.assertEqual(fixes[0].position, (49.2, 16.6))
+        self.assertEqual(fixes[1].altitude, 251)
+        self.assertEqual(fixes[1].gps_time - fixes[0].gps_time, 5)
+        # ~72.6 m in 5 seconds to the east
+        self.assertAlmostEqual(fixes[1].speed, 14.5, places=0)
+        self.assertAlmostEqual(fixes[1].bearing, 90, places=0)
+
+    def nmea_test(self):
+        """Check reading fixes from a NMEA log"""
+        lines = [nmea_sentence(data) for data in NMEA]
+        # sentence with a bad checksum is skipped
+        lines.append("$GPRMC,165323,A,4912.000,N,01636.030,E,010.0,090.0,130514,,*00")
+        fixes = location_replay.read_fixes(self.write("drive.nmea", "\n".join(lines)))
+        self.assertEqual(len(fixes), 3)
+        (lat, lon) = fixes[0].position
+        self.assertAlmostEqual(lat, 49.2)
+        self.assertAlmostEqual(lon, 16.6)
+        self.assertEqual(fixes[0].altitude, 250.0)
+        self.assertEqual(fixes[0].sats_in_use, 8)
+        self.assertIsNone(fixes[1].altitude)
+        self.assertAlmostEqual(fixes[0].speed, 5.144, places=3)
+        self.assertEqual(fixes[0].bearing, 90.0)
+        self.assertEqual(fixes[2].gps_time - fixes[0].gps_time, 2)
+
+    def invalid_log_test(self):
+        """Check that an invalid GPX file raises an exception"""
+        path = self.write("broken.gpx", "<gpx><trk>")
+        self.assertRaises(location_replay.TracklogParsingFailed, location_replay.read_fixes, path)
+
+    def replay_test(self):
+        """Check replaying fixes as fast as possible & stopping the replay"""
+        fixes = location_replay._synthetic_fixes(10, 10)
+        replayed = []
+        self.assertEqual(location_replay.replay(fixes, replayed.append, speed=None), 100)
+        self.assertEqual(replayed, fixes)
+        stopEvent = location_replay.threading.Event()
+
+        def callback(fix):
+            if fix is fixes[4]:
+                stopEvent.set()
+
+        self.assertEqual(location_replay.replay(fixes, callback, speed=None, stop_event=stopEvent), 5)
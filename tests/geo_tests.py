@@ -48,6 +48,68 @@ class GeoTests(unittest.TestCase):
         result = geo.get_closest_lle(reference_lle, lle_list)
         self.assertEqual(closest_lle, result)
 
+    def cluster_trackpoints_test(self):
+        """Test the clusterTrackpoints() function."""
+        class Trackpoint(object):
+            def __init__(self, latitude, longitude):
+                self.latitude = latitude
+                self.longitude = longitude
 
+        # no points, no clusters
+        self.assertEqual(geo.clusterTrackpoints([], 5), [])
+        self.assertEqual(geo.clusterTrackpoints([[]], 5), [])
 
+        # a track going north from Brno with a point roughly every 100 m
+        track = [Trackpoint(49.2 + i * 0.001, 16.6) for i in range(1000)]
+        clusters = geo.clusterTrackpoints([track], 5)
+        # the track is about 111 km long, so there should be
+        # around 22 clusters about 5 km in diameter
+        self.assertTrue(20 <= len(clusters) <= 24)
+        # no points should be lost and the track order should be kept
+        points = []
+        for cluster_points, centre_lat, centre_lon, radius in clusters:
+            points.extend(cluster_points)
+        self.assertEqual([(p["latitude"], p["longitude"]) for p in points],
+                         [(p.latitude, p.longitude) for p in track])
+        # all points should be inside the cluster circles
+        for cluster_points, centre_lat, centre_lon, radius in clusters:
+            for p in cluster_points:
+                self.assertLessEqual(geo.distance(centre_lat, centre_lon, p["latitude"], p["longitude"]),
+                                     radius + 0.000001)
 
+        # a track returning to the same area should result in separate clusters
+        track = [Trackpoint(49.2, 16.6), Trackpoint(49.3, 16.6), Trackpoint(49.2, 16.6)]
+        clusters = geo.clusterTrackpoints([track], 5)
+        self.assertEqual(len(clusters), 3)
+
+    def cluster_track_indexes_test(self):
+        """Test the clusterTrackIndexes() function."""
+        self.assertEqual(geo.clusterTrackIndexes([], [], 5), [])
+        lats = [49.2 + i * 0.001 for i in range(1000)]
+        lons = [16.6] * 1000
+        clusters = geo.clusterTrackIndexes(lats, lons, 5)
+        # contiguous index ranges covering the whole track
+        self.assertEqual(clusters[0][0], 0)
+        self.assertEqual(clusters[-1][1], 1000)
+        for previous, cluster in zip(clusters, clusters[1:]):
+            self.assertEqual(previous[1], cluster[0])
+        for start, end, centre_lat, centre_lon, radius in clusters:
+            for i in range(start, end):
+                self.assertLessEqual(geo.distance(centre_lat, centre_lon, lats[i], lons[i]),
+                                     radius + 0.000001)
+
+    def per_elev_list_from_arrays_test(self):
+        """Test that periodic elevation from arrays matches the trackpoint version"""
+        class Trackpoint(object):
+            def __init__(self, latitude, longitude, elevation):
+                self.latitude = latitude
+                self.longitude = longitude
+                self.elevation = elevation
+
+        track = [Trackpoint(49.2 + i * 0.001, 16.6, 200 + i) for i in range(50)]
+        result = geo.perElevListFromArrays([p.latitude for p in track],
+                                           [p.longitude for p in track],
+                                           [p.elevation for p in track], 10)
+        self.assertEqual(result, geo.perElevList([track], 10))
+        self.assertAlmostEqual(result[0][1], 200)
+        self.assertAlmostEqual(result[-1][1], 249)
@@ -0,0 +1,86 @@
+import unittest
+
+from core import geometry_cache
+from core.geometry_cache import GeometryCache, ProjectedGeometry
+from core.tilenames import ll2xy
+
+
+class FakeContext(object):
+    """Drawing context that records the calls made to it"""
+
+    def __init__(self):
+        self.calls = []
+
+    def move_to(self, x, y):
+        self.calls.append(("move_to", x, y))
+
+    def line_to(self, x, y):
+        self.calls.append(("line_to", x, y))
+
+
+# two clusters far from each other
+CLUSTERS = [[(49.0, 16.0), (49.01, 16.01)], [(50.0, 14.0), (50.01, 14.01), (50.02, 14.02)]]
+
+
+class GeometryCacheTests(unittest.TestCase):
+
+    def projection_test(self):
+        """Check that points are projected to global pixels with per part bounding boxes"""
+        geometry = ProjectedGeometry(CLUSTERS, 10, connect=True)
+        self.assertEqual(len(geometry.parts), 2)
+        # the second part starts with the last point of the first part
+        self.assertEqual(geometry.point_count, 6)
+        (bbox, xs, ys) = geometry.parts[0]
+        (px, py) = ll2xy(49.0, 16.0, 10)
+        self.assertAlmostEqual(xs[0], px * 256, places=4)
+        self.assertAlmostEqual(ys[0], py * 256, places=4)
+        self.assertEqual(bbox, (min(xs), min(ys), max(xs), max(ys)))
+
+    def culling_test(self):
+        """Check that only visible parts are drawn, translated to the screen"""
+        geometry = ProjectedGeometry(CLUSTERS, 10)
+        (bbox, xs, ys) = geometry.parts[1]
+        (x1, y1) = (xs[0] - 10, ys[0] - 10)
+        cr = FakeContext()
+        self.assertEqual(geometry.draw(cr, x1, y1, x1 + 100, y1 + 100, x1, y1), 1)
+        self.assertEqual(cr.calls[0][0], "move_to")
+        self.assertAlmostEqual(cr.calls[0][1], 10)
+        self.assertAlmostEqual(cr.calls[0][2], 10)
+        self.assertEqual([call[0] for call in cr.calls], ["move_to", "line_to", "line_to"])
+        self.assertEqual(geometry.draw(FakeContext(), 0, 0, 100, 100, 0, 0), 0)
+
+    def cache_test(self):
+        """Check caching per zoom level, versioning & eviction"""
+        cache = GeometryCache(max_points=8)
+        requests = []
+
+        def get_parts():
+            requests.append(1)
+            return CLUSTERS
+
+        version = geometry_cache.new_version()
+        first = cache.get("track", version, 10, get_parts)
+        self.assertIs(cache.get("track", version, 10, get_parts), first)
+        self.assertEqual(len(requests), 1)
+        # different zoom level
+        cache.get("track", version, 11, get_parts)
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(cache.point_count, 5)
+        # the track changed, versions are never reused
+        new_version = geometry_cache.new_version()
+        self.assertGreater(new_version, version)
+        self.assertIsNot(cache.get("track", new_version, 10, get_parts), first)
+        self.assertEqual(len(requests), 3)
+        # the least recently used geometry is evicted to stay within the limit
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.point_count, 5)
+        cache.get("other", 1, 10, get_parts)
+        cache.invalidate("other")
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.point_count, 0)
+
+    def split_test(self):
+        """Check that split parts share boundary points"""
+        points = list(range(10))
+        self.assertEqual(geometry_cache.split_points(points, 4), [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]])
+        self.assertEqual(geometry_cache.split_points([0], 4), [[0]])
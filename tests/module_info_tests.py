@@ -0,0 +1,122 @@
+import unittest
+
+from core import module_info
+
+
+class ModuleInfoTests(unittest.TestCase):
+
+    def startup_order_test(self):
+        """Check that dependencies are ordered before modules that need them"""
+        order = module_info.startup_order(["tileserver", "mapTiles", "mapView", "storeTiles", "mapLayers", "cron"])
+        self.assertEqual(sorted(order), sorted(["tileserver", "mapTiles", "mapView", "storeTiles", "mapLayers", "cron"]))
+        for dependency in ("mapView", "storeTiles", "mapLayers"):
+            self.assertLess(order.index(dependency), order.index("mapTiles"))
+        self.assertLess(order.index("mapTiles"), order.index("tileserver"))
+
+    def with_dependencies_test(self):
+        """Check that transitive dependencies are found"""
+        available = ["tileserver", "mapTiles", "mapView", "storeTiles", "cron"]
+        self.assertEqual(module_info.with_dependencies(["tileserver"], available),
+                         set(["tileserver", "mapTiles", "mapView", "storeTiles"]))
+
+    def unknown_module_test(self):
+        """Check that modules without metadata are loaded eagerly"""
+        info = module_info.get_module_info("someThirdPartyModule")
+        self.assertEqual(info.eagerness, module_info.EAGER)
+        self.assertEqual(info.dependencies, ())
+
+
+class ModuleDictTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+        self.modules = module_info.ModuleDict(self._loader)
+        self.modules.set_available({"a": "mod_a", "b": "mod_b", "broken": "mod_broken"})
+
+    def _loader(self, name):
+        self.loaded.append(name)
+        if name == "broken":
+            return None
+        return "module %s" % name
+
+    def load_on_access_test(self):
+        """Check that modules are loaded once, on first access"""
+        self.assertEqual(self.modules.values(), [])
+        self.assertEqual(self.modules.get("a"), "module a")
+        self.assertEqual(self.modules["a"], "module a")
+        self.assertEqual(self.loaded, ["a"])
+        self.assertEqual(self.modules.values(), ["module a"])
+        self.assertEqual(sorted(self.modules.not_loaded()), ["b", "broken"])
+
+    def missing_module_test(self):
+        """Check that missing and broken modules are handled like missing keys"""
+        self.assertIsNone(self.modules.get("missing"))
+        self.assertEqual(self.modules.get("broken", 1), 1)
+        self.assertIsNone(self.modules.get("broken"))
+        self.assertEqual(self.loaded, ["broken"])
+        with self.assertRaises(KeyError):
+            self.modules["missing"]
+
+    def concurrent_load_test(self):
+        """Check that a slow module does not block loading of other modules"""
+        import threading
+        loading = threading.Event()
+        release = threading.Event()
+
+        def slow_loader(name):
+            self.loaded.append(name)
+            if name == "a":
+                loading.set()
+                release.wait(10)
+            return "module %s" % name
+
+        modules = module_info.ModuleDict(slow_loader)
+        modules.set_available({"a": "mod_a", "b": "mod_b"})
+        results = []
+        first = threading.Thread(target=lambda: results.append(modules.get("a")))
+        first.start()
+        self.assertTrue(loading.wait(10))
+        # another module can be loaded while "a" is still loading
+        self.assertEqual(modules.get("b"), "module b")
+        # a second thread waits for "a" to be loaded instead of loading it again
+        second = threading.Thread(target=lambda: results.append(modules.get("a")))
+        second.start()
+        release.set()
+        first.join(10)
+        second.join(10)
+        self.assertEqual(results, ["module a", "module a"])
+        self.assertEqual(sorted(self.loaded), ["a", "b"])
+
+    def broadcast_test(self):
+        """Check that modules loaded later get broadcast messages sent before"""
+        class Module(object):
+            def __init__(self):
+                self.messages = []
+
+            def handleMessage(self, message, messageType, args):
+                self.messages.append(message)
+
+        modules = module_info.ModuleDict(lambda name: Module())
+        modules.set_available({"a": "mod_a", "b": "mod_b"})
+        a = modules.get("a")
+        modules.broadcast("first")
+        modules.broadcast("second")
+        self.assertEqual(a.messages, ["first", "second"])
+        self.assertEqual(modules.get("b").messages, ["first", "second"])
+        modules.broadcast("third")
+        self.assertEqual(modules.get("b").messages, ["first", "second", "third"])
+
+    def dispatch_test(self):
+        """Check that available modules are loaded through the dispatch callable"""
+        dispatched = []
+
+        def dispatch(callback, *args):
+            dispatched.append(args)
+            return callback(*args)
+
+        modules = module_info.ModuleDict(self._loader, dispatch=dispatch)
+        modules.set_available({"a": "mod_a"})
+        self.assertEqual(modules.get("a"), "module a")
+        self.assertEqual(modules.get("a"), "module a")
+        self.assertIsNone(modules.get("missing"))
+        self.assertEqual(dispatched, [("a",)])
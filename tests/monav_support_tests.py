@@ -0,0 +1,186 @@
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+from core import monav_support
+from core.point import Point
+
+# A stub Monav Light utility that never finishes
+STUB_MONAV_LIGHT = """#!%(python)s
+import time
+time.sleep(60)
+"""
+
+# A stub Monav server - answers "version" & "route" requests, one line each.
+# A mode file makes it crash or hang (once) on the next route request.
+STUB_SERVER = """#!%(python)s
+import os
+import socket
+import time
+
+server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("localhost", %(port)d))
+server.listen(5)
+while True:
+    connection = server.accept()[0]
+    request = connection.makefile("rb").readline().strip()
+    if request == b"route" and os.path.exists(%(mode_path)r):
+        with open(%(mode_path)r) as f:
+            mode = f.read()
+        os.remove(%(mode_path)r)
+        if mode == "crash":
+            os._exit(1)
+        elif mode == "hang":
+            time.sleep(60)
+    connection.sendall(b"ok " + request + b"\\n")
+    connection.close()
+"""
+
+
+class StubConnection(object):
+    """Connection to the stub server, replaces monav_server.TcpConnection"""
+
+    connections = []
+
+    def __init__(self, host='localhost', port=8040, timeout=None):
+        self._socket = socket.create_connection((host, port), timeout)
+        self.closed = False
+        StubConnection.connections.append(self)
+
+    def request(self, request):
+        self._socket.sendall(request + b"\n")
+        reply = self._socket.makefile("rb").readline().strip()
+        if reply != b"ok " + request:
+            raise Exception("stub server request failed")
+        return reply
+
+    def close(self):
+        self.closed = True
+        self._socket.close()
+
+
+def _stub_monav_modules():
+    monav_server = types.ModuleType("monav_server")
+    monav_server.TcpConnection = StubConnection
+    monav_server.get_version = lambda connection: connection.request(b"version")
+    monav_server.get_route = lambda data_directory, waypoints, connection: connection.request(b"route")
+    signals_pb2 = types.ModuleType("signals_pb2")
+    signals_pb2.RoutingResult = object
+    return {"monav_server": monav_server, "signals_pb2": signals_pb2}
+
+
+def _free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class MonavServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mode_path = os.path.join(self.folder, "mode")
+        port = _free_port()
+        server_path = os.path.join(self.folder, "monav-server")
+        with open(server_path, "w") as f:
+            f.write(STUB_SERVER % {"python": sys.executable, "port": port, "mode_path": self.mode_path})
+        os.chmod(server_path, os.stat(server_path).st_mode | stat.S_IEXEC)
+
+        self.saved_modules = {}
+        for name, module in _stub_monav_modules().items():
+            self.saved_modules[name] = sys.modules.get(name)
+            sys.modules[name] = module
+        self.saved_constants = (monav_support.MONAV_SERVER_PORT, monav_support.ROUTING_TIMEOUT,
+                                monav_support.HEALTH_CHECK_TIMEOUT)
+        monav_support.MONAV_SERVER_PORT = port
+        monav_support.ROUTING_TIMEOUT = 0.5
+        monav_support.HEALTH_CHECK_TIMEOUT = 0.5
+        StubConnection.connections = []
+        self.server = monav_support.MonavServer("/monav/data", server_path)
+        self.waypoints = [Point(49.2, 16.6), Point(49.3, 16.7)]
+
+    def tearDown(self):
+        self.server.stop_server()
+        (monav_support.MONAV_SERVER_PORT, monav_support.ROUTING_TIMEOUT,
+         monav_support.HEALTH_CHECK_TIMEOUT) = self.saved_constants
+        for name, module in self.saved_modules.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+        shutil.rmtree(self.folder)
+
+    def set_mode(self, mode):
+        with open(self.mode_path, "w") as f:
+            f.write(mode)
+
+    def assert_connections_closed(self):
+        self.assertTrue(StubConnection.connections)
+        self.assertTrue(all(connection.closed for connection in StubConnection.connections))
+
+    def route_test(self):
+        """Check that the server is started once & all connections are closed"""
+        self.assertEqual(self.server.get_monav_directions(self.waypoints, None), b"ok route")
+        process = self.server._monav_server_process
+        self.assertEqual(self.server.get_monav_directions(self.waypoints, None), b"ok route")
+        self.assertIs(self.server._monav_server_process, process)
+        self.assertEqual(self.server.restart_count, 0)
+        self.assert_connections_closed()
+
+    def restart_on_crash_test(self):
+        """Check that a server crashing during a request is restarted"""
+        self.assertTrue(self.server.start_server())
+        self.set_mode("crash")
+        self.assertEqual(self.server.get_monav_directions(self.waypoints, None), b"ok route")
+        self.assertEqual(self.server.restart_count, 1)
+        self.assert_connections_closed()
+
+    def restart_dead_server_test(self):
+        """Check that a server that died between requests is restarted"""
+        self.assertTrue(self.server.start_server())
+        self.server._monav_server_process.kill()
+        self.server._monav_server_process.wait()
+        self.assertEqual(self.server.get_monav_directions(self.waypoints, None), b"ok route")
+        self.assertEqual(self.server.restart_count, 1)
+        self.assertTrue(self.server.server_running)
+
+    def timeout_test(self):
+        """Check that a hung server times out & is restarted"""
+        self.assertTrue(self.server.start_server())
+        hung_process = self.server._monav_server_process
+        self.set_mode("hang")
+        self.assertEqual(self.server.get_monav_directions(self.waypoints, None), b"ok route")
+        self.assertEqual(self.server.restart_count, 1)
+        self.assertIsNotNone(hung_process.poll())
+        self.assert_connections_closed()
+
+
+class MonavLightTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.light_path = os.path.join(self.folder, "monav-light")
+        with open(self.light_path, "w") as f:
+            f.write(STUB_MONAV_LIGHT % {"python": sys.executable})
+        os.chmod(self.light_path, os.stat(self.light_path).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def cancel_test(self):
+        """Check that a cancelled route search kills the Monav Light process"""
+        monav_light = monav_support.MonavLight("/monav/data", self.light_path)
+        start = time.time()
+        result = monav_light.get_monav_directions([Point(49.2, 16.6), Point(49.3, 16.7)], None,
+                                                  cancelled=lambda: time.time() - start > 0.3)
+        self.assertIsNone(result)
+        self.assertLess(time.time() - start, 5)
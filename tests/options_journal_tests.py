@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.options_journal import OptionsJournal, DELETED
+
+
+class OptionsJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "options.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def round_trip_test(self):
+        """Check that the snapshot and journal records are combined on load"""
+        journal = OptionsJournal(self.path)
+        self.assertEqual(journal.load(), {})
+        journal.compact({"a": 1, "b": [1, 2], "c": {"x": "y"}})
+        journal.append({"a": 2, "d": u"\u00fe"})
+        journal.append({"b": DELETED})
+        self.assertEqual(OptionsJournal(self.path).load(), {"a": 2, "c": {"x": "y"}, "d": u"\u00fe"})
+
+    def sync_test(self):
+        """Check that the journal is fsync-ed only if requested"""
+        from core import options_journal
+        synced = []
+        original_fsync = options_journal.os.fsync
+        options_journal.os.fsync = synced.append
+        try:
+            journal = OptionsJournal(self.path)
+            journal.append({"pos": (49.2, 16.6)}, sync=False)
+            self.assertEqual(synced, [])
+            journal.append({"a": 1})
+            self.assertEqual(len(synced), 1)
+        finally:
+            options_journal.os.fsync = original_fsync
+        self.assertEqual(OptionsJournal(self.path).load(), {"pos": (49.2, 16.6), "a": 1})
+
+    def torn_record_test(self):
+        """Check that a record torn by a crash is ignored and truncated"""
+        journal = OptionsJournal(self.path)
+        journal.append({"a": 1})
+        valid_size = os.path.getsize(journal.journal_path)
+        journal.append({"b": 2})
+        with open(journal.journal_path, "r+b") as f:
+            f.truncate(os.path.getsize(journal.journal_path) - 1)
+        journal = OptionsJournal(self.path)
+        self.assertEqual(journal.load(), {"a": 1})
+        self.assertEqual(os.path.getsize(journal.journal_path), valid_size)
+        # new records are appended after the last valid one
+        journal.append({"c": 3})
+        self.assertEqual(OptionsJournal(self.path).load(), {"a": 1, "c": 3})
+
+    def compaction_test(self):
+        """Check that compaction writes a snapshot and removes the journal"""
+        journal = OptionsJournal(self.path, compaction_threshold=64)
+        journal.append({"a": "x" * 100})
+        self.assertTrue(journal.needs_compaction)
+        journal.compact({"a": "x" * 100})
+        self.assertFalse(journal.needs_compaction)
+        self.assertFalse(os.path.exists(journal.journal_path))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertEqual(OptionsJournal(self.path).load(), {"a": "x" * 100})
+
+    def unsupported_value_test(self):
+        """Check that values marshal can't store are skipped"""
+        journal = OptionsJournal(self.path)
+        self.assertEqual(journal.append({"a": object(), "b": 1}), 1)
+        self.assertEqual(OptionsJournal(self.path).load(), {"b": 1})
+
+    def corrupted_snapshot_test(self):
+        """Check that options are saved again after loading a damaged snapshot"""
+        with open(self.path, "wb") as f:
+            f.write(b"\x00 not a marshaled dictionary")
+        journal = OptionsJournal(self.path)
+        self.assertRaises(Exception, journal.load)
+        self.assertEqual(journal.load_or_reset(), ({}, False))
+        # the damaged file is kept for inspection
+        self.assertEqual(len([name for name in os.listdir(self.temp_dir) if ".corrupted-" in name]), 1)
+        journal.append({"a": 1})
+        self.assertEqual(OptionsJournal(self.path).load(), {"a": 1})
+        journal.compact({"a": 1, "b": 2})
+        self.assertEqual(OptionsJournal(self.path).load_or_reset(), ({"a": 1, "b": 2}, True))
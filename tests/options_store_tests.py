@@ -0,0 +1,113 @@
+import unittest
+
+from core.options_store import OptionsStore
+
+
+class OptionsStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store = OptionsStore()
+        self.calls = []
+
+    def _callback(self, key, oldValue, newValue, *args):
+        self.calls.append((key, oldValue, newValue) + args)
+
+    def get_set_test(self):
+        """Check basic getting & setting"""
+        self.assertIsNone(self.store.get("foo"))
+        self.assertEqual(self.store.get("foo", 1), 1)
+        self.store.set("foo", 2)
+        self.assertEqual(self.store.get("foo", 1), 2)
+        self.assertTrue(self.store.has_key("foo"))
+        self.assertTrue(self.store.purge_key("foo"))
+        self.assertFalse(self.store.has_key("foo"))
+        self.assertFalse(self.store.purge_key("foo"))
+
+    def key_modifier_test(self):
+        """Check that keys with modifiers have per mode values"""
+        self.store.set("mode", "car")
+        self.store.set("speed_limit", 130)
+        self.store.add_key_modifier("speed_limit")
+        self.assertTrue(self.store.has_key_modifier("speed_limit"))
+        self.assertTrue(self.store.has_key_modifier_in_mode("speed_limit"))
+        self.assertFalse(self.store.has_key_modifier_in_mode("speed_limit", mode="walk"))
+        # initial value is copied to the mode
+        self.assertEqual(self.store.get("speed_limit"), 130)
+        self.store.set("speed_limit", 90)
+        self.assertEqual(self.store.get("speed_limit"), 90)
+        # modes without a modifier use the normal value
+        self.assertEqual(self.store.get("speed_limit", mode="walk"), 130)
+        self.store.set("mode", "walk")
+        self.assertEqual(self.store.get("speed_limit"), 130)
+        self.store.set("mode", "car")
+        self.assertEqual(self.store.get("speed_limit"), 90)
+        self.assertTrue(self.store.remove_key_modifier("speed_limit"))
+        self.assertEqual(self.store.get("speed_limit"), 130)
+        self.assertFalse(self.store.remove_key_modifier("speed_limit"))
+
+    def mode_change_notification_test(self):
+        """Check that mode change notifies watchers of keys with modifiers"""
+        self.store.set("mode", "car")
+        self.store.set("speed_limit", 130)
+        self.store.add_key_modifier("speed_limit")
+        self.store.set("speed_limit", 90)
+        self.store.watch("speed_limit", self._callback)
+        self.store.set("mode", "walk")
+        self.assertEqual(self.calls, [("speed_limit", 90, 130)])
+
+    def set_many_test(self):
+        """Check that set_many notifies each key once, after all values are set"""
+        seen = []
+        self.store.set("a", 1)
+        self.store.set("b", 1)
+        self.store.watch("a", lambda key, old, new: seen.append((key, old, new, self.store.get("b"))))
+        self.store.set_many([("a", 2), ("b", 2), ("a", 3)])
+        self.assertEqual(seen, [("a", 1, 3, 2)])
+        self.store.set_many({"a": 4}, notify=False)
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(self.store.get("a"), 4)
+
+    def watch_test(self):
+        """Check adding & removing watches"""
+        watch_id = self.store.watch("some_key", self._callback, args=["arg"])
+        self.assertTrue(watch_id)
+        self.store.set("some_key", 1)
+        self.assertEqual(self.calls, [("some_key", 1, 1, "arg")])
+        self.assertTrue(self.store.remove_watch(watch_id))
+        self.assertFalse(self.store.remove_watch(watch_id))
+        self.store.set("some_key", 2)
+        self.assertEqual(len(self.calls), 1)
+
+    def watch_removed_by_callback_test(self):
+        """Check that a watch returning False is removed without skipping other watches"""
+        self.store.watch("foo", lambda key, old, new: False)
+        self.store.watch("foo", self._callback)
+        self.store.set("foo", 1)
+        self.store.set("foo", 2)
+        self.assertEqual(self.calls, [("foo", 1, 1), ("foo", 1, 2)])
+
+    def changed_keys_test(self):
+        """Check that changed keys are tracked and loading does not mark them"""
+        changes = []
+        store = OptionsStore(on_change=lambda: changes.append(True))
+        store.load({"a": 1, "b": 2})
+        self.assertEqual(store.get("a"), 1)
+        self.assertEqual(store.take_changed_keys(), [])
+        store.set("a", 2)
+        store.purge_key("b")
+        # only the first change is reported until the changes are taken
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(sorted(store.take_changed_keys()), ["a", "b"])
+        store.set("a", 3)
+        self.assertEqual(len(changes), 2)
+
+    def restore_changed_keys_test(self):
+        """Check that keys that failed to be saved are reported again"""
+        changes = []
+        store = OptionsStore(on_change=lambda: changes.append(True))
+        store.set("a", 1)
+        keys = store.take_changed_keys()
+        store.restore_changed_keys(keys)
+        # a new write is requested
+        self.assertEqual(len(changes), 2)
+        self.assertEqual(store.take_changed_keys(), ["a"])
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from core import poi_db
+from core.point import POI
+
+
+class POIDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "poi.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _check_spatial_queries(self, db):
+        brno = db.store_poi(POI("Brno", "", 49.2, 16.6, 1))
+        prague = db.store_poi(POI("Prague", "", 50.08, 14.43, 2))
+        db.store_poi(POI("Vienna", "", 48.2, 16.37, 1))
+        # Fiji, on both sides of the antimeridian
+        db.store_poi(POI("Suva", "", -18.14, 178.44, 3))
+        db.store_poi(POI("Taveuni", "", -16.85, -179.97, 3))
+
+        def names(pois):
+            return sorted(poi.name for poi in pois)
+
+        self.assertEqual(names(db.get_poi_in_bbox((49.0, 14.0, 51.0, 17.0))), ["Brno", "Prague"])
+        self.assertEqual(names(db.get_poi_in_bbox((49.0, 14.0, 51.0, 17.0), categories=[2])), ["Prague"])
+        self.assertEqual(len(db.get_poi_in_bbox((48.0, 14.0, 51.0, 17.0), limit=2)), 2)
+        self.assertEqual(names(db.get_poi_in_bbox((-20.0, 178.0, -16.0, -179.0))), ["Suva", "Taveuni"])
+        # the index is updated when POI are moved or deleted
+        moved = db.get_poi(brno)
+        moved.lat = 10.0
+        db.store_poi(moved)
+        db.delete_poi(prague)
+        self.assertEqual(db.get_poi_in_bbox((49.0, 14.0, 51.0, 17.0)), [])
+
+        nearest = db.nearest_poi(49.2, 16.6, k=2)
+        self.assertEqual([poi.name for (distance, poi) in nearest], ["Vienna", "Brno"])
+        self.assertAlmostEqual(nearest[0][0], 112.5, delta=0.1)
+        self.assertEqual([poi.name for (distance, poi) in db.nearest_poi(-17.0, 179.9, k=1)], ["Taveuni"])
+        self.assertEqual(len(db.nearest_poi(0.0, 0.0, k=10)), 4)
+
+    def rtree_index_test(self):
+        """Check spatial queries using the R*Tree index"""
+        db = poi_db.POIDatabase(self.db_path)
+        self.assertEqual(db.spatial_index, poi_db.RTREE_INDEX)
+        self._check_spatial_queries(db)
+
+    def grid_index_test(self):
+        """Check spatial queries using the grid index"""
+        db = poi_db.POIDatabase(self.db_path, spatial_index=poi_db.GRID_INDEX)
+        self.assertEqual(db.spatial_index, poi_db.GRID_INDEX)
+        self._check_spatial_queries(db)
+
+    def migration_test(self):
+        """Check that POI in databases without a spatial index get indexed"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE category (cat_id integer PRIMARY KEY,label text, desc text, enabled integer)')
+        conn.execute('CREATE TABLE poi (poi_id integer PRIMARY KEY, lat real, lon real, '
+                     'label text, desc text, cat_id integer)')
+        conn.execute("INSERT INTO poi VALUES (1, 49.2, 16.6, 'Brno', '', 1)")
+        conn.commit()
+        conn.close()
+        db = poi_db.POIDatabase(self.db_path)
+        self.assertEqual([poi.db_index for poi in db.get_poi_in_bbox((49.0, 16.0, 50.0, 17.0))], [1])
+        db.disconnect_from_database()
+        # the migration only runs once
+        db = poi_db.POIDatabase(self.db_path)
+        self.assertEqual(len(db.get_poi_in_bbox((49.0, 16.0, 50.0, 17.0))), 1)
+        self.assertEqual([poi.db_index for poi in db.search_poi("brno")], [1])
+
+    def search_test(self):
+        """Check ranked prefix search of POI labels and descriptions"""
+        db = poi_db.POIDatabase(self.db_path)
+        db.store_poi(POI("Cafe Rozkvet", "coffee & cakes", 49.2, 16.6, 3))
+        db.store_poi(POI("Hotel Slavia", "near cafe Rozkvet", 49.2, 16.6, 7))
+        db.store_poi(POI("Rozkvet Garden", "", 49.2, 16.6, 5))
+        self.assertEqual([poi.name for poi in db.search_poi("rozk caf")], ["Cafe Rozkvet", "Hotel Slavia"])
+        self.assertEqual([poi.name for poi in db.search_poi("cakes")], ["Cafe Rozkvet"])
+        self.assertEqual([poi.name for poi in db.search_poi("rozkvet", categories=[5, 7])],
+                         ["Rozkvet Garden", "Hotel Slavia"])
+        self.assertEqual(len(db.search_poi("rozkvet", limit=1)), 1)
+        # query syntax is not interpreted
+        self.assertEqual(db.search_poi('"NOT* OR'), [])
+        self.assertEqual(db.search_poi(""), [])
+
+    def bulk_import_test(self):
+        """Check that bulk imported POI are indexed and triggers still work afterwards"""
+        db = poi_db.POIDatabase(self.db_path)
+        db.store_poi(POI("Old", "", 10.0, 10.0, 1))
+        points = [("Imported %d" % i, "", 49.0 + i * 0.01, 16.0) for i in range(100)]
+        self.assertEqual(db.import_poi(points, 2), 100)
+        self.assertEqual(len(db.get_poi_in_bbox((49.0, 15.0, 51.0, 17.0))), 100)
+        self.assertEqual(len(db.search_poi("imported")), 50)
+        self.assertEqual([category[2] for category in db.list_used_categories()], [1, 2])
+        new_id = db.store_poi(POI("New", "", 49.5, 16.0, 1))
+        self.assertIn(new_id, [poi.db_index for poi in db.get_poi_in_bbox((49.0, 15.0, 51.0, 17.0))])
+
+        def broken_points():
+            yield ("Broken", "", 49.0, 16.0)
+            raise ValueError("parsing failed")
+
+        with self.assertRaises(ValueError):
+            db.import_poi(broken_points(), 2)
+        # nothing is imported if the import fails
+        self.assertEqual(db.search_poi("broken"), [])
+        self.assertEqual(len(db.search_poi("new")), 1)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core import poi_import
+
+
+class POIImportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.temp_dir, filename)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def gpx_test(self):
+        """Check parsing of GPX waypoints"""
+        path = self._write("poi.gpx", """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<wpt lat="49.2" lon="16.6"><name>Brno</name><desc>city</desc></wpt>
+<wpt lat="50.08" lon="14.43"><name>Prague</name><cmt>capital</cmt></wpt>
+<trk><trkseg><trkpt lat="1.0" lon="1.0"/></trkseg></trk>
+</gpx>""")
+        self.assertEqual(list(poi_import.read_poi_file(path)),
+                         [("Brno", "city", 49.2, 16.6), ("Prague", "capital", 50.08, 14.43)])
+
+    def csv_test(self):
+        """Check parsing of CSV files with and without a header"""
+        path = self._write("header.csv", "Lon,Lat,Name\n16.6,49.2,Brno\n")
+        self.assertEqual(list(poi_import.read_poi_file(path)), [("Brno", "", 49.2, 16.6)])
+        # modRana POI database dump
+        path = self._write("dump.csv", "1,49.2,16.6,Brno,city,10\n")
+        self.assertEqual(list(poi_import.read_poi_file(path)), [("Brno", "city", 49.2, 16.6)])
+        path = self._write("simple.csv", "49.2,16.6,Brno\n50.08,14.43\n")
+        self.assertEqual(list(poi_import.read_poi_file(path)),
+                         [("Brno", "", 49.2, 16.6), ("", "", 50.08, 14.43)])
+
+    def osm_test(self):
+        """Check that only named OSM nodes are parsed"""
+        path = self._write("poi.osm", """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+<node id="1" lat="49.2" lon="16.6"><tag k="name" v="Spilberk"/><tag k="historic" v="castle"/></node>
+<node id="2" lat="49.3" lon="16.7"/>
+<node id="3" lat="49.4" lon="16.8"><tag k="name" v="Pub"/><tag k="description" v="beer"/></node>
+<way id="4"><nd ref="1"/><nd ref="2"/><tag k="name" v="Street"/></way>
+</osm>""")
+        self.assertEqual(list(poi_import.read_poi_file(path)),
+                         [("Spilberk", "historic: castle", 49.2, 16.6), ("Pub", "beer", 49.4, 16.8)])
+
+    def unsupported_format_test(self):
+        """Check that unsupported files are rejected"""
+        with self.assertRaises(poi_import.POIImportFailed):
+            poi_import.read_poi_file(self._write("poi.txt", ""))
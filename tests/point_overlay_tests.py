@@ -0,0 +1,101 @@
+import unittest
+
+from core import point_overlay
+from core.point_overlay import PointOverlay, PointIndex, LabelPlacer
+
+
+class PointOverlayTests(unittest.TestCase):
+
+    def morton_code_test(self):
+        """Check bit interleaving & that tiles map to continuous code ranges"""
+        self.assertEqual(point_overlay.morton_code(0, 0), 0)
+        self.assertEqual(point_overlay.morton_code(1, 0), 1)
+        self.assertEqual(point_overlay.morton_code(0, 1), 2)
+        self.assertEqual(point_overlay.morton_code(3, 3), 15)
+        self.assertEqual(point_overlay.morton_code(1 << 25, 0), 1 << 50)
+        index = PointIndex([(49.2, 16.6, "Brno"), (50.1, 14.4, "Prague"), (49.19, 16.61, "Brno 2")])
+        # zoom level 1 - both cities are in the north east tile
+        self.assertEqual(index.tile_range(1, 1, 0), (0, 3))
+        self.assertEqual(index.tile_range(1, 0, 0), (0, 0))
+        # zoom level 8 - Prague is in a different tile
+        (start, end) = index.tile_range(8, 139, 87)
+        self.assertEqual(end - start, 2)
+        self.assertAlmostEqual(index.centroid(start, end)[2], 49.195)
+
+    def clustering_test(self):
+        """Check clustering on low zoom levels & separate points on high zoom levels"""
+        points = [(49.2, 16.6, "a"), (49.2001, 16.6001, "b"), (50.1, 14.4, "c")]
+        overlay = PointOverlay(max_cluster_zoom=15)
+        self.assertTrue(overlay.set_points(1, lambda: points))
+        self.assertFalse(overlay.set_points(1, lambda: self.fail("points requested again")))
+        n = 256 * 2 ** 8
+        clusters = sorted(overlay.query(8, 0, 0, n, n), key=lambda c: -c.count)
+        self.assertEqual([c.count for c in clusters], [2, 1])
+        self.assertIn(overlay.get_item(clusters[0]), ("a", "b"))
+        self.assertEqual(overlay.get_item(clusters[1]), "c")
+        self.assertAlmostEqual(clusters[0].lat, 49.20005)
+        # visible area around Prague only
+        (x, y) = (clusters[1].x, clusters[1].y)
+        self.assertEqual(overlay.query(8, x - 10, y - 10, x + 10, y + 10), [clusters[1]])
+        # not clustered
+        n = 256 * 2 ** 15
+        clusters = overlay.query(15, 0, 0, n, n)
+        self.assertEqual(sorted(overlay.get_item(c) for c in clusters), ["a", "b", "c"])
+        # new version of the points
+        overlay.set_points(2, lambda: points[:1])
+        self.assertEqual(len(overlay.query(15, 0, 0, n, n)), 1)
+
+    def label_placer_test(self):
+        """Check collision culling of labels"""
+        placer = LabelPlacer(cell_size=100)
+        self.assertTrue(placer.place((0, 0, 150, 20)))
+        self.assertFalse(placer.place((140, 10, 200, 30)))
+        # touching but not overlapping
+        self.assertTrue(placer.place((150, 0, 250, 20)))
+        self.assertTrue(placer.place((0, 20, 150, 40)))
+        self.assertEqual(placer.placed, 3)
+
+    def label_placement_cache_test(self):
+        """Check that label placement is decided once per zoom level"""
+        # points on the same latitude, 0.001 degrees apart
+        points = [(49.2, 16.6 + i * 0.001, i) for i in range(4)]
+        overlay = PointOverlay(max_cluster_zoom=15)
+        overlay.set_points(1, lambda: points)
+        boxes = []
+
+        def label_box(cluster):
+            boxes.append(cluster.index)
+            return 0, 0, 100, 20
+
+        n = 256 * 2 ** 16
+        clusters = overlay.query(16, 0, 0, n, n, label_box=label_box)
+        labels = dict((c.index, c.label) for c in clusters)
+        # the points are ~47 pixels apart & the labels are 100 pixels wide
+        self.assertEqual([i for i in sorted(labels) if labels[i] is not None], [0, 3])
+        self.assertEqual(sorted(boxes), [0, 1, 2, 3])
+        overlay.query(16, 0, 0, n, n, label_box=label_box)
+        self.assertEqual(len(boxes), 4)
+        # another zoom level has its own placement
+        overlay.query(17, 0, 0, 2 * n, 2 * n, label_box=label_box)
+        self.assertEqual(len(boxes), 8)
+
+    def label_key_test(self):
+        """Check that labels are placed again once the label key changes"""
+        points = [(49.2, 16.6 + i * 0.001, i) for i in range(4)]
+        overlay = PointOverlay(max_cluster_zoom=15)
+        overlay.set_points(1, lambda: points)
+        width = [100]
+
+        def label_box(cluster):
+            return 0, 0, width[0], 20
+
+        n = 256 * 2 ** 16
+        clusters = overlay.query(16, 0, 0, n, n, label_box=label_box, label_key="far")
+        self.assertEqual(len([c for c in clusters if c.label is not None]), 2)
+        # shorter captions (eq. closer to the current position)
+        width[0] = 40
+        clusters = overlay.query(16, 0, 0, n, n, label_box=label_box, label_key="far")
+        self.assertEqual(len([c for c in clusters if c.label is not None]), 2)
+        clusters = overlay.query(16, 0, 0, n, n, label_box=label_box, label_key="near")
+        self.assertEqual(len([c for c in clusters if c.label is not None]), 4)
+        self.assertEqual(clusters[0].label[2] - clusters[0].label[0], 40)
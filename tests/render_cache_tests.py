@@ -0,0 +1,96 @@
+import unittest
+
+from core.render_cache import LRUCache, TextCache, ShelfPacker, LabelAtlas
+
+
+class FakeContext(object):
+    """Cairo context replacement recording the calls made to it"""
+
+    def __init__(self):
+        self.calls = []
+        self.font_size = 10
+
+    def set_font_size(self, size):
+        self.font_size = size
+
+    def text_extents(self, text):
+        self.calls.append(("text_extents", text, self.font_size))
+        width = len(text) * self.font_size / 2.0
+        return 0, -self.font_size, width, self.font_size, width, 0
+
+    def __getattr__(self, name):
+        def record(*args):
+            self.calls.append((name,) + args)
+        return record
+
+
+class RenderCacheTests(unittest.TestCase):
+
+    def lru_test(self):
+        """Check least recently used item eviction"""
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.put("c", 3), ("b", 2))
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("b", "missing"), "missing")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # replacing an item does not evict anything
+        self.assertIsNone(cache.put("a", 4))
+        self.assertEqual(len(cache), 2)
+
+    def text_cache_test(self):
+        """Check that text is measured only once"""
+        cache = TextCache()
+        cr = FakeContext()
+        extents = cache.text_extents(cr, "Brno", 20)
+        self.assertEqual(extents[2:4], (40.0, 20))
+        self.assertEqual(cache.text_extents(cr, "Brno", 20), extents)
+        self.assertEqual(len(cr.calls), 1)
+        # the text does not fit, so it is measured again with a smaller font
+        self.assertEqual(cache.fit_font_size(cr, "Brno", 20, 20), (10.0, 20.0, 10.0))
+        self.assertEqual(cache.fit_font_size(cr, "Brno", 20, 20), (10.0, 20.0, 10.0))
+        self.assertEqual(len(cr.calls), 2)
+        # fits without scaling
+        self.assertEqual(cache.fit_font_size(cr, "Brno", 20, 100), (20, 40.0, 20))
+        self.assertEqual(len(cr.calls), 2)
+
+    def shelf_packer_test(self):
+        """Check packing of rectangles to shelves"""
+        packer = ShelfPacker(100, 50)
+        self.assertEqual(packer.add(60, 20), (0, 0))
+        self.assertEqual(packer.add(40, 20), (60, 0))
+        # does not fit to the first shelf
+        self.assertEqual(packer.add(10, 20), (0, 20))
+        self.assertEqual(packer.add(10, 20), (10, 20))
+        # no space left on the shelves & below them
+        self.assertIsNone(packer.add(100, 20))
+        self.assertIsNone(packer.add(200, 10))
+
+    def label_atlas_test(self):
+        """Check that frequently drawn labels are rendered only once"""
+        surfaces = []
+        renders = []
+
+        def create_surface(w, h):
+            surfaces.append((w, h))
+            return "surface%d" % len(surfaces)
+
+        atlas = LabelAtlas(create_surface, lambda surface: FakeContext(), width=100, height=30, min_uses=2)
+        cr = FakeContext()
+        render = lambda ct: renders.append(ct)
+        # drawn directly the first time
+        self.assertFalse(atlas.draw(cr, "a", 10.4, 10, 50, 20, render))
+        self.assertIs(renders[-1], cr)
+        # added to the atlas on the second use and blitted afterwards
+        self.assertTrue(atlas.draw(cr, "a", 10.4, 10, 50, 20, render))
+        self.assertTrue(atlas.draw(cr, "a", 10.4, 10, 50, 20, render))
+        self.assertEqual(len(renders), 2)
+        self.assertIn(("set_source_surface", "surface1", 10, 10), cr.calls)
+        self.assertEqual(surfaces, [(100, 30)])
+        # no space for another label - the atlas is cleared
+        atlas.draw(cr, "b", 0, 0, 60, 20, render)
+        atlas.draw(cr, "b", 0, 0, 60, 20, render)
+        self.assertEqual((len(atlas), atlas.resets), (1, 1))
+        self.assertEqual(len(surfaces), 2)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.point import Point
+from modules.mod_onlineServices import result_cache
+from modules.mod_onlineServices.geonames import GeonamesWikipediaPoint
+from modules.mod_onlineServices.online_providers import LocalSearchPoint
+
+
+class ResultCacheKeyTests(unittest.TestCase):
+
+    def normalize_query_test(self):
+        """Check that case and whitespace differences are ignored"""
+        self.assertEqual(result_cache.make_key("Geocoding", query="  Brno   Main Street "),
+                         result_cache.make_key("Geocoding", query="brno main street"))
+        self.assertNotEqual(result_cache.make_key("Geocoding", query="brno"),
+                            result_cache.make_key("OtherGeocoding", query="brno"))
+
+    def location_cell_test(self):
+        """Check that nearby locations share a cell"""
+        cell_size = result_cache.REVERSE_GEOCODING_CELL_SIZE
+        key = result_cache.make_key("Reverse", location=(49.20001, 16.60001), cell_size=cell_size)
+        self.assertEqual(key, result_cache.make_key("Reverse", location=(49.20002, 16.60003),
+                                                    cell_size=cell_size))
+        self.assertNotEqual(key, result_cache.make_key("Reverse", location=(49.201, 16.60001),
+                                                       cell_size=cell_size))
+        # cells don't wrap around zero
+        self.assertNotEqual(result_cache.location_cell(0.0001, 0.0001, cell_size),
+                            result_cache.location_cell(-0.0001, -0.0001, cell_size))
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "cache.sqlite")
+        self.cache = result_cache.ResultCache(self.db_path, ttls={"Expired": -1})
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def round_trip_test(self):
+        """Check that all result point types survive a round trip trough the cache"""
+        results = [
+            Point(49.2, 16.6, elevation=250, name="Brno", summary="city", message="Brno\ncity"),
+            LocalSearchPoint(49.19, 16.61, name="Cafe", phoneNumbers=[("main", "123")],
+                             addressLines=["Main street 1"], priceLevel=2, rating=4.5),
+            GeonamesWikipediaPoint({"lat": 49.2, "lng": 16.6, "title": "Brno",
+                                    "summary": "A city in Moravia", "wikipediaUrl": "en.wikipedia.org/wiki/Brno"}),
+        ]
+        self.cache.put("key", "GeocodingNominatim", results)
+        # reopen to make sure the results are persistent
+        self.cache.close()
+        self.cache = result_cache.ResultCache(self.db_path)
+        point, local_point, wikipedia_point = self.cache.get("key")
+
+        self.assertEqual((point.lat, point.lon, point.elevation), (49.2, 16.6, 250))
+        self.assertEqual((point.name, point.summary, point.description), ("Brno", "city", "Brno\ncity"))
+
+        self.assertIsInstance(local_point, LocalSearchPoint)
+        self.assertEqual(local_point.name, "Cafe")
+        self.assertEqual(local_point.addressLines, ["Main street 1"])
+        self.assertEqual(local_point.phoneNumbers[0][1], "123")
+        self.assertEqual((local_point.priceLevel, local_point.rating), (2, 4.5))
+        self.assertEqual(local_point.description, results[1].description)
+
+        self.assertIsInstance(wikipedia_point, GeonamesWikipediaPoint)
+        self.assertEqual(wikipedia_point.getUrls(), results[2].getUrls())
+
+    def ttl_test(self):
+        """Check that expired results are only returned when asked for"""
+        self.cache.put("key", "Expired", [Point(1.0, 2.0)])
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(self.cache.get("key", ignore_ttl=True)[0].getLL(), (1.0, 2.0))
+        self.assertIsNone(self.cache.get("missing", ignore_ttl=True))
+        self.assertEqual(self.cache.ttl("unknown provider"), result_cache.DEFAULT_TTL)
+
+    def purge_test(self):
+        """Check that old results are purged"""
+        self.cache.put("key", "GeocodingNominatim", [Point(1.0, 2.0)])
+        self.assertEqual(self.cache.purge(max_age=3600), 0)
+        self.assertEqual(self.cache.purge(max_age=-1), 1)
+        self.assertIsNone(self.cache.get("key", ignore_ttl=True))
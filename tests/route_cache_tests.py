@@ -0,0 +1,121 @@
+import unittest
+
+from core import constants
+from core import geo
+from core import route_cache
+from core.point import Point, TurnByTurnPoint, Waypoint
+from core.providers import RoutingProvider, RouteParameters, RoutingResult, DummyController
+from core.way import Way
+
+# about 100 meters at the equator
+STEP = 0.0009
+
+
+class MockRoutingProvider(RoutingProvider):
+    """Routes along straight lines between waypoints, with a point every STEP degrees
+
+    :param float detour: latitude offset of the route middle, to simulate detours
+    """
+
+    def __init__(self, detour=0.0):
+        RoutingProvider.__init__(self)
+        self.detour = detour
+        self.requests = []
+
+    def search(self, waypoints, route_params=None, controller=DummyController()):
+        self.requests.append(waypoints)
+        points = []
+        message_points = []
+        for start, end in zip(waypoints, waypoints[1:]):
+            count = max(2, int(geo.distance(start.lat, start.lon, end.lat, end.lon) * 1000 / 100))
+            for i in range(count):
+                fraction = float(i) / count
+                offset = self.detour * (1 - abs(2 * fraction - 1))
+                points.append((start.lat + (end.lat - start.lat) * fraction + offset,
+                               start.lon + (end.lon - start.lon) * fraction, None))
+            message_points.append(TurnByTurnPoint(start.lat, start.lon, message="turn"))
+        points.append((waypoints[-1].lat, waypoints[-1].lon, None))
+        message_points.append(TurnByTurnPoint(waypoints[-1].lat, waypoints[-1].lon, message="arrive"))
+        way = Way(points)
+        distances = way.get_distances_from_start()
+        for point in message_points:
+            point.distance_from_start = distances[way.get_closest_point_index(point.lat, point.lon)]
+        way.add_message_points(message_points)
+        way._set_length(distances[-1])
+        return RoutingResult(way, route_params, constants.ROUTING_SUCCESS)
+
+
+class RouteCacheTests(unittest.TestCase):
+
+    def route_key_test(self):
+        """Check that nearby waypoints & same route parameters share a key"""
+        params = RouteParameters(routeMode=constants.ROUTE_CAR)
+        key = route_cache.route_key([Point(49.0, 16.0), Point(49.5, 16.5)], params, "provider")
+        self.assertEqual(key, route_cache.route_key([Point(49.0001, 16.0001), Point(49.5, 16.5)],
+                                                    RouteParameters(routeMode=constants.ROUTE_CAR),
+                                                    "provider"))
+        self.assertNotEqual(key, route_cache.route_key([Point(49.0, 16.0), Point(49.5, 16.5)],
+                                                       RouteParameters(routeMode=constants.ROUTE_PEDESTRIAN),
+                                                       "provider"))
+        self.assertNotEqual(key, route_cache.route_key([Point(49.01, 16.0), Point(49.5, 16.5)], params, "provider"))
+        self.assertNotEqual(key, route_cache.route_key([Point(49.0, 16.0), Point(49.5, 16.5)], params, "other"))
+        # waypoint heading changes the route
+        north = route_cache.route_key([Waypoint(49.0, 16.0, heading=0), Point(49.5, 16.5)], params, "provider")
+        self.assertNotEqual(key, north)
+        self.assertNotEqual(north, route_cache.route_key([Waypoint(49.0, 16.0, heading=90), Point(49.5, 16.5)],
+                                                         params, "provider"))
+        self.assertEqual(north, route_cache.route_key([Waypoint(49.0, 16.0, heading=355), Point(49.5, 16.5)],
+                                                      params, "provider"))
+        params.addressRoute = True
+        self.assertIsNone(route_cache.route_key(["Brno", "Praha"], params))
+
+    def cache_test(self):
+        """Check LRU eviction and that cached routes are copies"""
+        cache = route_cache.RouteCache(size=2)
+        provider = MockRoutingProvider()
+        route = provider.search([Point(0.0, 0.0), Point(0.0, 0.01)]).route
+        cache.put("a", route)
+        # changing the original route does not change the cached route
+        route.message_points[0].visited = True
+        cached = cache.get("a")
+        self.assertEqual(cached.points_lle, route.points_lle)
+        self.assertFalse(cached.message_points[0].visited)
+        cache.put("b", route)
+        cache.get("a")
+        cache.put("c", route)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(route_cache.RouteCache(ttl=-1).get("a"))
+
+    def rejoin_test(self):
+        """Check that a rejoin route is spliced into the current route"""
+        provider = MockRoutingProvider()
+        # a 10 km route along the equator
+        route = provider.search([Point(0.0, 0.0), Point(0.0, 100 * STEP)]).route
+        # 2 km from start, 100 m off the route
+        lat, lon = STEP, 20 * STEP
+        index = route_cache.find_rejoin_point(route, lat, lon)
+        rejoin_point = route.get_point_by_index(index)
+        self.assertAlmostEqual(rejoin_point.lon, 25 * STEP)
+
+        connector = provider.search([Point(lat, lon), rejoin_point]).route
+        self.assertTrue(route_cache.rejoin_acceptable(connector, lat, lon, rejoin_point.lat, rejoin_point.lon))
+        spliced = route.splice(connector, index)
+        self.assertEqual(spliced.get_point_by_index(0).getLL(), (lat, lon))
+        self.assertEqual(spliced.get_point_by_index(-1).getLL(), (0.0, 100 * STEP))
+        self.assertAlmostEqual(spliced.length, connector.length + route.length - 2500, delta=10)
+        # the departure message point of the connector is followed by the arrival
+        # at the destination - the connector arrival at the rejoin point is dropped
+        self.assertEqual([point.description for point in spliced.message_points], ["turn", "arrive"])
+        self.assertEqual(spliced.message_points[-1].getLL(), (0.0, 100 * STEP))
+
+        # a route with a big detour is not acceptable
+        detour = MockRoutingProvider(detour=10 * STEP).search([Point(lat, lon), rejoin_point]).route
+        self.assertFalse(route_cache.rejoin_acceptable(detour, lat, lon, rejoin_point.lat, rejoin_point.lon))
+
+    def no_rejoin_near_destination_test(self):
+        """Check that routes are not rejoined close to the destination"""
+        route = MockRoutingProvider().search([Point(0.0, 0.0), Point(0.0, 20 * STEP)]).route
+        self.assertIsNone(route_cache.find_rejoin_point(route, STEP, 14 * STEP))
+        self.assertIsNotNone(route_cache.find_rejoin_point(route, STEP, 2 * STEP))
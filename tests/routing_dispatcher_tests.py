@@ -0,0 +1,149 @@
+import socket
+import time
+import unittest
+
+from core import constants
+from core import threads
+from core import routing_dispatcher
+from core import routing_providers
+from core.point import Point
+from core.providers import RoutingProvider, RoutingResult, DummyController
+from core.way import Way
+
+
+class SleepingRoutingProvider(RoutingProvider):
+    """Returns a straight line route after a delay
+
+    :param float delay: how long to "route" in seconds
+    :param duration: duration of the returned route
+    :param bool fail: return a failed routing result
+    """
+
+    def __init__(self, delay, duration=None, fail=False):
+        RoutingProvider.__init__(self)
+        self.delay = delay
+        self.duration = duration
+        self.fail = fail
+        self.cancelled = False
+
+    def search(self, waypoints, route_params=None, controller=DummyController()):
+        end = time.time() + self.delay
+        while time.time() < end:
+            if controller.cancelled:
+                self.cancelled = True
+                return RoutingResult(None, route_params)
+            time.sleep(0.01)
+        if self.fail:
+            return RoutingResult(None, route_params, constants.ROUTING_ROUTE_FAILED)
+        way = Way([(point.lat, point.lon, None) for point in waypoints])
+        if self.duration is not None:
+            way._set_duration(self.duration)
+        return RoutingResult(way, route_params, constants.ROUTING_SUCCESS)
+
+
+WAYPOINTS = [Point(49.0, 16.0), Point(49.1, 16.1)]
+
+
+class RoutingDispatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        if threads.threadMgr is None:
+            threads.initThreading()
+
+    def first_acceptable_test(self):
+        """Check that the first successful route wins and slower providers are cancelled"""
+        fast = SleepingRoutingProvider(0.05, duration=200)
+        slow = SleepingRoutingProvider(2.0, duration=100)
+        failing = SleepingRoutingProvider(0.0, fail=True)
+        dispatcher = routing_dispatcher.RoutingDispatcher([("slow", slow), ("failing", failing), ("fast", fast)])
+        result = dispatcher.search(WAYPOINTS)
+        self.assertEqual(result.returnCode, constants.ROUTING_SUCCESS)
+        self.assertEqual(result.route.duration, 200)
+        time.sleep(0.1)
+        self.assertTrue(slow.cancelled)
+        self.assertEqual(dispatcher.get_stats("fast").successes, 1)
+        self.assertEqual(dispatcher.get_stats("failing").failures, 1)
+        # the successful provider is now tried first
+        self.assertEqual(dispatcher.provider_ids[0], "fast")
+
+    def best_of_test(self):
+        """Check that the fastest route returned within the window wins"""
+        dispatcher = routing_dispatcher.RoutingDispatcher(
+            [("first", SleepingRoutingProvider(0.0, duration=200)),
+             ("better", SleepingRoutingProvider(0.1, duration=100)),
+             ("late", SleepingRoutingProvider(2.0, duration=50))],
+            policy=routing_dispatcher.BEST_OF, best_of_window=0.5)
+        start = time.time()
+        result = dispatcher.search(WAYPOINTS)
+        self.assertEqual(result.route.duration, 100)
+        self.assertLess(time.time() - start, 1.5)
+
+    def deadline_test(self):
+        """Check that providers missing their deadline are counted as timeouts"""
+        dispatcher = routing_dispatcher.RoutingDispatcher(
+            [("hung", SleepingRoutingProvider(2.0)), ("failing", SleepingRoutingProvider(0.0, fail=True))],
+            deadlines={"hung": 0.1})
+        result = dispatcher.search(WAYPOINTS)
+        self.assertIsNone(result.route)
+        self.assertEqual(result.returnCode, constants.ROUTING_ROUTE_FAILED)
+        self.assertEqual(dispatcher.get_stats("hung").timeouts, 1)
+
+    def cancel_test(self):
+        """Check that the dispatcher stops once its controller is cancelled"""
+        provider = SleepingRoutingProvider(2.0)
+        dispatcher = routing_dispatcher.RoutingDispatcher([("slow", provider)])
+        controller = DummyController()
+        controller.cancelled = True
+        start = time.time()
+        self.assertIsNone(dispatcher.search(WAYPOINTS, controller=controller).route)
+        self.assertLess(time.time() - start, 1.0)
+        time.sleep(0.1)
+        self.assertTrue(provider.cancelled)
+
+    def availability_check_test(self):
+        """Check that providers failing their availability check are skipped"""
+        unavailable = SleepingRoutingProvider(0.0, duration=50)
+        checked = []
+
+        def check():
+            checked.append(True)
+            return False
+
+        dispatcher = routing_dispatcher.RoutingDispatcher(
+            [("unavailable", unavailable), ("available", SleepingRoutingProvider(0.05, duration=200))],
+            policy=routing_dispatcher.BEST_OF, best_of_window=0.1,
+            availability_checks={"unavailable": check})
+        result = dispatcher.search(WAYPOINTS)
+        self.assertEqual(result.route.duration, 200)
+        self.assertEqual(checked, [True])
+        self.assertEqual(dispatcher.get_stats("unavailable").to_dict(), routing_dispatcher.ProviderStats().to_dict())
+
+    def stats_test(self):
+        """Check provider statistics round trip & ordering"""
+        stats = routing_dispatcher.ProviderStats()
+        stats.add_success(1.0)
+        stats.add_success(2.0)
+        stats.add_failure()
+        self.assertAlmostEqual(stats.latency, 1.3)
+        self.assertAlmostEqual(stats.success_rate, 0.6)
+        restored = routing_dispatcher.ProviderStats.from_dict(stats.to_dict())
+        self.assertEqual(restored.to_dict(), stats.to_dict())
+        dispatcher = routing_dispatcher.RoutingDispatcher(
+            [("a", None), ("b", None)],
+            stats={"b": {"successes": 10, "latency": 0.2}})
+        self.assertEqual(dispatcher.provider_ids, ["b", "a"])
+
+    def osm_scout_server_check_test(self):
+        """Check that OSM Scout Server is only reported as running if it accepts connections"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("localhost", 0))
+        server.listen(1)
+        original_port = routing_providers.OSM_SCOUT_SERVER_PORT
+        routing_providers.OSM_SCOUT_SERVER_PORT = server.getsockname()[1]
+        try:
+            self.assertTrue(routing_providers.osm_scout_server_running())
+            server.close()
+            self.assertFalse(routing_providers.osm_scout_server_running())
+        finally:
+            server.close()
+            routing_providers.OSM_SCOUT_SERVER_PORT = original_port
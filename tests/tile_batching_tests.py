@@ -0,0 +1,68 @@
+import time
+import unittest
+
+from core import tile_batching
+
+
+class TileBatchingTests(unittest.TestCase):
+
+    def range_request_test(self):
+        """Check grouping of tile ids to tile range requests"""
+        tile_ids = ["map/mapnik/15/10/20", "map/mapnik/15/12/21", "map/cycle/15/10/20"]
+        requests = sorted(tile_batching.make_range_requests(tile_ids))
+        self.assertEqual(requests, [["map", "cycle", 15, 10, 20, 1, 1, []],
+                                    ["map", "mapnik", 15, 10, 20, 3, 2, [0, 5]]])
+
+    def range_reply_test(self):
+        """Check tile range replies & that they map back to the requested tiles"""
+        checked = []
+
+        def check_tile(z, x, y, tile_id):
+            checked.append(tile_id)
+            return x == 12
+
+        request = ["map", "mapnik", 15, 10, 20, 3, 2, [0, 5]]
+        reply = tile_batching.answer_range_request(request, check_tile)
+        self.assertEqual(reply, "0----1")
+        self.assertEqual(checked, ["map/mapnik/15/10/20", "map/mapnik/15/12/21"])
+        self.assertEqual(list(tile_batching.iterate_range_reply(request, reply)),
+                         [("map/mapnik/15/10/20", False), ("map/mapnik/15/12/21", True)])
+        # all tiles in the range requested
+        reply = tile_batching.answer_range_request(["map", "mapnik", 15, 10, 20, 3, 1, []], check_tile)
+        self.assertEqual(reply, "001")
+
+    def tile_id_cache_test(self):
+        """Check that tile ids are parsed only once"""
+        lookups = []
+
+        def get_layer(layer_id):
+            lookups.append(layer_id)
+            return "layer:" + layer_id
+
+        cache = tile_batching.TileIdCache(get_layer, max_size=2)
+        self.assertEqual(cache.get("map/mapnik/15/10/20"), ("layer:mapnik", 15, 10, 20))
+        cache.get("map/mapnik/15/10/20")
+        self.assertEqual(lookups, ["mapnik"])
+        cache.get("map/mapnik/15/10/21")
+        cache.get("map/mapnik/15/10/22")
+        cache.get("map/mapnik/15/10/20")
+        self.assertEqual(len(lookups), 4)
+
+    def notification_batching_test(self):
+        """Check that download notifications are coalesced per map instance"""
+        sent = []
+        batcher = tile_batching.NotificationBatcher(lambda map_id, batch: sent.append((map_id, batch)),
+                                                    interval=0.05)
+        for i in range(10):
+            batcher.add("map", ["map/mapnik/15/%d/0" % i, True, False])
+        batcher.add("overview", ["overview/mapnik/5/0/0", False, True])
+        self.assertEqual(sent, [])
+        end = time.time() + 2.0
+        while len(sent) < 2 and time.time() < end:
+            time.sleep(0.01)
+        self.assertEqual(sorted(len(batch) for map_id, batch in sent), [1, 10])
+        self.assertEqual((batcher.batches_sent, batcher.notifications_sent), (2, 11))
+        batcher.add("map", ["map/mapnik/15/0/1", True, False])
+        batcher.cancel()
+        time.sleep(0.1)
+        self.assertEqual(len(sent), 2)
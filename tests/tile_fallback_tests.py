@@ -0,0 +1,93 @@
+import unittest
+
+from modules.mod_mapTiles import tile_fallback
+from modules.mod_mapTiles.tile_fallback import FallbackResolver
+
+
+class TileFallbackTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tiles = {}
+        self.lookups = []
+        self.resolver = FallbackResolver(self._lookup, self._render_ancestor, self._render_children,
+                                         max_levels=2, cache_size=2)
+
+    def _lookup(self, lzxy):
+        self.lookups.append(lzxy)
+        return self.tiles.get(lzxy)
+
+    def _render_ancestor(self, image, crop_x, crop_y, crop_size):
+        return ("ancestor", image, crop_x, crop_y, crop_size)
+
+    def _render_children(self, children):
+        return ("children", sorted(children))
+
+    def ancestors_test(self):
+        """Check ancestor tiles and the covered part of them"""
+        self.assertEqual(tile_fallback.get_ancestors(3, 5, 6, max_levels=4),
+                         [(2, 2, 3, 0.5, 0.0, 0.5), (1, 1, 1, 0.25, 0.5, 0.25), (0, 0, 0, 0.625, 0.75, 0.125)])
+        self.assertEqual(tile_fallback.get_ancestors(0, 0, 0), [])
+
+    def children_test(self):
+        """Check child tiles and their position in the tile"""
+        self.assertEqual(tile_fallback.get_children(1, 1, 0),
+                         [(2, 2, 0, 0.0, 0.0), (2, 3, 0, 0.5, 0.0), (2, 2, 1, 0.0, 0.5), (2, 3, 1, 0.5, 0.5)])
+
+    def resolver_test(self):
+        """Check fallback tile preference & caching"""
+        self.assertIsNone(self.resolver.get(("l", 5, 10, 10)))
+        # the nearest ancestor is used
+        self.tiles[("l", 3, 2, 2)] = "grandparent"
+        self.tiles[("l", 4, 5, 5)] = "parent"
+        self.assertEqual(self.resolver.get(("l", 5, 10, 10)), ("ancestor", "parent", 0.0, 0.0, 0.5))
+        # incomplete children are used only if no ancestor is available & are not cached
+        self.tiles[("l", 6, 20, 20)] = "child"
+        self.assertEqual(self.resolver.get(("l", 5, 10, 11)),
+                         ("ancestor", "parent", 0.0, 0.5, 0.5))
+        self.assertEqual(self.resolver.get(("other", 5, 10, 10)), None)
+        self.tiles[("other", 6, 20, 20)] = "child"
+        self.assertEqual(self.resolver.get(("other", 5, 10, 10)), ("children", [("child", 0.0, 0.0)]))
+        self.assertEqual(len(self.resolver), 2)
+        # rendered fallback tiles are cached
+        self.lookups = []
+        self.assertEqual(self.resolver.get(("l", 5, 10, 10)), ("ancestor", "parent", 0.0, 0.0, 0.5))
+        self.assertEqual(self.lookups, [])
+
+    def children_preferred_test(self):
+        """Check that all four children are preferred to an ancestor"""
+        self.tiles[("l", 0, 0, 0)] = "root"
+        for z, x, y, position_x, position_y in tile_fallback.get_children(1, 0, 1):
+            self.tiles[("l", z, x, y)] = "%d/%d" % (x, y)
+        self.assertEqual(self.resolver.get(("l", 1, 0, 1))[0], "children")
+        self.assertEqual(self.resolver.get(("l", 1, 1, 1)), ("ancestor", "root", 0.5, 0.5, 0.5))
+
+    def cache_bound_test(self):
+        """Check that the fallback tile cache is bounded"""
+        self.tiles[("l", 0, 0, 0)] = "root"
+        for x in range(4):
+            self.resolver.get(("l", 2, x, 0))
+        self.assertEqual(len(self.resolver), 2)
+        self.resolver.invalidate(("l", 2, 3, 0))
+        self.assertEqual(len(self.resolver), 1)
+        self.resolver.clear()
+        self.assertEqual(len(self.resolver), 0)
+
+    def invalidate_test(self):
+        """Check that fallback tiles a newly available tile could replace are dropped"""
+        resolver = FallbackResolver(self._lookup, self._render_ancestor, self._render_children,
+                                    max_levels=2, cache_size=10)
+        self.tiles[("l", 0, 0, 0)] = "root"
+        for lzxy in (("l", 1, 0, 0), ("l", 2, 0, 0), ("l", 2, 1, 1), ("l", 2, 3, 3)):
+            resolver.get(lzxy)
+        self.tiles[("other", 0, 0, 0)] = "root"
+        resolver.get(("other", 2, 0, 0))
+        self.assertEqual(len(resolver), 5)
+        # the tile itself and its descendants are dropped, other tiles & layers are kept
+        self.tiles[("l", 1, 0, 0)] = "tile"
+        resolver.invalidate(("l", 1, 0, 0))
+        self.assertEqual(len(resolver), 2)
+        self.assertEqual(resolver.get(("l", 2, 1, 1)), ("ancestor", "tile", 0.5, 0.5, 0.5))
+        # a child makes the parent fallback obsolete
+        resolver.invalidate(("l", 3, 6, 7))
+        self.assertEqual(len(resolver), 2)
+        self.assertIsNone(resolver._cache.get(("l", 2, 3, 3)))
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core import tracklog_cache
+from core import tracklog_parser
+
+
+class TracklogCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = tracklog_cache.TracklogCache(os.path.join(self.temp_dir, "cache"))
+        self.track_path = os.path.join(self.temp_dir, "track.gpx")
+        with open(self.track_path, "wt") as f:
+            f.write("dummy track content")
+        points = tracklog_parser.TrackpointArrays()
+        points.append(49.2, 16.6, 250.0)
+        points.append(49.3, 16.7)
+        points.append(49.4, 16.8, 260.0)
+        self.entry = tracklog_cache.CacheEntry(points,
+                                               clusters=[(0, 2, 49.25, 16.65, 1.5), (2, 3, 49.4, 16.8, 0.0)],
+                                               simplification={10: [0, 1, 2], 250: [0, 2]},
+                                               stats={"length": 27.5})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def store_and_get_test(self):
+        """Check that a stored entry can be loaded back"""
+        self.assertIsNone(self.cache.get(self.track_path))
+        self.assertTrue(self.cache.store(self.track_path, self.entry))
+        entry = self.cache.get(self.track_path)
+        self.assertIsNotNone(entry)
+        self.assertEqual(list(entry.points.lat), [49.2, 49.3, 49.4])
+        self.assertEqual(list(entry.points.lon), [16.6, 16.7, 16.8])
+        trackpoints = entry.points.to_trackpoints_list()[0]
+        self.assertEqual([p.elevation for p in trackpoints], [250.0, None, 260.0])
+        self.assertEqual(entry.clusters, self.entry.clusters)
+        self.assertEqual(list(entry.simplification[250]), [0, 2])
+        self.assertEqual(list(entry.simplification[10]), [0, 1, 2])
+        self.assertEqual(entry.stats, {"length": 27.5})
+
+    def invalidation_test(self):
+        """Check that entries for modified tracklogs are ignored"""
+        self.cache.store(self.track_path, self.entry)
+        with open(self.track_path, "at") as f:
+            f.write("more content")
+        self.assertIsNone(self.cache.get(self.track_path))
+        # the same size but a different modification time
+        self.cache.store(self.track_path, self.entry)
+        stat = os.stat(self.track_path)
+        os.utime(self.track_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(self.cache.get(self.track_path))
+        # the tracklog has been removed
+        self.cache.store(self.track_path, self.entry)
+        os.remove(self.track_path)
+        self.assertIsNone(self.cache.get(self.track_path))
+
+    def remove_and_clean_test(self):
+        """Check cache entry removal"""
+        self.cache.store(self.track_path, self.entry)
+        self.cache.remove(self.track_path)
+        self.assertIsNone(self.cache.get(self.track_path))
+        self.cache.store(self.track_path, self.entry)
+        self.cache.clean([self.track_path])
+        self.assertIsNotNone(self.cache.get(self.track_path))
+        # no tracklogs listed means nothing to clean
+        self.cache.clean([])
+        self.assertIsNotNone(self.cache.get(self.track_path))
+        self.cache.clean([self.track_path + ".other"])
+        self.assertIsNone(self.cache.get(self.track_path))
+        self.assertEqual(os.listdir(self.cache.folder_path), [])
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.tracklog_catalog import TracklogCatalog
+
+
+class TracklogCatalogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tracklog_folder = os.path.join(self.temp_dir, "tracklogs")
+        for category in ("logs", "misc"):
+            os.makedirs(os.path.join(self.tracklog_folder, category))
+        self.db_path = os.path.join(self.temp_dir, "catalog.sqlite")
+        self.catalog = TracklogCatalog(self.db_path)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _create_tracklog(self, category, filename):
+        path = os.path.join(self.tracklog_folder, category, filename)
+        with open(path, "wt") as f:
+            f.write("<gpx/>")
+        return path
+
+    def _paths(self):
+        return sorted(record["path"] for record in self.catalog.list_tracklogs())
+
+    def reconcile_test(self):
+        """Check that reconciliation finds added and removed tracklogs"""
+        path1 = self._create_tracklog("logs", "1.gpx")
+        path2 = self._create_tracklog("misc", "2.GPX")
+        self._create_tracklog("misc", "not_a_tracklog.txt")
+        self.catalog.reconcile(self.tracklog_folder)
+        self.assertEqual(self._paths(), sorted([path1, path2]))
+        self.assertEqual(self.catalog.list_categories(), [("logs", 1), ("misc", 1)])
+        record = self.catalog.get(path1)
+        self.assertEqual(record["category"], "logs")
+        self.assertEqual(record["filename"], "1.gpx")
+        self.assertEqual(record["size"], 6)
+
+        os.remove(path1)
+        # force the folder mtime to change even on coarse grained file systems
+        folder_stat = os.stat(os.path.dirname(path1))
+        os.utime(os.path.dirname(path1), (folder_stat.st_atime, folder_stat.st_mtime + 10))
+        self.catalog.reconcile(self.tracklog_folder)
+        self.assertEqual(self._paths(), [path2])
+
+        # the catalogue should persist
+        self.catalog.close()
+        self.catalog = TracklogCatalog(self.db_path)
+        self.assertEqual(self._paths(), [path2])
+
+        # removed categories should be removed together with their tracklogs
+        shutil.rmtree(os.path.join(self.tracklog_folder, "misc"))
+        self.catalog.reconcile(self.tracklog_folder)
+        self.assertEqual(self._paths(), [])
+        self.assertEqual(self.catalog.list_categories(), [("logs", 0)])
+
+    def add_remove_test(self):
+        """Check incremental catalogue updates"""
+        self.catalog.reconcile(self.tracklog_folder)
+        path = self._create_tracklog("logs", "new.gpx")
+        self.catalog.add(path, "logs")
+        self.assertEqual(self._paths(), [path])
+        self.assertEqual(len(self.catalog.list_tracklogs(category="logs")), 1)
+        self.assertEqual(self.catalog.list_tracklogs(category="misc"), [])
+        self.catalog.remove(path)
+        self.assertEqual(self._paths(), [])
+
+    def bbox_query_test(self):
+        """Check the tracklog bounding box query"""
+        path1 = self._create_tracklog("logs", "brno.gpx")
+        path2 = self._create_tracklog("logs", "prague.gpx")
+        path3 = self._create_tracklog("logs", "not_loaded.gpx")
+        self.catalog.reconcile(self.tracklog_folder)
+        self.catalog.update_stats(path1, 100, (49.1, 16.5, 49.3, 16.7), 12.5, 3600)
+        self.catalog.update_stats(path2, 100, (50.0, 14.3, 50.1, 14.5), 8.0, None)
+        record = self.catalog.get(path1)
+        self.assertEqual(record["point_count"], 100)
+        self.assertEqual(record["length"], 12.5)
+        self.assertEqual(record["duration"], 3600)
+        # tracklogs with unknown bounding box are always returned
+        self.assertEqual(self.catalog.paths_in_bbox(49.0, 16.0, 49.2, 16.6), set([path1, path3]))
+        self.assertEqual(self.catalog.paths_in_bbox(49.9, 14.0, 51.0, 15.0), set([path2, path3]))
+        self.assertEqual(self.catalog.paths_in_bbox(49.0, 14.0, 51.0, 17.0, paths=[path1, path2]),
+                         set([path1, path2]))
@@ -0,0 +1,107 @@
+import os
+import unittest
+import tempfile
+
+from core import tracklog_parser
+
+GPX_TRACK = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><name>test</name>
+<trkseg>
+<trkpt lat="49.2" lon="16.6"><ele>250.5</ele><time>2017-01-01T00:00:00Z</time></trkpt>
+<trkpt lat="49.3" lon="16.7"></trkpt>
+</trkseg>
+<trkseg>
+<trkpt lat="50.0" lon="14.4"><ele>200</ele></trkpt>
+</trkseg>
+</trk>
+</gpx>
+"""
+
+CSV_TRACK = """49.2,16.6,250.5,2017-01-01T00:00:00
+49.3,16.7,None,2017-01-01T00:00:01
+
+50.0,14.4,,2017-01-01T00:00:02
+"""
+
+
+class TracklogParserTests(unittest.TestCase):
+
+    def _write_temp_file(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "wt") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def parse_gpx_test(self):
+        """Test streaming GPX parsing"""
+        path = self._write_temp_file(".gpx", GPX_TRACK)
+        points = tracklog_parser.parse_tracklog(path)
+        self.assertEqual(points.file_type, tracklog_parser.GPX)
+        self.assertEqual(len(points), 3)
+        trackpoints_list = points.to_trackpoints_list()
+        self.assertEqual(len(trackpoints_list), 2)
+        first_segment = trackpoints_list[0]
+        self.assertEqual(len(first_segment), 2)
+        self.assertEqual((first_segment[0].latitude, first_segment[0].longitude), (49.2, 16.6))
+        self.assertEqual(first_segment[0].elevation, 250.5)
+        self.assertIsNone(first_segment[1].elevation)
+        self.assertEqual(trackpoints_list[1][0].elevation, 200.0)
+        self.assertEqual(points.bounding_box(), (49.2, 14.4, 50.0, 16.7))
+        # only the first point has a timestamp
+        self.assertEqual(points.duration, 0)
+
+    def parse_csv_test(self):
+        """Test CSV tracklog parsing"""
+        path = self._write_temp_file(".csv", CSV_TRACK)
+        points = tracklog_parser.parse_tracklog(path)
+        self.assertEqual(points.file_type, tracklog_parser.CSV)
+        trackpoints_list = points.to_trackpoints_list()
+        self.assertEqual(len(trackpoints_list), 1)
+        self.assertEqual([p.elevation for p in trackpoints_list[0]], [250.5, None, None])
+        self.assertEqual(points.duration, 2)
+
+    def invalid_file_test(self):
+        """Test that invalid files raise TracklogParsingFailed"""
+        path = self._write_temp_file(".gpx", "<gpx><trk><trkseg><trkpt lat=")
+        with self.assertRaises(tracklog_parser.TracklogParsingFailed):
+            tracklog_parser.parse_tracklog(path)
+
+    def pool_corrupt_file_test(self):
+        """Test that a corrupt file loaded by a process pool still reports back"""
+        import multiprocessing
+        good_path = self._write_temp_file(".gpx", GPX_TRACK)
+        corrupt_path = self._write_temp_file(".gpx", "<gpx><trk><trkseg><trkpt lat=")
+        self.assertIsNone(tracklog_parser.parse_tracklog_or_none(corrupt_path))
+        results = {}
+        pool = multiprocessing.Pool(processes=2)
+        try:
+            for path in (good_path, corrupt_path):
+                pool.apply_async(tracklog_parser.parse_tracklog_or_none, (path,),
+                                 callback=lambda points, path=path: results.__setitem__(path, points))
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+        # the callback is called for both files
+        self.assertEqual(len(results[good_path]), 3)
+        self.assertIsNone(results[corrupt_path])
+
+    def update_gpx_elevation_test(self):
+        """Test that elevation is written back without losing other data"""
+        path = self._write_temp_file(".gpx", GPX_TRACK)
+        trackpoints_list = tracklog_parser.parse_tracklog(path).to_trackpoints_list()
+        trackpoints_list[0][1].elevation = 300
+        trackpoints_list[1][0].elevation = 210.25
+        self.assertEqual(tracklog_parser.update_gpx_elevation(path, trackpoints_list), 3)
+        points = tracklog_parser.parse_tracklog(path)
+        written = points.to_trackpoints_list()
+        self.assertEqual([[(p.latitude, p.longitude, p.elevation) for p in segment] for segment in written],
+                         [[(49.2, 16.6, 250.5), (49.3, 16.7, 300.0)], [(50.0, 14.4, 210.25)]])
+        with open(path) as f:
+            content = f.read()
+        # timestamps, track metadata & the default namespace are kept
+        self.assertEqual(points.start_time, "2017-01-01T00:00:00Z")
+        self.assertIn("<name>test</name>", content)
+        self.assertNotIn("ns0:", content)
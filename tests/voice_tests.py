@@ -16,14 +16,37 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
 import tempfile
+import threading
 import time
 import unittest
 
 from core import voice
 from core import threads
+from core.point import TurnByTurnPoint
 threads.initThreading()
 
+
+class FakeVoiceEngine(voice.VoiceEngine):
+
+    """Voice engine writing text to the WAV file."""
+
+    name = "Fake"
+    voices = {"en": {"male": "fake", "female": "fake-female"}}
+
+    def __init__(self, language, gender="male"):
+        voice.VoiceEngine.__init__(self, language, gender)
+        self.texts = []
+        self._lock = threading.Lock()
+
+    def make_wav(self, text, fname):
+        with self._lock:
+            self.texts.append(text)
+        with open(fname, "w") as f:
+            f.write(text * 100)
+        return True
+
 class TestVoiceGenerator(unittest.TestCase):
 
     def setUp(self):
@@ -109,3 +132,113 @@ class TestVoiceGenerator(unittest.TestCase):
         self.generator.set_voice("en", "female")
         self.generator.set_voice("en_US")
         self.generator.set_voice("en_XX")
+
+
+class TestWavCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.engine = FakeVoiceEngine("en")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _make_wav(self, text):
+        handle, fname = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        self.engine.make_wav(text, fname)
+        return fname
+
+    def key_test(self):
+        """Check that the cache key ignores redundant whitespace"""
+        self.assertEqual(voice.WavCache.key(self.engine, "turn  left "),
+                         voice.WavCache.key(self.engine, "turn left"))
+        # different voice, same text
+        self.assertNotEqual(voice.WavCache.key(self.engine, "turn left"),
+                            voice.WavCache.key(FakeVoiceEngine("en", "female"), "turn left"))
+        # same voice, different text
+        self.assertNotEqual(voice.WavCache.key(self.engine, "turn left"),
+                            voice.WavCache.key(self.engine, "turn right"))
+
+    def eviction_test(self):
+        """Check size bounded LRU eviction & persistence"""
+        # each file has 1000 bytes
+        cache = voice.WavCache(self.cache_dir, max_size=2500)
+        for text in ("aaaaaaaaaa", "bbbbbbbbbb"):
+            cache.put(text, self._make_wav(text))
+        self.assertIsNotNone(cache.get("aaaaaaaaaa"))
+        cache.put("cccccccccc", self._make_wav("cccccccccc"))
+        self.assertIsNone(cache.get("bbbbbbbbbb"))
+        self.assertEqual(cache.size, 2000)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        # reload the cache from disk
+        cache = voice.WavCache(self.cache_dir, max_size=2500)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get("cccccccccc"))
+        cache.clear()
+        self.assertFalse(os.listdir(self.cache_dir))
+
+
+class TestVoicePresynthesis(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.generator = voice.VoiceGenerator(cache_dir=self.cache_dir, workers=2)
+        self.generator._engine = FakeVoiceEngine("en")
+
+    def tearDown(self):
+        self.generator.quit()
+        shutil.rmtree(self.cache_dir)
+
+    def presynthesize_test(self):
+        """Check that announcements ahead are generated & cached across sessions"""
+        points = []
+        for distance, message in ((0, "start"), (500, "turn left"), (1500, "turn right")):
+            point = TurnByTurnPoint(0.0, 0.0, message=message)
+            point.distance_from_start = distance
+            points.append(point)
+        points[1].ssml_message = '<p xml:lang="en">turn <b>left</b></p>'
+        self.generator.presynthesize(points, distance=100)
+        self.generator._task_queue.join()
+        self.assertIsNone(self.generator.get("start"))
+        self.assertTrue(os.path.isfile(self.generator.get("turn left")))
+        self.assertEqual(sorted(self.generator._engine.texts), ["turn left", "turn right"])
+
+        # a new session finds the generated files
+        self.generator.quit()
+        self.generator = voice.VoiceGenerator(cache_dir=self.cache_dir, workers=2)
+        self.generator._engine = FakeVoiceEngine("en")
+        self.generator.make("turn  right")
+        self.assertTrue(os.path.isfile(self.generator.get("turn  right")))
+        self.assertFalse(self.generator._engine.texts)
+
+    def presynthesis_window_test(self):
+        """Check that only the next few message points are pre-synthesized"""
+        points = []
+        for index in range(10):
+            point = TurnByTurnPoint(0.0, 0.0, message="turn %d" % index)
+            point.distance_from_start = index * 100
+            points.append(point)
+        self.generator.presynthesize(points, distance=150, window=3)
+        self.generator._task_queue.join()
+        self.assertEqual(sorted(self.generator._engine.texts), ["turn 2", "turn 3", "turn 4"])
+
+        # the window moves ahead as message points are passed
+        self.generator.presynthesize(points, distance=400, window=3)
+        self.generator._task_queue.join()
+        self.assertEqual(sorted(self.generator._engine.texts),
+                         ["turn 2", "turn 3", "turn 4", "turn 5", "turn 6"])
+
+    def wait_test(self):
+        """Check waiting for a text to be generated"""
+        self.generator.make("turn left")
+        fname = self.generator.wait("turn left", 10)
+        self.assertTrue(os.path.isfile(fname))
+        self.assertFalse(self.generator.failed("turn left"))
+        # texts not queued are not waited for
+        self.assertIsNone(self.generator.wait("turn right", 10))
+
+        self.generator._engine.make_wav = lambda text, fname: False
+        self.generator.make("turn right")
+        self.assertIsNone(self.generator.wait("turn right", 10))
+        self.assertTrue(self.generator.failed("turn right"))